@@ -0,0 +1,141 @@
+import argparse
+import os
+import re
+import sys
+
+
+# Other Variables
+repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+default_template = os.path.join(repo_dir, 'automated-archive-restore-and-copy-solution-latest.yaml')
+function_code_dir = os.path.join(repo_dir, 'src', 'function-codes')
+# Source file of the inline code of each function
+function_sources = {
+    'CheckBucketExistsLambdaFunction': 'CheckBucketExists.py',
+    'NametoLower': 'NametoLower.py',
+    'S3AutoRestoreMigrateRestoreWorker': 'RestoreWorker.py',
+    'RestoreWorker2Function': 'RestoreWorker2.py',
+    'S3AutoRestoreMigrateCopyWorker': 'CopyWorker.py',
+    'S3AutoRestoreMigrateJobTrackerWorker': 'JobTracker.py',
+    'S3AutoRestoreMigrateJobSchedulerWorker': 'JobScheduler.py',
+    'CreateBucketEventNotification': 'CreateBucketEventNotification.py',
+    'S3BatchCopyLambdafunction': 'BatchCopy.py',
+    'S3AutoRestoreMigrateCustomResourceLambdaFunction': 'CustomResource.py',
+    'RemoveS3InventoryCustomResourceLambdaFunction': 'RemoveS3Inventory.py',
+    'S3AutoRestoreMigrateChecknumrowsFunction': 'Checknumrows.py',
+    'S3AutoRestoreMigrateGetqueryresultsFunction': 'Getqueryresults.py',
+    'S3AutoRestoreMigrateAthenaSplitFunction': 'AthenaSplit.py',
+    'S3AutoRestoreMigrateTriggerStateMachineFunction': 'TriggerStateMachine.py',
+    'InitiateFlowFunction': 'InitiateFlow.py',
+    'ListPrefixFunction': 'ListPrefix.py',
+    'PostWorkflowTasksFunction': 'PostWorkflowTasks.py',
+    'InvokeRestoreFunction': 'InvokeRestoreFunction.py',
+    'InventoryEngineFunction': 'InventoryEngine.py',
+    'S3AutoRestoreMigrateCheckQueryStatusFunction': 'CheckQueryStatus.py',
+    'RestoreSchedulerFunction': 'RestoreScheduler.py',
+    'RestoreEventTrackerFunction': 'RestoreEventTracker.py',
+}
+# Inline code is a single file, an import of another file of src/function-codes is replaced with that file's code
+shared_import_pattern = re.compile(r'^from (\w+) import [\w, ]+$')
+resource_pattern = re.compile(r'^  (\w+):\s*$')
+zip_file_line = 'ZipFile: |'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Write the code in src/function-codes into the inline ZipFile code of the template functions')
+    parser.add_argument('--template', default=default_template, help='CloudFormation template to update')
+    parser.add_argument('--check', action='store_true',
+                        help='Only check the template is up to date, exit with 1 when it is not')
+    return parser.parse_args()
+
+
+def read_lines(file_name):
+    with open(os.path.join(function_code_dir, file_name)) as source_file:
+        return source_file.read().rstrip('\n').split('\n')
+
+
+def is_import(line):
+    return line.startswith(('import ', 'from '))
+
+
+############# Function Code #############
+
+# The function file with its shared imports replaced by the shared code. Imports of the shared file the function
+# file already has are left out, the others stay at the top of the shared code
+def function_code(file_name):
+    lines = read_lines(file_name)
+    code = []
+    for line in lines:
+        match = shared_import_pattern.match(line)
+        if not match or not os.path.exists(os.path.join(function_code_dir, f'{match.group(1)}.py')):
+            code.append(line)
+            continue
+        shared_lines = read_lines(f'{match.group(1)}.py')
+        code.extend(shared_line for shared_line in shared_lines if is_import(shared_line) and shared_line not in lines)
+        shared_code = '\n'.join(shared_line for shared_line in shared_lines if not is_import(shared_line))
+        code.extend(['', ''] + shared_code.strip('\n').split('\n'))
+    return code
+
+
+############# Template #############
+
+# Replace the body of each ZipFile block, keeping its indentation and the blank lines after it
+def build_template(template_lines):
+    output = []
+    resource = None
+    found = set()
+    position = 0
+    while position < len(template_lines):
+        line = template_lines[position]
+        output.append(line)
+        position += 1
+        match = resource_pattern.match(line)
+        if match:
+            resource = match.group(1)
+        if line.strip() != zip_file_line:
+            continue
+        if resource not in function_sources:
+            raise ValueError(f'No source file for the inline code of {resource}')
+        block_indent = len(line) - len(line.lstrip())
+        body = []
+        while position < len(template_lines) and (not template_lines[position].strip() or
+                                                  len(template_lines[position]) - len(template_lines[position].lstrip())
+                                                  > block_indent):
+            body.append(template_lines[position])
+            position += 1
+        code_indent = next(len(body_line) - len(body_line.lstrip()) for body_line in body if body_line.strip())
+        trailing_blank_lines = 0
+        for body_line in reversed(body):
+            if body_line.strip():
+                break
+            trailing_blank_lines += 1
+        output.extend(' ' * code_indent + code_line if code_line.strip() else ''
+                      for code_line in function_code(function_sources[resource]))
+        output.extend([''] * trailing_blank_lines)
+        found.add(resource)
+    missing = set(function_sources) - found
+    if missing:
+        raise ValueError(f'No inline code in the template for {", ".join(sorted(missing))}')
+    return output
+
+
+def main():
+    args = parse_args()
+    with open(args.template) as template_file:
+        template_lines = template_file.read().split('\n')
+    try:
+        output = build_template(template_lines)
+    except ValueError as e:
+        sys.exit(f'error: {e}')
+    if output == template_lines:
+        print(f'{args.template} is up to date')
+        return
+    if args.check:
+        sys.exit(f'{args.template} is out of date, run src/build_template.py')
+    with open(args.template, 'w') as template_file:
+        template_file.write('\n'.join(output))
+    print(f'Updated the inline code of {args.template}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,12 @@
 import math
 import json
-import os
+import time
 import uuid
-import boto3
 from botocore.exceptions import ClientError
 import logging
 from urllib.parse import urlparse
+from EmitMetrics import emit_metrics
+from Runtime import env_int, env_str, get_client
 
 
 # Set up logging
@@ -14,17 +15,49 @@ logger.setLevel('INFO')
 
 
 # Define Environmental Variables
-my_glue_db = str(os.environ['glue_db'])
-my_glue_tbl = str(os.environ['glue_tbl'])
-my_workgroup_name = str(os.environ['workgroup_name'])
-my_region = str(os.environ['current_region'])
-my_incl_versions = str(os.environ['included_obj_versions'])
-my_storage_class_to_restore = str(os.environ['storage_class_to_restore'])
+my_glue_db = env_str('glue_db')
+my_glue_tbl = env_str('glue_tbl')
+my_workgroup_name = env_str('workgroup_name')
+my_incl_versions = env_str('included_obj_versions')
+my_storage_class_to_restore = env_str('storage_class_to_restore')
+my_manifest_generation_mode = env_str('manifest_generation_mode')
+my_csv_max_bytes = env_int('csv_max_gib') * 1024 ** 3
+# Glue table over a Parquet S3 Inventory of the destination bucket, blank when none is configured
+my_copied_glue_tbl = env_str('copied_glue_tbl')
+my_destination_prefix = env_str('destination_bucket_prefix')
+my_version_deduplication = env_str('version_deduplication')
 
+# Athena UNLOAD writes at most 100 partitions per query, SinglePass mode writes up to this many chunks per query
+max_unload_partitions = 100
+# Versions of a key with the same ETag and size are restored once, the others are listed on the restored version's
+# manifest row, at most this many per row so the row stays well within the part of the manifest RestoreWorker2 reads
+max_duplicate_versions_per_row = 99
 
-# Set Service Client
-athena_client = boto3.client('athena', region_name=my_region)
-s3Client = boto3.client("s3", region_name=my_region)
+
+############# Restore Order Strategies #############
+
+# Each strategy returns the ORDER BY used to number the inventory rows, the first chunks are restored first.
+# Every order ends with the key and version id, which are unique, so each UNLOAD batch numbers the rows the same way
+unique_order = "key ASC, coalesce(version_id, 'null') ASC"
+
+
+def priority_prefix_order(priority_prefixes):
+    order_cases = ''
+    for priority, prefix in enumerate(priority_prefixes):
+        quoted_prefix = prefix.replace("'", "''")
+        order_cases += f"WHEN substr(key, 1, {len(prefix)}) = '{quoted_prefix}' THEN {priority} "
+    if not order_cases:
+        return unique_order
+    return f'CASE {order_cases}ELSE {len(priority_prefixes)} END ASC, {unique_order}'
+
+
+restore_order_strategies = {
+    'OldestFirst': lambda priority_prefixes: f'last_modified_date ASC, {unique_order}',
+    'NewestFirst': lambda priority_prefixes: "last_modified_date DESC, key DESC, coalesce(version_id, 'null') DESC",
+    'SizeAscending': lambda priority_prefixes: f'size ASC, last_modified_date ASC, {unique_order}',
+    'PrefixClustered': lambda priority_prefixes: unique_order,
+    'PriorityPrefixes': priority_prefix_order,
+}
 
 
 ############# Athena Query Function #############
@@ -32,7 +65,7 @@ s3Client = boto3.client("s3", region_name=my_region)
 def start_query_execution(query_string, athena_db, workgroup_name, query_output_location):
     logger.info(f'Starting Athena query...... with query string: {query_string}')
     try:
-        execute_query = athena_client.start_query_execution(
+        execute_query = get_client('athena').start_query_execution(
             QueryString=query_string,
             QueryExecutionContext={
                 'Database': athena_db
@@ -47,27 +80,34 @@ def start_query_execution(query_string, athena_db, workgroup_name, query_output_
         raise
     else:
         logger.info(f'Query Successful: {execute_query}')
+        return execute_query.get('QueryExecutionId')
 
 
-def lambda_handler(event, context):
-    logger.info(f'Initiating Main Function...')
-    print(event)
-    s3Bucket = str(event.get('s3Bucket'))
-    my_s3_bucket = str(event.get('my_s3_bucket'))
-    chunk_num = int(event.get('next_chunk'))
-    next_chunk = int(event.get('next_chunk'))
-    num_chunks = int(event.get('num_chunks'))
-    my_csv_max_rows = int(event.get('my_csv_max_rows'))
-    my_csv_num_rows = int(event.get('my_csv_num_rows'))
-    csv_chunking_complete = event.get('csv_chunking_complete')
-    my_dt = event.get('my_dt')
-    jobgroupid = event.get('jobgroupid')
-    print(next_chunk)
+# The first single pass UNLOAD also writes its totals as leading partitions (total_rows=N/[last_chunk_id=M/]chunk_id=K/),
+# walk down the prefix and read them back. UNLOAD writes nothing when no rows match the filter.
+def get_unloaded_counts(bucket, unload_location_path):
+    unloaded_counts = {}
+    prefix = unload_location_path
+    while True:
+        logger.info(f'Reading unloaded counts from s3://{bucket}/{prefix}')
+        try:
+            list_response = get_client('s3').list_objects_v2(Bucket=bucket, Prefix=prefix, Delimiter='/')
+        except ClientError as e:
+            logger.error(e)
+            raise
+        partitions = [common_prefix.get('Prefix') for common_prefix in list_response.get('CommonPrefixes', [])
+                      if not common_prefix.get('Prefix').rstrip('/').split('/')[-1].startswith('chunk_id=')]
+        if not partitions:
+            return unloaded_counts
+        prefix = partitions[0]
+        name, value = prefix.rstrip('/').split('/')[-1].split('=')
+        unloaded_counts[name] = int(value)
 
-    ########## Define Athena Query ##########
-    my_query_string = ''
 
-    ### Condition for storage class to restore ###
+############# Manifest Queries #############
+
+# Condition on the storage class of the inventory rows to restore
+def storage_class_filter():
     archive_qr = None
 
     if my_storage_class_to_restore == 'GLACIER':
@@ -76,12 +116,12 @@ def lambda_handler(event, context):
         archive_qr = f"storage_class = 'DEEP_ARCHIVE'"
     elif my_storage_class_to_restore == 'GLACIER_AND_DEEP_ARCHIVE':
         archive_qr = f'''(storage_class = 'GLACIER' OR storage_class = 'DEEP_ARCHIVE')'''
+    return archive_qr
 
-    my_query_output_location = f's3://{s3Bucket}/athena-query-results/csv-chunks/{jobgroupid}/'
-    output_location_path = f'athena-query-results/csv-chunks/{jobgroupid}/'
-
-    ### Create Multiple Query String for Versioned and Non-Versioned Restores ###
 
+# OffsetLimit query of chunk next_chunk, of the current versions or of all versions
+def offset_limit_query(my_s3_bucket, my_dt, my_order_by, next_chunk, my_csv_max_rows):
+    archive_qr = storage_class_filter()
     my_query_string_no_version = f"""
     SELECT bucket as "{my_s3_bucket}", key as "my_key"
     FROM "{my_glue_db}"."{my_glue_tbl}"
@@ -94,7 +134,7 @@ def lambda_handler(event, context):
     bucket = '{my_s3_bucket}'
     AND
     dt = '{my_dt}'
-    ORDER BY last_modified_date ASC
+    ORDER BY {my_order_by}
     OFFSET {next_chunk * my_csv_max_rows}
     LIMIT {my_csv_max_rows};
     """
@@ -109,40 +149,259 @@ def lambda_handler(event, context):
     bucket = '{my_s3_bucket}'
     AND
     dt = '{my_dt}'
-    ORDER BY last_modified_date ASC
+    ORDER BY {my_order_by}
     OFFSET {next_chunk * my_csv_max_rows}
     LIMIT {my_csv_max_rows};
     """
 
-    ### Create Multiple Queries for Current and All Versions ###
+    if my_incl_versions == 'All':
+        return my_query_string_versioned
+    return my_query_string_no_version
 
-    if my_incl_versions == 'Current':
-        my_query_string = my_query_string_no_version
-    elif my_incl_versions == 'All':
-        my_query_string = my_query_string_versioned
 
-    logger.info(my_query_string)
+# Objects the destination inventory lists with the same size and ETag were copied by an earlier run. A copy of a
+# multipart source has another ETag, its source ETag is in user metadata the inventory leaves out, the same size
+# written at or after the source was modified is taken as the copy
+def copied_filter():
+    my_copied_filter = ''
+    if my_copied_glue_tbl:
+        my_destination_key = 'inventory.key'
+        if my_destination_prefix:
+            quoted_prefix = my_destination_prefix.replace("'", "''")
+            my_destination_key = f"concat('{quoted_prefix}/', inventory.key)"
+        my_copied_filter = f"""
+                AND NOT EXISTS (
+                    SELECT 1 FROM "{my_glue_db}"."{my_copied_glue_tbl}" copied
+                    WHERE copied.key = {my_destination_key}
+                    AND copied.size = inventory.size
+                    AND (copied.e_tag = inventory.e_tag
+                         OR (strpos(inventory.e_tag, '-') > 0
+                             AND copied.last_modified_date >= inventory.last_modified_date))
+                    AND coalesce(copied.is_latest, true)
+                    AND NOT coalesce(copied.is_delete_marker, false)
+                )"""
+    return my_copied_filter
 
-    try:
-        start_query_execution(my_query_string, my_glue_db, my_workgroup_name, my_query_output_location)
-    except Exception as e:
-        logger.error(e)
-        raise
-    if next_chunk == num_chunks:
-        csv_chunking_complete = True
+
+# Single pass UNLOAD of chunks next_chunk..last_chunk, chunk_id is computed once and becomes the partition. Until
+# the rows are counted, the query also writes the totals as leading partitions
+def unload_query(my_s3_bucket, my_dt, my_order_by, next_chunk, last_chunk, my_csv_max_rows, csv_counting_complete,
+                 my_unload_location):
+    archive_qr = storage_class_filter()
+    my_copied_filter = copied_filter()
+    my_unload_rows_no_version = f"""
+                SELECT bucket, url_encode(key) as key, coalesce(size, 0) as size,
+                row_number() OVER (ORDER BY {my_order_by}) - 1 as row_num
+                FROM "{my_glue_db}"."{my_glue_tbl}" inventory
+                WHERE {archive_qr}
+                AND
+                is_latest = true
+                AND
+                is_delete_marker = false
+                AND
+                bucket = '{my_s3_bucket}'
+                AND
+                dt = '{my_dt}'{my_copied_filter}
+    """
+
+    my_unload_rows_versioned = f"""
+                SELECT bucket, url_encode(key) as key, CASE WHEN version_id IS NULL THEN 'null' ELSE version_id END as version_id,
+                coalesce(size, 0) as size,
+                row_number() OVER (ORDER BY {my_order_by}) - 1 as row_num
+                FROM "{my_glue_db}"."{my_glue_tbl}" inventory
+                WHERE {archive_qr}
+                AND
+                is_delete_marker = false
+                AND
+                bucket = '{my_s3_bucket}'
+                AND
+                dt = '{my_dt}'{my_copied_filter}
+    """
+
+    # The oldest version of each content is restored, the row lists the other versions CopyWorker copies from it
+    my_unload_rows_deduplicated = f"""
+                SELECT bucket, url_encode(key) as key, version_id, duplicate_versions, size,
+                row_number() OVER (ORDER BY {my_order_by}) - 1 as row_num
+                FROM (
+                    SELECT *,
+                    row_number() OVER (PARTITION BY key, content_id, size, content_group ORDER BY content_version) as group_version,
+                    array_join(slice(array_agg(version_id) OVER (
+                        PARTITION BY key, content_id, size, content_group ORDER BY content_version
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING), 2, {max_duplicate_versions_per_row}), '|') as duplicate_versions
+                    FROM (
+                        SELECT *, (content_version - 1) / {max_duplicate_versions_per_row + 1} as content_group
+                        FROM (
+                            SELECT bucket, key, version_id, size, last_modified_date, content_id,
+                            row_number() OVER (PARTITION BY key, content_id, size ORDER BY last_modified_date ASC, version_id ASC) as content_version
+                            FROM (
+                                SELECT bucket, key, CASE WHEN version_id IS NULL THEN 'null' ELSE version_id END as version_id,
+                                coalesce(size, 0) as size, last_modified_date,
+                                coalesce(e_tag, version_id, 'null') as content_id
+                                FROM "{my_glue_db}"."{my_glue_tbl}" inventory
+                                WHERE {archive_qr}
+                                AND
+                                is_delete_marker = false
+                                AND
+                                bucket = '{my_s3_bucket}'
+                                AND
+                                dt = '{my_dt}'{my_copied_filter}
+                            )
+                        )
+                    )
+                )
+                WHERE group_version = 1
+    """
+
+    my_unload_rows = my_unload_rows_no_version
+    my_version_select = ''
+    if my_incl_versions == 'All':
+        my_unload_rows = my_unload_rows_versioned
+        my_version_select = 'version_id, '
+        if my_version_deduplication == 'Enable':
+            my_unload_rows = my_unload_rows_deduplicated
+            my_version_select = 'version_id, duplicate_versions, '
+
+    # Row cap only, or a new chunk whenever the running size within a row chunk crosses the byte cap
+    my_chunked_rows = f"""
+        SELECT *, row_num / {my_csv_max_rows} as chunk_id
+        FROM ({my_unload_rows})
+    """
+    if my_csv_max_bytes > 0:
+        my_chunked_rows = f"""
+        SELECT *, dense_rank() OVER (ORDER BY row_chunk_id, byte_chunk_id) - 1 as chunk_id
+        FROM (
+            SELECT *, (sum(size) OVER (PARTITION BY row_chunk_id ORDER BY row_num ROWS UNBOUNDED PRECEDING) - 1) / {my_csv_max_bytes} as byte_chunk_id
+            FROM (
+                SELECT *, row_num / {my_csv_max_rows} as row_chunk_id
+                FROM ({my_unload_rows})
+            )
+        )
+    """
+
+    # The counting batch writes the totals as leading partitions, read back by get_unloaded_counts
+    my_count_columns = ''
+    my_count_select = ''
+    my_unload_partitions = "ARRAY['chunk_id', 'chunk_rows', 'chunk_bytes']"
+    if not csv_counting_complete:
+        my_count_columns = ', count(*) OVER () as total_rows'
+        my_count_select = 'total_rows, '
+        my_unload_partitions = "ARRAY['total_rows', 'chunk_id', 'chunk_rows', 'chunk_bytes']"
+        if my_csv_max_bytes > 0:
+            my_count_columns = ', count(*) OVER () as total_rows, max(chunk_id) OVER () as last_chunk_id'
+            my_count_select = 'total_rows, last_chunk_id, '
+            my_unload_partitions = "ARRAY['total_rows', 'last_chunk_id', 'chunk_id', 'chunk_rows', 'chunk_bytes']"
+
+    my_unload_query_string = f"""
+    UNLOAD (
+    SELECT bucket, key, {my_version_select}size, {my_count_select}chunk_id, count(*) OVER (PARTITION BY chunk_id) as chunk_rows,
+    sum(size) OVER (PARTITION BY chunk_id) as chunk_bytes
+    FROM (
+        SELECT *{my_count_columns}
+        FROM ({my_chunked_rows})
+    )
+    WHERE chunk_id BETWEEN {next_chunk} AND {last_chunk}
+    )
+    TO '{my_unload_location}'
+    WITH (format = 'TEXTFILE', field_delimiter = ',', compression = 'NONE', partitioned_by = {my_unload_partitions});
+    """
+    return my_unload_query_string
+
+
+def lambda_handler(event, context):
+    logger.info(f'Initiating Main Function...')
+    print(event)
+    s3Bucket = str(event.get('s3Bucket'))
+    my_s3_bucket = str(event.get('my_s3_bucket'))
+    next_chunk = int(event.get('next_chunk'))
+    num_chunks = int(event.get('num_chunks'))
+    my_csv_max_rows = int(event.get('my_csv_max_rows'))
+    my_csv_num_rows = int(event.get('my_csv_num_rows'))
+    csv_chunking_complete = event.get('csv_chunking_complete')
+    csv_counting_complete = event.get('csv_counting_complete')
+    my_query_execution_id = event.get('my_query_execution_id')
+    my_dt = event.get('my_dt')
+    jobgroupid = event.get('jobgroupid')
+    restore_order = event.get('restore_order')
+    priority_prefixes = event.get('priority_prefixes')
+    print(next_chunk)
+
+    ########## Define Athena Query ##########
+    my_order_by = restore_order_strategies[restore_order](
+        [prefix.strip() for prefix in priority_prefixes.split(',') if prefix.strip()])
+    logger.info(f'Restore order {restore_order}: ORDER BY {my_order_by}')
+
+    my_query_output_location = f's3://{s3Bucket}/athena-query-results/csv-chunks/{jobgroupid}/'
+    output_location_path = f'athena-query-results/csv-chunks/{jobgroupid}/'
+
+    ### Single Pass writes chunks next_chunk..last_chunk, Offset/Limit writes chunk next_chunk only ###
+    start_query = True
+    if my_manifest_generation_mode == 'SinglePass':
+        # Without a COUNT(*) pass, the first UNLOAD counts the rows and the next invocation reads the count back
+        if not csv_counting_complete and next_chunk > 0:
+            unloaded_counts = get_unloaded_counts(s3Bucket, f'{output_location_path}chunks-0-{next_chunk - 1}/')
+            my_csv_num_rows = unloaded_counts.get('total_rows', 0)
+            num_chunks = unloaded_counts.get('last_chunk_id', my_csv_num_rows // my_csv_max_rows)
+            csv_counting_complete = True
+            logger.info(f'Single pass counted {my_csv_num_rows} rows in {num_chunks + 1} chunks')
+            # Nothing left to write, the poller sees the previous query as SUCCEEDED
+            start_query = my_csv_num_rows > 0 and next_chunk <= num_chunks
+            csv_chunking_complete = my_csv_num_rows > 0 and next_chunk > num_chunks
+        if csv_counting_complete:
+            last_chunk = min(next_chunk + max_unload_partitions - 1, num_chunks)
+        else:
+            last_chunk = next_chunk + max_unload_partitions - 1
+    else:
+        if my_csv_max_bytes > 0:
+            logger.warning('The manifest size cap needs SinglePass manifest generation, OffsetLimit chunks by key count only')
+        last_chunk = next_chunk
+
+    # Keep the UNLOAD query results and their manifest out of the prefix ListPrefix reads
+    my_unload_location = f'{my_query_output_location}chunks-{next_chunk}-{last_chunk}/'
+    my_unload_query_output_location = f's3://{s3Bucket}/athena-query-results/unload-results/{jobgroupid}/'
+
+    if my_manifest_generation_mode == 'SinglePass':
+        my_query_output_location = my_unload_query_output_location
+        my_query_string = unload_query(my_s3_bucket, my_dt, my_order_by, next_chunk, last_chunk, my_csv_max_rows,
+                                       csv_counting_complete, my_unload_location)
     else:
-        next_chunk = chunk_num + 1
+        my_query_string = offset_limit_query(my_s3_bucket, my_dt, my_order_by, next_chunk, my_csv_max_rows)
+
+    logger.info(my_query_string)
+
+    if start_query:
+        query_start = time.perf_counter()
+        try:
+            my_query_execution_id = start_query_execution(my_query_string, my_glue_db, my_workgroup_name, my_query_output_location)
+        except Exception as e:
+            logger.error(e)
+            emit_metrics({'JobGroup': jobgroupid, 'StorageClass': my_storage_class_to_restore},
+                         {'ManifestQueryFailures': (1, 'Count')})
+            raise
+        emit_metrics({'JobGroup': jobgroupid, 'StorageClass': my_storage_class_to_restore}, {
+            'ManifestQueriesStarted': (1, 'Count'),
+            'ManifestChunksRequested': (last_chunk - next_chunk + 1, 'Count'),
+            'InventoryRowsToRestore': (my_csv_num_rows if csv_counting_complete else None, 'Count'),
+            'QueryStartLatency': ((time.perf_counter() - query_start) * 1000, 'Milliseconds'),
+        }, {'QueryExecutionId': my_query_execution_id, 'ManifestGenerationMode': my_manifest_generation_mode})
+        if csv_counting_complete and last_chunk == num_chunks:
+            csv_chunking_complete = True
+        else:
+            next_chunk = last_chunk + 1
 
     return {
             'num_chunks' : num_chunks,
             'next_chunk': next_chunk,
             'csv_chunking_complete': csv_chunking_complete,
+            'csv_counting_complete': csv_counting_complete,
             'my_csv_num_rows' : my_csv_num_rows,
             'my_csv_max_rows' : my_csv_max_rows,
             'my_dt' : my_dt,
             's3Bucket' : s3Bucket,
             'jobgroupid' : jobgroupid,
             'my_query_output_location': my_query_output_location,
+            'my_query_execution_id': my_query_execution_id,
             'output_location_path': output_location_path,
             'my_s3_bucket': my_s3_bucket,
+            'restore_order': restore_order,
+            'priority_prefixes': priority_prefixes,
             }
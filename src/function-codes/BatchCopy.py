@@ -1,24 +1,29 @@
-import boto3
-import os
 from urllib import parse
-from botocore.client import Config
 from botocore.exceptions import ClientError as S3ClientError
-from boto3.s3.transfer import TransferConfig
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from s3transfer.subscribers import BaseSubscriber
 import logging
 import datetime
+import math
+import time
+from EmitMetrics import emit_metrics
+from Runtime import client_config, env_int, env_str, get_client
 
 # Define Environmental Variables
-target_bucket = str(os.environ['destination_bucket'])
-my_max_pool_connections = int(os.environ['max_pool_connections'])
-my_max_concurrency = int(os.environ['max_concurrency'])
-my_multipart_chunksize = int(os.environ['multipart_chunksize'])
-my_max_attempts = int(os.environ['max_attempts'])
-metadata_copy = str(os.environ['copy_metadata'])
-tagging_copy = str(os.environ['copy_tagging'])
-obj_copy_storage_class = str(os.environ['copy_storage_class'])
-new_prefix = str(os.environ['destination_bucket_prefix'])
-# my_source_storage_class = str(os.environ['source_storage_class'])
-my_source_storage_class = ['GLACIER', 'DEEP_ARCHIVE']
+target_bucket = env_str('destination_bucket')
+my_max_pool_connections = env_int('max_pool_connections')
+my_max_concurrency = env_int('max_concurrency')
+my_multipart_chunksize = env_int('multipart_chunksize')
+my_max_attempts = env_int('max_attempts')
+metadata_copy = env_str('copy_metadata')
+tagging_copy = env_str('copy_tagging')
+obj_copy_storage_class = env_str('copy_storage_class')
+new_prefix = env_str('destination_bucket_prefix')
+lambda_memory_mb = env_int('AWS_LAMBDA_FUNCTION_MEMORY_SIZE')
+copy_verification = env_str('copy_verification')
+skip_copied_objects = env_str('skip_copied_objects')
+# Copy manifests only list objects their restore job restored successfully, and S3 only restores objects
+# in an archive storage class, so the source storage class needs no HEAD request to check
 
 
 # # Set up logging
@@ -29,14 +34,292 @@ logger.setLevel('INFO')
 # boto3.set_stream_logger("")
 
 # Set and Declare Configuration Parameters
-transfer_config = TransferConfig(max_concurrency=my_max_concurrency, multipart_chunksize=my_multipart_chunksize)
-config = Config(max_pool_connections=my_max_pool_connections, retries = {'max_attempts': my_max_attempts})
+# S3 multipart upload limits
+max_upload_parts = 10000
+max_part_bytes = 5 * 1024 ** 3
+part_size_step = 1024 ** 2
+# Memory budgeted per in-flight part request, bounds the part concurrency on small function sizes
+memory_mb_per_part_request = 2
+max_part_concurrency = max(1, min(my_max_concurrency, lambda_memory_mb // memory_mb_per_part_request))
+# Every in-flight part needs its own connection, a smaller pool would leave part threads waiting for one
+config = client_config(max_pool_connections=max(my_max_pool_connections, max_part_concurrency), max_attempts=my_max_attempts)
 
-# Set and Declare Copy Arguments
-myargs = {'ACL': 'bucket-owner-full-control', 'StorageClass': obj_copy_storage_class}
+# CopyObject rejects copy sources above 5 GiB with this error, those objects are copied in parts
+single_copy_too_large_code = 'InvalidRequest'
+single_copy_too_large_message = 'maximum allowable size'
+
+# Copy verification, the destination ETag equals the source ETag when both have the same part boundaries
+verification_mode = 'ETag'
+checksum_algorithms = ['CRC32', 'CRC32C', 'SHA1', 'SHA256']
+# ETags of objects encrypted with these are not an MD5 of the content and cannot be compared
+etag_incomparable_encryption = ['aws:kms', 'aws:kms:dsse']
+# Copies of multipart sources record the source ETag in this user metadata, so a later run can tell the object was
+# copied and a verified copy can be checked when its ETag cannot be compared
+copied_source_etag_metadata = 'restore-copy-source-etag'
+record_source_etag = skip_copied_objects == 'Enable' or copy_verification == verification_mode
+missing_object_codes = ['404', 'NoSuchKey', 'NotFound']
+# CopyWorker marks the copies of a restored version made for its duplicate versions
+duplicate_copy_marker = '#copy-as-'
+
+
+# Hand the size from our own HEAD request to the transfer manager, so it does not send another one
+class SourceSizeSubscriber(BaseSubscriber):
+  def __init__(self, size):
+    self._size = size
+
+  def on_queued(self, future, **kwargs):
+    future.meta.provide_transfer_size(self._size)
+
+
+# One CopyObject request, S3 carries the source metadata and tags over server side
+def single_request_copy(copy_source, newBucket, newKey, **copy_args):
+  request_args = {
+    'MetadataDirective': 'COPY' if metadata_copy == 'Enable' else 'REPLACE',
+    'TaggingDirective': 'COPY' if tagging_copy == 'Enable' else 'REPLACE',
+  }
+  request_args.update(copy_args)
+  return get_client('s3', config).copy_object(
+    CopySource=copy_source,
+    Bucket=newBucket,
+    Key=newKey,
+    ACL='bucket-owner-full-control',
+    StorageClass=obj_copy_storage_class,
+    **request_args
+  )
+
+
+# The copy of a multipart source in one request has an MD5 ETag that never equals the source "-N" ETag. Replace the
+# metadata with the source metadata and the source ETag marker, for the same object the HEAD request read
+def source_etag_copy_args(source_head):
+  copy_args = metadata_args(source_head) if metadata_copy == 'Enable' else {}
+  copy_args['Metadata'] = dict(copy_args.get('Metadata', {}), **{copied_source_etag_metadata: source_head['ETag']})
+  copy_args['MetadataDirective'] = 'REPLACE'
+  copy_args['CopySourceIfMatch'] = source_head['ETag']
+  return copy_args
+
+
+def is_too_large_for_single_copy(e):
+  error = e.response.get('Error', {})
+  return error.get('Code') == single_copy_too_large_code and single_copy_too_large_message in str(error.get('Message'))
+
+
+# Part size and parts in flight for an object: parts of at least my_multipart_chunksize, grown so the object
+# fits in max_upload_parts, and as many parts in flight as there are parts, up to max_part_concurrency
+# Verified copies pass the part size of the source instead, to keep its part boundaries
+def transfer_profile(size, source_part_bytes=None):
+  part_bytes = max(my_multipart_chunksize, math.ceil(size / max_upload_parts / part_size_step) * part_size_step)
+  part_bytes = min(part_bytes, max_part_bytes)
+  if source_part_bytes:
+    part_bytes = source_part_bytes
+  parts = max(1, math.ceil(size / part_bytes))
+  return {
+    'bytes': size,
+    'part_bytes': part_bytes,
+    'parts': parts,
+    'concurrency': min(parts, max_part_concurrency),
+  }
+
+
+# Request arguments that set the metadata of the source HEAD response on the new object
+def metadata_args(get_metadata):
+  myargs = {}
+  # Create variables to append as metadata to destination object
+  cache_control = get_metadata.get('CacheControl')
+  content_disposition = get_metadata.get('ContentDisposition')
+  content_encoding = get_metadata.get('ContentEncoding')
+  content_language = get_metadata.get('ContentLanguage')
+  content_type = get_metadata.get('ContentType')
+  metadata = get_metadata.get('Metadata')
+  website_redirect_location = get_metadata.get('WebsiteRedirectLocation')
+  expires = get_metadata.get('Expires')
+  # Construct Request With Required and Available Arguments
+  if cache_control:
+    myargs['CacheControl'] = cache_control
+  if content_disposition:
+    myargs['ContentDisposition'] = content_disposition
+  if content_encoding:
+    myargs['ContentEncoding'] = content_encoding
+  if content_language:
+    myargs['ContentLanguage'] = content_language
+  if content_type:
+    myargs['ContentType'] = content_type
+  if metadata:
+    myargs['Metadata'] = metadata
+  if website_redirect_location:
+    myargs['WebsiteRedirectLocation'] = website_redirect_location
+  if expires:
+    myargs['Expires'] = expires
+  return myargs
+
+
+# Multipart uploads do not carry metadata or tags over, read them from the source and set them on the new object
+def multipart_copy(copy_source, newBucket, newKey, get_metadata=None, source_part_bytes=None, checksum_algorithm=None):
+  myargs = {'ACL': 'bucket-owner-full-control', 'StorageClass': obj_copy_storage_class}
+  if checksum_algorithm:
+    myargs['ChecksumAlgorithm'] = checksum_algorithm
+  # Construct/Retrieve get source key metadata, the size is always needed for the parts
+  if get_metadata is None:
+    get_metadata = get_client('s3', config).head_object(**copy_source)
+  else:
+    # Verified copies read the source ETag first, only copy parts of that same object
+    myargs['CopySourceIfMatch'] = get_metadata['ETag']
+
+  # Toggle Metadata or Tagging Copy Based on Enviromental Variables
+  # Construct Request Parameters with metadata and tagging from sourceKey
+  if metadata_copy == 'Enable':
+    logger.info("Object Metadata Copy Enabled from Source to Destination")
+    myargs.update(metadata_args(get_metadata))
+  else:
+    logger.info("Object Metadata Copy Disabled")
+
+  if record_source_etag:
+    myargs['Metadata'] = dict(myargs.get('Metadata', {}), **{copied_source_etag_metadata: get_metadata['ETag']})
+
+  if tagging_copy == 'Enable':
+    logger.info("Object Tagging Copy Enabled from Source to Destination")
+    # Construct/Retrieve get source key tagging
+    get_obj_tag = get_client('s3', config).get_object_tagging(**copy_source)
+    existing_tag_set = (get_obj_tag.get('TagSet'))
+    # Convert the Output from get object tagging to be compatible with transfer s3.copy()
+    tagging_to_s3 = "&".join([f"{parse.quote_plus(d['Key'])}={parse.quote_plus(d['Value'])}" for d in existing_tag_set])
+    # Construct Request With Required and Available Arguments
+    if existing_tag_set:
+      myargs['Tagging'] = tagging_to_s3
+  else:
+    logger.info("Object Tagging Copy Disabled")
+
+  profile = transfer_profile(get_metadata['ContentLength'], source_part_bytes)
+  logger.info(f"Copying {get_metadata['ContentLength']} bytes with profile {profile}")
+  transfer_config = TransferConfig(max_concurrency=profile['concurrency'], multipart_chunksize=profile['part_bytes'])
+  # A multipart source smaller than the default threshold must still be copied in parts to keep its ETag
+  if source_part_bytes:
+    transfer_config.multipart_threshold = min(transfer_config.multipart_threshold, source_part_bytes)
+  with create_transfer_manager(get_client('s3', config), transfer_config) as manager:
+    future = manager.copy(copy_source, newBucket, newKey, extra_args=myargs,
+                          subscribers=[SourceSizeSubscriber(get_metadata['ContentLength'])])
+    future.result()
+  return profile
+
+
+# Part length of a multipart source whose parts, except the last, all have the length of the first part
+def get_source_part_bytes(copy_source, source_head):
+  source_etag = source_head['ETag'].strip('"')
+  if '-' not in source_etag:
+    return None
+  parts_count = int(source_etag.rsplit('-', 1)[1])
+  first_part_bytes = get_client('s3', config).head_object(PartNumber=1, **copy_source)['ContentLength']
+  if math.ceil(source_head['ContentLength'] / first_part_bytes) != parts_count:
+    return None
+  return first_part_bytes
+
+
+def get_source_checksum(source_head):
+  for algorithm in checksum_algorithms:
+    checksum = source_head.get(f'Checksum{algorithm}')
+    if checksum:
+      return algorithm, checksum
+  return None, None
+
+
+def match_status(method, matches):
+  return f'{method}-match' if matches else f'{method}-mismatch'
+
+
+# Compare the new object with its source, e.g. etag-match, checksum-SHA256-mismatch, size-match, or unavailable.
+# etag_parity is True when both objects are known to have the same part boundaries
+def compare_copy(source_head, source_checksum, destination, etag_parity):
+  checksum_algorithm, checksum = source_checksum
+  destination_checksum = destination.get(f'Checksum{checksum_algorithm}') if checksum_algorithm else None
+  # Full object checksums compare whatever the part boundaries
+  if destination_checksum and '-' not in checksum and '-' not in destination_checksum:
+    return match_status(f'checksum-{checksum_algorithm}', destination_checksum == checksum)
+  # Composite checksums and ETags of multipart objects, "<digest>-<parts>", depend on the part boundaries too. Equal
+  # values prove the copy, different values only show a mismatch when both objects have the same parts
+  if destination_checksum and (etag_parity or destination_checksum == checksum):
+    return match_status(f'checksum-{checksum_algorithm}', destination_checksum == checksum)
+  encrypted = (source_head.get('SSECustomerAlgorithm') or
+               source_head.get('ServerSideEncryption') in etag_incomparable_encryption or
+               destination.get('ServerSideEncryption') in etag_incomparable_encryption)
+  if not encrypted and (etag_parity or destination['ETag'] == source_head['ETag']):
+    return match_status('etag', destination['ETag'] == source_head['ETag'])
+  # Otherwise only the size and the source ETag recorded on the copy can be checked
+  if 'ContentLength' in destination:
+    return match_status('size', destination['ContentLength'] == source_head['ContentLength'] and
+                        destination.get('Metadata', {}).get(copied_source_etag_metadata) == source_head['ETag'])
+  return 'unavailable'
+
+
+# Copy keeping the source part boundaries, or with the source checksum algorithm, then compare both objects
+# without reading their content. Returns the copy profile, the verification result and the bytes copied
+def verified_copy(copy_source, newBucket, newKey, source_head=None):
+  if source_head is None:
+    source_head = get_client('s3', config).head_object(ChecksumMode='ENABLED', **copy_source)
+  source_checksum = get_source_checksum(source_head)
+  source_part_bytes = get_source_part_bytes(copy_source, source_head)
+  source_is_multipart = '-' in source_head['ETag']
+
+  if not source_is_multipart and source_head['ContentLength'] <= max_part_bytes:
+    copy_args = {'CopySourceIfMatch': source_head['ETag']}
+    if source_checksum[0]:
+      copy_args['ChecksumAlgorithm'] = source_checksum[0]
+    response = single_request_copy(copy_source, newBucket, newKey, **copy_args)
+    destination = dict(response['CopyObjectResult'], ServerSideEncryption=response.get('ServerSideEncryption'))
+    copy_profile = 'profile=single'
+    etag_parity = True
+  else:
+    profile = multipart_copy(copy_source, newBucket, newKey, source_head, source_part_bytes, source_checksum[0])
+    copy_profile = 'profile=multipart part_bytes={part_bytes} parts={parts} concurrency={concurrency}'.format(**profile)
+    # The transfer manager does not return the completed upload, read its ETag and checksum back
+    destination = get_client('s3', config).head_object(Bucket=newBucket, Key=newKey, ChecksumMode='ENABLED')
+    # The source part size only comes from its first part, the other parts may still differ
+    etag_parity = False
+
+  return copy_profile, compare_copy(source_head, source_checksum, destination, etag_parity), source_head['ContentLength']
+
+
+# Copy one object, returns the copy profile, the verification result when copies are verified, and the bytes
+# copied when a HEAD request read the source size, single request copies without one leave them unknown
+def copy_to_destination(copy_source, newBucket, newKey, source_head=None):
+  if copy_verification == verification_mode:
+    copy_profile, verification_status, copied_bytes = verified_copy(copy_source, newBucket, newKey, source_head)
+    return copy_profile, f'verification={verification_status}', copied_bytes
+  copy_args = {}
+  if skip_copied_objects == 'Enable':
+    if source_head is None:
+      source_head = get_client('s3', config).head_object(**copy_source)
+    if '-' in source_head['ETag']:
+      copy_args = source_etag_copy_args(source_head)
+  try:
+    single_request_copy(copy_source, newBucket, newKey, **copy_args)
+  except S3ClientError as e:
+    if not is_too_large_for_single_copy(e):
+      raise
+    logger.info(f"Object {copy_source['Key']} is above the single request copy limit, copying it in parts")
+    profile = multipart_copy(copy_source, newBucket, newKey, source_head)
+    # Space separated so the profile stays a single column of the completion report
+    return 'profile=multipart part_bytes={part_bytes} parts={parts} concurrency={concurrency}'.format(**profile), None, profile['bytes']
+  return 'profile=single', None, source_head['ContentLength'] if source_head else None
+
+
+# How the destination key is known to hold the source object already, e.g. etag or marker, or None to copy it.
+# Also returns the source HEAD response when one was needed, so the copy does not send it again
+def find_existing_copy(copy_source, newBucket, newKey):
+  try:
+    destination = get_client('s3', config).head_object(Bucket=newBucket, Key=newKey, ChecksumMode='ENABLED')
+  except S3ClientError as e:
+    if e.response.get('Error', {}).get('Code') in missing_object_codes:
+      return None, None
+    raise
+  source_head = get_client('s3', config).head_object(ChecksumMode='ENABLED', **copy_source)
+  if destination['ContentLength'] != source_head['ContentLength']:
+    return None, source_head
+  if destination.get('Metadata', {}).get(copied_source_etag_metadata) == source_head['ETag']:
+    return 'marker', source_head
+  match = compare_copy(source_head, get_source_checksum(source_head), destination, True)
+  if match.endswith('-match'):
+    return match[:-len('-match')], source_head
+  return None, source_head
 
-# Instantiate S3Client
-s3Client = boto3.client('s3', config=config)
 
 def lambda_handler(event, context):
   # Parse job parameters from Amazon S3 batch operations
@@ -54,6 +337,14 @@ def lambda_handler(event, context):
   s3VersionId = event['tasks'][0]['s3VersionId']
   s3BucketArn = event['tasks'][0]['s3BucketArn']
   s3Bucket = s3BucketArn.split(':')[-1]
+  # Each duplicate version adds another version of the key to the destination, a copy already there is no reason to skip it
+  duplicate_copy = s3VersionId is not None and duplicate_copy_marker in s3VersionId
+  if duplicate_copy:
+    s3VersionId = s3VersionId.split(duplicate_copy_marker, 1)[0]
+  # Copy, SingleCopy, MultipartCopy or AlreadyCopied, the metrics of failed copies keep Copy unless the profile is known
+  metric_operation = 'Copy'
+  copied_bytes = None
+  copy_start = time.perf_counter()
 
   try:
     # Prepare result code and string
@@ -68,19 +359,6 @@ def lambda_handler(event, context):
     # If source key has VersionID, then construct request with VersionID
     if s3VersionId is not None:
       copy_source['VersionId'] = s3VersionId
-      # Construct/Retrieve get source key metadata
-      if metadata_copy == 'Enable':
-        get_metadata = s3Client.head_object(Bucket=s3Bucket, Key=s3Key, VersionId=s3VersionId)
-      # Construct/Retrieve get source key tagging
-      if tagging_copy == 'Enable':
-        get_obj_tag = s3Client.get_object_tagging(Bucket=s3Bucket, Key=s3Key, VersionId=s3VersionId)
-    else:
-      # Construct/Retrieve get source key metadata
-      if metadata_copy == 'Enable':
-        get_metadata = s3Client.head_object(Bucket=s3Bucket, Key=s3Key)
-      # Construct/Retrieve get source key tagging
-      if tagging_copy == 'Enable':
-        get_obj_tag = s3Client.get_object_tagging(Bucket=s3Bucket, Key=s3Key)
 
     # Construct New Path
     # Construct New Key
@@ -91,68 +369,32 @@ def lambda_handler(event, context):
 
     newBucket = target_bucket
 
-    # Toggle Metadata or Tagging Copy Based on Enviromental Variables
-    # Construct Request Parameters with metadata and tagging from sourceKey
-    # Create variables to append as metadata and tagging to destination object
-    if metadata_copy == 'Enable':
-      logger.info("Object Metadata Copy Enabled from Source to Destination")
-      cache_control = get_metadata.get('CacheControl')
-      content_disposition = get_metadata.get('ContentDisposition')
-      content_encoding = get_metadata.get('ContentEncoding')
-      content_language = get_metadata.get('ContentLanguage')
-      metadata = get_metadata.get('Metadata')
-      website_redirect_location = get_metadata.get('WebsiteRedirectLocation')
-      expires = get_metadata.get('Expires')
-      # Construct Request With Required and Available Arguments
-      if cache_control:
-        myargs['CacheControl'] = cache_control
-      if content_disposition:
-        myargs['ContentDisposition'] = content_disposition
-      if content_encoding:
-        myargs['ContentEncoding'] = content_encoding
-      if content_language:
-        myargs['ContentLanguage'] = content_language
-      if metadata:
-        myargs['Metadata'] = metadata
-      if website_redirect_location:
-        myargs['WebsiteRedirectLocation'] = website_redirect_location
-      if expires:
-        myargs['Expires'] = expires
-    else:
-      logger.info("Object Metadata Copy Disabled")
-
-    if tagging_copy == 'Enable':
-      logger.info("Object Tagging Copy Enabled from Source to Destination")
-      existing_tag_set = (get_obj_tag.get('TagSet'))
-      # Convert the Output from get object tagging to be compatible with transfer s3.copy()
-      tagging_to_s3 = "&".join([f"{parse.quote_plus(d['Key'])}={parse.quote_plus(d['Value'])}" for d in existing_tag_set])
-      # Construct Request With Required and Available Arguments
-      if existing_tag_set:
-        myargs['Tagging'] = tagging_to_s3
-    else:
-      logger.info("Object Tagging Copy Disabled")
-
-    # Include Copy Source Storage Class Condition:
-    response = {}
-    head_object_storage_class = get_metadata.get('StorageClass')
-    logger.info(f"Storage class of source key is {head_object_storage_class}!")
-    # my_source_storage_class
-    if head_object_storage_class in my_source_storage_class:
-      # Initiate the Actual Copy Operation and include transfer config option
-      logger.info(f"starting copy of object {s3Key} with versionID {s3VersionId} between SOURCEBUCKET: {s3Bucket} and DESTINATIONBUCKET: {newBucket}")
-      response = s3Client.copy(copy_source, newBucket, newKey, Config=transfer_config, ExtraArgs=myargs)
-      # Confirm copy was successful
-      logger.info("Successfully completed the copy process!")
-
-      # Mark as succeeded
-      resultCode = 'Succeeded'
-      resultString = str("Successfully completed the copy process!")
+    # Initiate the Actual Copy Operation, a single request first and in parts when the object is too large
+    logger.info(f"starting copy of object {s3Key} with versionID {s3VersionId} between SOURCEBUCKET: {s3Bucket} and DESTINATIONBUCKET: {newBucket}")
+    source_head = None
+    copied_match = None
+    if skip_copied_objects == 'Enable' and not duplicate_copy:
+      copied_match, source_head = find_existing_copy(copy_source, newBucket, newKey)
 
+    if copied_match:
+      logger.info(f"Skipping copy, {newKey} in DESTINATIONBUCKET: {newBucket} already holds object {s3Key} with versionID {s3VersionId}")
+      resultCode = 'Succeeded'
+      resultString = str(f"AlreadyCopied: destination object already matches its source! match={copied_match}")
+      metric_operation = 'AlreadyCopied'
     else:
-      logger.info(f"Skipping Copy, object {s3Key} with versionID {s3VersionId} in storage-class {head_object_storage_class} is not in specified storage class {my_source_storage_class}!")
-      # Mark as succeeded
-      resultCode = 'PermanentFailure'
-      resultString = str("Skipping copy, object storage class does not match the specified copy source storage class")
+      copy_profile, verification, copied_bytes = copy_to_destination(copy_source, newBucket, newKey, source_head)
+      metric_operation = 'MultipartCopy' if copy_profile.startswith('profile=multipart') else 'SingleCopy'
+      if verification and verification.endswith('-mismatch'):
+        logger.error(f"Copy of {s3Key} does not match its source, {verification}")
+        resultCode = 'PermanentFailure'
+        resultString = str(f"Copied object does not match its source! {copy_profile} {verification}")
+      else:
+        # Confirm copy was successful
+        logger.info("Successfully completed the copy process!")
+
+        # Mark as succeeded
+        resultCode = 'Succeeded'
+        resultString = str(f"Successfully completed the copy process! {copy_profile} {verification or ''}".rstrip())
 
   except S3ClientError as e:
     # log errors, some errors does not have a response, so handle them
@@ -194,6 +436,16 @@ def lambda_handler(event, context):
     'resultCode': resultCode,
     'resultString': resultString
     })
+    copy_latency = (time.perf_counter() - copy_start) * 1000
+    copy_succeeded = resultCode == 'Succeeded' and metric_operation != 'AlreadyCopied'
+    emit_metrics({'StorageClass': obj_copy_storage_class, 'Operation': metric_operation}, {
+      'ObjectsCopied': (1 if copy_succeeded else 0, 'Count'),
+      'ObjectsSkipped': (1 if metric_operation == 'AlreadyCopied' else 0, 'Count'),
+      'CopyFailures': (0 if resultCode == 'Succeeded' else 1, 'Count'),
+      'BytesCopied': (copied_bytes if copy_succeeded else None, 'Bytes'),
+      'CopyLatency': (copy_latency, 'Milliseconds'),
+      'CopyThroughput': (copied_bytes / copy_latency * 1000 if copy_succeeded and copied_bytes else None, 'Bytes/Second'),
+    }, {'BatchJobId': jobId, 'TaskId': taskId})
 
   return {
   'invocationSchemaVersion': invocationSchemaVersion,
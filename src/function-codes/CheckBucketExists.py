@@ -1,10 +1,8 @@
 import json
 import cfnresponse
 import logging
-import os
-import boto3
 from botocore.exceptions import ClientError
-from botocore.client import Config
+from Runtime import client_config, get_client
 
 # Enable debugging for troubleshooting
 # boto3.set_stream_logger("")
@@ -15,22 +13,17 @@ logger = logging.getLogger(__name__)
 logger.setLevel('INFO')
 
 
-# Define Environmental Variables
-my_region = str(os.environ['AWS_REGION'])
-
-
 # Set SDK paramters
-config = Config(retries = {'max_attempts': 5})
+config = client_config(max_attempts=5)
 
 # Set variables
 # Set Service Parameters
-s3Client = boto3.client('s3', config=config, region_name=my_region)
 
 
 def check_bucket_exists(bucket):
     logger.info(f"Checking if Archive Bucket Exists")
     try:
-        check_bucket = s3Client.get_bucket_location(
+        check_bucket = get_client('s3', config).get_bucket_location(
             Bucket=bucket,
         )
     except ClientError as e:
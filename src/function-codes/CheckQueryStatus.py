@@ -0,0 +1,70 @@
+import datetime
+from botocore.exceptions import ClientError
+import logging
+from Runtime import env_int, get_client
+
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+
+# Define Environmental Variables
+my_min_poll_wait = env_int('min_poll_wait_seconds')
+my_max_poll_wait = env_int('max_poll_wait_seconds')
+
+# Other Variables
+# The wait before the next poll grows with the time the query has been running, capped at my_max_poll_wait
+poll_backoff_fraction = 0.5
+query_running_states = ['QUEUED', 'RUNNING']
+query_failed_states = ['FAILED', 'CANCELLED']
+
+
+# Raised so the state machine fails as soon as Athena reports the query failed or was cancelled
+class QueryFailedError(Exception):
+    pass
+
+
+############# Athena Get Query Execution #############
+
+def get_query_execution_status(query_execution_id):
+    logger.info(f'Getting Athena query execution status for {query_execution_id}')
+    try:
+        get_query_execution = get_client('athena').get_query_execution(
+            QueryExecutionId=query_execution_id,
+        )
+    except ClientError as e:
+        logger.error(e)
+        raise
+    else:
+        return get_query_execution['QueryExecution']['Status']
+
+
+def next_poll_wait(submission_datetime):
+    elapsed_seconds = (datetime.datetime.now(submission_datetime.tzinfo) - submission_datetime).total_seconds()
+    return int(min(my_max_poll_wait, max(my_min_poll_wait, elapsed_seconds * poll_backoff_fraction)))
+
+
+def lambda_handler(event, context):
+    logger.info(f'Event details are: {event}')
+    my_query_execution_id = str(event.get('my_query_execution_id'))
+
+    query_status = get_query_execution_status(my_query_execution_id)
+    query_state = query_status.get('State')
+    logger.info(f'Query {my_query_execution_id} state is {query_state}')
+
+    if query_state in query_failed_states:
+        state_change_reason = query_status.get('StateChangeReason')
+        logger.error(f'Query {my_query_execution_id} {query_state}: {state_change_reason}')
+        raise QueryFailedError(f'Athena query {my_query_execution_id} {query_state}: {state_change_reason}')
+
+    poll_wait_seconds = 0
+    if query_state in query_running_states:
+        poll_wait_seconds = next_poll_wait(query_status.get('SubmissionDateTime'))
+        logger.info(f'Polling query {my_query_execution_id} again in {poll_wait_seconds} seconds')
+
+    return {
+            'my_query_execution_id': my_query_execution_id,
+            'query_state': query_state,
+            'poll_wait_seconds': poll_wait_seconds,
+            }
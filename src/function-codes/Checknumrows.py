@@ -1,12 +1,11 @@
 import math
 import json
-import os
 import uuid
-import boto3
 from botocore.exceptions import ClientError
 import logging
 import datetime
 from urllib import parse
+from Runtime import env_int, env_str, get_client
 
 
 # Set up logging
@@ -15,26 +14,21 @@ logger.setLevel('INFO')
 
 
 # Define Environmental Variables
-my_glue_db = str(os.environ['glue_db'])
-my_glue_tbl = str(os.environ['glue_tbl'])
-my_workgroup_name = str(os.environ['workgroup_name'])
-my_csv_max_rows = int(os.environ['csv_max_rows'])
-my_s3_bucket = str(os.environ['s3_bucket'])
-my_region = str(os.environ['current_region'])
-my_incl_versions = str(os.environ['included_obj_versions'])
-my_storage_class_to_restore = str(os.environ['storage_class_to_restore'])
-
-
-# Set Service Client
-athena_client = boto3.client('athena', region_name=my_region)
-s3Client = boto3.client("s3", region_name=my_region)
+my_glue_db = env_str('glue_db')
+my_glue_tbl = env_str('glue_tbl')
+my_workgroup_name = env_str('workgroup_name')
+my_csv_max_rows = env_int('csv_max_rows')
+my_s3_bucket = env_str('s3_bucket')
+my_incl_versions = env_str('included_obj_versions')
+my_storage_class_to_restore = env_str('storage_class_to_restore')
+my_manifest_generation_mode = env_str('manifest_generation_mode')
 
 
 ############# Athena Query Function #############
 def start_query_execution(query_string, athena_db, workgroup_name):
     logger.info(f'Starting Athena query...... with query string: {query_string}')
     try:
-        execute_query = athena_client.start_query_execution(
+        execute_query = get_client('athena').start_query_execution(
             QueryString=query_string,
             QueryExecutionContext={
                 'Database': athena_db
@@ -54,6 +48,28 @@ def lambda_handler(event, context):
     s3Bucket = event.get('s3Bucket')
     s3Key = parse.unquote_plus(event.get('s3Key'))
     my_dt = s3Key.split('/')[-2].split('=')[-1]
+    jobgroupid = str(uuid.uuid4())
+    restore_order = event.get('restore_order')
+    priority_prefixes = event.get('priority_prefixes')
+
+    ### Single Pass counts rows in its first UNLOAD, so skip the COUNT(*) scan and go straight to AthenaSplit ###
+    if my_manifest_generation_mode == 'SinglePass':
+        logger.info('Single pass manifest generation, skipping the count query')
+        return {
+                'manifest_generation_mode': my_manifest_generation_mode,
+                'num_chunks' : 0,
+                'my_csv_num_rows' : 0,
+                'csv_chunking_complete': False,
+                'csv_counting_complete': False,
+                'next_chunk' : 0,
+                'my_csv_max_rows' : my_csv_max_rows,
+                's3Bucket' : s3Bucket,
+                'jobgroupid' : jobgroupid,
+                'my_dt' : my_dt,
+                'my_s3_bucket': my_s3_bucket,
+                'restore_order': restore_order,
+                'priority_prefixes': priority_prefixes,
+                }
 
     ######  Start Athena Query ######
 
@@ -111,10 +127,13 @@ def lambda_handler(event, context):
         logger.error(e)
         raise
     return {
+            'manifest_generation_mode': my_manifest_generation_mode,
             's3Bucket' : s3Bucket,
             's3Key' : s3Key,
-            'jobgroupid' : str(uuid.uuid4()),
+            'jobgroupid' : jobgroupid,
             'my_dt' : my_dt,
             'my_query_execution_id' : my_query_execution_id,
             'my_s3_bucket': my_s3_bucket,
+            'restore_order': restore_order,
+            'priority_prefixes': priority_prefixes,
             }
@@ -1,11 +1,14 @@
-import json
+import csv
+import io
 import json
 import logging
-import os
-import boto3
-import botocore
-import jmespath
+import tempfile
+import time
+import uuid
+from urllib import parse
 from botocore.exceptions import ClientError
+from EmitMetrics import emit_metrics
+from Runtime import env_int, env_str, get_client, send_sns_message
 
 
 # Set up logging
@@ -14,20 +17,44 @@ logger.setLevel('INFO')
 # boto3.set_stream_logger("")
 
 # Define Lambda Environmental Variable
-my_role_arn = str(os.environ['batch_ops_role'])
-report_bucket_name = str(os.environ['batch_ops_copy_report_bucket'])
-bops_invoke_function_arn = str(os.environ['batch_ops_invoke_lambda'])
-report_prefix = str(os.environ['batch_ops_copy_report_prefix'])
-accountId = str(os.environ['my_account_id'])
-my_region = str(os.environ['my_current_region'])
-my_sns_topic_arn = str(os.environ['my_sns_topic_arn'])
-my_s3_bucket = str(os.environ['s3_bucket'])
+my_role_arn = env_str('batch_ops_role')
+report_bucket_name = env_str('batch_ops_copy_report_bucket')
+bops_invoke_function_arn = env_str('batch_ops_invoke_lambda')
+report_prefix = env_str('batch_ops_copy_report_prefix')
+accountId = env_str('my_account_id')
+my_sns_topic_arn = env_str('my_sns_topic_arn')
+my_s3_bucket = env_str('s3_bucket')
+my_copy_manifest_prefix = env_str('copy_manifest_prefix')
+my_copy_engine = env_str('copy_engine')
+my_native_copy_max_bytes = env_int('native_copy_max_bytes')
+target_bucket = env_str('destination_bucket')
+new_prefix = env_str('destination_bucket_prefix')
+metadata_copy = env_str('copy_metadata')
+tagging_copy = env_str('copy_tagging')
+obj_copy_storage_class = env_str('copy_storage_class')
+my_version_deduplication = env_str('version_deduplication')
+my_job_registry_prefix = env_str('job_registry_prefix')
 
 
 # Specify variables #############################
 
 # Job Manifest Details ################################
 job_manifest_format = 'S3BatchOperations_CSV_20180820'  # S3InventoryReport_CSV_20161130
+# Restore report rows are Bucket, Key, VersionId, TaskStatus, ErrorCode, HTTPStatusCode, ResultMessage
+report_task_status_column = 3
+report_task_succeeded = 'succeeded'
+report_task_failed = 'failed'
+# Generated restore manifests end with the object size, RestoreWorker2 marks that column Ignore
+manifest_size_field = 'Ignore'
+# Objects up to the single request copy limit are copied by S3 Batch Operations itself, larger ones by BatchCopy
+native_copy_operation = 'S3PutObjectCopy'
+lambda_copy_operation = 'LambdaInvoke'
+# With version deduplication, generated manifest rows list the other versions with the same content before the size
+duplicate_versions_separator = '|'
+version_map_header = ['Bucket', 'Key', 'VersionId', 'CopiedFromVersionId']
+# BatchCopy rows copying a restored version for a duplicate version carry '<restored version><marker><duplicate version>'
+# as their version id, so SkipCopiedObjects never takes the copy for one already made
+duplicate_copy_marker = '#copy-as-'
 
 
 # Job Report Details ############################
@@ -37,21 +64,6 @@ report_scope = 'AllTasks'
 # Construct ARNs ############################################
 report_bucket_arn = 'arn:aws:s3:::' + report_bucket_name
 
-# Initiate Service Clients ###################
-s3Client = boto3.client('s3', region_name=my_region)
-s3ControlClient = boto3.client('s3control', region_name=my_region)
-sns = boto3.client('sns', region_name=my_region)
-
-
-# SNS Message Function
-def send_sns_message(sns_topic_arn, sns_message):
-    sns_subject = 'Notification from AutoRestoreMigrate Solution'
-    logger.info("Sending SNS Notification Message......")
-    try:
-        response = sns.publish(TopicArn=sns_topic_arn, Message=sns_message, Subject=sns_subject)
-    except ClientError as e:
-        logger.error(e)
-
 
 def lambda_handler(event, context):
     logger.info(event)
@@ -62,20 +74,27 @@ def lambda_handler(event, context):
     logger.info(manifest_s3Bucket)
     logger.info(manifest_s3Key)
     logger.info(restore_job_id)
-    read_s3_object = get_read_s3_manifest(manifest_s3Bucket, manifest_s3Key)
     copy_job_id_list = []
-    if read_s3_object:
-        for r in read_s3_object:
-            mybucket = r[0]
-            mykey = r[1]
-            logger.info(mybucket)
-            logger.info(mykey)
-            copy_job_id = s3_batch_ops_copy(mybucket, mykey, restore_job_id, manifest_num_flds)
+    manifest_start = time.perf_counter()
+    copy_manifests = write_copy_manifests(manifest_s3Bucket, manifest_s3Key, restore_job_id, manifest_num_flds)
+    manifest_duration = (time.perf_counter() - manifest_start) * 1000
+    for copy_operation, (copy_manifest_key, copy_manifest_rows, copy_manifest_bytes) in copy_manifests.items():
+        if copy_manifest_rows:
+            copy_job_id = s3_batch_ops_copy(manifest_s3Bucket, copy_manifest_key, restore_job_id, manifest_num_flds,
+                                            copy_operation)
             copy_job_id_list.append(copy_job_id)
-    else:
+            emit_metrics({'Operation': copy_operation}, {
+                'CopyJobsSubmitted': (1 if copy_job_id else 0, 'Count'),
+                'CopyJobSubmitFailures': (0 if copy_job_id else 1, 'Count'),
+                'ObjectsQueued': (copy_manifest_rows, 'Count'),
+                'BytesQueued': (copy_manifest_bytes, 'Bytes'),
+                'CopyManifestDuration': (manifest_duration, 'Milliseconds'),
+            }, {'RestoreJobId': restore_job_id, 'CopyJobId': copy_job_id})
+    if not copy_job_id_list:
         logger.info("All Tasks have failed")
 
-    my_sns_message = f'Copy Job {copy_job_id_list} Successfully Submitted to Amazon S3 Batch Operation'
+    copied_objects = ', '.join([f'{rows} by {operation}' for operation, (key, rows, size) in copy_manifests.items() if rows])
+    my_sns_message = f'Copy Job {copy_job_id_list} Successfully Submitted to Amazon S3 Batch Operation for restored objects: {copied_objects}'
     send_sns_message(my_sns_topic_arn, my_sns_message)
 
 
@@ -86,42 +105,173 @@ def lambda_handler(event, context):
      }
 
 
-def get_read_s3_manifest(bucket, key):
-    result_query = jmespath.compile("Results[?TaskExecutionStatus=='succeeded'].[Bucket,Key]")
-    get_response = s3Client.get_object(
+def iter_csv_rows(bucket, key):
+    get_response = get_client('s3').get_object(Bucket=bucket, Key=key)
+    report_lines = (line.decode('utf-8') for line in get_response.get('Body').iter_lines())
+    for row in csv.reader(report_lines):
+        if row:
+            yield row
+
+
+def object_id(row, manifest_flds_num):
+    version_id = row[2] if manifest_flds_num == '3' and row[2] != 'null' else ''
+    return row[0], parse.unquote_plus(row[1]), version_id
+
+
+# Restore manifest of the restore job when it carries object sizes, otherwise None
+def get_sized_restore_manifest(restore_job_id):
+    try:
+        restore_job = get_client('s3control').describe_job(AccountId=accountId, JobId=restore_job_id).get('Job')
+    except ClientError as e:
+        logger.error(e)
+        return None
+    if restore_job.get('Manifest').get('Spec').get('Fields')[-1] != manifest_size_field:
+        return None
+    manifest_bucket, manifest_key = restore_job.get('Manifest').get('Location').get('ObjectArn').split(':::', 1)[1].split('/', 1)
+    return manifest_bucket, manifest_key
+
+
+# Stream the restore report into Bucket,Key[,VersionId] manifests of the objects restored successfully, split by copy operation
+# Returns the manifest key, rows and bytes of each copy operation
+def write_copy_manifests(bucket, key, restore_job_id, manifest_flds_num):
+    get_response = get_client('s3').get_object(
         Bucket=bucket,
         Key=key,
     )
-    display_s3_object = json.loads(get_response.get('Body').read().decode('utf-8'))
-    filtered_result = result_query.search(display_s3_object)
-    return filtered_result
+    report_manifest = json.loads(get_response.get('Body').read().decode('utf-8'))
+    num_fields = 3 if manifest_flds_num == '3' else 2
+    deduplicate_versions = my_version_deduplication == 'Enable' and num_fields == 3
+    restore_manifest = get_sized_restore_manifest(restore_job_id) if my_copy_engine == 'Hybrid' or deduplicate_versions else None
+    copy_manifests = {}
+    version_map_rows = 0
+    with tempfile.TemporaryFile() as native_manifest, tempfile.TemporaryFile() as lambda_manifest, \
+            tempfile.TemporaryFile() as version_map:
+        copy_manifest_files = {native_copy_operation: native_manifest, lambda_copy_operation: lambda_manifest}
+        text_manifests = {operation: io.TextIOWrapper(manifest_file, encoding='utf-8', newline='')
+                          for operation, manifest_file in copy_manifest_files.items()}
+        manifest_writers = {operation: csv.writer(text_manifest, lineterminator='\n')
+                            for operation, text_manifest in text_manifests.items()}
+        copy_manifest_rows = {operation: 0 for operation in copy_manifest_files}
+        # Only restore manifests carry object sizes, without one the bytes stay unknown
+        copy_manifest_bytes = {operation: 0 if restore_manifest else None for operation in copy_manifest_files}
+        text_version_map = io.TextIOWrapper(version_map, encoding='utf-8', newline='')
+        version_map_writer = csv.writer(text_version_map, lineterminator='\n')
+        version_map_writer.writerow(version_map_header)
+        if restore_manifest:
+            # Sizes are in the restore manifest, drop the objects the report lists as failed
+            failed_objects = set()
+            for report_file in report_manifest.get('Results', []):
+                if report_file.get('TaskExecutionStatus') == report_task_failed:
+                    failed_objects.update(object_id(row, manifest_flds_num)
+                                          for row in iter_csv_rows(report_file.get('Bucket'), report_file.get('Key')))
+            for row in iter_csv_rows(*restore_manifest):
+                if object_id(row, manifest_flds_num) in failed_objects:
+                    continue
+                copy_operation = lambda_copy_operation
+                try:
+                    object_bytes = int(row[-1])
+                except ValueError:
+                    object_bytes = 0
+                else:
+                    if my_copy_engine == 'Hybrid' and object_bytes <= my_native_copy_max_bytes:
+                        copy_operation = native_copy_operation
+                manifest_writers[copy_operation].writerow(row[:num_fields])
+                copy_manifest_rows[copy_operation] += 1
+                copy_manifest_bytes[copy_operation] += object_bytes
+                # Each duplicate version becomes another copy of the restored version with the same content
+                if deduplicate_versions and len(row) > num_fields + 1 and row[num_fields]:
+                    for duplicate_version in row[num_fields].split(duplicate_versions_separator):
+                        duplicate_row = row[:num_fields]
+                        # S3 Batch Operations Copy jobs need the version id as it is and never skip an object
+                        if copy_operation == lambda_copy_operation:
+                            duplicate_row[2] = f'{row[2]}{duplicate_copy_marker}{duplicate_version}'
+                        manifest_writers[copy_operation].writerow(duplicate_row)
+                        copy_manifest_rows[copy_operation] += 1
+                        copy_manifest_bytes[copy_operation] += object_bytes
+                        version_map_writer.writerow([row[0], row[1], duplicate_version, row[2]])
+                        version_map_rows += 1
+        else:
+            # The failed results file only lists failed tasks, skip it without reading
+            for report_file in report_manifest.get('Results', []):
+                if report_file.get('TaskExecutionStatus') != report_task_succeeded:
+                    continue
+                for row in iter_csv_rows(report_file.get('Bucket'), report_file.get('Key')):
+                    if len(row) <= report_task_status_column or row[report_task_status_column] != report_task_succeeded:
+                        continue
+                    manifest_writers[lambda_copy_operation].writerow(row[:num_fields])
+                    copy_manifest_rows[lambda_copy_operation] += 1
+        for copy_operation, manifest_file in copy_manifest_files.items():
+            copy_manifest_key = f'{my_copy_manifest_prefix}{restore_job_id}-{copy_operation}.csv'
+            copy_manifests[copy_operation] = (copy_manifest_key, copy_manifest_rows[copy_operation],
+                                              copy_manifest_bytes[copy_operation])
+            if not copy_manifest_rows[copy_operation]:
+                continue
+            text_manifests[copy_operation].detach()
+            manifest_file.seek(0)
+            get_client('s3').upload_fileobj(manifest_file, bucket, copy_manifest_key)
+            logger.info(f'Wrote {copy_manifest_rows[copy_operation]} restored objects to {copy_manifest_key}')
+        if version_map_rows:
+            version_map_key = f'{my_copy_manifest_prefix}{restore_job_id}-version-map.csv'
+            text_version_map.detach()
+            version_map.seek(0)
+            get_client('s3').upload_fileobj(version_map, bucket, version_map_key)
+            logger.info(f'Wrote {version_map_rows} versions copied from a restored version with the same content to {version_map_key}')
+    return copy_manifests
+
+
+# Native copy settings matching the BatchCopy function environment
+def native_copy_operation_spec():
+    copy_spec = {
+        'TargetResource': f'arn:aws:s3:::{target_bucket}',
+        'CannedAccessControlList': 'bucket-owner-full-control',
+        'StorageClass': obj_copy_storage_class,
+        'MetadataDirective': 'COPY' if metadata_copy == 'Enable' else 'REPLACE',
+    }
+    if metadata_copy != 'Enable':
+        copy_spec['NewObjectMetadata'] = {}
+    if tagging_copy != 'Enable':
+        copy_spec['NewObjectTagging'] = []
+    if new_prefix:
+        # BatchCopy places objects under '<prefix>/<key>', the native copy appends the key to the prefix as is
+        copy_spec['TargetKeyPrefix'] = f'{new_prefix}/'
+    return copy_spec
+
 
+# Record the job as it is submitted, JobTracker reads it instead of the job description and tags
+def register_job(job_id, job_registration):
+    registry_key = f'{my_job_registry_prefix}{job_id}.json'
+    try:
+        get_client('s3').put_object(Bucket=report_bucket_name, Key=registry_key, Body=json.dumps(job_registration),
+                            ContentType='application/json')
+    except ClientError as e:
+        logger.error(e)
 
-def s3_batch_ops_copy(manifest_bucket, manifest_key, restore_job_to_tag, manifest_flds_num):
+
+def s3_batch_ops_copy(manifest_bucket, manifest_key, restore_job_to_tag, manifest_flds_num, copy_operation):
     if manifest_flds_num == '3':
-        manifest_fields = ['Bucket', 'Key', 'VersionId', 'Ignore', 'Ignore', 'Ignore', 'Ignore']
+        manifest_fields = ['Bucket', 'Key', 'VersionId']
     elif manifest_flds_num == '2':
-        manifest_fields = ['Bucket', 'Key', 'Ignore', 'Ignore', 'Ignore', 'Ignore', 'Ignore']
+        manifest_fields = ['Bucket', 'Key']
 
     # Set Description #
     my_job_description = f"Lambda Invoke Copy Job by AutoRestoreMigrate Solution for S3Bucket: {my_s3_bucket}"    
+    my_copy_operation = {'LambdaInvoke': {'FunctionArn': bops_invoke_function_arn}}
+    if copy_operation == native_copy_operation:
+        my_job_description = f"Copy Job by AutoRestoreMigrate Solution for S3Bucket: {my_s3_bucket}"
+        my_copy_operation = {'S3PutObjectCopy': native_copy_operation_spec()}
 
     # Construct ARNs ############################################
     manifest_bucket_arn = 'arn:aws:s3:::' + manifest_bucket
     manifest_key_arn = 'arn:aws:s3:::' + manifest_bucket + '/' + manifest_key
     # Get manifest key ETag ####################################
-    manifest_key_object_etag = s3Client.head_object(Bucket=manifest_bucket, Key=manifest_key)['ETag']
+    manifest_key_object_etag = get_client('s3').head_object(Bucket=manifest_bucket, Key=manifest_key)['ETag']
     logger.info(manifest_key_object_etag)
 
     try:
-        response = s3ControlClient.create_job(
+        response = get_client('s3control').create_job(
             AccountId=accountId,
             ConfirmationRequired=False,
-            Operation={
-                'LambdaInvoke': {
-                    'FunctionArn': bops_invoke_function_arn
-                }
-            },
+            Operation=my_copy_operation,
             Report={
                 'Bucket': report_bucket_arn,
                 'Format': report_format,
@@ -141,6 +291,8 @@ def s3_batch_ops_copy(manifest_bucket, manifest_key, restore_job_to_tag, manifes
             },
             Priority=10,
             RoleArn=my_role_arn,
+            # Same token for the same restore job and report, so a re-dispatched copy returns the job already created
+            ClientRequestToken=str(uuid.uuid5(uuid.NAMESPACE_URL, f'{restore_job_to_tag}/{manifest_key}')),
             Description=my_job_description,
             Tags=[
                 {
@@ -152,6 +304,17 @@ def s3_batch_ops_copy(manifest_bucket, manifest_key, restore_job_to_tag, manifes
         logger.info(f"JobID is: {response.get('JobId')}")
         logger.info(f"S3 RequestID is: {response.get('ResponseMetadata').get('RequestId')}")
         logger.info(f"S3 Extended RequestID is:{response.get('ResponseMetadata').get('HostId')}")
+        register_job(response['JobId'], {
+            'job_id': response['JobId'],
+            'job_group': None,
+            'operation': copy_operation,
+            'restore_tier': None,
+            'num_manifest_fields': manifest_flds_num,
+            'restore_job_id': restore_job_to_tag,
+            'tag_key': 'auto-restore-copy',
+            'manifest_bucket': manifest_bucket,
+            'manifest_key': manifest_key,
+        })
         return response['JobId']
     except ClientError as e:
         logger.error(e)
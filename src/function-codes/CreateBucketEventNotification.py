@@ -1,11 +1,10 @@
 import cfnresponse
 import logging
 import random
-import boto3
-import os
 import uuid
 import jmespath
 from botocore.exceptions import ClientError as ServicesClientError
+from Runtime import env_str, get_resource
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -14,32 +13,29 @@ logger.setLevel('INFO')
 # Enable Verbose logging for Troubleshooting
 # boto3.set_stream_logger("")
 
-# Set Region #
-my_region = str(os.environ['AWS_REGION'])
-
 ### Initiate Variables ######
 # Start Global Variables
-my_event_one_id = str(os.environ['event_one_id'])
-my_event_one_prefix_value = str(os.environ['event_one_prefix_value'])
-my_event_one_suffix_value = str(os.environ['event_one_suffix_value'])
+my_event_one_id = env_str('event_one_id')
+my_event_one_prefix_value = env_str('event_one_prefix_value')
+my_event_one_suffix_value = env_str('event_one_suffix_value')
 
-my_event_two_id = str(os.environ['event_two_id'])
-my_event_two_prefix_value = str(os.environ['event_two_prefix_value'])
-my_event_two_suffix_value = str(os.environ['event_two_suffix_value'])
+my_event_two_id = env_str('event_two_id')
+my_event_two_prefix_value = env_str('event_two_prefix_value')
+my_event_two_suffix_value = env_str('event_two_suffix_value')
 
-my_event_three_id = str(os.environ['event_three_id'])
-my_event_three_prefix_value = str(os.environ['event_three_prefix_value'])
-my_event_three_suffix_value = str(os.environ['event_three_suffix_value'])
+my_event_three_id = env_str('event_three_id')
+my_event_three_prefix_value = env_str('event_three_prefix_value')
+my_event_three_suffix_value = env_str('event_three_suffix_value')
 
-my_event_four_id = str(os.environ['event_four_id'])
-my_event_four_prefix_value = str(os.environ['event_four_prefix_value'])
-my_event_four_suffix_value = str(os.environ['event_four_suffix_value'])
+my_event_four_id = env_str('event_four_id')
+my_event_four_prefix_value = env_str('event_four_prefix_value')
+my_event_four_suffix_value = env_str('event_four_suffix_value')
 
 
-struct_value_1 = str(os.environ['bucket_path_a'])
-struct_value_2 = str(os.environ['bucket_path_b'])
-struct_value_3 = str(os.environ['bucket_path_c'])
-struct_value_4 = str(os.environ['bucket_path_d'])
+struct_value_1 = env_str('bucket_path_a')
+struct_value_2 = env_str('bucket_path_b')
+struct_value_3 = env_str('bucket_path_c')
+struct_value_4 = env_str('bucket_path_d')
 
 
 bucket_structure = [
@@ -50,12 +46,10 @@ bucket_structure = [
 
 ]
 
-# Initiate Amazon S3 Bucket Resource
-s3 = boto3.resource('s3', region_name=my_region)
 
 def put_s3_object(my_bucket, my_key):
     try:
-      bucket = s3.Bucket(my_bucket)
+      bucket = get_resource('s3').Bucket(my_bucket)
       my_object = bucket.Object(my_key)
       put_obj_response = my_object.put()
     except ServicesClientError as e:
@@ -65,7 +59,7 @@ def put_s3_object(my_bucket, my_key):
 
 def bucket_put_event_notification(s3Bucket, my_event_one_fn_arn, my_event_two_fn_arn, my_event_three_fn_arn, my_event_four_fn_arn):
   # Initiate Bucket Notification ##
-  bucket_notification = s3.BucketNotification(s3Bucket)
+  bucket_notification = get_resource('s3').BucketNotification(s3Bucket)
   try:
       put_notification_response = bucket_notification.put(
           NotificationConfiguration={
@@ -165,7 +159,7 @@ def bucket_put_event_notification(s3Bucket, my_event_one_fn_arn, my_event_two_fn
 
 def remove_bucket_notification(s3Bucket):
   # Initiate Bucket Notification ##
-  bucket_notification = s3.BucketNotification(s3Bucket)
+  bucket_notification = get_resource('s3').BucketNotification(s3Bucket)
   try:
       remove_notification_response = bucket_notification.put(
           NotificationConfiguration={}
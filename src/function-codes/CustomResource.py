@@ -1,25 +1,17 @@
 import json
-import boto3
-import os
 import cfnresponse
 import logging
 from botocore.exceptions import ClientError
+from Runtime import env_str, get_client
 
 # Set up logging
 logger = logging.getLogger(__name__)
 logger.setLevel('INFO')
 
-# Define Region
-my_region = str(os.environ['AWS_REGION'])
-
-# Create Service Client
-s3 = boto3.resource('s3', region_name=my_region)
-s3client = boto3.client('s3', region_name=my_region)
-
 ### Define Environmental Variables ###
-my_inv_schedule = str(os.environ['inv_report_schedule'])
-accountId = str(os.environ['account_id'])
-my_config_id = str(os.environ['inv_config_id'])
+my_inv_schedule = env_str('inv_report_schedule')
+accountId = env_str('account_id')
+my_config_id = env_str('inv_config_id')
 
 # Define other parameters
 my_incl_versions = 'All'
@@ -79,7 +71,27 @@ def config_s3_inventory(src_bucket, config_id, dst_bucket,
     # Initiating Actual PutBucket Inventory API Call ##
     try:
         logger.info(f'Applying inventory configuration to S3 bucket {src_bucket}')
-        s3client.put_bucket_inventory_configuration(**my_request_kwargs)
+        get_client('s3').put_bucket_inventory_configuration(**my_request_kwargs)
+    except Exception as e:
+        logger.error(f'An error occurred processing, error details are: {e}')
+        raise
+
+
+# Send the Archive bucket events to EventBridge, keeping its existing notification configuration
+def enable_eventbridge_notifications(src_bucket):
+    try:
+        notification_config = get_client('s3').get_bucket_notification_configuration(Bucket=src_bucket)
+        notification_config.pop('ResponseMetadata', None)
+        if 'EventBridgeConfiguration' in notification_config:
+            logger.info(f'Amazon EventBridge notifications are already enabled on S3 bucket {src_bucket}')
+            return
+        notification_config['EventBridgeConfiguration'] = {}
+        logger.info(f'Enabling Amazon EventBridge notifications on S3 bucket {src_bucket}')
+        get_client('s3').put_bucket_notification_configuration(
+            Bucket=src_bucket,
+            NotificationConfiguration=notification_config,
+            SkipDestinationValidation=True,
+        )
     except Exception as e:
         logger.error(f'An error occurred processing, error details are: {e}')
         raise
@@ -104,8 +116,14 @@ def lambda_handler(event, context):
             my_src_bucket = event['ResourceProperties']['MyBucketwithArchives']
             my_src_prefix = event['ResourceProperties']['ArchiveBucketPrefix']
             my_dst_bucket = event['ResourceProperties']['MyS3InventoryDestinationBucket']
+            # The Embedded Inventory Engine reads CSV inventories without Athena or pyarrow
+            if event['ResourceProperties'].get('MyInventoryEngine') == 'Embedded':
+                my_inv_format = 'CSV'
             config_s3_inventory(my_src_bucket, my_config_id, my_dst_bucket,
                                     my_inv_format, my_src_prefix, my_dest_prefix, my_inv_status, my_inv_schedule, my_incl_versions)
+            # Copies start on the restore completed events of the Archive bucket
+            if event['ResourceProperties'].get('MyCopyStartTrigger') in ['RestoreCompletedEvents', 'RestoreCompletedBatches']:
+                enable_eventbridge_notifications(my_src_bucket)
             logger.info("Sending Successful response to custom resource")
             responseData['message'] = "Successful"
             logger.info(f"Sending Invocation Response {responseData['message']} to Cloudformation Service")
@@ -0,0 +1,28 @@
+import json
+import os
+import time
+
+
+############# Metrics #############
+
+metrics_namespace = str(os.environ['metrics_namespace'])
+
+
+# Embedded Metric Format log line, CloudWatch Logs extracts the metrics from it without a PutMetricData call
+def emit_metrics(dimensions, metrics, properties=None):
+    metrics = {name: metric for name, metric in metrics.items() if metric[0] is not None}
+    metric_log = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': metrics_namespace,
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, (value, unit) in metrics.items()],
+            }],
+        },
+    }
+    metric_log.update(properties or {})
+    metric_log.update({name: str(value) for name, value in dimensions.items()})
+    metric_log.update({name: value for name, (value, unit) in metrics.items()})
+    # Printed rather than logged, the log line must be the JSON document alone
+    print(json.dumps(metric_log, default=str))
@@ -1,12 +1,11 @@
 import math
 import json
-import os
 import uuid
-import boto3
 from botocore.exceptions import ClientError
 import logging
 import datetime
 from urllib import parse
+from Runtime import env_int, env_str, get_client
 
 
 # Set up logging
@@ -15,26 +14,21 @@ logger.setLevel('INFO')
 
 
 # Define Environmental Variables
-my_glue_db = str(os.environ['glue_db'])
-my_glue_tbl = str(os.environ['glue_tbl'])
-my_workgroup_name = str(os.environ['workgroup_name'])
-my_csv_max_rows = int(os.environ['csv_max_rows'])
-my_s3_bucket = str(os.environ['s3_bucket'])
-my_region = str(os.environ['current_region'])
-my_incl_versions = str(os.environ['included_obj_versions'])
-my_storage_class_to_restore = str(os.environ['storage_class_to_restore'])
+my_glue_db = env_str('glue_db')
+my_glue_tbl = env_str('glue_tbl')
+my_workgroup_name = env_str('workgroup_name')
+my_csv_max_rows = env_int('csv_max_rows')
+my_s3_bucket = env_str('s3_bucket')
+my_incl_versions = env_str('included_obj_versions')
+my_storage_class_to_restore = env_str('storage_class_to_restore')
 
 
-# Set Service Client
-athena_client = boto3.client('athena', region_name=my_region)
-s3Client = boto3.client("s3", region_name=my_region)
-
 ############### Athena Get Query Results #######################
 
 def get_query_result(query_execution_id):
     logger.info(f'Getting Athena query results')
     try:
-        get_query_results = athena_client.get_query_results(
+        get_query_results = get_client('athena').get_query_results(
             QueryExecutionId=query_execution_id,
         )
     except ClientError as e:
@@ -48,7 +42,6 @@ def get_query_result(query_execution_id):
         return query_result_count
 
 
-
 def lambda_handler(event, context):
     logger.info(event)
     my_csv_num_rows = None
@@ -62,6 +55,8 @@ def lambda_handler(event, context):
     s3Bucket = str(event.get('s3Bucket'))
     jobgroupid = event.get('jobgroupid')
     my_dt = event.get('my_dt')
+    restore_order = event.get('restore_order')
+    priority_prefixes = event.get('priority_prefixes')
 
     try:
         my_csv_num_rows = get_query_result(my_query_execution_id)
@@ -75,10 +70,13 @@ def lambda_handler(event, context):
             'num_chunks' : num_chunks,
             'my_csv_num_rows' : my_csv_num_rows,
             'csv_chunking_complete': False,
+            'csv_counting_complete': True,
             'next_chunk' : next_chunk,
             'my_csv_max_rows' : my_csv_max_rows,
             's3Bucket' : s3Bucket,
             'jobgroupid' : jobgroupid,
             'my_dt' : my_dt,
             'my_s3_bucket': my_s3_bucket,
+            'restore_order': restore_order,
+            'priority_prefixes': priority_prefixes,
             }
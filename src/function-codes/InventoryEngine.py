@@ -0,0 +1,329 @@
+import csv
+import gzip
+import heapq
+import io
+import itertools
+import json
+import os
+import sys
+import uuid
+from contextlib import closing
+from botocore.exceptions import ClientError
+import logging
+from urllib import parse
+from Runtime import env_int, env_str, get_client
+
+# pyarrow is only needed to read Parquet inventories, e.g. from the AWS SDK for pandas Lambda layer
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pc = None
+    pq = None
+
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+
+# Define Environmental Variables
+my_csv_max_rows = env_int('csv_max_rows')
+my_s3_bucket = env_str('s3_bucket')
+my_incl_versions = env_str('included_obj_versions')
+my_storage_class_to_restore = env_str('storage_class_to_restore')
+my_csv_max_bytes = env_int('csv_max_gib') * 1024 ** 3
+
+
+# Other Variables
+# Chunks are written outside restore-and-copy/csv-manifest/ so the RestoreWorker S3 event does not submit them all at once
+chunk_prefix = 'restore-and-copy/inventory-chunks'
+parquet_batch_rows = 65536
+# Rows are sorted in runs of this size spilled to work_dir, then merged
+sort_run_rows = 500000
+inventory_columns = ['bucket', 'key', 'version_id', 'size', 'last_modified_date', 'is_latest', 'is_delete_marker',
+                     'storage_class']
+
+# Map S3 Inventory CSV fileSchema names to the Parquet/Glue column names
+csv_schema_names = {
+    'Bucket': 'bucket',
+    'Key': 'key',
+    'VersionId': 'version_id',
+    'IsLatest': 'is_latest',
+    'IsDeleteMarker': 'is_delete_marker',
+    'Size': 'size',
+    'LastModifiedDate': 'last_modified_date',
+    'ETag': 'e_tag',
+    'StorageClass': 'storage_class',
+}
+
+
+############# Restore Filter #############
+
+def storage_classes_to_restore(storage_class_to_restore):
+    if storage_class_to_restore == 'GLACIER_AND_DEEP_ARCHIVE':
+        return ['GLACIER', 'DEEP_ARCHIVE']
+    return [storage_class_to_restore]
+
+
+# Same filter as the Checknumrows and AthenaSplit queries
+def row_is_restorable(row, storage_classes, incl_versions):
+    if row.get('storage_class') not in storage_classes:
+        return False
+    if row.get('is_delete_marker') in ('true', True):
+        return False
+    if incl_versions == 'Current' and row.get('is_latest') not in ('true', True):
+        return False
+    return True
+
+
+############# Inventory Readers #############
+
+# S3 Inventory CSV files are gzipped, have no header row and their keys are already URL encoded
+def iter_csv_inventory(fileobj, file_schema, storage_classes, incl_versions):
+    field_names = [csv_schema_names.get(name.strip(), name.strip()) for name in file_schema.split(',')]
+    text_stream = io.TextIOWrapper(gzip.GzipFile(fileobj=fileobj), encoding='utf-8', newline='')
+    for values in csv.reader(text_stream):
+        row = dict(zip(field_names, values))
+        if row_is_restorable(row, storage_classes, incl_versions):
+            yield (row['bucket'], row['key'], row.get('version_id') or 'null', int(row.get('size') or 0),
+                   row.get('last_modified_date', ''))
+
+
+# Filter each Parquet record batch with pyarrow compute kernels, keys are URL encoded for the manifest
+def iter_parquet_inventory(fileobj, storage_classes, incl_versions):
+    if pq is None:
+        raise RuntimeError('Reading a Parquet inventory requires pyarrow, attach the AWS SDK for pandas layer or use CSV')
+    parquet_file = pq.ParquetFile(fileobj)
+    columns = [name for name in inventory_columns if name in parquet_file.schema_arrow.names]
+    for batch in parquet_file.iter_batches(batch_size=parquet_batch_rows, columns=columns):
+        mask = pc.is_in(batch.column('storage_class'), value_set=pa.array(storage_classes))
+        mask = pc.and_(mask, pc.invert(pc.fill_null(batch.column('is_delete_marker'), False)))
+        if incl_versions == 'Current':
+            mask = pc.and_(mask, pc.fill_null(batch.column('is_latest'), False))
+        filtered = batch.filter(pc.fill_null(mask, False))
+        if 'version_id' in columns:
+            version_ids = pc.fill_null(filtered.column('version_id'), 'null').to_pylist()
+        else:
+            version_ids = ['null'] * filtered.num_rows
+        if 'size' in columns:
+            sizes = pc.fill_null(filtered.column('size'), 0).to_pylist()
+        else:
+            sizes = [0] * filtered.num_rows
+        if 'last_modified_date' in columns:
+            last_modified_dates = [value.isoformat() if value else ''
+                                   for value in filtered.column('last_modified_date').to_pylist()]
+        else:
+            last_modified_dates = [''] * filtered.num_rows
+        for bucket, key, version_id, size, last_modified_date in zip(
+                filtered.column('bucket').to_pylist(), filtered.column('key').to_pylist(), version_ids, sizes,
+                last_modified_dates):
+            yield bucket, parse.quote_plus(key), version_id, size, last_modified_date
+
+
+############# Restore Order Strategies #############
+
+# Same orders as the AthenaSplit ORDER BY strategies, each returns (sort key, reverse) for an inventory row tuple.
+# Every order ends with the key and version id, so rows never tie
+def unique_order(row):
+    return parse.unquote_plus(row[1]), row[2]
+
+
+def priority_prefix_sort(priority_prefixes):
+    def sort_key(row):
+        key = parse.unquote_plus(row[1])
+        for priority, prefix in enumerate(priority_prefixes):
+            if key.startswith(prefix):
+                return priority, key, row[2]
+        return len(priority_prefixes), key, row[2]
+    return sort_key, False
+
+
+restore_order_strategies = {
+    'OldestFirst': lambda priority_prefixes: (lambda row: (row[4],) + unique_order(row), False),
+    'NewestFirst': lambda priority_prefixes: (lambda row: (row[4],) + unique_order(row), True),
+    'SizeAscending': lambda priority_prefixes: (lambda row: (row[3], row[4]) + unique_order(row), False),
+    'PrefixClustered': lambda priority_prefixes: (unique_order, False),
+    'PriorityPrefixes': priority_prefix_sort,
+}
+
+
+# External merge sort, so ordering a large inventory does not need it all in memory
+def sort_inventory_rows(rows, restore_order, priority_prefixes, work_dir):
+    sort_key, reverse = restore_order_strategies[restore_order](priority_prefixes)
+    run_paths = []
+    while True:
+        run = list(itertools.islice(rows, sort_run_rows))
+        if not run:
+            break
+        run.sort(key=sort_key, reverse=reverse)
+        run_path = os.path.join(work_dir, f'sort-run-{len(run_paths)}.jsonl')
+        with open(run_path, 'w') as run_file:
+            for row in run:
+                run_file.write(json.dumps(row) + '\n')
+        run_paths.append(run_path)
+    run_files = [open(run_path) for run_path in run_paths]
+    try:
+        yield from heapq.merge(*[(tuple(json.loads(line)) for line in run_file) for run_file in run_files],
+                               key=sort_key, reverse=reverse)
+    finally:
+        for run_file, run_path in zip(run_files, run_paths):
+            run_file.close()
+            os.remove(run_path)
+
+
+############# Manifest Chunk Writer #############
+
+# Stream restorable rows into chunk files of at most max_rows keys and, when max_bytes is set, at most max_bytes
+# unless a single object is larger. write_chunk(chunk_num, chunk_rows, chunk_bytes, file_path) stores each chunk.
+def write_manifest_chunks(rows, incl_versions, max_rows, max_bytes, work_dir, write_chunk):
+    chunk_num = 0
+    chunk_rows = 0
+    chunk_bytes = 0
+    num_rows = 0
+    chunk_path = os.path.join(work_dir, f'chunk-{chunk_num}.csv')
+    chunk_file = open(chunk_path, 'w', newline='')
+    for bucket, key, version_id, size, last_modified_date in rows:
+        if chunk_rows == max_rows or (max_bytes and chunk_rows and chunk_bytes + size > max_bytes):
+            chunk_file.close()
+            write_chunk(chunk_num, chunk_rows, chunk_bytes, chunk_path)
+            chunk_num += 1
+            chunk_rows = 0
+            chunk_bytes = 0
+            chunk_path = os.path.join(work_dir, f'chunk-{chunk_num}.csv')
+            chunk_file = open(chunk_path, 'w', newline='')
+        # The trailing size lets CopyWorker pick the copy operation, RestoreWorker2 ignores it
+        if incl_versions == 'All':
+            chunk_file.write(f'{bucket},{key},{version_id},{size}\n')
+        else:
+            chunk_file.write(f'{bucket},{key},{size}\n')
+        chunk_rows += 1
+        chunk_bytes += size
+        num_rows += 1
+    chunk_file.close()
+    if chunk_rows:
+        write_chunk(chunk_num, chunk_rows, chunk_bytes, chunk_path)
+    else:
+        os.remove(chunk_path)
+    return num_rows, chunk_num
+
+
+def iter_inventory_rows(manifest, open_data_file, storage_classes, incl_versions):
+    file_format = manifest.get('fileFormat')
+    for data_file in manifest.get('files', []):
+        logger.info(f"Reading inventory data file {data_file.get('key')}")
+        with closing(open_data_file(data_file.get('key'))) as fileobj:
+            if file_format == 'CSV':
+                yield from iter_csv_inventory(fileobj, manifest.get('fileSchema'), storage_classes, incl_versions)
+            elif file_format == 'Parquet':
+                yield from iter_parquet_inventory(fileobj, storage_classes, incl_versions)
+            else:
+                raise ValueError(f'Unsupported S3 Inventory file format {file_format}')
+
+
+############# S3 Functions #############
+
+# symlink.txt sits at <prefix>/hive/dt=YYYY-MM-DD-HH-MM/, manifest.json at <prefix>/YYYY-MM-DDTHH-MMZ/
+def get_manifest_key(symlink_key):
+    inventory_prefix = symlink_key.split('/hive/')[0]
+    my_dt = symlink_key.split('/')[-2].split('=')[-1]
+    manifest_folder = f'{my_dt[:10]}T{my_dt[11:]}Z'
+    return f'{inventory_prefix}/{manifest_folder}/manifest.json', my_dt
+
+
+def get_inventory_manifest(bucket, key):
+    try:
+        get_response = get_client('s3').get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        logger.error(e)
+        raise
+    else:
+        return json.loads(get_response.get('Body').read().decode('utf-8'))
+
+
+def lambda_handler(event, context):
+    logger.info(f'Event details are: {event}')
+    s3Bucket = event.get('s3Bucket')
+    s3Key = parse.unquote_plus(event.get('s3Key'))
+    jobgroupid = str(uuid.uuid4())
+    restore_order = event.get('restore_order')
+    priority_prefixes = [prefix.strip() for prefix in event.get('priority_prefixes').split(',') if prefix.strip()]
+    manifest_key, my_dt = get_manifest_key(s3Key)
+    output_location_path = f'{chunk_prefix}/{jobgroupid}/'
+
+    manifest = get_inventory_manifest(s3Bucket, manifest_key)
+    logger.info(f"Inventory format is {manifest.get('fileFormat')} with {len(manifest.get('files', []))} data files")
+
+    # Parquet needs a seekable file, CSV is streamed straight from the response body
+    def open_data_file(data_key):
+        if manifest.get('fileFormat') == 'Parquet':
+            local_path = os.path.join('/tmp', os.path.basename(data_key))
+            get_client('s3').download_file(s3Bucket, data_key, local_path)
+            fileobj = open(local_path, 'rb')
+            os.remove(local_path)
+            return fileobj
+        return get_client('s3').get_object(Bucket=s3Bucket, Key=data_key).get('Body')
+
+    # Same chunk_id=N/chunk_rows=R/chunk_bytes=B/ layout as the single pass UNLOAD, ListPrefix reads the chunk size from the key
+    def write_chunk(chunk_num, chunk_rows, chunk_bytes, chunk_path):
+        chunk_key = (f'{output_location_path}chunk_id={chunk_num}/chunk_rows={chunk_rows}/chunk_bytes={chunk_bytes}/'
+                     f'chunk-{chunk_num:06d}.csv')
+        logger.info(f'Writing manifest chunk s3://{s3Bucket}/{chunk_key}')
+        try:
+            get_client('s3').upload_file(chunk_path, s3Bucket, chunk_key)
+        except ClientError as e:
+            logger.error(e)
+            raise
+        os.remove(chunk_path)
+
+    rows = iter_inventory_rows(manifest, open_data_file, storage_classes_to_restore(my_storage_class_to_restore),
+                               my_incl_versions)
+    rows = sort_inventory_rows(rows, restore_order, priority_prefixes, '/tmp')
+    my_csv_num_rows, num_chunks = write_manifest_chunks(rows, my_incl_versions, my_csv_max_rows, my_csv_max_bytes,
+                                                        '/tmp', write_chunk)
+    logger.info(f'Wrote {my_csv_num_rows} keys to {num_chunks + 1} manifest chunks under {output_location_path}')
+
+    # Same output as the last AthenaSplit iteration, so InitiateFlow and ListPrefix consume it unchanged
+    return {
+            'num_chunks' : num_chunks,
+            'csv_chunking_complete': my_csv_num_rows > 0,
+            'csv_counting_complete': True,
+            'my_csv_num_rows' : my_csv_num_rows,
+            'my_csv_max_rows' : my_csv_max_rows,
+            'my_dt' : my_dt,
+            's3Bucket' : s3Bucket,
+            'jobgroupid' : jobgroupid,
+            'output_location_path': output_location_path,
+            'my_s3_bucket': my_s3_bucket,
+            'restore_order': restore_order,
+            'priority_prefixes': event.get('priority_prefixes'),
+            }
+
+
+# Build manifest chunks from a local inventory:
+# python InventoryEngine.py <manifest.json> <data dir> <output dir> [restore order] [priority prefixes]
+if __name__ == '__main__':
+    logging.basicConfig()
+    local_manifest_path, local_data_dir, local_output_dir = sys.argv[1:4]
+    local_restore_order = sys.argv[4] if len(sys.argv) > 4 else 'OldestFirst'
+    local_priority_prefixes = [prefix for prefix in sys.argv[5].split(',') if prefix] if len(sys.argv) > 5 else []
+    with open(local_manifest_path) as manifest_file:
+        local_manifest = json.load(manifest_file)
+    local_rows = iter_inventory_rows(
+        local_manifest,
+        lambda data_key: open(os.path.join(local_data_dir, os.path.basename(data_key)), 'rb'),
+        storage_classes_to_restore(my_storage_class_to_restore),
+        my_incl_versions,
+    )
+    local_rows = sort_inventory_rows(local_rows, local_restore_order, local_priority_prefixes, local_output_dir)
+    local_chunk_bytes = []
+
+    def write_local_chunk(chunk_num, chunk_rows, chunk_bytes, chunk_path):
+        logger.info(f'Wrote {chunk_path} with {chunk_rows} keys and {chunk_bytes} bytes')
+        local_chunk_bytes.append(chunk_bytes)
+
+    local_num_rows, local_num_chunks = write_manifest_chunks(local_rows, my_incl_versions, my_csv_max_rows,
+                                                             my_csv_max_bytes, local_output_dir, write_local_chunk)
+    print(json.dumps({'my_csv_num_rows': local_num_rows, 'csv_file_bytes': local_chunk_bytes}))
@@ -1,9 +1,11 @@
 import math
 import json
 import logging
-import os
-import boto3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
+from Runtime import client_config, env_int, env_str, get_client
 
 
 # Set up logging
@@ -12,22 +14,25 @@ logger.setLevel('INFO')
 # boto3.set_stream_logger("")
 
 # Define Environmental Variables
-my_region = str(os.environ['AWS_REGION'])
-restore_function_name = str(os.environ['restore_function'])
-my_incl_versions = str(os.environ['included_obj_versions'])
+restore_function_name = env_str('restore_function')
+my_incl_versions = env_str('included_obj_versions')
+my_submission_concurrency = env_int('restore_submission_concurrency')
+my_max_submit_attempts = env_int('max_submit_attempts')
 
 
 # Other Variables
 copy_invocation_type = 'RequestResponse'
+# Recorded in restore_job_ids for a manifest that failed my_max_submit_attempts times, so the workflow moves on
+submit_failed_job_id = 'SubmitFailed'
 
-### Initiate Service Client
-client = boto3.client('lambda', region_name=my_region)
+### Service Client Config, restore manifests are submitted from worker threads
+config = client_config(max_pool_connections=my_submission_concurrency, max_attempts=10, retry_mode='adaptive')
 
 
 # Function to Invoke Copy Function Worker
 def invoke_function(function_name, invocation_type, payload):
     try:
-        invoke_response = client.invoke(
+        invoke_response = get_client('lambda', config).invoke(
           FunctionName=function_name,
           InvocationType=invocation_type,
           Payload=payload,
@@ -41,14 +46,66 @@ def invoke_function(function_name, invocation_type, payload):
         return response_payload
 
 
+# Submit one manifest through RestoreWorker2, returns the restore job id or None when the submission failed
+def submit_restore_job(bucketname, keyname, keyname_bytes, jobgroupid):
+    # Generate Payload for Invocation:
+    if my_incl_versions == 'Current':
+        num_fields = 2
+    elif my_incl_versions == 'All':
+        num_fields = 3
+
+    my_payload = {
+        "Records": [{
+            "s3": {
+                "bucket": {
+                    "name": bucketname
+                },
+                "object": {
+                    "key": keyname
+                }
+            },
+            "jobspec": {
+                "fields": num_fields,
+                "chunk_bytes": keyname_bytes,
+                # Same token for the same manifest, so a retried submission returns the job already created
+                "client_request_token": str(uuid.uuid5(uuid.NAMESPACE_URL, f'{jobgroupid}/{keyname}')),
+            },
+            "jobgroupid": jobgroupid,
+        }]
+    }
+
+    my_payload_json = json.dumps(my_payload)
+    logger.info(my_payload_json)
+
+    try:
+        invoke_restore_funct = invoke_function(restore_function_name, copy_invocation_type, my_payload_json)
+    except Exception as e:
+        logger.error(f'Submitting {keyname} failed: {e}')
+        return None
+    logger.info(invoke_restore_funct)
+    if invoke_restore_funct.get("statusCode") == 200 and invoke_restore_funct.get("body"):
+        return invoke_restore_funct.get("body")
+    return None
+
 
 def lambda_handler(event, context):
     logger.info(f'Event details: {event}')
     keyname = None
-    num_fields = None
+    keyname_bytes = None
     item_count = int(event.get('item_count'))
     item_loop_status = 'Started'
     csv_files = event.get('csv_files')
+    csv_file_rows = event.get('csv_file_rows')
+    csv_file_bytes = event.get('csv_file_bytes')
+    # Job id per manifest, None until submitted, so a failed or redriven iteration only resubmits what is missing
+    restore_job_ids = event.get('restore_job_ids')
+    restore_submit_attempts = event.get('restore_submit_attempts')
+    restore_schedule = event.get('restore_schedule', {})
+    # Last submission, RestoreScheduler paces the next one against the restore budget
+    last_submit_time = event.get('last_submit_time')
+    last_submit_manifests = event.get('last_submit_manifests')
+    last_submit_rows = event.get('last_submit_rows')
+    last_submit_bytes = event.get('last_submit_bytes')
     num_count = int(event.get('num_count'))
     bucketname = event.get('bucketname')
     jobgroupid = str(event.get('jobgroupid'))
@@ -62,51 +119,58 @@ def lambda_handler(event, context):
         item_loop_status = 'complete'
         logger.info(f'item_loop_status is: {item_loop_status}')
     else:
-        keyname = csv_files[num_count]
-        logger.info(f'keyname is: {keyname}')
-        # Generate Payload for Invocation:
-        if my_incl_versions == 'Current':
-            num_fields = 2
-        elif my_incl_versions == 'All':
-            num_fields = 3
-
-        my_payload = {
-            "Records": [{
-                "s3": {
-                    "bucket": {
-                        "name": bucketname
-                    },
-                    "object": {
-                        "key": keyname
-                    }
-                },
-                "jobspec": {
-                    "fields": num_fields
-                },
-                "jobgroupid": jobgroupid,
-            }]
-        }
-
-        my_payload_json = json.dumps(my_payload)
-        logger.info(my_payload)
-        logger.info(my_payload_json)
-
-        # Start Copy Function Invoke
-        invoke_restore_funct = invoke_function(restore_function_name, copy_invocation_type, my_payload_json)
-        logger.info(invoke_restore_funct)
-        invoke_status_code = invoke_restore_funct.get("statusCode")
-        invoke_copy_job_id = invoke_restore_funct.get("body")
-
-        num_count += 1
+        submit_count = int(restore_schedule.get('submit_count', 1))
+        pending_items = [item for item in range(item_count) if restore_job_ids[item] is None][:submit_count]
+        logger.info(f'Submitting {len(pending_items)} manifests with {my_submission_concurrency} concurrent workers')
+
+        with ThreadPoolExecutor(max_workers=my_submission_concurrency) as executor:
+            submitted_job_ids = list(executor.map(
+                lambda item: submit_restore_job(bucketname, csv_files[item], csv_file_bytes[item], jobgroupid),
+                pending_items))
+
+        submitted_items = []
+        for item, job_id in zip(pending_items, submitted_job_ids):
+            restore_submit_attempts[item] += 1
+            if job_id:
+                restore_job_ids[item] = job_id
+                submitted_items.append(item)
+                keyname = csv_files[item]
+                keyname_bytes = csv_file_bytes[item]
+            elif restore_submit_attempts[item] >= my_max_submit_attempts:
+                logger.error(f'Giving up on {csv_files[item]} after {restore_submit_attempts[item]} attempts')
+                restore_job_ids[item] = submit_failed_job_id
+            else:
+                logger.warning(f'Submitting {csv_files[item]} failed, it is retried on the next iteration')
+
+        # OffsetLimit manifests carry no row or byte totals, RestoreScheduler then assumes full manifests
+        if submitted_items:
+            last_submit_time = int(time.time())
+            last_submit_manifests = len(submitted_items)
+            last_submit_rows = None
+            last_submit_bytes = None
+            if all(csv_file_rows[item] is not None for item in submitted_items):
+                last_submit_rows = sum(csv_file_rows[item] for item in submitted_items)
+            if all(csv_file_bytes[item] is not None for item in submitted_items):
+                last_submit_bytes = sum(csv_file_bytes[item] for item in submitted_items)
+        num_count = len([job_id for job_id in restore_job_ids if job_id is not None])
 
     # Return Values
     return {
         'item_count': item_count,
         'item_loop_status': item_loop_status,
         'csv_files': csv_files,
+        'csv_file_rows': csv_file_rows,
+        'csv_file_bytes': csv_file_bytes,
+        'restore_job_ids': restore_job_ids,
+        'restore_submit_attempts': restore_submit_attempts,
+        'last_submit_time': last_submit_time,
+        'last_submit_manifests': last_submit_manifests,
+        'last_submit_rows': last_submit_rows,
+        'last_submit_bytes': last_submit_bytes,
         'num_count': num_count,
         'bucketname': bucketname,
         'keyname': keyname,
+        'keyname_bytes': keyname_bytes,
         'jobgroupid': jobgroupid,
         'my_csv_num_rows': my_csv_num_rows,
     }
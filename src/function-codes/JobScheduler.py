@@ -1,59 +1,55 @@
 import json
 import logging
-import os
 import datetime
-from dateutil.tz import tzlocal
-from dateutil import parser
-import boto3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from boto3.dynamodb.conditions import Key, Attr
+from dateutil import parser
 from botocore.exceptions import ClientError
+from EmitMetrics import emit_metrics
+from Runtime import client_config, env_int, env_str, get_client, get_table
 
 # Set up logging
 logger = logging.getLogger(__name__)
 logger.setLevel('INFO')
 # boto3.set_stream_logger("")
 
-# Set Region #
-my_region = str(os.environ['AWS_REGION'])
-
-### Initiate Service Client and DDB Table
-dynamodb = boto3.resource('dynamodb', region_name=my_region)
-client = boto3.client('lambda', region_name=my_region)
+my_dispatch_concurrency = env_int('copy_dispatch_concurrency')
 
 ### Initiate Variables ######
-table = dynamodb.Table(str(os.environ['job_ddb']))
-copy_function_name = str(os.environ['copy_function'])
-my_archive_storage_class = str(os.environ['existing_archive_storage_class'])
-my_gfr_standard_retrieval_delay = int(os.environ['gfr_standard_retrieval_delay'])
-my_gfr_bulk_retrieval_delay = int(os.environ['gfr_bulk_retrieval_delay'])
-my_gda_standard_retrieval_delay = int(os.environ['gda_standard_retrieval_delay'])
-my_gda_bulk_retrieval_delay = int(os.environ['gda_bulk_retrieval_delay'])
+my_job_ddb = env_str('job_ddb')
+copy_ready_index = env_str('copy_ready_index')
+copy_function_name = env_str('copy_function')
+my_archive_storage_class = env_str('existing_archive_storage_class')
+my_gfr_standard_retrieval_delay = env_int('gfr_standard_retrieval_delay')
+my_gfr_bulk_retrieval_delay = env_int('gfr_bulk_retrieval_delay')
+my_gda_standard_retrieval_delay = env_int('gda_standard_retrieval_delay')
+my_gda_bulk_retrieval_delay = env_int('gda_bulk_retrieval_delay')
+
+### Service Client Config, copy jobs are dispatched from worker threads
+config = client_config(max_pool_connections=my_dispatch_concurrency, max_attempts=10, retry_mode='adaptive')
 
 # Other Variables
 copy_invocation_type = 'RequestResponse'
+scheduled_event_source = 'aws.events'
 
 
-# Define Copy Job Initiation Delay parameters based on Archive Class #
-# Define Parameters #
+# Define Copy Job Initiation Delay parameters based on Archive Class, only used for items recorded without
+# copy_ready_time, JobTracker sets it on the items it creates #
 standard_restore_copy_job_delay = None
 bulk_restore_copy_job_delay = None
 
 if my_archive_storage_class == 'GLACIER':
     standard_restore_copy_job_delay = my_gfr_standard_retrieval_delay
     bulk_restore_copy_job_delay = my_gfr_bulk_retrieval_delay
-    logger.info(
-        f"Delay time set for Glacier are Std: {standard_restore_copy_job_delay} and Bulk: {bulk_restore_copy_job_delay}")
-
-elif my_archive_storage_class == 'DEEP_ARCHIVE' or 'GLACIER_AND_DEEP_ARCHIVE':
+elif my_archive_storage_class in ['DEEP_ARCHIVE', 'GLACIER_AND_DEEP_ARCHIVE']:
     standard_restore_copy_job_delay = my_gda_standard_retrieval_delay
     bulk_restore_copy_job_delay = my_gda_bulk_retrieval_delay
-    logger.info(
-        f"Delay time set for Deep_Archive are Std: {standard_restore_copy_job_delay} and Bulk: {bulk_restore_copy_job_delay}")
 
 
 # Function to Invoke Copy Function Worker
 def invoke_function(function_name, invocation_type, payload):
-    invoke_response = client.invoke(
+    invoke_response = get_client('lambda', config).invoke(
         FunctionName=function_name,
         InvocationType=invocation_type,
         Payload=payload,
@@ -62,21 +58,46 @@ def invoke_function(function_name, invocation_type, payload):
     response_payload = json.loads(invoke_response['Payload'].read().decode("utf-8"))
     return response_payload
 
-# Scan DynamoDB Table
-def scan_table(column_name, column_value):
-    projection_expression = "copy_manifest_s3bucket, copy_manifest_skey, restore_date_completed, restore_job_tier, " \
-                            "restore_job_id "
+
+# Start the copy job for one due item, returns the copy job ids or None so a failure never affects the other items
+def dispatch_copy_job(data):
+    restore_jobid = data.get('restore_job_id')
+    copy_job_start = datetime.datetime.utcfromtimestamp(int(data.get('copy_ready_time')))
+    logger.info(f"Restore Tier is: {data.get('restore_job_tier')}")
+    logger.info(f"Job planned time was {copy_job_start} so, start the copy job for {restore_jobid} now!")
+    # Generate Payload for Invocation:
+    my_payload = {"copymanifestbucket": data.get('copy_manifest_s3bucket'),
+                  "copymanifestkey": data.get('copy_manifest_skey'),
+                  "restorejobid": restore_jobid, 'nummanifestcols': str(data.get('num_manifest_fields'))}
+    my_payload_json = json.dumps(my_payload)
+
+    try:
+        invoke_copy_funct = invoke_function(copy_function_name, copy_invocation_type, my_payload_json)
+    except Exception as e:
+        logger.error(f'Starting the copy job for {restore_jobid} failed: {e}')
+        return None
+    logger.info(invoke_copy_funct)
+    invoke_copy_job_id = invoke_copy_funct.get("body")
+    # CopyWorker lists one job id per report manifest, a None means that copy job was not created
+    if invoke_copy_funct.get("statusCode") == 200 and invoke_copy_job_id and None not in invoke_copy_job_id:
+        return invoke_copy_job_id
+    logger.error(f'Copy job for {restore_jobid} was not started, it is retried on the next run')
+    return None
+
+# Query the sparse copy ready index, JobTracker sets copy_ready_time to the restore completion plus the tier delay
+def query_copy_ready(column_name, column_value, ready_time):
     ddb_items = []
-    scan_kwargs = {
-        'FilterExpression': Key(column_name).eq(column_value),
+    query_kwargs = {
+        'IndexName': copy_ready_index,
+        'KeyConditionExpression': Key(column_name).eq(column_value) & Key('copy_ready_time').lte(ready_time),
     }
     try:
         done = False
         begin = None
         while not done:
             if begin:
-                scan_kwargs['ExclusiveStartKey'] = begin
-            response = table.scan(**scan_kwargs)
+                query_kwargs['ExclusiveStartKey'] = begin
+            response = get_table(my_job_ddb).query(**query_kwargs)
             ddb_items.extend(response.get('Items', []))
             begin = response.get('LastEvaluatedKey', None)
             done = begin is None
@@ -85,15 +106,87 @@ def scan_table(column_name, column_value):
 
     return ddb_items
 
+# Items recorded before JobTracker set copy_ready_time are not in the copy ready index and would never be copied.
+# Give them the copy_ready_time JobTracker would have set, restore completion plus the tier delay, so the index query
+# picks them up. Returns the number of items backfilled
+def backfill_copy_ready_time(column_name, column_value):
+    backfilled_items = 0
+    scan_kwargs = {
+        'FilterExpression': Attr(column_name).eq(column_value) & Attr('copy_ready_time').not_exists()
+                            & Attr('restore_date_completed').exists(),
+        'ProjectionExpression': 'restore_job_id, restore_job_status, restore_job_tier, restore_date_completed',
+    }
+    try:
+        done = False
+        begin = None
+        while not done:
+            if begin:
+                scan_kwargs['ExclusiveStartKey'] = begin
+            response = get_table(my_job_ddb).scan(**scan_kwargs)
+            for data in response.get('Items', []):
+                if data.get('restore_job_tier') == 'STANDARD':
+                    offset_hours = standard_restore_copy_job_delay
+                else:
+                    offset_hours = bulk_restore_copy_job_delay
+                copy_job_start = parser.parse(data.get('restore_date_completed')) + datetime.timedelta(hours=offset_hours)
+                logger.info(f"Restore job {data.get('restore_job_id')} has no copy_ready_time, setting it to {copy_job_start}")
+                try:
+                    get_table(my_job_ddb).update_item(
+                        Key={
+                            'restore_job_id': data.get('restore_job_id'),
+                            'restore_job_status': data.get('restore_job_status')
+                        },
+                        # Only while the item still waits for its copy, a concurrent dispatch has already moved it on
+                        UpdateExpression='SET copy_ready_time = :val1',
+                        ConditionExpression=Attr(column_name).eq(column_value) & Attr('copy_ready_time').not_exists(),
+                        ExpressionAttributeValues={
+                            ':val1': int(copy_job_start.timestamp())
+                        }
+                    )
+                    backfilled_items += 1
+                except ClientError as e:
+                    logger.error(e)
+            begin = response.get('LastEvaluatedKey', None)
+            done = begin is None
+    except ClientError as e:
+        logger.error(e)
+
+    return backfilled_items
+
+# Count the items of the copy ready index whose copy_ready_time is still ahead, for the queue depth metric
+def count_copy_waiting(column_name, column_value, ready_time):
+    waiting_items = 0
+    query_kwargs = {
+        'IndexName': copy_ready_index,
+        'KeyConditionExpression': Key(column_name).eq(column_value) & Key('copy_ready_time').gt(ready_time),
+        'Select': 'COUNT',
+    }
+    try:
+        done = False
+        begin = None
+        while not done:
+            if begin:
+                query_kwargs['ExclusiveStartKey'] = begin
+            response = get_table(my_job_ddb).query(**query_kwargs)
+            waiting_items += response.get('Count', 0)
+            begin = response.get('LastEvaluatedKey', None)
+            done = begin is None
+    except ClientError as e:
+        logger.error(e)
+        return None
+
+    return waiting_items
+
 # Update DynamoDB Table Function
 def ddb_update_item(restorejobid, restorejobstatus, updatedval1, updatedval2):
     try:
-        update_response = table.update_item(
+        update_response = get_table(my_job_ddb).update_item(
             Key={
                 'restore_job_id': restorejobid,
                 'restore_job_status': restorejobstatus
             },
-            UpdateExpression='SET copy_job_id = :val1, copy_job_status = :val2',
+            # Drop copy_ready_time so the item leaves the copy ready index
+            UpdateExpression='SET copy_job_id = :val1, copy_job_status = :val2 REMOVE copy_ready_time',
             ExpressionAttributeValues={
                 ':val1': updatedval1,
                 ':val2': updatedval2
@@ -108,49 +201,43 @@ def ddb_update_item(restorejobid, restorejobstatus, updatedval1, updatedval2):
 def lambda_handler(event, context):
     my_column_name = 'copy_job_status'
     my_column_value = 'NotStarted'
-    ddb_scan_result = scan_table(my_column_name, my_column_value)
-    for data in ddb_scan_result:
-        logger.info(data)
-        copy_job_manifest_key = data.get('copy_manifest_skey')
-        copy_job_manifest_bucket = data.get('copy_manifest_s3bucket')
-        restore_job_completion_date = data.get('restore_date_completed')
-        restore_job_retrieval_tier = data.get('restore_job_tier')
-        restore_jobid = data.get('restore_job_id')
-        restorejobstatus = data.get('restore_job_status')
-        manifest_flds_num = str(data.get('num_manifest_fields'))
-        # Add 48 hours to the restore_job_completion, to allow Glacier Restore Completion
-        conv_to_timestamp = parser.parse(restore_job_completion_date)
-        if restore_job_retrieval_tier == 'STANDARD':
-            offset_hours = standard_restore_copy_job_delay
-        elif restore_job_retrieval_tier == 'BULK':
-            offset_hours = bulk_restore_copy_job_delay
-        copy_job_start = conv_to_timestamp + datetime.timedelta(hours=offset_hours)
-        logger.info(f"Restore Job Completion date is: {restore_job_completion_date}")
-        logger.info(f"Restore Tier is: {restore_job_retrieval_tier}")
-        logger.info(f"Scheduled time for Copy Job Start: {copy_job_start}")
-        logger.info(f"The Restore Job ID is: {restore_jobid}")
-        my_current_time_now = datetime.datetime.utcnow().replace(tzinfo=tzlocal())
-        logger.info(f"My current time is: {my_current_time_now}")
-        # Start Copy Function Invoke
-        # Generate Payload for Invocation:
-        my_payload = {"copymanifestbucket": copy_job_manifest_bucket, "copymanifestkey": copy_job_manifest_key,
-                      "restorejobid": restore_jobid, 'nummanifestcols': manifest_flds_num}
-        my_payload_json = json.dumps(my_payload)
-
-        if my_current_time_now >= copy_job_start:
-            logger.info(
-                f"My current time is: {my_current_time_now} and job planned time is {copy_job_start} so, start the "
-                f"copy job now!")
-            # Start Copy Function Invoke
-            invoke_copy_funct = invoke_function(copy_function_name, copy_invocation_type, my_payload_json)
-            logger.info(invoke_copy_funct)
-            invoke_status_code = invoke_copy_funct.get("statusCode")
-            invoke_copy_job_id = invoke_copy_funct.get("body")
-            # Change Copy Job Status in DDB to Submitted
-            updatedval2 = 'Submitted'
-            if invoke_status_code == 200 and invoke_copy_job_id:
+    my_current_time_now = int(time.time())
+    logger.info(f"My current time is: {datetime.datetime.utcfromtimestamp(my_current_time_now)}")
+    # The scheduled runs also look for items from before the copy ready index, the runs started by restore events
+    # only need the index
+    if event.get('source') == scheduled_event_source:
+        logger.info(f'Backfilled copy_ready_time on {backfill_copy_ready_time(my_column_name, my_column_value)} items')
+    # Only items whose copy_ready_time has passed are returned
+    ddb_query_result = query_copy_ready(my_column_name, my_column_value, my_current_time_now)
+    logger.info(f'{len(ddb_query_result)} copy jobs are due, starting them with {my_dispatch_concurrency} concurrent workers')
+    # Change Copy Job Status in DDB to Submitted
+    updatedval2 = 'Submitted'
+    copy_jobs_started = 0
+    dispatch_start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=my_dispatch_concurrency) as executor:
+        dispatched_items = {executor.submit(dispatch_copy_job, data): data for data in ddb_query_result}
+        # Record each copy job as soon as it starts, items left NotStarted are picked up again on the next run
+        for dispatched_item in as_completed(dispatched_items):
+            data = dispatched_items[dispatched_item]
+            invoke_copy_job_id = dispatched_item.result()
+            if invoke_copy_job_id:
                 # Update the DDB Table if Job Invocation is Successful
-                ddb_update_item(restore_jobid, restorejobstatus, invoke_copy_job_id, updatedval2)
+                ddb_update_item(data.get('restore_job_id'), data.get('restore_job_status'), invoke_copy_job_id, updatedval2)
+                copy_jobs_started += 1
+
+    logger.info(f'Started {copy_jobs_started} of {len(ddb_query_result)} copy jobs')
+    oldest_due_age = None
+    if ddb_query_result:
+        oldest_due_age = my_current_time_now - min(int(data.get('copy_ready_time')) for data in ddb_query_result)
+    emit_metrics({'Operation': 'CopyDispatch'}, {
+        'CopyJobsDue': (len(ddb_query_result), 'Count'),
+        'CopyJobsWaiting': (count_copy_waiting(my_column_name, my_column_value, my_current_time_now), 'Count'),
+        'CopyJobsStarted': (copy_jobs_started, 'Count'),
+        'CopyDispatchFailures': (len(ddb_query_result) - copy_jobs_started, 'Count'),
+        'OldestDueCopyAge': (oldest_due_age, 'Seconds'),
+        'CopyDispatchDuration': ((time.perf_counter() - dispatch_start) * 1000, 'Milliseconds'),
+    })
 
     return {
         'statusCode': 200,
@@ -1,10 +1,13 @@
-import boto3
-import botocore
-import os
+import array
+import csv
+import hashlib
+import json
 import logging
 import datetime
 from botocore.exceptions import ClientError
 from urllib import parse
+from EmitMetrics import emit_metrics
+from Runtime import env_int, env_str, get_client, get_table, send_sns_message
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -13,27 +16,55 @@ logger.setLevel('INFO')
 # Initiate Variables
 
 # Lambda Environment Variables
-accountId = str(os.environ['my_account_id'])
-my_region = str(os.environ['my_current_region'])
-my_sns_topic_arn = str(os.environ['my_sns_topic_arn'])
-
-# Create Service Clients
-dynamodb = boto3.resource('dynamodb', region_name=my_region)
-s3ControlClient = boto3.client('s3control', region_name=my_region)
-sns = boto3.client('sns', region_name=my_region)
-s3Client = boto3.client('s3', region_name=my_region)
-# Instantiate Table Resource
-table = dynamodb.Table(str(os.environ['job_ddb']))
-
-
-# SNS Message Function
-def send_sns_message(sns_topic_arn, sns_message):
-    sns_subject = 'Notification from AutoRestoreMigrate Solution'
-    logger.info("Sending SNS Notification Message......")
-    try:
-        response = sns.publish(TopicArn=sns_topic_arn, Message=sns_message, Subject=sns_subject)
-    except ClientError as e:
-        logger.error(e)
+accountId = env_str('my_account_id')
+my_sns_topic_arn = env_str('my_sns_topic_arn')
+my_archive_storage_class = env_str('existing_archive_storage_class')
+my_gfr_standard_retrieval_delay = env_int('gfr_standard_retrieval_delay')
+my_gfr_bulk_retrieval_delay = env_int('gfr_bulk_retrieval_delay')
+my_gda_standard_retrieval_delay = env_int('gda_standard_retrieval_delay')
+my_gda_bulk_retrieval_delay = env_int('gda_bulk_retrieval_delay')
+my_copy_start_trigger = env_str('copy_start_trigger')
+my_restore_tracking_prefix = env_str('restore_tracking_prefix')
+my_job_ddb = env_str('job_ddb')
+my_job_registry_prefix = env_str('job_registry_prefix')
+
+
+# Tags of the jobs submitted by the solution, the value names the restore job a copy job belongs to
+job_tag_keys = ['auto-restore-copy', 'auto-restore-copy-batch']
+
+
+# Define Copy Job Initiation Delay parameters based on Archive Class, JobScheduler queries copy_ready_time #
+standard_restore_copy_job_delay = None
+bulk_restore_copy_job_delay = None
+
+if my_archive_storage_class == 'GLACIER':
+    standard_restore_copy_job_delay = my_gfr_standard_retrieval_delay
+    bulk_restore_copy_job_delay = my_gfr_bulk_retrieval_delay
+elif my_archive_storage_class in ['DEEP_ARCHIVE', 'GLACIER_AND_DEEP_ARCHIVE']:
+    standard_restore_copy_job_delay = my_gda_standard_retrieval_delay
+    bulk_restore_copy_job_delay = my_gda_bulk_retrieval_delay
+
+
+# Task counts and run time of a finished Batch Operations job, restore jobs by tier
+def emit_job_metrics(job_details, job_operation, job_tier, job_status):
+    dimensions = {'Operation': job_operation}
+    if job_operation == 'S3InitiateRestoreObject':
+        dimensions['RestoreTier'] = job_tier
+    progress = job_details.get('ProgressSummary')
+    job_duration = None
+    task_throughput = None
+    if job_details.get('CreationTime') and job_details.get('TerminationDate'):
+        job_duration = (job_details.get('TerminationDate') - job_details.get('CreationTime')).total_seconds()
+        if job_duration > 0:
+            task_throughput = progress.get('TotalNumberOfTasks') / job_duration
+    emit_metrics(dimensions, {
+        'JobsCompleted': (1 if job_status == 'Complete' else 0, 'Count'),
+        'JobsFailed': (1 if job_status == 'Failed' else 0, 'Count'),
+        'TasksSucceeded': (progress.get('NumberOfTasksSucceeded'), 'Count'),
+        'TasksFailed': (progress.get('NumberOfTasksFailed'), 'Count'),
+        'JobDuration': (job_duration, 'Seconds'),
+        'TaskThroughput': (task_throughput, 'Count/Second'),
+    }, {'JobId': job_details.get('JobId'), 'JobStatus': job_status})
 
 
 def create_ddb_entry(
@@ -52,35 +83,45 @@ def create_ddb_entry(
         job_details,
         num_manifest_fields,
         copy_job_status,
+        copy_ready_time,
+        restore_tracking_key=None,
+        restore_tracked_objects=None,
 ):
     logger.info("Create DDB Entry for S3 Batch Operation Job Tracker")
+    my_item = {
+        'restore_job_id': job_id,
+        'restore_job_status': job_status,
+        'job_operation': job_operation,
+        'restore_job_tier': job_tier,
+        'restore_job_arn': job_arn,
+        'restore__date_created': date_created,
+        'restore_date_completed': date_completed,
+        'restore_number_of_tasks': number_of_tasks,
+        'restore_tasks_succeeded': tasks_succeeded,
+        'restore_tasks_failed': tasks_failed,
+        'copy_job_status': copy_job_status,
+        'copy_manifest_s3bucket': bucket_name,
+        'copy_manifest_skey': key_name,
+        'restore_job_details': job_details,
+        'num_manifest_fields': num_manifest_fields,
+    }
+    # Only items waiting for their copy carry copy_ready_time, which keeps the copy ready index sparse
+    if copy_job_status == 'NotStarted':
+        my_item['copy_ready_time'] = copy_ready_time
+    # RestoreEventTracker counts restore completed events against the objects in the tracking file
+    if restore_tracking_key:
+        my_item['restore_tracking_key'] = restore_tracking_key
+        my_item['restore_tracked_objects'] = restore_tracked_objects
+        my_item['restored_objects'] = 0
     try:
-        response = table.put_item(
-            Item={
-                'restore_job_id': job_id,
-                'restore_job_status': job_status,
-                'job_operation': job_operation,
-                'restore_job_tier': job_tier,
-                'restore_job_arn': job_arn,
-                'restore__date_created': date_created,
-                'restore_date_completed': date_completed,
-                'restore_number_of_tasks': number_of_tasks,
-                'restore_tasks_succeeded': tasks_succeeded,
-                'restore_tasks_failed': tasks_failed,
-                'copy_job_status': copy_job_status,
-                'copy_manifest_s3bucket': bucket_name,
-                'copy_manifest_skey': key_name,
-                'restore_job_details': job_details,
-                'num_manifest_fields': num_manifest_fields,
-            }
-        )
+        response = get_table(my_job_ddb).put_item(Item=my_item)
         logger.info("PutItem succeeded:")
     except ClientError as e:
         print(e)
 
 
 def s3_batch_describe_job(my_job_id):
-    response = s3ControlClient.describe_job(
+    response = get_client('s3control').describe_job(
         AccountId=accountId,
         JobId=my_job_id
     )
@@ -88,22 +129,65 @@ def s3_batch_describe_job(my_job_id):
     return job_desc
 
 
-def ddb_update_item(restorejobid, restorejobstatus, updatedval1, updatedval2, updatedval3, updatedval4, updatedval5, updatedval6):
+# A restore job may be copied by a native copy job and a BatchCopy job, add up their results once per job
+def ddb_update_item(restorejobid, restorejobstatus, updatedval1, updatedval2, updatedval3, updatedval4, updatedval5, updatedval6,
+                    copyjobid):
     try:
-        update_response = table.update_item(
+        update_response = get_table(my_job_ddb).update_item(
             Key={
                 'restore_job_id': restorejobid,
                 'restore_job_status': restorejobstatus
             },
-            UpdateExpression='SET copy_job_status = :val1, copy_number_of_tasks = :val2, copy_tasks_failed = :val3, '
-                             'copy_tasks_succeeded = :val4, copy_job_details = :val5, item_expiration = :val6',
+            UpdateExpression='ADD copy_jobs_completed :val0, copy_number_of_tasks :val2, copy_tasks_failed :val3, '
+                             'copy_tasks_succeeded :val4 SET copy_job_details = :val5, item_expiration = :val6',
+            ConditionExpression='attribute_exists(restore_job_id) AND NOT contains(copy_jobs_completed, :val7)',
             ExpressionAttributeValues={
-                ':val1': updatedval1,
+                ':val0': {copyjobid},
                 ':val2': updatedval2,
                 ':val3': updatedval3,
                 ':val4': updatedval4,
                 ':val5': updatedval5,
-                ':val6': updatedval6
+                ':val6': updatedval6,
+                ':val7': copyjobid
+            },
+            ReturnValues="ALL_NEW"
+        )
+        attributes = update_response.get('Attributes')
+        logger.info(attributes)
+        copy_job_ids = attributes.get('copy_job_id')
+        num_copy_jobs = len(copy_job_ids) if isinstance(copy_job_ids, list) else 1
+        if len(attributes.get('copy_jobs_completed')) >= num_copy_jobs:
+            get_table(my_job_ddb).update_item(
+                Key={
+                    'restore_job_id': restorejobid,
+                    'restore_job_status': restorejobstatus
+                },
+                UpdateExpression='SET copy_job_status = :val1',
+                ExpressionAttributeValues={
+                    ':val1': updatedval1
+                },
+            )
+    except ClientError as e:
+        logger.error(e)
+
+
+# Copy batches add up their results on the restore job they copy
+def ddb_add_copy_batch(restorejobid, restorejobstatus, updatedval1, updatedval2, updatedval3, updatedval4):
+    try:
+        update_response = get_table(my_job_ddb).update_item(
+            Key={
+                'restore_job_id': restorejobid,
+                'restore_job_status': restorejobstatus
+            },
+            UpdateExpression='ADD copy_batches_completed :val0, copy_number_of_tasks :val1, copy_tasks_failed :val2, '
+                             'copy_tasks_succeeded :val3 SET item_expiration = :val4',
+            ConditionExpression='attribute_exists(restore_job_id)',
+            ExpressionAttributeValues={
+                ':val0': 1,
+                ':val1': updatedval1,
+                ':val2': updatedval2,
+                ':val3': updatedval3,
+                ':val4': updatedval4
             },
             ReturnValues="UPDATED_NEW"
         )
@@ -112,20 +196,70 @@ def ddb_update_item(restorejobid, restorejobstatus, updatedval1, updatedval2, up
         logger.error(e)
 
 
+# RestoreEventTracker hashes the restore completed events the same way
+def object_hash(bucket, key, version_id=None):
+    object_id = f'{bucket}/{parse.unquote_plus(key)}'
+    if version_id:
+        object_id = f'{object_id}?versionId={version_id}'
+    return int.from_bytes(hashlib.blake2b(object_id.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+# Write the sorted hashes of the objects the restore job initiated, returns the tracking key and object count
+def write_restore_tracking(report_bucket, report_manifest_key, job_id, num_manifest_fields):
+    logger.info(f"Writing the restore tracking file for Restore Job {job_id}")
+    members = array.array('Q')
+    try:
+        get_response = get_client('s3').get_object(Bucket=report_bucket, Key=report_manifest_key)
+        report_manifest = json.loads(get_response.get('Body').read().decode('utf-8'))
+        for report_file in report_manifest.get('Results', []):
+            if report_file.get('TaskExecutionStatus') != 'succeeded':
+                continue
+            get_response = get_client('s3').get_object(Bucket=report_file.get('Bucket'), Key=report_file.get('Key'))
+            report_lines = (line.decode('utf-8') for line in get_response.get('Body').iter_lines())
+            for row in csv.reader(report_lines):
+                if not row:
+                    continue
+                version_id = row[2] if num_manifest_fields == '3' else None
+                members.append(object_hash(row[0], row[1], version_id))
+        if not members:
+            return None, None
+        tracking_key = f'{my_restore_tracking_prefix}{job_id}.bin'
+        get_client('s3').put_object(Bucket=report_bucket, Key=tracking_key,
+                            Body=array.array('Q', sorted(members)).tobytes())
+    except ClientError as e:
+        logger.error(e)
+        return None, None
+    logger.info(f"Tracking {len(members)} objects of Restore Job {job_id} in {tracking_key}")
+    return tracking_key, len(members)
+
+
+# The solution tag of the job, jobs may carry other tags in any order
 def get_job_tagging(bops_job_id):
     logger.info("Initiate GetJob Tagging")
     try:
-        get_job_tag_response = s3ControlClient.get_job_tagging(
+        get_job_tag_response = get_client('s3control').get_job_tagging(
             AccountId=accountId,
             JobId=bops_job_id
         )
     except ClientError as e:
         logger.error(e)
-    else:
-        logger.info("Successfully retrieved Job Tags")
-        tag_key = get_job_tag_response.get('Tags')[0].get('Key')
-        tag_value = get_job_tag_response.get('Tags')[0].get('Value')
-        return tag_key, tag_value
+        return None, None
+    logger.info("Successfully retrieved Job Tags")
+    for job_tag in get_job_tag_response.get('Tags', []):
+        if job_tag.get('Key') in job_tag_keys:
+            return job_tag.get('Key'), job_tag.get('Value')
+    return None, None
+
+
+# What the submitting function recorded about the job, None for jobs submitted before the registry or by hand
+def get_job_registration(report_bucket, bops_job_id):
+    registry_key = f'{my_job_registry_prefix}{bops_job_id}.json'
+    try:
+        get_response = get_client('s3').get_object(Bucket=report_bucket, Key=registry_key)
+    except ClientError as e:
+        logger.info(f"Job {bops_job_id} is not in the job registry: {e}")
+        return None
+    return json.loads(get_response.get('Body').read().decode('utf-8'))
 
 
 def lambda_handler(event, context):
@@ -136,15 +270,27 @@ def lambda_handler(event, context):
         logger.info(f"S3 Key is: {s3Key}")
         retrieve_job_id = s3Key.split('/')[-2]
         job_id = retrieve_job_id.replace('job-', '', 1)
+        # DescribeJob gives the status and task counts, the registry the rest without more control plane calls
         my_job_details = s3_batch_describe_job(job_id)
         logger.info(f"Batch Operation Job details: {my_job_details}")
-        job_operation = list(my_job_details.get('Operation').keys())[0]
+        job_registration = get_job_registration(s3Bucket, job_id)
+        if job_registration:
+            job_operation = job_registration.get('operation')
+            job_tier = job_registration.get('restore_tier')
+            number_of_fields = job_registration.get('num_manifest_fields')
+            job_tag_key = job_registration.get('tag_key')
+            job_tag_value = job_registration.get('restore_job_id')
+        else:
+            job_operation = list(my_job_details.get('Operation').keys())[0]
+            job_tier = my_job_details.get('Operation').get(job_operation).get('GlacierJobTier')
+            # The object size column of generated manifests is an Ignore field
+            number_of_fields = str(len([field for field in my_job_details.get('Manifest').get('Spec').get('Fields') if field != 'Ignore']))
+            job_tag_key, job_tag_value = get_job_tagging(job_id)
         job_status = my_job_details.get('Status')
         job_arn = my_job_details.get('JobArn')
         job_creation_datetime = str(my_job_details.get('CreationTime'))
         job_completion_datetime = str(my_job_details.get('TerminationDate'))
         number_of_tasks = my_job_details.get('ProgressSummary').get('TotalNumberOfTasks')
-        number_of_fields = str(len(my_job_details.get('Manifest').get('Spec').get('Fields')))
         tasks_succeeded = my_job_details.get('ProgressSummary').get('NumberOfTasksSucceeded')
         tasks_failed = my_job_details.get('ProgressSummary').get('NumberOfTasksFailed')
         logger.info(f'Number of Tasks: {number_of_tasks}')
@@ -163,15 +309,28 @@ def lambda_handler(event, context):
                 set_copy_job_status = 'NotStarted'
         job_details = str(my_job_details)
         # Only work on Tagged Jobs
-        job_tag_key, job_tag_value = get_job_tagging(job_id)
+        if job_tag_key in job_tag_keys:
+            emit_job_metrics(my_job_details, job_operation, job_tier, job_status)
         # Workflow for a Restore Job Creates an Entry in DynamoDB, Copy Job Updates existing Table ########
         if job_operation == 'S3InitiateRestoreObject':
-            job_tier = my_job_details.get('Operation').get('S3InitiateRestoreObject').get('GlacierJobTier')
             logger.info(f"Restore Job Tier is: {job_tier}")
+            # Add the tier delay to the restore job completion, to allow Glacier Restore Completion
+            if job_tier == 'STANDARD':
+                offset_hours = standard_restore_copy_job_delay
+            elif job_tier == 'BULK':
+                offset_hours = bulk_restore_copy_job_delay
+            copy_ready_time = int((my_job_details.get('TerminationDate') + datetime.timedelta(hours=offset_hours)).timestamp())
+            logger.info(f"Scheduled time for Copy Job Start: {datetime.datetime.utcfromtimestamp(copy_ready_time)}")
+            restore_tracking_key = None
+            restore_tracked_objects = None
             # Starting Condition
             if job_tag_key == 'auto-restore-copy' and job_status == 'Complete':
                 my_sns_message = f'Restore Job {job_id} Completed: {tasks_failed} failed out of {number_of_tasks}. Please check the Batch Operations Job JobID {job_id} in the Amazon S3 Console for more details.'
                 send_sns_message(my_sns_topic_arn, my_sns_message)
+                # The copy starts as the objects are restored, copy_ready_time remains the fallback
+                if my_copy_start_trigger != 'RetrievalDelay' and set_copy_job_status == 'NotStarted':
+                    restore_tracking_key, restore_tracked_objects = write_restore_tracking(
+                        s3Bucket, s3Key, job_id, number_of_fields)
                 create_ddb_entry(
                     job_id,
                     job_status,
@@ -187,22 +346,34 @@ def lambda_handler(event, context):
                     s3Key,
                     job_details,
                     number_of_fields,
-                    set_copy_job_status
+                    set_copy_job_status,
+                    copy_ready_time,
+                    restore_tracking_key,
+                    restore_tracked_objects
                 )
 
             elif job_tag_key == 'auto-restore-copy' and job_status == 'Failed':
                 my_sns_message = f'Restore Job {job_id} failed, please check the Batch Operations Job JobID {job_id} in the Amazon S3 Console for more details!'
                 send_sns_message(my_sns_topic_arn, my_sns_message)
 
-        elif job_operation == 'LambdaInvoke':
+        elif job_operation in ['LambdaInvoke', 'S3PutObjectCopy']:
             if job_tag_key == 'auto-restore-copy' and job_status == 'Complete':
                 logger.info("Updating the Database with Copy Job information!")
                 my_sns_message = f'Copy Job {job_id} Completed: {tasks_failed} failed out of {number_of_tasks}. Please check the Batch Operations Job JobID {job_id} in the Amazon S3 Console for more details.'
                 send_sns_message(my_sns_topic_arn, my_sns_message)
                 ddb_update_item(job_tag_value, 'Complete', 'Complete', number_of_tasks, tasks_failed, tasks_succeeded,
-                                job_details, my_item_expiration)
+                                job_details, my_item_expiration, job_id)
 
-            elif job_tag_key == 'auto-restore-copy' and job_status == 'Failed':
+            elif job_tag_key == 'auto-restore-copy-batch' and job_status == 'Complete':
+                logger.info("Adding the Copy Batch results to the Restore Job!")
+                ddb_add_copy_batch(job_tag_value, 'Complete', number_of_tasks, tasks_failed, tasks_succeeded,
+                                   my_item_expiration)
+                # Copy batches are frequent, only notify about the ones with failed tasks
+                if tasks_failed:
+                    my_sns_message = f'Copy Batch {job_id} Completed: {tasks_failed} failed out of {number_of_tasks}. Please check the Batch Operations Job JobID {job_id} in the Amazon S3 Console for more details.'
+                    send_sns_message(my_sns_topic_arn, my_sns_message)
+
+            elif job_tag_key in ['auto-restore-copy', 'auto-restore-copy-batch'] and job_status == 'Failed':
                 my_sns_message = f'Copy Job {job_id} failed, please check the Batch Operations Job JobID {job_id} in the Amazon S3 Console for more details!'
                 send_sns_message(my_sns_topic_arn, my_sns_message)
 
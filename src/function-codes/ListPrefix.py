@@ -1,10 +1,9 @@
 import math
 import json
-import os
 import uuid
-import boto3
 from botocore.exceptions import ClientError
 import logging
+from Runtime import get_client
 
 
 # Set up logging
@@ -12,17 +11,26 @@ logger = logging.getLogger(__name__)
 logger.setLevel('INFO')
 
 
-# Define Environmental Variables
-my_region = str(os.environ['AWS_REGION'])
+# Sort key to submit single pass UNLOAD chunks in chunk_id order
+def chunk_sort_key(key):
+    if '/chunk_id=' in key:
+        return 0, int(key.split('/chunk_id=')[-1].split('/')[0]), key
+    return 1, 0, key
 
 
-# Set Service Client
-s3 = boto3.resource('s3', region_name=my_region)
+# Single pass UNLOAD and the embedded engine write each chunk under chunk_rows=R/chunk_bytes=B/,
+# OffsetLimit chunks carry neither
+def chunk_partition_value(key, partition_name):
+    if f'/{partition_name}=' in key:
+        return int(key.split(f'/{partition_name}=')[-1].split('/')[0])
+    return None
 
 
 def lambda_handler(event, context):
     logger.info(f'Event detail is: {event}')
     csv_files = []
+    csv_file_rows = []
+    csv_file_bytes = []
     item_count = 0
     num_count = 0
     item_loop_status = 'NotStarted'
@@ -31,26 +39,38 @@ def lambda_handler(event, context):
     jobgroupid = str(event.get('jobgroupid'))
     my_csv_num_rows = str(event.get('my_csv_num_rows'))
 
-    # Instatiate Service API Parameters
-    mybucket = s3.Bucket(bucketname)
-
     #### Initiate List Objects ####
     try:
-        all_objs = mybucket.objects.filter(Prefix=prefix)
-        obj_keys = [obj.key for obj in all_objs if obj.key.endswith('.csv')]
+        obj_keys = []
+        list_kwargs = {'Bucket': bucketname, 'Prefix': prefix}
+        while True:
+            list_response = get_client('s3').list_objects_v2(**list_kwargs)
+            # Athena SELECT results end with .csv, single pass UNLOAD chunks are written without extension under chunk_id=N/
+            obj_keys.extend(obj['Key'] for obj in list_response.get('Contents', [])
+                            if obj['Key'].endswith('.csv') or '/chunk_id=' in obj['Key'])
+            if not list_response.get('IsTruncated'):
+                break
+            list_kwargs['ContinuationToken'] = list_response['NextContinuationToken']
     except ClientError as e:
         logger.error(e)
         raise
     else:
-        csv_files = obj_keys
+        csv_files = sorted(obj_keys, key=chunk_sort_key)
+        csv_file_rows = [chunk_partition_value(key, 'chunk_rows') for key in csv_files]
+        csv_file_bytes = [chunk_partition_value(key, 'chunk_bytes') for key in csv_files]
         item_count = len(csv_files)
         logger.info(f'item_count is: {item_count}')
+        logger.info(f'Chunk sizes in bytes are: {csv_file_bytes}')
     #### Start variables ###
     # Return Values
     return {
         'item_count': item_count,
         'item_loop_status': item_loop_status,
         'csv_files': csv_files,
+        'csv_file_rows': csv_file_rows,
+        'csv_file_bytes': csv_file_bytes,
+        'restore_job_ids': [None] * item_count,
+        'restore_submit_attempts': [0] * item_count,
         'num_count': num_count,
         'bucketname': bucketname,
         'jobgroupid': jobgroupid,
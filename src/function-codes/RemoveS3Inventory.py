@@ -1,9 +1,8 @@
 import json
-import boto3
-import os
 import cfnresponse
 import logging
 from botocore.exceptions import ClientError
+from Runtime import env_str, get_client
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -13,20 +12,14 @@ SUCCESS = "SUCCESS"
 FAILED = "FAILED"
 
 ### Define Environmental Variables ###
-# Define Region
-my_region = str(os.environ['AWS_REGION'])
-my_config_id = str(os.environ['inv_config_id'])
-
-# Create Service Client
-s3 = boto3.resource('s3', region_name=my_region)
-s3client = boto3.client('s3', region_name=my_region)
+my_config_id = env_str('inv_config_id')
 
 
 # Remove S3 Inventory Configuration #
 def del_inventory_configuration(src_bucket, config_id):
     try:
         logger.info(f"Starting the process to remove the S3 Inventory configuration {config_id}")
-        response = s3client.delete_bucket_inventory_configuration(
+        response = get_client('s3').delete_bucket_inventory_configuration(
             Bucket=src_bucket,
             Id=config_id,
         )
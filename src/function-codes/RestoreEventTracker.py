@@ -0,0 +1,526 @@
+import array
+import bisect
+import csv
+import datetime
+import hashlib
+import io
+import json
+import logging
+import time
+import uuid
+from urllib import parse
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from Runtime import env_int, env_str, get_client, get_table
+
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+
+# Define Environmental Variables
+my_s3_bucket = env_str('s3_bucket')
+copy_ready_index = env_str('copy_ready_index')
+my_job_ddb = env_str('job_ddb')
+job_scheduler_function = env_str('job_scheduler_function')
+my_max_receive_count = env_int('max_event_receive_count')
+my_copy_start_trigger = env_str('copy_start_trigger')
+my_archive_bucket = env_str('archive_bucket')
+accountId = env_str('my_account_id')
+my_role_arn = env_str('batch_ops_role')
+bops_invoke_function_arn = env_str('batch_ops_invoke_lambda')
+report_prefix = env_str('batch_ops_copy_report_prefix')
+my_copy_batch_prefix = env_str('copy_batch_prefix')
+my_copy_batch_max_keys = env_int('copy_batch_max_keys')
+my_copy_batch_max_wait = env_int('copy_batch_max_wait_minutes') * 60
+my_job_registry_prefix = env_str('job_registry_prefix')
+
+# Other Variables
+# Restore jobs waiting for their copy, JobTracker sets copy_ready_time to the retrieval delay fallback
+restore_pending_copy_status = 'NotStarted'
+# Set once every object of the restore job has been copied by a copy batch
+copied_in_batches_status = 'CopiedInBatches'
+job_scheduler_invocation_type = 'Event'
+# Restored objects are recorded by their position in the tracking file, in number sets of this many positions per item
+# so an item stays a few KB. The sort key prefix keeps these items apart from the job items
+restored_positions_per_item = 1000
+restored_positions_status = 'RestoredPositions'
+restored_positions_expiration_days = 60
+
+# Copy Batch Job Details ############################
+job_manifest_format = 'S3BatchOperations_CSV_20180820'
+report_format = 'Report_CSV_20180820'
+report_scope = 'AllTasks'
+report_bucket_arn = 'arn:aws:s3:::' + my_s3_bucket
+# JobTracker adds the copy batch results to the restore job named by this tag
+copy_batch_tag_key = 'auto-restore-copy-batch'
+# Restored objects wait in fragments under this folder of their restore job until their copy batch is due
+copy_batch_pending_folder = 'pending/'
+# Only the run holding the copy batch lock of a restore job submits its batch, a lock older than the longest
+# function run is left by a failed run and taken over
+copy_batch_lock_seconds = 900
+delete_objects_max_keys = 1000
+
+
+# Sorted object hashes of each tracked restore job, kept while the container is warm
+restore_job_members = {}
+
+
+# JobTracker hashes the restore report rows the same way, the version id is only used for All versions manifests
+def object_hash(bucket, key, version_id=None):
+    object_id = f'{bucket}/{parse.unquote_plus(key)}'
+    if version_id:
+        object_id = f'{object_id}?versionId={version_id}'
+    return int.from_bytes(hashlib.blake2b(object_id.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+############# Restore Jobs Pending Copy #############
+
+def query_restores_pending_copy():
+    ddb_items = []
+    query_kwargs = {
+        'IndexName': copy_ready_index,
+        'KeyConditionExpression': Key('copy_job_status').eq(restore_pending_copy_status),
+    }
+    try:
+        while True:
+            response = get_table(my_job_ddb).query(**query_kwargs)
+            ddb_items.extend([item for item in response.get('Items', []) if item.get('restore_tracking_key')])
+            if not response.get('LastEvaluatedKey'):
+                break
+            query_kwargs['ExclusiveStartKey'] = response.get('LastEvaluatedKey')
+    except ClientError as e:
+        logger.error(e)
+        raise
+    return ddb_items
+
+
+def get_restore_job_members(tracking_key):
+    if tracking_key not in restore_job_members:
+        logger.info(f'Loading restore tracking file {tracking_key}')
+        try:
+            get_response = get_client('s3').get_object(Bucket=my_s3_bucket, Key=tracking_key)
+        except ClientError as e:
+            logger.error(e)
+            raise
+        members = array.array('Q')
+        members.frombytes(get_response['Body'].read())
+        restore_job_members[tracking_key] = members
+    return restore_job_members[tracking_key]
+
+
+# Position of the object in the sorted tracking file, None when the restore job did not initiate it
+def member_position(members, member_hash):
+    position = bisect.bisect_left(members, member_hash)
+    if position < len(members) and members[position] == member_hash:
+        return position
+    return None
+
+
+############# Copy Readiness #############
+
+# Record the restored positions, returns the positions no earlier event recorded. Restore completed events are
+# delivered at least once, the number set makes a repeated event a no-op
+def add_restored_positions(restore_job, restored_positions):
+    item_expiration = int((datetime.datetime.now() + datetime.timedelta(restored_positions_expiration_days)).timestamp())
+    items = {}
+    for position in restored_positions:
+        items.setdefault(position // restored_positions_per_item, set()).add(position)
+    new_positions = set()
+    for item_number, positions in items.items():
+        update_response = get_table(my_job_ddb).update_item(
+            Key={
+                'restore_job_id': restore_job.get('restore_job_id'),
+                'restore_job_status': f'{restored_positions_status}#{item_number}'
+            },
+            UpdateExpression='ADD restored_positions :val1 SET item_expiration = :val2',
+            ExpressionAttributeValues={
+                ':val1': positions,
+                ':val2': item_expiration
+            },
+            ReturnValues="UPDATED_OLD"
+        )
+        recorded_positions = {int(position) for position in
+                              update_response.get('Attributes', {}).get('restored_positions', set())}
+        new_positions.update(positions - recorded_positions)
+    return new_positions
+
+
+# Count the distinct restored objects. With a batch_time the new objects also join the pending copy batch, which opens
+# with its first object. Returns the restore job item as updated, None when it failed, and the new positions
+def add_restored_objects(restore_job, restored_positions, batch_time=None):
+    try:
+        new_positions = add_restored_positions(restore_job, restored_positions)
+        update_expression = 'ADD restored_objects :val1'
+        expression_values = {':val1': len(new_positions)}
+        if batch_time is not None:
+            update_expression = 'ADD restored_objects :val1, copy_batch_pending_objects :val1'
+            if new_positions:
+                update_expression += ' SET copy_batch_opened = if_not_exists(copy_batch_opened, :val2)'
+                expression_values[':val2'] = batch_time
+        update_response = get_table(my_job_ddb).update_item(
+            Key={
+                'restore_job_id': restore_job.get('restore_job_id'),
+                'restore_job_status': restore_job.get('restore_job_status')
+            },
+            UpdateExpression=update_expression,
+            ConditionExpression='attribute_exists(restore_job_id)',
+            ExpressionAttributeValues=expression_values,
+            ReturnValues="ALL_NEW"
+        )
+    except ClientError as e:
+        logger.error(e)
+        return None, set()
+    attributes = update_response.get('Attributes')
+    logger.info(f"Restore Job {restore_job.get('restore_job_id')}: {attributes.get('restored_objects')} "
+                f"of {attributes.get('restore_tracked_objects')} objects restored")
+    return attributes, new_positions
+
+
+# True once every object the restore job initiated is restored
+def all_objects_restored(attributes):
+    return attributes.get('restored_objects') >= attributes.get('restore_tracked_objects')
+
+
+# Bring copy_ready_time forward to now, the condition skips jobs already due or already copied
+def mark_copy_ready(restore_job, ready_time):
+    try:
+        get_table(my_job_ddb).update_item(
+            Key={
+                'restore_job_id': restore_job.get('restore_job_id'),
+                'restore_job_status': restore_job.get('restore_job_status')
+            },
+            UpdateExpression='SET copy_ready_time = :val1',
+            ConditionExpression='copy_ready_time > :val1',
+            ExpressionAttributeValues={
+                ':val1': ready_time
+            },
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            logger.info(f"Restore Job {restore_job.get('restore_job_id')} is already due or copied")
+            return False
+        logger.error(e)
+        raise
+    logger.info(f"All objects of Restore Job {restore_job.get('restore_job_id')} are restored, the copy can start now")
+    return True
+
+
+############# Copy Batches #############
+
+# Record the job as it is submitted, JobTracker reads it instead of the job description and tags
+def register_job(job_id, job_registration):
+    registry_key = f'{my_job_registry_prefix}{job_id}.json'
+    try:
+        get_client('s3').put_object(Bucket=my_s3_bucket, Key=registry_key, Body=json.dumps(job_registration),
+                                    ContentType='application/json')
+    except ClientError as e:
+        logger.error(e)
+
+
+def manifest_fields(restore_job):
+    if str(restore_job.get('num_manifest_fields')) == '3':
+        return ['Bucket', 'Key', 'VersionId']
+    return ['Bucket', 'Key']
+
+
+# The restored objects as Bucket,Key[,VersionId] manifest rows
+def manifest_rows(restore_job, restored_keys):
+    manifest_body = io.StringIO()
+    manifest_writer = csv.writer(manifest_body, lineterminator='\n')
+    for bucket, key, version_id in restored_keys:
+        manifest_row = [bucket, parse.quote(parse.unquote_plus(key))]
+        if len(manifest_fields(restore_job)) == 3:
+            manifest_row.append(version_id or '')
+        manifest_writer.writerow(manifest_row)
+    return manifest_body.getvalue()
+
+
+# Write the manifest of a copy batch and copy its objects with the BatchCopy function
+def submit_copy_batch(restore_job, manifest_body, batch_objects, batch_token):
+    restore_job_id = restore_job.get('restore_job_id')
+    manifest_key = f'{my_copy_batch_prefix}{restore_job_id}/{batch_token}.csv'
+    my_job_description = f"Lambda Invoke Copy Batch by AutoRestoreMigrate Solution for S3Bucket: {my_archive_bucket}"
+
+    try:
+        put_response = get_client('s3').put_object(Bucket=my_s3_bucket, Key=manifest_key, Body=manifest_body)
+        response = get_client('s3control').create_job(
+            AccountId=accountId,
+            ConfirmationRequired=False,
+            Operation={
+                'LambdaInvoke': {
+                    'FunctionArn': bops_invoke_function_arn
+                }
+            },
+            Report={
+                'Bucket': report_bucket_arn,
+                'Format': report_format,
+                'Enabled': True,
+                'Prefix': report_prefix,
+                'ReportScope': report_scope
+            },
+            Manifest={
+                'Spec': {
+                    'Format': job_manifest_format,
+                    'Fields': manifest_fields(restore_job)
+                },
+                'Location': {
+                    'ObjectArn': f'arn:aws:s3:::{my_s3_bucket}/{manifest_key}',
+                    'ETag': put_response['ETag']
+                }
+            },
+            Priority=10,
+            RoleArn=my_role_arn,
+            # A retried submission of the same pending fragments returns the copy batch already created
+            ClientRequestToken=batch_token,
+            Description=my_job_description,
+            Tags=[
+                {
+                    'Key': copy_batch_tag_key,
+                    'Value': restore_job_id
+                },
+            ]
+        )
+    except ClientError as e:
+        logger.error(e)
+        raise
+    logger.info(f"Copy Batch JobID {response.get('JobId')} copies {batch_objects} objects of Restore Job {restore_job_id}")
+    register_job(response.get('JobId'), {
+        'job_id': response.get('JobId'),
+        'job_group': None,
+        'operation': 'LambdaInvoke',
+        'restore_tier': None,
+        'num_manifest_fields': str(len(manifest_fields(restore_job))),
+        'restore_job_id': restore_job_id,
+        'tag_key': copy_batch_tag_key,
+        'manifest_bucket': my_s3_bucket,
+        'manifest_key': manifest_key,
+    })
+    return response.get('JobId')
+
+
+def pending_prefix(restore_job):
+    return f"{my_copy_batch_prefix}{restore_job.get('restore_job_id')}/{copy_batch_pending_folder}"
+
+
+# Keep the restored objects until their copy batch is due. The fragment is written before the objects are recorded as
+# restored, so a failed run can copy an object twice but never leaves it out
+def write_pending_fragment(restore_job, restored_keys):
+    fragment_key = f'{pending_prefix(restore_job)}{uuid.uuid4()}.csv'
+    get_client('s3').put_object(Bucket=my_s3_bucket, Key=fragment_key, Body=manifest_rows(restore_job, restored_keys))
+    return fragment_key
+
+
+# Keep only the objects no earlier event recorded, the others are already in a pending or submitted copy batch
+def trim_pending_fragment(restore_job, fragment_key, restored_keys):
+    if restored_keys:
+        get_client('s3').put_object(Bucket=my_s3_bucket, Key=fragment_key,
+                                    Body=manifest_rows(restore_job, restored_keys))
+    else:
+        get_client('s3').delete_objects(Bucket=my_s3_bucket, Delete={'Objects': [{'Key': fragment_key}], 'Quiet': True})
+
+
+# A copy batch is due once it holds CopyBatchMaxKeys objects or its first object has waited CopyBatchMaxWaitMinutes
+def copy_batch_due(attributes, batch_time):
+    if int(attributes.get('copy_batch_pending_objects', 0)) >= my_copy_batch_max_keys:
+        return True
+    return 'copy_batch_opened' in attributes and batch_time - int(attributes.get('copy_batch_opened')) >= my_copy_batch_max_wait
+
+
+def lock_copy_batch(restore_job, batch_time):
+    try:
+        get_table(my_job_ddb).update_item(
+            Key={
+                'restore_job_id': restore_job.get('restore_job_id'),
+                'restore_job_status': restore_job.get('restore_job_status')
+            },
+            UpdateExpression='SET copy_batch_locked = :val1',
+            ConditionExpression='attribute_not_exists(copy_batch_locked) OR copy_batch_locked < :val2',
+            ExpressionAttributeValues={
+                ':val1': batch_time,
+                ':val2': batch_time - copy_batch_lock_seconds
+            },
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            logger.info(f"Copy batch of Restore Job {restore_job.get('restore_job_id')} is being submitted by another run")
+            return False
+        logger.error(e)
+        raise
+    return True
+
+
+# Release the lock, the submitted objects leave the pending count and the next object opens a new copy batch
+def unlock_copy_batch(restore_job, submitted_objects):
+    update_expression = 'REMOVE copy_batch_locked'
+    expression_values = {}
+    if submitted_objects:
+        update_expression = 'REMOVE copy_batch_locked, copy_batch_opened ADD copy_batch_pending_objects :val1'
+        expression_values[':val1'] = -submitted_objects
+    update_kwargs = {
+        'Key': {
+            'restore_job_id': restore_job.get('restore_job_id'),
+            'restore_job_status': restore_job.get('restore_job_status')
+        },
+        'UpdateExpression': update_expression,
+    }
+    if expression_values:
+        update_kwargs['ExpressionAttributeValues'] = expression_values
+    try:
+        get_table(my_job_ddb).update_item(**update_kwargs)
+    except ClientError as e:
+        logger.error(e)
+
+
+# Submit every pending fragment of the restore job as one copy batch, returns the number of objects submitted. The
+# batch token names the fragments, so a run that failed before deleting them returns the copy batch already created
+def flush_copy_batch(restore_job):
+    fragment_keys = []
+    list_kwargs = {'Bucket': my_s3_bucket, 'Prefix': pending_prefix(restore_job)}
+    while True:
+        list_response = get_client('s3').list_objects_v2(**list_kwargs)
+        fragment_keys.extend(s3_object['Key'] for s3_object in list_response.get('Contents', []))
+        if not list_response.get('IsTruncated'):
+            break
+        list_kwargs['ContinuationToken'] = list_response.get('NextContinuationToken')
+    manifest_lines = {}
+    for fragment_key in fragment_keys:
+        get_response = get_client('s3').get_object(Bucket=my_s3_bucket, Key=fragment_key)
+        manifest_lines.update(dict.fromkeys(get_response['Body'].read().decode('utf-8').splitlines()))
+    if manifest_lines:
+        batch_token = str(uuid.uuid5(uuid.NAMESPACE_URL, ','.join(fragment_keys)))
+        submit_copy_batch(restore_job, ''.join(f'{line}\n' for line in manifest_lines), len(manifest_lines),
+                          batch_token)
+    for first in range(0, len(fragment_keys), delete_objects_max_keys):
+        get_client('s3').delete_objects(Bucket=my_s3_bucket, Delete={
+            'Objects': [{'Key': fragment_key} for fragment_key in fragment_keys[first:first + delete_objects_max_keys]],
+            'Quiet': True})
+    return len(manifest_lines)
+
+
+# Add the restored objects, by tracking file position, to the pending copy batch of the restore job and submit the
+# batch once it is due or the whole restore job is restored. Returns False when the events must be retried
+def add_to_copy_batch(restore_job, restored_objects, batch_time):
+    restore_job_id = restore_job.get('restore_job_id')
+    fragment_key = write_pending_fragment(restore_job, restored_objects.values())
+    attributes, new_positions = add_restored_objects(restore_job, set(restored_objects), batch_time)
+    if attributes is None:
+        return False
+    if len(new_positions) < len(restored_objects):
+        logger.info(f'{len(restored_objects) - len(new_positions)} objects of Restore Job {restore_job_id} were already recorded')
+        trim_pending_fragment(restore_job, fragment_key, [restored_objects[position] for position in sorted(new_positions)])
+    restore_complete = all_objects_restored(attributes)
+    if not restore_complete and not copy_batch_due(attributes, batch_time):
+        return True
+    if not lock_copy_batch(restore_job, batch_time):
+        # The run holding the lock may have listed the fragments before this one, retry the last events of the restore
+        # job so its final copy batch is submitted
+        return not restore_complete
+    submitted_objects = 0
+    try:
+        submitted_objects = flush_copy_batch(restore_job)
+    finally:
+        unlock_copy_batch(restore_job, submitted_objects)
+    if restore_complete:
+        mark_copied_in_batches(restore_job)
+    return True
+
+
+# Every object of the restore job is copied, drop it from the copy ready index so the fallback copy never runs
+def mark_copied_in_batches(restore_job):
+    try:
+        get_table(my_job_ddb).update_item(
+            Key={
+                'restore_job_id': restore_job.get('restore_job_id'),
+                'restore_job_status': restore_job.get('restore_job_status')
+            },
+            UpdateExpression='SET copy_job_status = :val1 REMOVE copy_ready_time',
+            ConditionExpression='copy_job_status = :val2',
+            ExpressionAttributeValues={
+                ':val1': copied_in_batches_status,
+                ':val2': restore_pending_copy_status
+            },
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            logger.info(f"Restore Job {restore_job.get('restore_job_id')} copy has already started")
+            return
+        logger.error(e)
+        raise
+    logger.info(f"All objects of Restore Job {restore_job.get('restore_job_id')} are copied in batches")
+
+
+def invoke_job_scheduler():
+    try:
+        get_client('lambda').invoke(
+            FunctionName=job_scheduler_function,
+            InvocationType=job_scheduler_invocation_type,
+            Payload=json.dumps({'source': 'restore-completed-events'}),
+        )
+    except ClientError as e:
+        # The scheduled JobScheduler run still picks the copy up
+        logger.error(e)
+
+
+def lambda_handler(event, context):
+    records = event.get('Records', [])
+    logger.info(f'Received {len(records)} restore completed events')
+    pending_restore_jobs = query_restores_pending_copy()
+    # Release the tracking files of restore jobs that are no longer waiting
+    for tracking_key in set(restore_job_members) - {job.get('restore_tracking_key') for job in pending_restore_jobs}:
+        restore_job_members.pop(tracking_key)
+
+    restored_objects = {}
+    restored_messages = {}
+    batch_item_failures = []
+    for record in records:
+        detail = json.loads(record['body']).get('detail', {})
+        bucket = detail.get('bucket', {}).get('name')
+        s3_object = detail.get('object', {})
+        restore_job_id = None
+        for restore_job in pending_restore_jobs:
+            version_id = s3_object.get('version-id') if str(restore_job.get('num_manifest_fields')) == '3' else None
+            position = member_position(get_restore_job_members(restore_job.get('restore_tracking_key')),
+                                       object_hash(bucket, s3_object.get('key'), version_id))
+            if position is not None:
+                restore_job_id = restore_job.get('restore_job_id')
+                break
+        if restore_job_id:
+            restored_objects.setdefault(restore_job_id, {})[position] = (bucket, s3_object.get('key'),
+                                                                         s3_object.get('version-id'))
+            restored_messages.setdefault(restore_job_id, []).append(record.get('messageId'))
+        # JobTracker may not have recorded the restore job yet, retry the event until it has
+        elif int(record.get('attributes', {}).get('ApproximateReceiveCount', 1)) < my_max_receive_count:
+            batch_item_failures.append({'itemIdentifier': record.get('messageId')})
+        else:
+            logger.info(f"{bucket}/{s3_object.get('key')} does not belong to a restore job waiting for its copy")
+
+    copy_jobs_ready = 0
+    ready_time = int(time.time())
+    for restore_job in pending_restore_jobs:
+        restore_job_id = restore_job.get('restore_job_id')
+        if not restored_objects.get(restore_job_id):
+            continue
+        if my_copy_start_trigger == 'RestoreCompletedBatches':
+            try:
+                events_handled = add_to_copy_batch(restore_job, restored_objects.get(restore_job_id), ready_time)
+            except ClientError as e:
+                logger.error(e)
+                events_handled = False
+            if not events_handled:
+                batch_item_failures.extend(
+                    [{'itemIdentifier': message_id} for message_id in restored_messages.get(restore_job_id)])
+            continue
+        attributes, _ = add_restored_objects(restore_job, set(restored_objects.get(restore_job_id)))
+        if attributes and all_objects_restored(attributes):
+            copy_jobs_ready += mark_copy_ready(restore_job, ready_time)
+
+    logger.info(f'{sum(len(objects) for objects in restored_objects.values())} events matched, {len(batch_item_failures)} retried, '
+                f'{copy_jobs_ready} copy jobs ready at {datetime.datetime.utcfromtimestamp(ready_time)}')
+    if copy_jobs_ready:
+        invoke_job_scheduler()
+
+    return {
+        'batchItemFailures': batch_item_failures
+    }
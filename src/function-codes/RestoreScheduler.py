@@ -0,0 +1,179 @@
+import datetime
+import time
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+import logging
+from Runtime import env_int, env_str, get_client, get_table
+
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+
+# Define Environmental Variables
+accountId = env_str('my_account_id')
+my_s3_bucket = env_str('s3_bucket')
+my_csv_max_rows = env_int('csv_max_rows')
+my_restore_objects_per_hour = env_int('restore_objects_per_hour')
+my_restore_bytes_per_hour = env_int('restore_gib_per_hour') * 1024 ** 3
+my_max_active_restore_jobs = env_int('max_active_restore_jobs')
+my_restore_windows = env_str('restore_windows')
+my_capacity_poll_seconds = env_int('capacity_poll_seconds')
+my_max_manifests_per_submission = env_int('max_manifests_per_submission')
+copy_ready_index = env_str('copy_ready_index')
+my_job_ddb = env_str('job_ddb')
+
+# Other Variables
+# RestoreWorker2 sets this description on every restore job it creates
+restore_job_description = f"Restore Job by AutoRestoreMigrate Solution for S3Bucket: {my_s3_bucket}"
+restore_job_active_statuses = ['New', 'Preparing', 'Suspended', 'Ready', 'Active', 'Pausing', 'Paused', 'Completing']
+# Restore jobs whose objects are still being restored, JobTracker marks the copy NotStarted until JobScheduler copies them
+restore_pending_copy_status = 'NotStarted'
+
+
+############# Submission Windows #############
+
+# Windows are UTC HH:MM-HH:MM ranges separated by commas, a range may wrap past midnight, e.g. 22:00-06:00
+def parse_restore_windows(restore_windows):
+    windows = []
+    for window in restore_windows.split(','):
+        if not window.strip():
+            continue
+        window_start, window_end = window.strip().split('-')
+        start_hour, start_minute = window_start.split(':')
+        end_hour, end_minute = window_end.split(':')
+        window_start, window_end = int(start_hour) * 60 + int(start_minute), int(end_hour) * 60 + int(end_minute)
+        # An empty window would never open, and a window of the whole day is the same as no window
+        if window_start == window_end:
+            raise ValueError(f'Restore submission window {window.strip()} starts and ends at the same time')
+        windows.append((window_start, window_end))
+    return windows
+
+
+# Seconds until the next allowed window opens, 0 when now is inside a window or no windows are set
+def seconds_until_window(windows, now):
+    if not windows:
+        return 0
+    minute_of_day = now.hour * 60 + now.minute
+    minutes_until_open = []
+    for window_start, window_end in windows:
+        if window_start <= window_end:
+            in_window = window_start <= minute_of_day < window_end
+        else:
+            in_window = minute_of_day >= window_start or minute_of_day < window_end
+        if in_window:
+            return 0
+        minutes_until_open.append((window_start - minute_of_day) % (24 * 60))
+    return min(minutes_until_open) * 60 - now.second
+
+
+############# Restore Budget #############
+
+# Pace submissions so the last submission's objects and bytes are spread over the hourly budget
+def seconds_until_budget(last_submit_time, last_submit_manifests, last_submit_rows, last_submit_bytes, now_timestamp):
+    if not last_submit_time:
+        return 0
+    budget_seconds = 0
+    if my_restore_objects_per_hour > 0:
+        rows = last_submit_rows if last_submit_rows is not None else my_csv_max_rows * (last_submit_manifests or 1)
+        budget_seconds = max(budget_seconds, rows * 3600 / my_restore_objects_per_hour)
+    if my_restore_bytes_per_hour > 0 and last_submit_bytes is not None:
+        budget_seconds = max(budget_seconds, last_submit_bytes * 3600 / my_restore_bytes_per_hour)
+    return max(0, int(last_submit_time + budget_seconds - now_timestamp))
+
+
+# Manifests to submit together: pending ones in order, up to one hour of the rate budgets, always at least one
+def manifests_within_budget(event, submit_limit):
+    csv_file_rows = event.get('csv_file_rows')
+    csv_file_bytes = event.get('csv_file_bytes')
+    pending_items = [item for item, job_id in enumerate(event.get('restore_job_ids')) if job_id is None]
+    submit_count = 0
+    batch_rows = 0
+    batch_bytes = 0
+    for item in pending_items[:submit_limit]:
+        batch_rows += csv_file_rows[item] if csv_file_rows[item] is not None else my_csv_max_rows
+        batch_bytes += csv_file_bytes[item] or 0
+        over_budget = ((my_restore_objects_per_hour > 0 and batch_rows > my_restore_objects_per_hour) or
+                       (my_restore_bytes_per_hour > 0 and batch_bytes > my_restore_bytes_per_hour))
+        if submit_count and over_budget:
+            break
+        submit_count += 1
+    return submit_count
+
+
+def count_running_restore_jobs():
+    running_jobs = 0
+    list_jobs_kwargs = {
+        'AccountId': accountId,
+        'JobStatuses': restore_job_active_statuses,
+        'MaxResults': 1000,
+    }
+    try:
+        while True:
+            list_response = get_client('s3control').list_jobs(**list_jobs_kwargs)
+            for job in list_response.get('Jobs', []):
+                if job.get('Operation') == 'S3InitiateRestoreObject' and job.get('Description') == restore_job_description:
+                    running_jobs += 1
+            if not list_response.get('NextToken'):
+                break
+            list_jobs_kwargs['NextToken'] = list_response.get('NextToken')
+    except ClientError as e:
+        logger.error(e)
+        raise
+    return running_jobs
+
+
+def count_restores_pending_copy():
+    pending_jobs = 0
+    query_kwargs = {
+        'IndexName': copy_ready_index,
+        'KeyConditionExpression': Key('copy_job_status').eq(restore_pending_copy_status),
+        'Select': 'COUNT',
+    }
+    try:
+        while True:
+            response = get_table(my_job_ddb).query(**query_kwargs)
+            pending_jobs += response.get('Count', 0)
+            if not response.get('LastEvaluatedKey'):
+                break
+            query_kwargs['ExclusiveStartKey'] = response.get('LastEvaluatedKey')
+    except ClientError as e:
+        logger.error(e)
+        raise
+    return pending_jobs
+
+
+def lambda_handler(event, context):
+    logger.info(f'Event details are: {event}')
+    now_timestamp = time.time()
+    now = datetime.datetime.utcfromtimestamp(now_timestamp)
+
+    window_wait = seconds_until_window(parse_restore_windows(my_restore_windows), now)
+    budget_wait = seconds_until_budget(event.get('last_submit_time'), event.get('last_submit_manifests'),
+                                       event.get('last_submit_rows'), event.get('last_submit_bytes'), now_timestamp)
+    wait_seconds = max(window_wait, budget_wait)
+    active_restore_jobs = None
+    submit_limit = my_max_manifests_per_submission
+
+    # Only look up active jobs once the window and the rate budget allow a submission
+    if wait_seconds == 0 and my_max_active_restore_jobs > 0:
+        active_restore_jobs = count_running_restore_jobs() + count_restores_pending_copy()
+        logger.info(f'{active_restore_jobs} active restore jobs, the limit is {my_max_active_restore_jobs}')
+        if active_restore_jobs >= my_max_active_restore_jobs:
+            wait_seconds = my_capacity_poll_seconds
+        submit_limit = min(submit_limit, my_max_active_restore_jobs - active_restore_jobs)
+
+    submit_now = wait_seconds == 0
+    submit_count = manifests_within_budget(event, submit_limit) if submit_now else 0
+    logger.info(f'Window wait {window_wait}s, budget wait {budget_wait}s, submitting {submit_count} manifests')
+
+    return {
+            'submit_now': submit_now,
+            'submit_count': submit_count,
+            # Step Functions Wait states accept at most a year, re-check at least daily
+            'wait_seconds': min(wait_seconds, 86400),
+            'window_wait_seconds': window_wait,
+            'budget_wait_seconds': budget_wait,
+            'active_restore_jobs': active_restore_jobs,
+            }
@@ -1,10 +1,8 @@
 from urllib import parse
-import boto3
-import botocore
-import os
 import json
 import logging
 from botocore.exceptions import ClientError
+from Runtime import env_int, env_str, get_client, send_sns_message
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -14,15 +12,14 @@ logger.setLevel('INFO')
 # boto3.set_stream_logger("")
 
 # Define Lambda Environmental Variable
-my_role_arn = str(os.environ['batch_ops_role'])
-report_bucket_name = str(os.environ['batch_ops_report_bucket'])
+my_role_arn = env_str('batch_ops_role')
+report_bucket_name = env_str('batch_ops_report_bucket')
 # Archive Restoration Details ###############################################
-restore_expiration = int(os.environ['archive_restore_days'])
-restore_tier = str(os.environ['archive_restore_tier'])
-accountId = str(os.environ['my_account_id'])
-my_region = str(os.environ['my_current_region'])
-my_sns_topic_arn = str(os.environ['my_sns_topic_arn'])
-my_s3_bucket = str(os.environ['s3_bucket'])
+restore_expiration = env_int('archive_restore_days')
+restore_tier = env_str('archive_restore_tier')
+accountId = env_str('my_account_id')
+my_sns_topic_arn = env_str('my_sns_topic_arn')
+my_s3_bucket = env_str('s3_bucket')
 
 
 # Specify variables #############################
@@ -32,32 +29,19 @@ job_manifest_format = 'S3BatchOperations_CSV_20180820'  # S3InventoryReport_CSV_
 
 
 # Job Report Details ############################
-report_prefix = str(os.environ['batch_ops_restore_report_prefix'])
+report_prefix = env_str('batch_ops_restore_report_prefix')
 report_format = 'Report_CSV_20180820'
 report_scope = 'AllTasks'
 
 # Construct ARNs ############################################
 report_bucket_arn = 'arn:aws:s3:::' + report_bucket_name
 
-# Initiate Service Clients ###################
-s3Client = boto3.client('s3', region_name=my_region)
-s3ControlClient = boto3.client('s3control', region_name=my_region)
-sns = boto3.client('sns', region_name=my_region)
-
-# SNS Message Function
-def send_sns_message(sns_topic_arn, sns_message):
-    logger.info("Sending SNS Notification Message......")
-    sns_subject = 'Notification from AutoRestoreMigrate Solution'
-    try:
-        response = sns.publish(TopicArn=sns_topic_arn, Message=sns_message, Subject=sns_subject)
-    except ClientError as e:
-        logger.error(e)
 
 # Retrive Manifest ETag
 def get_manifest_etag(manifest_s3_bucket, manifest_s3_key):
     # Get manifest key ETag ####################################
     try:
-        manifest_key_object_etag = s3Client.head_object(Bucket=manifest_s3_bucket, Key=manifest_s3_key)['ETag']
+        manifest_key_object_etag = get_client('s3').head_object(Bucket=manifest_s3_bucket, Key=manifest_s3_key)['ETag']
     except ClientError as e:
         logger.error(e)
     else:
@@ -133,7 +117,7 @@ def s3_batch_ops_restore(manifest_bucket, manifest_key):
     }
 
     try:
-        response = s3ControlClient.create_job(**my_bops_restore_kwargs)
+        response = get_client('s3control').create_job(**my_bops_restore_kwargs)
         logger.info(f"JobID is: {response['JobId']}")
         logger.info(f"S3 RequestID is: {response['ResponseMetadata']['RequestId']}")
         logger.info(f"S3 Extended RequestID is:{response['ResponseMetadata']['HostId']}")
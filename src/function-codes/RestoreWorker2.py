@@ -1,10 +1,10 @@
 from urllib import parse
-import boto3
-import botocore
-import os
 import json
 import logging
+import time
 from botocore.exceptions import ClientError
+from EmitMetrics import emit_metrics
+from Runtime import client_config, env_int, env_str, get_client, send_sns_message
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -14,15 +14,15 @@ logger.setLevel('INFO')
 # boto3.set_stream_logger("")
 
 # Define Lambda Environmental Variable
-my_role_arn = str(os.environ['batch_ops_role'])
-report_bucket_name = str(os.environ['batch_ops_report_bucket'])
+my_role_arn = env_str('batch_ops_role')
+report_bucket_name = env_str('batch_ops_report_bucket')
 # Archive Restoration Details ###############################################
-restore_expiration = int(os.environ['archive_restore_days'])
-restore_tier = str(os.environ['archive_restore_tier'])
-accountId = str(os.environ['my_account_id'])
-my_region = str(os.environ['my_current_region'])
-my_sns_topic_arn = str(os.environ['my_sns_topic_arn'])
-my_s3_bucket = str(os.environ['s3_bucket'])
+restore_expiration = env_int('archive_restore_days')
+restore_tier = env_str('archive_restore_tier')
+accountId = env_str('my_account_id')
+my_sns_topic_arn = env_str('my_sns_topic_arn')
+my_s3_bucket = env_str('s3_bucket')
+my_job_registry_prefix = env_str('job_registry_prefix')
 
 
 # Specify variables #############################
@@ -32,41 +32,49 @@ job_manifest_format = 'S3BatchOperations_CSV_20180820'  # S3InventoryReport_CSV_
 
 
 # Job Report Details ############################
-report_prefix = str(os.environ['batch_ops_restore_report_prefix'])
+report_prefix = env_str('batch_ops_restore_report_prefix')
 report_format = 'Report_CSV_20180820'
 report_scope = 'AllTasks'
 
 # Construct ARNs ############################################
 report_bucket_arn = 'arn:aws:s3:::' + report_bucket_name
 
-# Initiate Service Clients ###################
-s3Client = boto3.client('s3', region_name=my_region)
-s3ControlClient = boto3.client('s3control', region_name=my_region)
-sns = boto3.client('sns', region_name=my_region)
-
-# SNS Message Function
-def send_sns_message(sns_topic_arn, sns_message):
-    logger.info("Sending SNS Notification Message......")
-    sns_subject = 'Notification from AutoRestoreMigrate Solution'
-    try:
-        response = sns.publish(TopicArn=sns_topic_arn, Message=sns_message, Subject=sns_subject)
-    except ClientError as e:
-        logger.error(e)
+# InvokeRestore submits manifests concurrently, back off adaptively when CreateJob is throttled
+s3control_config = client_config(max_attempts=10, retry_mode='adaptive')
 
 # Retrive Manifest ETag
 def get_manifest_etag(manifest_s3_bucket, manifest_s3_key):
     # Get manifest key ETag ####################################
     try:
-        manifest_key_object_etag = s3Client.head_object(Bucket=manifest_s3_bucket, Key=manifest_s3_key)['ETag']
+        manifest_key_object_etag = get_client('s3').head_object(Bucket=manifest_s3_bucket, Key=manifest_s3_key)['ETag']
     except ClientError as e:
         logger.error(e)
     else:
         logger.info(manifest_key_object_etag)
         return manifest_key_object_etag
 
+# Count the columns of the first manifest row, generated manifests add the object size after the key fields
+def get_manifest_columns(manifest_s3_bucket, manifest_s3_key):
+    try:
+        get_response = get_client('s3').get_object(Bucket=manifest_s3_bucket, Key=manifest_s3_key, Range='bytes=0-8191')
+    except ClientError as e:
+        logger.error(e)
+        return 0
+    first_line = get_response['Body'].read().decode('utf-8', errors='ignore').splitlines()
+    return len(first_line[0].split(',')) if first_line else 0
+
+# Record the job as it is submitted, JobTracker reads it instead of the job description and tags
+def register_job(job_id, job_registration):
+    registry_key = f'{my_job_registry_prefix}{job_id}.json'
+    try:
+        get_client('s3').put_object(Bucket=report_bucket_name, Key=registry_key, Body=json.dumps(job_registration),
+                            ContentType='application/json')
+    except ClientError as e:
+        logger.error(e)
+
 # S3 Batch Restore Job Function
 
-def s3_batch_ops_restore(manifest_bucket, manifest_key, num_manifest_fields):
+def s3_batch_ops_restore(manifest_bucket, manifest_key, num_manifest_fields, client_request_token=None):
     logger.info("Calling the Amazon S3 Batch Operation Restore API")
 
     # Construct ARNs ############################################
@@ -90,6 +98,11 @@ def s3_batch_ops_restore(manifest_bucket, manifest_key, num_manifest_fields):
         logger.info("Set Format to CSV and Don't use Version ID in Manifest")
         manifest_fields = ['Bucket', 'Key']
         manifest_fields_count = str(len(manifest_fields))
+    # S3 Batch Operations skips Ignore fields, CopyWorker reads the size from the last one
+    manifest_columns = get_manifest_columns(manifest_bucket, manifest_key)
+    if manifest_fields and manifest_columns > len(manifest_fields):
+        logger.info(f"Ignore {manifest_columns - len(manifest_fields)} extra manifest columns")
+        manifest_fields = manifest_fields + ['Ignore'] * (manifest_columns - len(manifest_fields))
 
 
     my_bops_restore_kwargs = {
@@ -131,8 +144,12 @@ def s3_batch_ops_restore(manifest_bucket, manifest_key, num_manifest_fields):
     }
 
 
+    # A repeated token returns the job created by an earlier attempt for the same manifest
+    if client_request_token:
+        my_bops_restore_kwargs['ClientRequestToken'] = client_request_token
+
     try:
-        response = s3ControlClient.create_job(**my_bops_restore_kwargs)
+        response = get_client('s3control', s3control_config).create_job(**my_bops_restore_kwargs)
         logger.info(f"JobID is: {response['JobId']}")
         logger.info(f"S3 RequestID is: {response['ResponseMetadata']['RequestId']}")
         logger.info(f"S3 Extended RequestID is:{response['ResponseMetadata']['HostId']}")
@@ -148,9 +165,37 @@ def lambda_handler(event, context):
     s3Key = parse.unquote_plus(event['Records'][0]['s3']['object']['key'], encoding='utf-8')
     logger.info(s3Key)
     my_num_manifest_fields = int(event['Records'][0]['jobspec']['fields'])
-    job_id = s3_batch_ops_restore(s3Bucket, s3Key, my_num_manifest_fields)
+    my_client_request_token = event['Records'][0]['jobspec'].get('client_request_token')
+    my_chunk_bytes = event['Records'][0]['jobspec'].get('chunk_bytes')
+    submit_start = time.perf_counter()
+    job_id = s3_batch_ops_restore(s3Bucket, s3Key, my_num_manifest_fields, my_client_request_token)
     my_job_group_id = str(event['Records'][0]['jobgroupid'])
+    emit_metrics({'JobGroup': my_job_group_id, 'RestoreTier': restore_tier}, {
+        'RestoreJobsSubmitted': (1 if job_id else 0, 'Count'),
+        'RestoreJobSubmitFailures': (0 if job_id else 1, 'Count'),
+        'ManifestBytes': (int(my_chunk_bytes) if job_id and my_chunk_bytes is not None else None, 'Bytes'),
+        'RestoreJobSubmitLatency': ((time.perf_counter() - submit_start) * 1000, 'Milliseconds'),
+    }, {'RestoreJobId': job_id, 'ManifestKey': s3Key})
+    if not job_id:
+        logger.error(f'Restore Job for manifest {s3Key} belonging to JobGroup {my_job_group_id} was not created')
+        return {
+            'statusCode': 500,
+            'body': None,
+        }
+    register_job(job_id, {
+        'job_id': job_id,
+        'job_group': my_job_group_id,
+        'operation': 'S3InitiateRestoreObject',
+        'restore_tier': restore_tier,
+        'num_manifest_fields': str(my_num_manifest_fields),
+        'restore_job_id': job_id,
+        'tag_key': 'auto-restore-copy',
+        'manifest_bucket': s3Bucket,
+        'manifest_key': s3Key,
+    })
     my_sns_message = f'Restore Job {job_id} belonging to JobGroup {my_job_group_id} Successfully Submitted to Amazon S3 Batch Operation'
+    if my_chunk_bytes is not None:
+        my_sns_message = f'{my_sns_message}, manifest covers {my_chunk_bytes} bytes'
     send_sns_message(my_sns_topic_arn, my_sns_message)
     return {
         'statusCode': 200,
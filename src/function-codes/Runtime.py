@@ -0,0 +1,87 @@
+import logging
+import os
+import threading
+import boto3
+from botocore.client import Config
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+
+############# Environment #############
+
+# Environment variables are read when the function loads, a missing or malformed value fails the cold start with
+# the variable name instead of partway through an invocation
+def env_str(name):
+    try:
+        return str(os.environ[name])
+    except KeyError:
+        raise RuntimeError(f'Environment variable {name} is not set') from None
+
+
+def env_int(name):
+    value = env_str(name)
+    try:
+        return int(value)
+    except ValueError:
+        raise RuntimeError(f'Environment variable {name} must be an integer, not {value!r}') from None
+
+
+# Lambda sets the Region of the function, without it boto3 falls back to its own configuration
+client_region = os.environ.get('AWS_REGION')
+
+
+############# Service Clients #############
+
+# Connection pool and retries of a client. Functions that send requests from several threads size the pool to
+# their thread count, the adaptive retry mode also slows the requests down while the service throttles them
+def client_config(max_pool_connections=None, max_attempts=None, retry_mode=None):
+    retries = {}
+    if max_attempts:
+        retries['max_attempts'] = max_attempts
+    if retry_mode:
+        retries['mode'] = retry_mode
+    return Config(max_pool_connections=max_pool_connections or 10, retries=retries or None)
+
+
+# Create Service Clients on first use and keep them while the container is warm, so a cold start only pays for the
+# services the invocation calls. The default boto3 session is not thread safe, so only one thread at a time
+# creates a client. The config of the first request for a service applies to its client
+service_clients = {}
+service_clients_lock = threading.Lock()
+
+
+def get_client(service_name, config=None):
+    with service_clients_lock:
+        if service_name not in service_clients:
+            service_clients[service_name] = boto3.client(service_name, region_name=client_region, config=config)
+        return service_clients[service_name]
+
+
+def get_resource(service_name):
+    with service_clients_lock:
+        if ('resource', service_name) not in service_clients:
+            service_clients[('resource', service_name)] = boto3.resource(service_name, region_name=client_region)
+        return service_clients[('resource', service_name)]
+
+
+def get_table(table_name):
+    dynamodb = get_resource('dynamodb')
+    with service_clients_lock:
+        if ('table', table_name) not in service_clients:
+            service_clients[('table', table_name)] = dynamodb.Table(table_name)
+        return service_clients[('table', table_name)]
+
+
+############# Notifications #############
+
+# SNS Message Function, failures are logged and only raised when the caller cannot go on without the message
+def send_sns_message(sns_topic_arn, sns_message, raise_errors=False):
+    logger.info("Sending SNS Notification Message......")
+    sns_subject = 'Notification from AutoRestoreMigrate Solution'
+    try:
+        get_client('sns').publish(TopicArn=sns_topic_arn, Message=sns_message, Subject=sns_subject)
+    except ClientError as e:
+        logger.error(e)
+        if raise_errors:
+            raise
@@ -1,12 +1,10 @@
 import json
-import boto3
 import uuid
-import os
 import logging
 import json
 from botocore.exceptions import ClientError
-from botocore.client import Config
 from urllib import parse
+from Runtime import env_str, get_client
 
 # Enable debugging for troubleshooting
 # boto3.set_stream_logger("")
@@ -17,15 +15,15 @@ logger = logging.getLogger(__name__)
 logger.setLevel('INFO')
 
 # Define Environmental Variables
-my_state_machine_arn = str(os.environ['step_function_arn'])
-my_region = str(os.environ['current_region'])
+my_state_machine_arn = env_str('step_function_arn')
+my_inventory_engine = env_str('inventory_engine')
+my_restore_order = env_str('restore_order')
+my_priority_prefixes = env_str('priority_prefixes')
 
-# Setup Service Client
-client = boto3.client('stepfunctions', region_name=my_region)
 
 def invoke_state_machine(state_machine_arn, inv_input, invocation_name):
     try:
-        response = client.start_execution(
+        response = get_client('stepfunctions').start_execution(
             stateMachineArn=state_machine_arn,
             name=invocation_name,
             input=inv_input,
@@ -39,7 +37,6 @@ def invoke_state_machine(state_machine_arn, inv_input, invocation_name):
         logger.info(f"Invocation Successful")
 
 
-
 def lambda_handler(event, context):
     logger.info(event)
 
@@ -54,6 +51,9 @@ def lambda_handler(event, context):
     state_machine_dict_input = {
                             's3Bucket': s3Bucket,
                             's3Key': s3Key,
+                            'inventory_engine': my_inventory_engine,
+                            'restore_order': my_restore_order,
+                            'priority_prefixes': my_priority_prefixes,
                             }
 
 
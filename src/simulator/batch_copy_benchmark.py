@@ -0,0 +1,378 @@
+import argparse
+import contextlib
+import datetime
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import sys
+import time
+import types
+import uuid
+from collections import Counter
+from urllib import parse
+
+import boto3
+import boto3.s3.transfer
+
+from local_aws import LocalAWS, VirtualClock, operation_name
+from local_batch_operations import lambda_invoke_payload
+from local_lambda import LocalLambda
+from local_s3 import (Content, LocalS3, S3Object, content_etag, create_transfer_manager, multipart_etag,
+                      parse_copy_source, parse_range)
+from stack import Stack, TemplateError, load_template
+
+
+# Set up logging
+logger = logging.getLogger('batch_copy_benchmark')
+logger.setLevel('INFO')
+
+
+# Other Variables
+default_template = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                                'automated-archive-restore-and-copy-solution-latest.yaml')
+batch_copy_function = 'S3BatchCopyLambdafunction'
+result_schema_version = 1
+kib = 1024
+mib = 1024 ** 2
+gib = 1024 ** 3
+# Object sizes of each profile, drawn log-uniformly between the bounds
+size_profiles = {
+    'tiny': (1 * kib, 64 * kib),
+    'small': (1 * mib, 64 * mib),
+    'medium': (64 * mib, 1 * gib),
+    'large': (5 * gib + 1, 20 * gib),
+    'mixed': (1 * kib, 8 * gib),
+}
+# Part size of the multipart uploads that wrote the source objects, the AWS CLI default
+source_part_bytes = 8 * mib
+source_multipart_threshold = 8 * mib
+# Function memory, the other settings that are not stack parameters are environment variables of the function,
+# e.g. copy_metadata, which CopyMetadata only allows to be Enable
+memory_setting = 'MemorySize'
+# Metrics compared against a baseline, and whether a higher value is better
+tracked_metrics = {
+    'objects_per_second': True,
+    'bytes_per_second': True,
+    'requests_per_object': False,
+    'latency_ms_p99': False,
+}
+
+
+# Requests sent during one task, with the part concurrency the transfer manager was given
+class RequestTrace:
+    def __init__(self):
+        self.requests = []
+        self.part_concurrency = 1
+
+
+# The local S3 with every request recorded as (operation, bytes copied or read) in the current trace
+class TracedS3:
+    def __init__(self, s3):
+        self._s3 = s3
+        self.trace = RequestTrace()
+
+    def __getattr__(self, name):
+        method = getattr(self._s3, name)
+        if name.startswith('_') or not callable(method):
+            return method
+
+        def traced(*args, **kwargs):
+            response = method(*args, **kwargs)
+            self.trace.requests.append((operation_name(name), self._request_bytes(name, kwargs, response)))
+            return response
+        return traced
+
+    def _request_bytes(self, name, kwargs, response):
+        if name == 'copy_object':
+            bucket, key, version_id = parse_copy_source(kwargs['CopySource'])
+            return self._s3._object(bucket, key, version_id, 'CopyObject').size
+        if name == 'upload_part_copy':
+            if kwargs.get('CopySourceRange'):
+                start, end = parse_range(kwargs['CopySourceRange'], math.inf)
+                return end - start + 1
+            bucket, key, version_id = parse_copy_source(kwargs['CopySource'])
+            return self._s3._object(bucket, key, version_id, 'UploadPartCopy').size
+        if name in ['get_object', 'upload_part', 'put_object']:
+            return response.get('ContentLength', 0) if name == 'get_object' else len(kwargs.get('Body') or b'')
+        return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the BatchCopy function of the template with synthetic S3 Batch Operations tasks '
+                    'against a local S3, sweeping object sizes and stack parameters')
+    parser.add_argument('--template', default=default_template, help='CloudFormation template to benchmark')
+    parser.add_argument('--objects', type=int, default=100, help='Objects copied in each case')
+    parser.add_argument('--size-profiles', default='tiny,small,medium,large,mixed',
+                        help=f'Comma separated object size profiles: {", ".join(size_profiles)}')
+    parser.add_argument('-p', '--parameter', action='append', default=[], metavar='Name=Value',
+                        help='Stack parameter of every case, can be repeated')
+    parser.add_argument('-s', '--sweep', action='append', default=None, metavar='Name=Value1,Value2',
+                        help='Stack parameter, function environment variable or MemorySize to sweep, can be '
+                             'repeated, cases are all the combinations. '
+                             'Default: copy_metadata and CopyTagging Enable and Disable')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the generated objects')
+    parser.add_argument('--request-latency-ms', type=float, default=25,
+                        help='Modelled time to first byte of each request')
+    parser.add_argument('--stream-mib-per-second', type=float, default=80,
+                        help='Modelled copy throughput of one CopyObject or UploadPartCopy request')
+    parser.add_argument('--invoke-overhead-ms', type=float, default=20,
+                        help='Modelled overhead of each Lambda invocation')
+    parser.add_argument('--lambda-concurrency', type=int, default=1000,
+                        help='Concurrent invocations of the copy job, lowered to the reserved concurrency if set')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Results JSON of an earlier run to compare with')
+    parser.add_argument('--max-regression', type=float, default=10,
+                        help='Percentage a tracked metric may get worse than the baseline before the run fails')
+    return parser.parse_args()
+
+
+def name_values(argument, separator):
+    name, found, values = argument.partition('=')
+    if not found:
+        raise TemplateError(f'Expected Name=Value, not {argument}')
+    return name, values.split(separator) if separator else values
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+############# Source Objects #############
+
+# Restored archive objects with user metadata and tags, objects above the CLI threshold were uploaded in parts
+def source_objects(s3, bucket, profile, count, random_source, clock):
+    low, high = size_profiles[profile]
+    objects = []
+    for index in range(count):
+        size = int(math.exp(random_source.uniform(math.log(low), math.log(high))))
+        content = Content(size)
+        part_sizes = None
+        etag = content_etag(content)
+        if size > source_multipart_threshold:
+            part_sizes = [min(source_part_bytes, size - start) for start in range(0, size, source_part_bytes)]
+            etag = multipart_etag([content.digest(start, start + part_size - 1) for start, part_size in
+                                   zip(range(0, size, source_part_bytes), part_sizes)])
+        s3_object = S3Object(
+            f'{profile}/object-{index:06d}.bin', content, version_id=uuid.uuid4().hex, etag=etag,
+            part_sizes=part_sizes, storage_class='GLACIER', metadata={'project': 'restore-benchmark'},
+            headers={'ContentType': 'application/octet-stream'},
+            tags=[{'Key': 'team', 'Value': 'archive'}, {'Key': 'index', 'Value': str(index)}],
+            last_modified=clock.datetime() - datetime.timedelta(days=365))
+        s3_object.restore_completes_at = clock.now - 3600
+        s3_object.restore_expiry = clock.now + 86400
+        bucket.add(s3_object)
+        objects.append(s3_object)
+    return objects
+
+
+############# Latency Model #############
+
+# Task latency: requests run one after the other, except the part copies of a multipart copy, which run on as
+# many connections as the part concurrency and the client pool allow
+def task_seconds(trace, pool_connections, args):
+    request_seconds = args.request_latency_ms / 1000
+    stream_bytes_per_second = args.stream_mib_per_second * mib
+    seconds = args.invoke_overhead_ms / 1000
+    lanes = [0.0] * max(1, min(trace.part_concurrency, pool_connections))
+    for operation, transferred in trace.requests:
+        duration = request_seconds + transferred / stream_bytes_per_second
+        if operation == 'UploadPartCopy':
+            heapq.heappush(lanes, heapq.heappop(lanes) + duration)
+        else:
+            seconds += duration
+    return seconds + max(lanes)
+
+
+# Job duration when S3 Batch Operations runs the tasks on the given number of concurrent invocations
+def job_seconds(latencies, concurrency):
+    lanes = [0.0] * max(1, min(concurrency, len(latencies)))
+    for latency in latencies:
+        heapq.heappush(lanes, heapq.heappop(lanes) + latency)
+    return max(lanes)
+
+
+############# Benchmark #############
+
+def run_case(args, profile, parameters, settings):
+    stack = Stack(args.template, dict(parameters, **{name: value for name, value in settings.items()
+                                                     if name in load_template(args.template)['Parameters']}))
+    clock = VirtualClock(datetime.datetime(2025, 1, 6, tzinfo=datetime.timezone.utc).timestamp())
+    aws = LocalAWS(clock, stack.region, stack.account_id)
+    s3 = LocalS3(aws, restore_seconds=lambda s3_object, tier: 0)
+    traced_s3 = TracedS3(s3)
+    aws.register('s3', traced_s3)
+    source_bucket = s3.add_bucket(stack.parameters['ArchiveBucket'], versioned=True)
+    s3.add_bucket(stack.parameters['DestinationBucket'])
+    sources = source_objects(s3, source_bucket, profile, args.objects, random.Random(args.seed), clock)
+
+    def traced_transfer_manager(client, config, osutil=None):
+        traced_s3.trace.part_concurrency = config.max_concurrency
+        return create_transfer_manager(client, config, osutil)
+    transfer_module = types.ModuleType('boto3.s3.transfer')
+    transfer_module.__dict__.update(boto3.s3.transfer.__dict__)
+    transfer_module.create_transfer_manager = traced_transfer_manager
+    lambda_service = LocalLambda(aws, stack, module_overrides={'boto3.s3.transfer': transfer_module})
+    function = lambda_service.function(batch_copy_function)
+    for name, value in settings.items():
+        if name == memory_setting:
+            function.spec['memory_mb'] = int(value)
+        elif name not in stack.parameters:
+            if name not in function.spec['environment']:
+                raise TemplateError(f'{name} is neither a stack parameter nor a variable of {batch_copy_function}')
+            function.spec['environment'][name] = value
+
+    pool_connections = []
+
+    def local_client(service_name, *client_args, **client_kwargs):
+        config = client_kwargs.get('config')
+        pool_connections.append(config.max_pool_connections if config and config.max_pool_connections else 10)
+        return aws.client(service_name, *client_args, **client_kwargs)
+    boto3.client = local_client
+    boto3.resource = aws.resource
+
+    latencies = []
+    wall_seconds = []
+    requests = Counter()
+    results = Counter()
+    # The handler prints its metric log lines, they are timed but not part of the report
+    with open(os.devnull, 'w') as handler_output:
+        for s3_object in sources:
+            traced_s3.trace = RequestTrace()
+            task = {'Bucket': source_bucket.name, 'Key': parse.quote_plus(s3_object.key, safe='/'),
+                    'VersionId': s3_object.version_id}
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(handler_output):
+                response, function_error = lambda_service.run(batch_copy_function, lambda_invoke_payload('benchmark', task))
+            wall_seconds.append(time.perf_counter() - started)
+            results[function_error.split(':')[0] if function_error else response['results'][0]['resultCode']] += 1
+            requests.update(operation for operation, transferred in traced_s3.trace.requests)
+            latencies.append(task_seconds(traced_s3.trace, pool_connections[0], args))
+
+    reserved = function.spec['reserved_concurrency']
+    concurrency = min(args.lambda_concurrency, reserved) if reserved else args.lambda_concurrency
+    duration = job_seconds(latencies, concurrency)
+    total_bytes = sum(s3_object.size for s3_object in sources)
+    return {
+        'size_profile': profile,
+        'settings': settings,
+        'objects': len(sources),
+        'bytes': total_bytes,
+        'results': dict(results),
+        'lambda_concurrency': concurrency,
+        'job_seconds': duration,
+        'objects_per_second': len(sources) / duration,
+        'bytes_per_second': total_bytes / duration,
+        'requests_per_object': sum(requests.values()) / len(sources),
+        'requests': dict(sorted(requests.items())),
+        'latency_ms_p50': percentile(latencies, 0.5) * 1000,
+        'latency_ms_p99': percentile(latencies, 0.99) * 1000,
+        'handler_wall_ms_p50': percentile(wall_seconds, 0.5) * 1000,
+        'handler_wall_ms_p99': percentile(wall_seconds, 0.99) * 1000,
+    }
+
+
+def case_key(case):
+    return json.dumps([case['size_profile'], case['settings']], sort_keys=True)
+
+
+# Relative change of each tracked metric, positive when the metric got worse
+def regressions(cases, baseline_cases, max_regression):
+    baseline = {case_key(case): case for case in baseline_cases}
+    found = []
+    for case in cases:
+        previous = baseline.get(case_key(case))
+        if previous is None:
+            continue
+        for metric, higher_is_better in tracked_metrics.items():
+            if not previous[metric]:
+                continue
+            change = (case[metric] - previous[metric]) / previous[metric] * 100
+            worse = -change if higher_is_better else change
+            if worse > max_regression:
+                found.append((case, metric, previous[metric], case[metric], change))
+    return found
+
+
+def format_bytes(value):
+    for unit, size in [('GiB', gib), ('MiB', mib), ('KiB', kib)]:
+        if value >= size:
+            return f'{value / size:.1f} {unit}'
+    return f'{value:.0f} B'
+
+
+def settings_label(settings):
+    return ' '.join(f'{name}={value}' for name, value in settings.items()) or 'defaults'
+
+
+def print_cases(cases):
+    print(f"{'profile':<8} {'settings':<48} {'objects/s':>10} {'bytes/s':>12} {'req/obj':>8} "
+          f"{'p50 ms':>9} {'p99 ms':>10} {'wall p50 ms':>11}  results")
+    for case in cases:
+        print(f"{case['size_profile']:<8} {settings_label(case['settings']):<48} {case['objects_per_second']:>10.1f} "
+              f"{format_bytes(case['bytes_per_second']) + '/s':>12} {case['requests_per_object']:>8.2f} "
+              f"{case['latency_ms_p50']:>9.0f} {case['latency_ms_p99']:>10.0f} {case['handler_wall_ms_p50']:>11.2f}  "
+              + ', '.join(f'{code} {count}' for code, count in sorted(case['results'].items())))
+
+
+def main():
+    args = parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)
+    parameters = dict(name_values(parameter, None) for parameter in args.parameter)
+    sweeps = dict(name_values(sweep, ',') for sweep in args.sweep or
+                  ['copy_metadata=Enable,Disable', 'CopyTagging=Enable,Disable'])
+    profiles = [profile.strip() for profile in args.size_profiles.split(',') if profile.strip()]
+    unknown = [profile for profile in profiles if profile not in size_profiles]
+    if unknown:
+        sys.exit(f'error: unknown size profiles {", ".join(unknown)}')
+
+    cases = []
+    for profile in profiles:
+        for values in itertools.product(*sweeps.values()):
+            settings = dict(zip(sweeps, values))
+            try:
+                cases.append(run_case(args, profile, parameters, settings))
+            except TemplateError as e:
+                sys.exit(f'error: {e}')
+    print_cases(cases)
+
+    report = {
+        'schema_version': result_schema_version,
+        'benchmark': 'BatchCopy',
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'parameters': parameters,
+        'model': {
+            'request_latency_ms': args.request_latency_ms,
+            'stream_mib_per_second': args.stream_mib_per_second,
+            'invoke_overhead_ms': args.invoke_overhead_ms,
+            'lambda_concurrency': args.lambda_concurrency,
+            'objects': args.objects,
+            'seed': args.seed,
+        },
+        'cases': cases,
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('model') != report['model']:
+            print(f'Note: {args.baseline} was run with another latency model or object count, '
+                  'compare the cases with care')
+        found = regressions(cases, baseline['cases'], args.max_regression)
+        for case, metric, previous, current, change in found:
+            print(f"Regression: {case['size_profile']} {settings_label(case['settings'])} {metric} "
+                  f"{previous:.2f} -> {current:.2f} ({change:+.1f}%)")
+        if found:
+            sys.exit(1)
+        print(f'No metric regressed more than {args.max_regression}% against {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+import csv
+import io
+import logging
+import re
+import uuid
+from urllib import parse
+
+from local_aws import client_error
+
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+
+# Other Variables
+running_states = ['QUEUED', 'RUNNING']
+
+
+class UnsupportedQuery(Exception):
+    pass
+
+
+############# Query Interpretation #############
+
+# Presto url_encode escapes like java.net.URLEncoder
+def url_encode(key):
+    return parse.quote_plus(key, safe='*').replace('~', '%7E')
+
+
+def search(pattern, query, default=None):
+    match = re.search(pattern, query, re.S)
+    return match.group(1) if match else default
+
+
+def source_table(query, alias=''):
+    table = search(rf'FROM "[^"]+"\."([^"]+)"\s*{alias}', query)
+    if table is None:
+        raise UnsupportedQuery('No inventory table found in the query')
+    return table
+
+
+# Sort rows by the ORDER BY of the restore order strategies: plain columns and the priority prefix CASE
+def order_rows(rows, order_by):
+    terms = []
+    case = re.match(r'CASE (.*?) ELSE (\d+) END (ASC|DESC)(?:, )?', order_by, re.S)
+    if case:
+        prefixes = [(int(length), value.replace("''", "'"), int(priority)) for length, value, priority in
+                    re.findall(r"WHEN substr\(key, 1, (\d+)\) = '((?:[^']|'')*)' THEN (\d+)", case.group(1))]
+        default_priority = int(case.group(2))
+
+        def priority(row):
+            for length, value, prefix_priority in prefixes:
+                if row['key'][:length] == value:
+                    return prefix_priority
+            return default_priority
+        terms.append((priority, case.group(3) == 'DESC'))
+        order_by = order_by[case.end():]
+    # Plain columns, or coalesce(column, 'default') as the tie-breaking version id
+    for coalesce_column, default, column, direction in re.findall(
+            r"(?:coalesce\((\w+), '([^']*)'\)|(\w+))\s+(ASC|DESC)", order_by):
+        if coalesce_column:
+            terms.append(((lambda row, column=coalesce_column, default=default:
+                           default if row[column] is None else row[column]), direction == 'DESC'))
+        else:
+            terms.append(((lambda row, column=column: row[column]), direction == 'DESC'))
+    if not terms:
+        raise UnsupportedQuery(f'Unsupported ORDER BY {order_by}')
+    ordered = list(rows)
+    for value, descending in reversed(terms):
+        ordered.sort(key=value, reverse=descending)
+    return ordered
+
+
+# Rows of the inventory the WHERE clause selects: storage class, latest versions only, no delete markers
+def select_inventory_rows(query, inventory_rows, table_rows):
+    storage_classes = re.findall(r"storage_class = '(\w+)'", query)
+    bucket = search(r"\bbucket = '([^']+)'", query)
+    latest_only = 'is_latest = true' in query
+    rows = [row for row in inventory_rows
+            if row['storage_class'] in storage_classes and row['bucket'] == bucket and not row['is_delete_marker']
+            and (row['is_latest'] or not latest_only)]
+    if 'NOT EXISTS' in query:
+        copied_rows = table_rows(source_table(query, 'copied'))
+        destination_prefix = search(r"concat\('((?:[^']|'')*)/', inventory\.key\)", query)
+        destination_prefix = f"{destination_prefix.replace(chr(39) * 2, chr(39))}/" if destination_prefix else ''
+        copied = {}
+        for row in copied_rows:
+            if row['is_latest'] is not False and not row['is_delete_marker']:
+                copied.setdefault((row['key'], row['size']), []).append(row)
+
+        # Same ETag, or a multipart source and a copy written at or after it
+        def was_copied(row):
+            return any(copy['e_tag'] == row['e_tag'] or
+                       ('-' in row['e_tag'] and copy['last_modified_date'] >= row['last_modified_date'])
+                       for copy in copied.get((destination_prefix + row['key'], row['size']), []))
+        rows = [row for row in rows if not was_copied(row)]
+    return rows
+
+
+# Versions of a key with the same content are restored once, the others are listed on the row of the oldest one
+def deduplicate_versions(query, rows):
+    group_size = int(search(r'/ (\d+) as content_group', query))
+    max_duplicates = int(search(r'array_agg\(version_id\).*?, 2, (\d+)\)', query))
+    contents = {}
+    for row in rows:
+        content_id = row['e_tag'] or row['version_id'] or 'null'
+        contents.setdefault((row['key'], content_id, row['size']), []).append(row)
+    deduplicated = []
+    for versions in contents.values():
+        versions.sort(key=lambda row: (row['last_modified_date'], row['version_id'] or 'null'))
+        for start in range(0, len(versions), group_size):
+            group = versions[start:start + group_size]
+            deduplicated.append(dict(group[0], duplicate_versions='|'.join(
+                row['version_id'] or 'null' for row in group[1:1 + max_duplicates])))
+    return deduplicated
+
+
+############# Athena #############
+
+class LocalAthena:
+    def __init__(self, aws, base_seconds=20, rows_per_second=200000):
+        self.aws = aws
+        # Glue table name to a function returning its inventory rows at query time
+        self.tables = {}
+        # Workgroup name to the output location of the queries that do not set one
+        self.workgroups = {}
+        self.queries = {}
+        self.base_seconds = base_seconds
+        self.rows_per_second = rows_per_second
+
+    def add_table(self, name, rows):
+        self.tables[name] = rows
+
+    def add_workgroup(self, name, output_location):
+        self.workgroups[name] = output_location
+
+    def _table_rows(self, name):
+        if name not in self.tables:
+            raise UnsupportedQuery(f'Table {name} does not exist')
+        return self.tables[name]()
+
+    def start_query_execution(self, QueryString, ResultConfiguration=None, QueryExecutionContext=None,
+                              WorkGroup='primary', ClientRequestToken=None, **kwargs):
+        for query in self.queries.values():
+            if query['client_request_token'] == ClientRequestToken:
+                return {'QueryExecutionId': query['id']}
+        query_id = str(uuid.uuid4())
+        output_location = (ResultConfiguration or {}).get('OutputLocation') or self.workgroups.get(WorkGroup) or \
+            f's3://aws-athena-query-results-{self.aws.account_id}-{self.aws.region}/'
+        query = {
+            'id': query_id,
+            'query': QueryString,
+            'output_location': output_location if output_location.endswith('/') else f'{output_location}/',
+            'workgroup': WorkGroup,
+            'database': (QueryExecutionContext or {}).get('Database'),
+            'client_request_token': ClientRequestToken,
+            'state': 'QUEUED',
+            'reason': None,
+            'submitted': self.aws.clock.datetime(),
+            'completed': None,
+            'result_rows': None,
+            'scanned_rows': 0,
+        }
+        self.queries[query_id] = query
+        try:
+            scanned_rows = len(self._table_rows(source_table(QueryString)))
+        except UnsupportedQuery:
+            scanned_rows = 0
+        # Athena reads the whole inventory table whatever the query writes
+        self.aws.events.schedule(self.base_seconds + scanned_rows / self.rows_per_second,
+                                 lambda: self._complete(query), 'Athena query')
+        query['state'] = 'RUNNING'
+        return {'QueryExecutionId': query_id}
+
+    def _complete(self, query):
+        with self.aws.lock:
+            try:
+                self._run(query)
+                query['state'] = 'SUCCEEDED'
+            except UnsupportedQuery as e:
+                logger.error(f'Query {query["id"]} failed: {e}')
+                query['state'] = 'FAILED'
+                query['reason'] = str(e)
+            query['completed'] = self.aws.clock.datetime()
+
+    def _run(self, query):
+        query_string = query['query']
+        inventory_rows = self._table_rows(source_table(query_string))
+        query['scanned_rows'] = len(inventory_rows)
+        if query_string.strip().startswith('UNLOAD'):
+            self._unload(query, inventory_rows)
+        elif re.search(r'SELECT count\(\*\)', query_string):
+            rows = select_inventory_rows(query_string, inventory_rows, self._table_rows)
+            query['result_rows'] = [['_col0'], [str(len(rows))]]
+            self._write_csv(query, query['result_rows'])
+        elif 'OFFSET' in query_string:
+            self._offset_limit(query, inventory_rows)
+        else:
+            raise UnsupportedQuery('The pipeline simulator only runs the manifest queries of the solution')
+
+    def _write_csv(self, query, rows):
+        body = io.StringIO()
+        csv.writer(body, quoting=csv.QUOTE_ALL, lineterminator='\n').writerows(rows)
+        bucket, _, prefix = query['output_location'][len('s3://'):].partition('/')
+        self.aws.services['s3'].put_object(Bucket=bucket, Key=f'{prefix}{query["id"]}.csv', Body=body.getvalue())
+
+    # OffsetLimit mode writes one manifest chunk per query as the CSV result of a SELECT
+    def _offset_limit(self, query, inventory_rows):
+        query_string = query['query']
+        rows = select_inventory_rows(query_string, inventory_rows, self._table_rows)
+        rows = order_rows(rows, search(r'ORDER BY (.+?)\s+OFFSET', query_string))
+        offset = int(search(r'OFFSET (\d+)', query_string))
+        limit = int(search(r'LIMIT (\d+)', query_string))
+        header = re.findall(r'as "?(\w[^",]*)"?', search(r'SELECT (.+?)\s+FROM', query_string))
+        result_rows = [header]
+        for row in rows[offset:offset + limit]:
+            result_row = [row['bucket'], row['key']]
+            if 'VersionId' in header:
+                result_row.append(row['version_id'] or 'null')
+            result_rows.append(result_row)
+        self._write_csv(query, result_rows)
+
+    # Single pass UNLOAD: number the rows in restore order, cut them into chunks by row and byte caps and write
+    # the requested chunks as partitions, led by the totals when the query counts them
+    def _unload(self, query, inventory_rows):
+        query_string = query['query']
+        rows = select_inventory_rows(query_string, inventory_rows, self._table_rows)
+        if 'duplicate_versions' in query_string:
+            rows = deduplicate_versions(query_string, rows)
+        order_by = search(r'row_number\(\) OVER \(ORDER BY (.+?)\) - 1 as row_num', query_string)
+        if order_by is None:
+            raise UnsupportedQuery('No row numbering found in the UNLOAD query')
+        rows = order_rows(rows, order_by)
+        max_rows = int(search(r'row_num / (\d+) as (?:row_)?chunk_id', query_string))
+        max_bytes = search(r'- 1\) / (\d+) as byte_chunk_id', query_string)
+        chunk_ids = []
+        if max_bytes is None:
+            chunk_ids = [row_num // max_rows for row_num in range(len(rows))]
+        else:
+            max_bytes = int(max_bytes)
+            chunk_keys = []
+            running_bytes = 0
+            for row_num, row in enumerate(rows):
+                if row_num % max_rows == 0:
+                    running_bytes = 0
+                running_bytes += row['size']
+                # Presto integer division truncates towards zero
+                chunk_keys.append((row_num // max_rows, max(running_bytes - 1, 0) // max_bytes))
+            ranks = {chunk_key: rank for rank, chunk_key in enumerate(sorted(set(chunk_keys)))}
+            chunk_ids = [ranks[chunk_key] for chunk_key in chunk_keys]
+        first_chunk, last_chunk = [int(value) for value in
+                                   re.search(r'chunk_id BETWEEN (\d+) AND (\d+)', query_string).groups()]
+        location = search(r"TO '([^']+)'", query_string)
+        partitions = re.findall(r"'(\w+)'", search(r'partitioned_by = ARRAY\[([^\]]+)\]', query_string))
+        select_columns = [column.strip() for column in
+                          search(r'UNLOAD \(\s*SELECT (.+?)\s+FROM', query_string).split(',')]
+        columns = []
+        for column in select_columns:
+            if column in partitions:
+                break
+            columns.append(column)
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        s3 = self.aws.services['s3']
+        if s3.list_objects_v2(Bucket=bucket, Prefix=prefix, MaxKeys=1).get('KeyCount'):
+            raise UnsupportedQuery(f'HIVE_PATH_ALREADY_EXISTS: Target directory for table already exists: {location}')
+        totals = {'total_rows': len(rows), 'last_chunk_id': max(chunk_ids) if chunk_ids else 0}
+        chunks = {}
+        for row, chunk_id in zip(rows, chunk_ids):
+            if first_chunk <= chunk_id <= last_chunk:
+                chunks.setdefault(chunk_id, []).append(row)
+        written_files = []
+        for chunk_id, chunk_rows in sorted(chunks.items()):
+            partition_values = dict(totals, chunk_id=chunk_id, chunk_rows=len(chunk_rows),
+                                    chunk_bytes=sum(row['size'] for row in chunk_rows))
+            partition_path = ''.join(f'{name}={partition_values[name]}/' for name in partitions)
+            lines = []
+            for row in chunk_rows:
+                values = {'bucket': row['bucket'], 'key': url_encode(row['key']),
+                          'version_id': row['version_id'] or 'null', 'size': row['size'],
+                          'duplicate_versions': row.get('duplicate_versions', '')}
+                lines.append(','.join(str(values[column]) for column in columns))
+            file_key = f'{prefix}{partition_path}{query["id"]}_{uuid.uuid4()}'
+            s3.put_object(Bucket=bucket, Key=file_key, Body='\n'.join(lines) + '\n')
+            written_files.append(f's3://{bucket}/{file_key}')
+        result_bucket, _, result_prefix = query['output_location'][len('s3://'):].partition('/')
+        s3.put_object(Bucket=result_bucket, Key=f'{result_prefix}{query["id"]}-manifest.csv',
+                      Body=''.join(f'{file}\n' for file in written_files))
+
+    def _query(self, query_execution_id, operation):
+        if query_execution_id not in self.queries:
+            raise client_error(operation, 'InvalidRequestException', f'QueryExecution {query_execution_id} was not found')
+        return self.queries[query_execution_id]
+
+    def get_query_execution(self, QueryExecutionId, **kwargs):
+        query = self._query(QueryExecutionId, 'GetQueryExecution')
+        status = {'State': query['state'], 'SubmissionDateTime': query['submitted']}
+        if query['completed']:
+            status['CompletionDateTime'] = query['completed']
+        if query['reason']:
+            status['StateChangeReason'] = query['reason']
+        return {'QueryExecution': {
+            'QueryExecutionId': query['id'],
+            'Query': query['query'],
+            'StatementType': 'DML',
+            'ResultConfiguration': {'OutputLocation': f'{query["output_location"]}{query["id"]}.csv'},
+            'QueryExecutionContext': {'Database': query['database']},
+            'Status': status,
+            'Statistics': {'DataScannedInBytes': query['scanned_rows'] * 200},
+            'WorkGroup': query['workgroup'],
+        }}
+
+    def get_query_results(self, QueryExecutionId, **kwargs):
+        query = self._query(QueryExecutionId, 'GetQueryResults')
+        if query['state'] in running_states:
+            raise client_error('GetQueryResults', 'InvalidRequestException',
+                               f'Query has not yet finished. Current state: {query["state"]}')
+        if query['state'] != 'SUCCEEDED':
+            raise client_error('GetQueryResults', 'InvalidRequestException', query['reason'] or query['state'])
+        rows = query['result_rows'] or []
+        return {
+            'UpdateCount': 0,
+            'ResultSet': {
+                'Rows': [{'Data': [{'VarCharValue': value} for value in row]} for row in rows],
+                'ResultSetMetadata': {'ColumnInfo': [{'Name': name, 'Type': 'varchar'} for name in rows[0]]}
+                if rows else {'ColumnInfo': []},
+            },
+        }
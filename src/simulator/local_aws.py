@@ -0,0 +1,262 @@
+import datetime
+import heapq
+import logging
+import threading
+import time
+import types
+import uuid
+from collections import Counter
+from urllib import parse
+
+import botocore.session
+from botocore.exceptions import ClientError
+from botocore.validate import validate_parameters
+
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+
+# Other Variables
+# Operations that are SDK customizations rather than API calls, recorded as the call they make
+sdk_operations = {
+    'upload_fileobj': 'PutObject',
+}
+# Calls made outside any function invocation, e.g. by the simulator preparing the archive bucket
+simulator_actor = 'Simulator'
+
+
+############# Virtual Time #############
+
+# Every handler and stand-in reads the time from here, the simulation jumps from one event to the next
+class VirtualClock:
+    def __init__(self, start_timestamp):
+        self.start = start_timestamp
+        self.now = start_timestamp
+
+    def time(self):
+        return self.now
+
+    def elapsed(self):
+        return self.now - self.start
+
+    def datetime(self):
+        return datetime.datetime.fromtimestamp(self.now, datetime.timezone.utc)
+
+
+# time module for the handlers, time.time() follows the clock and time.sleep() returns at once
+def virtual_time_module(clock):
+    module = types.ModuleType('time')
+    module.__dict__.update(time.__dict__)
+    module.time = clock.time
+    module.sleep = lambda seconds: None
+    return module
+
+
+# datetime module for the handlers, now(), utcnow() and today() follow the clock
+def virtual_datetime_module(clock):
+    class VirtualDatetime(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.datetime.fromtimestamp(clock.time(), tz)
+
+        @classmethod
+        def utcnow(cls):
+            return datetime.datetime.fromtimestamp(clock.time(), datetime.timezone.utc).replace(tzinfo=None)
+
+        @classmethod
+        def today(cls):
+            return cls.now()
+
+    module = types.ModuleType('datetime')
+    module.__dict__.update(datetime.__dict__)
+    module.datetime = VirtualDatetime
+    return module
+
+
+# Events ordered by virtual time, events at the same time run in the order they were scheduled
+class EventQueue:
+    def __init__(self, clock, lock):
+        self.clock = clock
+        self.lock = lock
+        self._events = []
+        self._sequence = 0
+        self._foreground = 0
+
+    def schedule(self, delay_seconds, callback, label, background=False):
+        with self.lock:
+            self._sequence += 1
+            self._foreground += 0 if background else 1
+            heapq.heappush(self._events, (self.clock.now + max(0, delay_seconds), self._sequence, label, callback,
+                                          background))
+
+    # Background events, such as the scheduled JobScheduler runs, never keep the simulation going on their own
+    def pending(self):
+        return self._foreground
+
+    def run_next(self):
+        with self.lock:
+            if not self._events:
+                return False
+            event_time, sequence, label, callback, background = heapq.heappop(self._events)
+            self._foreground -= 0 if background else 1
+            self.clock.now = max(self.clock.now, event_time)
+        callback()
+        return True
+
+    def next_time(self):
+        with self.lock:
+            return self._events[0][0] if self._events else None
+
+
+############# API Call Recording #############
+
+# Counts API calls per calling function, invocations started from a thread of another invocation
+# (e.g. a ThreadPoolExecutor in the handler) belong to the invocation that started the pool
+class ApiRecorder:
+    def __init__(self):
+        self.calls = Counter()
+        self._local = threading.local()
+        self._active = []
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def enter(self, actor):
+        stack = self._stack()
+        stack.append(actor)
+        if threading.current_thread() is threading.main_thread():
+            self._active.append(actor)
+
+    def leave(self):
+        self._stack().pop()
+        if threading.current_thread() is threading.main_thread():
+            self._active.pop()
+
+    def current_actor(self):
+        stack = self._stack()
+        if stack:
+            return stack[-1]
+        if self._active:
+            return self._active[-1]
+        return simulator_actor
+
+    def record(self, service_name, operation):
+        with self._lock:
+            self.calls[(self.current_actor(), service_name, operation)] += 1
+
+
+############# Errors #############
+
+def client_error(operation, code, message, status_code=400):
+    return ClientError({
+        'Error': {'Code': code, 'Message': message},
+        'ResponseMetadata': {'RequestId': uuid.uuid4().hex[:16].upper(), 'HostId': uuid.uuid4().hex,
+                             'HTTPStatusCode': status_code},
+    }, operation)
+
+
+def response_metadata(status_code=200):
+    return {
+        'RequestId': uuid.uuid4().hex[:16].upper(),
+        'HostId': uuid.uuid4().hex,
+        'HTTPStatusCode': status_code,
+        'HTTPHeaders': {},
+        'RetryAttempts': 0,
+    }
+
+
+# Mark a stand-in method that must not hold the service lock, e.g. Lambda Invoke, which runs another handler
+def unlocked(method):
+    method.unlocked = True
+    return method
+
+
+# CopySource may be given as a dict, the SDK sends it as bucket/key?versionId=
+def sdk_parameters(kwargs):
+    copy_source = kwargs.get('CopySource')
+    if not isinstance(copy_source, dict):
+        return kwargs
+    header = f"{copy_source['Bucket']}/{parse.quote(copy_source['Key'], safe='/~')}"
+    if copy_source.get('VersionId'):
+        header = f"{header}?versionId={copy_source['VersionId']}"
+    return dict(kwargs, CopySource=header)
+
+
+def operation_name(method_name):
+    return sdk_operations.get(method_name) or ''.join(part.capitalize() for part in method_name.split('_'))
+
+
+############# Clients #############
+
+# A boto3 client over a stand-in: parameters are validated against the botocore service model as the real
+# client does, idempotency tokens are filled in, and each call is recorded for the calling function
+class LocalClient:
+    def __init__(self, aws, service_name, implementation):
+        self._aws = aws
+        self._service_name = service_name
+        self._implementation = implementation
+
+    def __getattr__(self, name):
+        method = getattr(self._implementation, name, None)
+        if name.startswith('_') or method is None:
+            raise NotImplementedError(f'The pipeline simulator does not implement {self._service_name}.{name}')
+        operation = operation_name(name)
+        service_model = self._aws.service_model(self._service_name)
+
+        def api_call(*args, **kwargs):
+            kwargs = sdk_parameters(kwargs)
+            if name not in sdk_operations and operation in service_model.operation_names:
+                operation_model = service_model.operation_model(operation)
+                for member in operation_model.idempotent_members:
+                    kwargs.setdefault(member, str(uuid.uuid4()))
+                validate_parameters(kwargs, operation_model.input_shape)
+            self._aws.recorder.record(self._service_name, operation)
+            if getattr(method, 'unlocked', False):
+                response = method(*args, **kwargs)
+            else:
+                with self._aws.lock:
+                    response = method(*args, **kwargs)
+            if isinstance(response, dict):
+                response.setdefault('ResponseMetadata', response_metadata())
+            return response
+        return api_call
+
+
+# The stand-in services of one simulation and the boto3.client/boto3.resource replacements handing them out
+class LocalAWS:
+    def __init__(self, clock, region, account_id):
+        self.clock = clock
+        self.region = region
+        self.account_id = account_id
+        self.lock = threading.RLock()
+        self.events = EventQueue(clock, self.lock)
+        self.recorder = ApiRecorder()
+        self.services = {}
+        self.resources = {}
+        self._session = botocore.session.get_session()
+        self._service_models = {}
+
+    def service_model(self, service_name):
+        if service_name not in self._service_models:
+            self._service_models[service_name] = self._session.get_service_model(service_name)
+        return self._service_models[service_name]
+
+    def register(self, service_name, implementation, resource=None):
+        self.services[service_name] = implementation
+        if resource is not None:
+            self.resources[service_name] = resource
+
+    def client(self, service_name, *args, **kwargs):
+        if service_name not in self.services:
+            raise NotImplementedError(f'The pipeline simulator has no local {service_name}')
+        return LocalClient(self, service_name, self.services[service_name])
+
+    def resource(self, service_name, *args, **kwargs):
+        if service_name not in self.resources:
+            raise NotImplementedError(f'The pipeline simulator has no local {service_name} resource')
+        return self.resources[service_name](self)
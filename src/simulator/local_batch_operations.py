@@ -0,0 +1,344 @@
+import csv
+import heapq
+import io
+import json
+import logging
+import uuid
+from urllib import parse
+
+from botocore.exceptions import ClientError
+
+from local_aws import client_error
+
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+
+# Other Variables
+batch_operations_actor = 'S3BatchOperations'
+report_schema = 'Bucket, Key, VersionId, TaskStatus, ErrorCode, HTTPStatusCode, ResultMessage'
+active_statuses = ['New', 'Preparing', 'Ready', 'Active', 'Pausing', 'Paused', 'Cancelling', 'Suspended']
+# Tasks run in groups of this many per event, which keeps the event queue small on large jobs
+tasks_per_event = 100
+# Batch Operations retries tasks a Lambda function reports as TemporaryFailure
+max_task_attempts = 3
+
+
+def bucket_from_arn(arn):
+    return arn.split(':::', 1)[1].split('/', 1)[0]
+
+
+# Schema 1.0 event of a LambdaInvoke task, the key is URL encoded as it is in the manifest
+def lambda_invoke_payload(job_id, task):
+    return {
+        'invocationSchemaVersion': '1.0',
+        'invocationId': str(uuid.uuid4()),
+        'job': {'id': job_id},
+        'tasks': [{
+            'taskId': str(uuid.uuid4()),
+            's3Key': task['Key'],
+            's3VersionId': task['VersionId'],
+            's3BucketArn': f'arn:aws:s3:::{task["Bucket"]}',
+        }],
+    }
+
+
+############# S3 Batch Operations #############
+
+# s3control jobs: the manifest is read when the job is created, tasks run after the setup time at the modelled
+# rate and the completion report is written at the end, which starts JobTracker through the bucket notification
+class LocalBatchOperations:
+    def __init__(self, aws, setup_seconds=120, restore_tasks_per_second=1000, lambda_concurrency=100,
+                 native_copy_concurrency=1000, copy_bytes_per_second=100 * 1024 ** 2, task_overhead_seconds=0.2):
+        self.aws = aws
+        self.jobs = {}
+        self.setup_seconds = setup_seconds
+        self.restore_tasks_per_second = restore_tasks_per_second
+        self.lambda_concurrency = lambda_concurrency
+        self.native_copy_concurrency = native_copy_concurrency
+        self.copy_bytes_per_second = copy_bytes_per_second
+        self.task_overhead_seconds = task_overhead_seconds
+
+    def _s3(self):
+        return self.aws.services['s3']
+
+    def create_job(self, AccountId, Operation, Report, ClientRequestToken, Manifest, Priority, RoleArn,
+                   ConfirmationRequired=False, Description=None, Tags=None, **kwargs):
+        for job in self.jobs.values():
+            if job['client_request_token'] == ClientRequestToken:
+                return {'JobId': job['id']}
+        if len(Operation) != 1:
+            raise client_error('CreateJob', 'InvalidRequest', 'Exactly one operation must be specified')
+        job_id = str(uuid.uuid4())
+        job = {
+            'id': job_id,
+            'arn': f'arn:aws:s3:{self.aws.region}:{AccountId}:job/{job_id}',
+            'client_request_token': ClientRequestToken,
+            'operation': Operation,
+            'operation_name': next(iter(Operation)),
+            'manifest': Manifest,
+            'report': Report,
+            'priority': Priority,
+            'role_arn': RoleArn,
+            'confirmation_required': ConfirmationRequired,
+            'description': Description,
+            'tags': [dict(tag) for tag in Tags or []],
+            'status': 'New',
+            'failure_reasons': [],
+            'created': self.aws.clock.datetime(),
+            'started': None,
+            'terminated': None,
+            'tasks': [],
+            'results': [],
+            'succeeded': 0,
+            'failed': 0,
+        }
+        self.jobs[job_id] = job
+        self._read_manifest(job)
+        if job['status'] != 'Failed':
+            job['status'] = 'Preparing'
+            self.aws.events.schedule(self.setup_seconds, lambda: self._start(job), 'Batch Operations job')
+        return {'JobId': job_id}
+
+    # Manifest rows are URL encoded Bucket,Key[,VersionId] with Ignore fields skipped
+    def _read_manifest(self, job):
+        location = job['manifest']['Location']
+        manifest_bucket, manifest_key = location['ObjectArn'].split(':::', 1)[1].split('/', 1)
+        try:
+            manifest_object = self._s3()._object(manifest_bucket, manifest_key, location.get('ObjectVersionId'),
+                                                 'CreateJob')
+        except ClientError as e:
+            self._fail(job, 'ManifestNotFound', e.response['Error']['Message'])
+            return
+        if location.get('ETag') and location['ETag'].strip('"') != manifest_object.etag.strip('"'):
+            self._fail(job, 'ManifestETagMismatch', 'The ETag of the manifest does not match')
+            return
+        fields = job['manifest']['Spec']['Fields']
+        body = manifest_object.content.read(0, manifest_object.size - 1).decode('utf-8')
+        for row in csv.reader(io.StringIO(body)):
+            if not row:
+                continue
+            task = {name: value for name, value in zip(fields, row) if name != 'Ignore'}
+            task['VersionId'] = task.get('VersionId') or None
+            job['tasks'].append(task)
+
+    def _fail(self, job, code, reason):
+        job['status'] = 'Failed'
+        job['failure_reasons'].append({'FailureCode': code, 'FailureReason': reason})
+        job['terminated'] = self.aws.clock.datetime()
+
+    ############# Task Execution #############
+
+    def _task_size(self, task):
+        try:
+            return self._s3()._object(task['Bucket'], parse.unquote_plus(task['Key']), task['VersionId'],
+                                      'HeadObject').size
+        except ClientError:
+            return 0
+
+    # Start time and duration of each task: restores are submitted at a fixed rate, copies run on a fixed
+    # number of concurrent lanes and take as long as their bytes need
+    def _task_schedule(self, job):
+        if job['operation_name'] == 'S3InitiateRestoreObject':
+            return [(index / self.restore_tasks_per_second, 0) for index in range(len(job['tasks']))]
+        concurrency = self.lambda_concurrency if job['operation_name'] == 'LambdaInvoke' else \
+            self.native_copy_concurrency
+        lanes = [0.0] * min(concurrency, max(len(job['tasks']), 1))
+        schedule = []
+        for task in job['tasks']:
+            start = heapq.heappop(lanes)
+            duration = self.task_overhead_seconds + self._task_size(task) / self.copy_bytes_per_second
+            schedule.append((start, duration))
+            heapq.heappush(lanes, start + duration)
+        return schedule
+
+    def _start(self, job):
+        with self.aws.lock:
+            job['status'] = 'Active'
+            job['started'] = self.aws.clock.datetime()
+            schedule = self._task_schedule(job)
+        for first in range(0, len(job['tasks']), tasks_per_event):
+            last = min(first + tasks_per_event, len(job['tasks']))
+            self.aws.events.schedule(schedule[first][0], lambda first=first, last=last: self._run_tasks(job, first, last),
+                                     'Batch Operations tasks')
+        end = max([start + duration for start, duration in schedule] or [0])
+        self.aws.events.schedule(end, lambda: self._complete(job), 'Batch Operations job')
+
+    def _run_tasks(self, job, first, last):
+        run_task = {
+            'S3InitiateRestoreObject': self._restore_task,
+            'LambdaInvoke': self._lambda_task,
+            'S3PutObjectCopy': self._copy_task,
+        }.get(job['operation_name'])
+        self.aws.recorder.enter(batch_operations_actor)
+        try:
+            for task in job['tasks'][first:last]:
+                if run_task is None:
+                    result = ('failed', 'UnsupportedOperation', '400', f'{job["operation_name"]} is not simulated')
+                else:
+                    result = run_task(job, task)
+                with self.aws.lock:
+                    job['results'].append((task, result))
+                    job['succeeded' if result[0] == 'succeeded' else 'failed'] += 1
+        finally:
+            self.aws.recorder.leave()
+
+    def _restore_task(self, job, task):
+        restore_spec = job['operation']['S3InitiateRestoreObject']
+        self.aws.recorder.record('s3', 'RestoreObject')
+        try:
+            with self.aws.lock:
+                status_code = self._s3().initiate_restore(
+                    task['Bucket'], parse.unquote_plus(task['Key']), task['VersionId'],
+                    int(restore_spec.get('ExpirationInDays', 1)), restore_spec.get('GlacierJobTier', 'BULK'))
+        except ClientError as e:
+            # A restore already in progress is not a failure of the restore job
+            if e.response['Error']['Code'] == 'RestoreAlreadyInProgress':
+                return 'succeeded', '200', '', 'Successful'
+            return 'failed', e.response['Error']['Code'], str(e.response['ResponseMetadata']['HTTPStatusCode']), \
+                e.response['Error']['Message']
+        return 'succeeded', str(status_code), '', 'Successful'
+
+    def _lambda_task(self, job, task):
+        function_arn = job['operation']['LambdaInvoke']['FunctionArn']
+        payload = lambda_invoke_payload(job['id'], task)
+        for attempt in range(max_task_attempts):
+            self.aws.recorder.record('lambda', 'Invoke')
+            response, function_error = self.aws.services['lambda'].run(function_arn, payload)
+            if function_error:
+                return 'failed', 'PermanentFailure', '200', f'Lambda returned function error: {function_error}'
+            result = (response or {}).get('results', [{}])[0]
+            if result.get('resultCode') == 'Succeeded':
+                return 'succeeded', '200', '', result.get('resultString') or ''
+            if result.get('resultCode') != 'TemporaryFailure':
+                break
+        return 'failed', result.get('resultCode') or 'PermanentFailure', '200', result.get('resultString') or ''
+
+    def _copy_task(self, job, task):
+        copy_spec = job['operation']['S3PutObjectCopy']
+        key = parse.unquote_plus(task['Key'])
+        copy_args = {
+            'StorageClass': copy_spec.get('StorageClass'),
+            'MetadataDirective': copy_spec.get('MetadataDirective', 'COPY'),
+        }
+        if 'NewObjectMetadata' in copy_spec:
+            copy_args['Metadata'] = copy_spec['NewObjectMetadata'].get('UserMetadata', {})
+        if 'NewObjectTagging' in copy_spec:
+            copy_args['TaggingDirective'] = 'REPLACE'
+            copy_args['Tagging'] = parse.urlencode([(tag['Key'], tag['Value'])
+                                                    for tag in copy_spec['NewObjectTagging']])
+        copy_source = {'Bucket': task['Bucket'], 'Key': key}
+        if task['VersionId']:
+            copy_source['VersionId'] = task['VersionId']
+        self.aws.recorder.record('s3', 'CopyObject')
+        try:
+            with self.aws.lock:
+                self._s3().copy_object(CopySource=copy_source, Bucket=bucket_from_arn(copy_spec['TargetResource']),
+                                       Key=copy_spec.get('TargetKeyPrefix', '') + key,
+                                       **{name: value for name, value in copy_args.items() if value is not None})
+        except ClientError as e:
+            return 'failed', e.response['Error']['Code'], str(e.response['ResponseMetadata']['HTTPStatusCode']), \
+                e.response['Error']['Message']
+        return 'succeeded', '200', '', 'Successful'
+
+    ############# Completion Report #############
+
+    def _complete(self, job):
+        with self.aws.lock:
+            job['status'] = 'Complete'
+            job['terminated'] = self.aws.clock.datetime()
+            if job['report'].get('Enabled'):
+                self._write_report(job)
+
+    # Results files per task status and the manifest.json listing them, written last like S3 does
+    def _write_report(self, job):
+        report_bucket = bucket_from_arn(job['report']['Bucket'])
+        report_prefix = f"{job['report']['Prefix'].rstrip('/')}/job-{job['id']}" if job['report'].get('Prefix') \
+            else f"job-{job['id']}"
+        results = []
+        for task_status in ['succeeded', 'failed']:
+            rows = [[task['Bucket'], task['Key'], task['VersionId'] or '', status, error_code, http_status, message]
+                    for task, (status, error_code, http_status, message) in job['results'] if status == task_status]
+            if not rows or (job['report'].get('ReportScope') == 'FailedTasksOnly' and task_status == 'succeeded'):
+                continue
+            body = io.StringIO()
+            csv.writer(body, lineterminator='\n').writerows(rows)
+            results_key = f'{report_prefix}/results/{uuid.uuid4().hex}.csv'
+            put_response = self._s3().put_object(Bucket=report_bucket, Key=results_key, Body=body.getvalue())
+            results.append({'TaskExecutionStatus': task_status, 'Bucket': report_bucket,
+                            'MD5Checksum': put_response['ETag'].strip('"'), 'Key': results_key})
+        report_manifest = {
+            'Format': job['report'].get('Format'),
+            'ReportCreationDate': self.aws.clock.datetime().isoformat().replace('+00:00', 'Z'),
+            'Results': results,
+            'ReportSchema': report_schema,
+        }
+        self._s3().put_object(Bucket=report_bucket, Key=f'{report_prefix}/manifest.json',
+                              Body=json.dumps(report_manifest))
+
+    ############# Job API #############
+
+    def _job(self, job_id, operation):
+        if job_id not in self.jobs:
+            raise client_error(operation, 'NoSuchJob', 'The specified job does not exist', 404)
+        return self.jobs[job_id]
+
+    def _progress(self, job):
+        progress = {
+            'TotalNumberOfTasks': len(job['tasks']),
+            'NumberOfTasksSucceeded': job['succeeded'],
+            'NumberOfTasksFailed': job['failed'],
+        }
+        if job['started']:
+            end = job['terminated'] or self.aws.clock.datetime()
+            progress['Timers'] = {'ElapsedTimeInActiveSeconds': int((end - job['started']).total_seconds())}
+        return progress
+
+    def describe_job(self, AccountId, JobId, **kwargs):
+        job = self._job(JobId, 'DescribeJob')
+        description = {
+            'JobId': job['id'],
+            'ConfirmationRequired': job['confirmation_required'],
+            'JobArn': job['arn'],
+            'Status': job['status'],
+            'Manifest': job['manifest'],
+            'Operation': job['operation'],
+            'Priority': job['priority'],
+            'ProgressSummary': self._progress(job),
+            'FailureReasons': job['failure_reasons'],
+            'Report': job['report'],
+            'CreationTime': job['created'],
+            'RoleArn': job['role_arn'],
+        }
+        if job['description']:
+            description['Description'] = job['description']
+        if job['terminated']:
+            description['TerminationDate'] = job['terminated']
+        return {'Job': description}
+
+    def list_jobs(self, AccountId, JobStatuses=None, NextToken=None, MaxResults=1000, **kwargs):
+        jobs = [job for job in self.jobs.values() if not JobStatuses or job['status'] in JobStatuses]
+        start = int(NextToken or 0)
+        response = {'Jobs': [{
+            'JobId': job['id'],
+            'Description': job['description'] or '',
+            'Operation': job['operation_name'],
+            'Priority': job['priority'],
+            'Status': job['status'],
+            'CreationTime': job['created'],
+            'ProgressSummary': self._progress(job),
+            **({'TerminationDate': job['terminated']} if job['terminated'] else {}),
+        } for job in jobs[start:start + MaxResults]]}
+        if start + MaxResults < len(jobs):
+            response['NextToken'] = str(start + MaxResults)
+        return response
+
+    def get_job_tagging(self, AccountId, JobId, **kwargs):
+        return {'Tags': [dict(tag) for tag in self._job(JobId, 'GetJobTagging')['tags']]}
+
+    ############# Statistics #############
+
+    def active_jobs(self):
+        return [job for job in self.jobs.values() if job['status'] in active_statuses]
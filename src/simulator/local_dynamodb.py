@@ -0,0 +1,534 @@
+import logging
+import re
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+from local_aws import client_error
+
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+
+# Other Variables
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+token_pattern = re.compile(r'\s*(<>|<=|>=|[=<>(),+\-]|#[A-Za-z0-9_]+|:[A-Za-z0-9_]+|[A-Za-z_][A-Za-z0-9_.\[\]]*)')
+keywords = ['AND', 'OR', 'NOT', 'BETWEEN', 'IN', 'SET', 'REMOVE', 'ADD', 'DELETE']
+missing = object()
+
+
+def serialize_item(item):
+    return {name: serializer.serialize(value) for name, value in item.items()}
+
+
+def deserialize_item(item):
+    return {name: deserializer.deserialize(value) for name, value in item.items()}
+
+
+############# Expressions #############
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = token_pattern.match(expression, position)
+        if not match:
+            raise client_error('Query', 'ValidationException', f'Invalid expression: {expression}')
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+# Evaluates the condition, key condition and update expressions the handlers send, against one item
+class Expression:
+    def __init__(self, expression, names=None, values=None, operation='UpdateItem'):
+        self.tokens = tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+        self.operation = operation
+
+    def _error(self, message):
+        return client_error(self.operation, 'ValidationException', f'Invalid expression: {message}')
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        self.position += 1
+        return token
+
+    def _expect(self, expected):
+        token = self._next()
+        if token is None or token.upper() != expected:
+            raise self._error(f'expected {expected}, found {token}')
+
+    def _at_keyword(self, keyword):
+        token = self._peek()
+        return token is not None and token.upper() == keyword
+
+    def _path(self):
+        token = self._next()
+        if token is None:
+            raise self._error('unexpected end of expression')
+        if token.startswith('#'):
+            if token not in self.names:
+                raise self._error(f'undefined attribute name {token}')
+            return self.names[token]
+        return token
+
+    def _value(self, token):
+        if token not in self.values:
+            raise self._error(f'undefined attribute value {token}')
+        return self.values[token]
+
+    # An operand is a value placeholder, an attribute path or size(path)
+    def _operand(self, item):
+        token = self._peek()
+        if token is not None and token.startswith(':'):
+            return self._value(self._next())
+        if token is not None and token.lower() == 'size':
+            self._next()
+            self._expect('(')
+            value = item.get(self._path(), missing)
+            self._expect(')')
+            return missing if value is missing else Decimal(len(value))
+        return item.get(self._path(), missing)
+
+    ############# Conditions #############
+
+    def condition(self, item):
+        result = self._or(item)
+        if self._peek() is not None:
+            raise self._error(f'unexpected {self._peek()}')
+        return result
+
+    def _or(self, item):
+        result = self._and(item)
+        while self._at_keyword('OR'):
+            self._next()
+            result = self._and(item) or result
+        return result
+
+    def _and(self, item):
+        result = self._not(item)
+        while self._at_keyword('AND'):
+            self._next()
+            result = self._not(item) and result
+        return result
+
+    def _not(self, item):
+        if self._at_keyword('NOT'):
+            self._next()
+            return not self._not(item)
+        return self._primary(item)
+
+    def _primary(self, item):
+        token = self._peek()
+        if token == '(':
+            self._next()
+            result = self._or(item)
+            self._expect(')')
+            return result
+        if token is not None and token.lower() in ['attribute_exists', 'attribute_not_exists', 'contains',
+                                                     'begins_with', 'attribute_type']:
+            return self._function(item)
+        left = self._operand(item)
+        operator = self._next()
+        if operator is not None and operator.upper() == 'BETWEEN':
+            low = self._operand(item)
+            self._expect('AND')
+            high = self._operand(item)
+            return compare(low, '<=', left) and compare(left, '<=', high)
+        if operator is not None and operator.upper() == 'IN':
+            self._expect('(')
+            candidates = [self._operand(item)]
+            while self._peek() == ',':
+                self._next()
+                candidates.append(self._operand(item))
+            self._expect(')')
+            return any(compare(left, '=', candidate) for candidate in candidates)
+        if operator not in ['=', '<>', '<', '<=', '>', '>=']:
+            raise self._error(f'unexpected {operator}')
+        return compare(left, operator, self._operand(item))
+
+    def _function(self, item):
+        function_name = self._next().lower()
+        self._expect('(')
+        value = item.get(self._path(), missing)
+        argument = None
+        if function_name != 'attribute_exists' and function_name != 'attribute_not_exists':
+            self._expect(',')
+            argument = self._operand(item)
+        self._expect(')')
+        if function_name == 'attribute_exists':
+            return value is not missing
+        if function_name == 'attribute_not_exists':
+            return value is missing
+        if value is missing or argument is missing:
+            return False
+        if function_name == 'contains':
+            if isinstance(value, str):
+                return isinstance(argument, str) and argument in value
+            return isinstance(value, (set, list)) and argument in value
+        if function_name == 'begins_with':
+            return isinstance(value, str) and isinstance(argument, str) and value.startswith(argument)
+        return type_code(value) == argument
+
+    ############# Updates #############
+
+    # Apply the update to a copy of the item, returns the new item and the names of the attributes it touched
+    def update(self, item):
+        item = dict(item)
+        updated = []
+        while self._peek() is not None:
+            clause = self._next().upper()
+            if clause not in ['SET', 'REMOVE', 'ADD', 'DELETE']:
+                raise self._error(f'unexpected {clause}')
+            while True:
+                name = self._path()
+                updated.append(name)
+                if clause == 'SET':
+                    self._expect('=')
+                    item[name] = self._set_value(item)
+                elif clause == 'REMOVE':
+                    item.pop(name, None)
+                elif clause == 'ADD':
+                    item[name] = add_value(item.get(name, missing), self._value(self._next()), self)
+                else:
+                    remaining = item.get(name, set()) - self._value(self._next())
+                    if remaining:
+                        item[name] = remaining
+                    else:
+                        item.pop(name, None)
+                if self._peek() != ',':
+                    break
+                self._next()
+        return item, updated
+
+    def _set_value(self, item):
+        value = self._set_operand(item)
+        if self._peek() in ['+', '-']:
+            operator = self._next()
+            other = self._set_operand(item)
+            if not isinstance(value, Decimal) or not isinstance(other, Decimal):
+                raise self._error('an operand in the update expression has an incorrect data type')
+            value = value + other if operator == '+' else value - other
+        return value
+
+    def _set_operand(self, item):
+        token = self._peek()
+        if token is not None and token.lower() in ['if_not_exists', 'list_append']:
+            function_name = self._next().lower()
+            self._expect('(')
+            # The attribute if_not_exists checks may be missing
+            first = self._operand(item) if function_name == 'if_not_exists' else self._set_operand(item)
+            self._expect(',')
+            second = self._set_operand(item)
+            self._expect(')')
+            if function_name == 'if_not_exists':
+                return second if first is missing else first
+            return list(first) + list(second)
+        value = self._operand(item)
+        if value is missing:
+            raise self._error('the provided expression refers to an attribute that does not exist in the item')
+        return value
+
+
+def compare(left, operator, right):
+    if left is missing or right is missing:
+        return operator == '<>'
+    if operator == '=':
+        return left == right
+    if operator == '<>':
+        return left != right
+    if type(left) is not type(right) and not (isinstance(left, Decimal) and isinstance(right, Decimal)):
+        return False
+    return {'<': left < right, '<=': left <= right, '>': left > right, '>=': left >= right}[operator]
+
+
+def add_value(current, value, expression):
+    if current is missing:
+        return value
+    if isinstance(current, Decimal) and isinstance(value, Decimal):
+        return current + value
+    if isinstance(current, set) and isinstance(value, set):
+        return current | value
+    raise expression._error('an operand in the update expression has an incorrect data type')
+
+
+def type_code(value):
+    return next(iter(serializer.serialize(value)))
+
+
+############# Tables #############
+
+class Table:
+    def __init__(self, name, key_schema, indexes):
+        self.name = name
+        self.hash_key = key_schema['HASH']
+        self.range_key = key_schema.get('RANGE')
+        # Index name to its key attributes and projected attributes, None projects all attributes
+        self.indexes = indexes
+        self.items = {}
+
+    def key_of(self, item):
+        return item.get(self.hash_key), item.get(self.range_key) if self.range_key else None
+
+    def key_names(self):
+        return [name for name in [self.hash_key, self.range_key] if name]
+
+
+def key_schema(definition):
+    return {element['KeyType']: element['AttributeName'] for element in definition}
+
+
+class LocalDynamoDB:
+    def __init__(self, aws):
+        self.aws = aws
+        self.tables = {}
+
+    # Create a table from the properties of an AWS::DynamoDB::Table resource
+    def add_table(self, name, properties):
+        indexes = {}
+        for index in properties.get('GlobalSecondaryIndexes', []) + properties.get('LocalSecondaryIndexes', []):
+            projection = index.get('Projection', {})
+            projected = None
+            if projection.get('ProjectionType') == 'KEYS_ONLY':
+                projected = []
+            elif projection.get('ProjectionType') == 'INCLUDE':
+                projected = list(projection.get('NonKeyAttributes', []))
+            indexes[index['IndexName']] = {'keys': key_schema(index['KeySchema']), 'projected': projected}
+        self.tables[name] = Table(name, key_schema(properties['KeySchema']), indexes)
+        return self.tables[name]
+
+    def _table(self, name, operation):
+        if name not in self.tables:
+            raise client_error(operation, 'ResourceNotFoundException', 'Requested resource not found')
+        return self.tables[name]
+
+    def _key(self, table, key, operation):
+        key = deserialize_item(key)
+        if sorted(key) != sorted(table.key_names()):
+            raise client_error(operation, 'ValidationException',
+                               'The provided key element does not match the schema')
+        return table.key_of(key)
+
+    def _check_condition(self, operation, item, condition_expression, names, values):
+        if condition_expression and not Expression(condition_expression, names, values, operation).condition(item):
+            raise client_error(operation, 'ConditionalCheckFailedException', 'The conditional request failed')
+
+    def _values(self, values):
+        return deserialize_item(values or {})
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, ReturnValues='NONE', **kwargs):
+        table = self._table(TableName, 'PutItem')
+        item = deserialize_item(Item)
+        key = table.key_of(item)
+        if None in key[:1 if not table.range_key else 2]:
+            raise client_error('PutItem', 'ValidationException', 'Missing the key in the item')
+        old_item = table.items.get(key, {})
+        self._check_condition('PutItem', old_item, ConditionExpression, ExpressionAttributeNames,
+                              self._values(ExpressionAttributeValues))
+        table.items[key] = item
+        if ReturnValues == 'ALL_OLD' and old_item:
+            return {'Attributes': serialize_item(old_item)}
+        return {}
+
+    def get_item(self, TableName, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        table = self._table(TableName, 'GetItem')
+        item = table.items.get(self._key(table, Key, 'GetItem'))
+        if item is None:
+            return {}
+        return {'Item': serialize_item(project(item, ProjectionExpression, ExpressionAttributeNames))}
+
+    def delete_item(self, TableName, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE', **kwargs):
+        table = self._table(TableName, 'DeleteItem')
+        key = self._key(table, Key, 'DeleteItem')
+        old_item = table.items.get(key, {})
+        self._check_condition('DeleteItem', old_item, ConditionExpression, ExpressionAttributeNames,
+                              self._values(ExpressionAttributeValues))
+        table.items.pop(key, None)
+        if ReturnValues == 'ALL_OLD' and old_item:
+            return {'Attributes': serialize_item(old_item)}
+        return {}
+
+    def update_item(self, TableName, Key, UpdateExpression=None, ConditionExpression=None,
+                    ExpressionAttributeNames=None, ExpressionAttributeValues=None, ReturnValues='NONE', **kwargs):
+        table = self._table(TableName, 'UpdateItem')
+        key = self._key(table, Key, 'UpdateItem')
+        values = self._values(ExpressionAttributeValues)
+        old_item = table.items.get(key, {})
+        self._check_condition('UpdateItem', old_item, ConditionExpression, ExpressionAttributeNames, values)
+        new_item = dict(old_item or deserialize_item(Key))
+        updated = []
+        if UpdateExpression:
+            new_item, updated = Expression(UpdateExpression, ExpressionAttributeNames, values).update(new_item)
+        if any(name in updated for name in table.key_names()):
+            raise client_error('UpdateItem', 'ValidationException',
+                               'Cannot update attribute, this attribute is part of the key')
+        table.items[key] = new_item
+        if ReturnValues == 'ALL_NEW':
+            return {'Attributes': serialize_item(new_item)}
+        if ReturnValues == 'ALL_OLD' and old_item:
+            return {'Attributes': serialize_item(old_item)}
+        if ReturnValues == 'UPDATED_NEW':
+            return {'Attributes': serialize_item({name: new_item[name] for name in updated if name in new_item})}
+        if ReturnValues == 'UPDATED_OLD':
+            return {'Attributes': serialize_item({name: old_item[name] for name in updated if name in old_item})}
+        return {}
+
+    # Items of the table or index in key order, an index only holds the items that carry its key attributes
+    def _ordered_items(self, table, index_name, operation):
+        if index_name is None:
+            key_names = table.key_names()
+            projected = None
+        else:
+            if index_name not in table.indexes:
+                raise client_error(operation, 'ValidationException',
+                                   'The table does not have the specified index: ' + index_name)
+            index = table.indexes[index_name]
+            key_names = [index['keys']['HASH']] + ([index['keys']['RANGE']] if 'RANGE' in index['keys'] else [])
+            projected = None if index['projected'] is None else index['projected'] + key_names + table.key_names()
+        items = [item for item in table.items.values() if all(name in item for name in key_names)]
+        items.sort(key=lambda item: tuple(sort_value(item[name]) for name in key_names + table.key_names()))
+        return items, key_names, projected
+
+    def _page(self, table, index_name, operation, matches, Limit, ExclusiveStartKey, Select, ProjectionExpression,
+              ExpressionAttributeNames, FilterExpression, values):
+        items, key_names, projected = self._ordered_items(table, index_name, operation)
+        order = key_names + table.key_names()
+        if ExclusiveStartKey:
+            start = deserialize_item(ExclusiveStartKey)
+            start_position = tuple(sort_value(start.get(name)) for name in order)
+            items = [item for item in items
+                     if tuple(sort_value(item[name]) for name in order) > start_position]
+        evaluated = []
+        last_key = None
+        for item in items:
+            if not matches(item):
+                continue
+            evaluated.append(item)
+            if Limit and len(evaluated) >= Limit:
+                last_key = {name: item[name] for name in dict.fromkeys(order)}
+                break
+        returned = [item for item in evaluated
+                    if not FilterExpression or Expression(FilterExpression, ExpressionAttributeNames, values,
+                                                          operation).condition(item)]
+        response = {'Count': len(returned), 'ScannedCount': len(evaluated)}
+        if Select != 'COUNT':
+            if projected is not None:
+                returned = [{name: value for name, value in item.items() if name in projected} for item in returned]
+            response['Items'] = [serialize_item(project(item, ProjectionExpression, ExpressionAttributeNames))
+                                 for item in returned]
+        if last_key and len(evaluated) < len(items):
+            response['LastEvaluatedKey'] = serialize_item(last_key)
+        return response
+
+    def query(self, TableName, KeyConditionExpression, IndexName=None, ExpressionAttributeNames=None,
+              ExpressionAttributeValues=None, FilterExpression=None, Select=None, Limit=None,
+              ExclusiveStartKey=None, ProjectionExpression=None, **kwargs):
+        table = self._table(TableName, 'Query')
+        values = self._values(ExpressionAttributeValues)
+
+        def matches(item):
+            return Expression(KeyConditionExpression, ExpressionAttributeNames, values, 'Query').condition(item)
+        return self._page(table, IndexName, 'Query', matches, Limit, ExclusiveStartKey, Select, ProjectionExpression,
+                          ExpressionAttributeNames, FilterExpression, values)
+
+    def scan(self, TableName, IndexName=None, FilterExpression=None, ExpressionAttributeNames=None,
+             ExpressionAttributeValues=None, Select=None, Limit=None, ExclusiveStartKey=None,
+             ProjectionExpression=None, **kwargs):
+        table = self._table(TableName, 'Scan')
+        return self._page(table, IndexName, 'Scan', lambda item: True, Limit, ExclusiveStartKey, Select,
+                          ProjectionExpression, ExpressionAttributeNames, FilterExpression,
+                          self._values(ExpressionAttributeValues))
+
+
+# Numbers sort before strings, missing values first, so mixed keys still order deterministically
+def sort_value(value):
+    if value is None:
+        return (0, '')
+    if isinstance(value, Decimal):
+        return (1, value)
+    return (2, str(value))
+
+
+def project(item, projection_expression, names):
+    if not projection_expression:
+        return item
+    attributes = [(names or {}).get(name.strip(), name.strip()) for name in projection_expression.split(',')]
+    return {name: value for name, value in item.items() if name in attributes}
+
+
+############# DynamoDB Resource #############
+
+# The boto3 Table resource: builds expressions from condition objects and converts Python values,
+# then calls the local client so every call is validated and recorded
+class LocalTableResource:
+    def __init__(self, client, name):
+        self._client = client
+        self.name = name
+        self.table_name = name
+
+    def _expressions(self, kwargs):
+        builder = ConditionExpressionBuilder()
+        names = dict(kwargs.pop('ExpressionAttributeNames', None) or {})
+        values = dict(kwargs.pop('ExpressionAttributeValues', None) or {})
+        for argument, is_key_condition in [('KeyConditionExpression', True), ('ConditionExpression', False),
+                                           ('FilterExpression', False)]:
+            if isinstance(kwargs.get(argument), ConditionBase):
+                built = builder.build_expression(kwargs[argument], is_key_condition=is_key_condition)
+                kwargs[argument] = built.condition_expression
+                names.update(built.attribute_name_placeholders)
+                values.update(built.attribute_value_placeholders)
+        if names:
+            kwargs['ExpressionAttributeNames'] = names
+        if values:
+            kwargs['ExpressionAttributeValues'] = serialize_item(values)
+        for argument in ['Item', 'Key', 'ExclusiveStartKey']:
+            if argument in kwargs:
+                kwargs[argument] = serialize_item(kwargs[argument])
+        return dict(kwargs, TableName=self.name)
+
+    def _response(self, response):
+        for argument in ['Attributes', 'Item', 'LastEvaluatedKey']:
+            if argument in response:
+                response[argument] = deserialize_item(response[argument])
+        if 'Items' in response:
+            response['Items'] = [deserialize_item(item) for item in response['Items']]
+        return response
+
+    def put_item(self, **kwargs):
+        return self._response(self._client.put_item(**self._expressions(kwargs)))
+
+    def get_item(self, **kwargs):
+        return self._response(self._client.get_item(**self._expressions(kwargs)))
+
+    def update_item(self, **kwargs):
+        return self._response(self._client.update_item(**self._expressions(kwargs)))
+
+    def delete_item(self, **kwargs):
+        return self._response(self._client.delete_item(**self._expressions(kwargs)))
+
+    def query(self, **kwargs):
+        return self._response(self._client.query(**self._expressions(kwargs)))
+
+    def scan(self, **kwargs):
+        return self._response(self._client.scan(**self._expressions(kwargs)))
+
+
+class LocalDynamoDBResource:
+    def __init__(self, aws):
+        self._client = aws.client('dynamodb')
+
+    def Table(self, name):
+        return LocalTableResource(self._client, name)
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import logging
+import re
+import uuid
+
+from local_aws import simulator_actor
+
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+
+# Other Variables
+# The Lambda poller that reads the queue for its event source mapping
+event_source_mapping_actor = 'EventSourceMapping'
+rate_units = {'minute': 60, 'minutes': 60, 'hour': 3600, 'hours': 3600, 'day': 86400, 'days': 86400}
+
+
+# EventBridge event patterns: lists match any of their values or {'prefix': ...}, dicts match nested fields
+def pattern_matches(pattern, event):
+    for name, expected in pattern.items():
+        value = event.get(name) if isinstance(event, dict) else None
+        if isinstance(expected, dict):
+            if not isinstance(value, dict) or not pattern_matches(expected, value):
+                return False
+            continue
+        if not any(value.startswith(candidate['prefix']) if isinstance(candidate, dict) and 'prefix' in candidate
+                   and isinstance(value, str) else value == candidate for candidate in expected):
+            return False
+    return True
+
+
+def rate_seconds(schedule_expression):
+    match = re.fullmatch(r'rate\((\d+) (\w+)\)', schedule_expression.strip())
+    if not match or match.group(2) not in rate_units:
+        raise ValueError(f'The pipeline simulator only runs rate() schedules, not {schedule_expression}')
+    return int(match.group(1)) * rate_units[match.group(2)]
+
+
+############# SQS #############
+
+class Queue:
+    def __init__(self, arn, visibility_timeout, retention_seconds):
+        self.arn = arn
+        self.visibility_timeout = visibility_timeout
+        self.retention_seconds = retention_seconds
+        self.messages = {}
+        self.mapping = None
+        self.flush_scheduled = False
+        self.expired = 0
+
+
+# Queues and their Lambda event source mappings, which poll batches of up to BatchSize messages,
+# wait up to the batching window to fill a batch and retry the batch item failures after the visibility timeout
+class LocalSQS:
+    def __init__(self, aws):
+        self.aws = aws
+        self.queues = {}
+
+    def add_queue(self, arn, visibility_timeout=30, retention_seconds=345600):
+        self.queues[arn] = Queue(arn, int(visibility_timeout), int(retention_seconds))
+        return self.queues[arn]
+
+    def add_event_source_mapping(self, queue_arn, function_name, batch_size=10, batching_window_seconds=0):
+        self.queues[queue_arn].mapping = {
+            'function_name': function_name,
+            'batch_size': int(batch_size),
+            'window': int(batching_window_seconds),
+        }
+
+    def send(self, queue_arn, body):
+        queue = self.queues[queue_arn]
+        now = self.aws.clock.now
+        message_id = str(uuid.uuid4())
+        queue.messages[message_id] = {'id': message_id, 'body': body, 'sent': now, 'visible': now,
+                                      'receive_count': 0}
+        self._poll_later(queue)
+
+    def _visible(self, queue):
+        now = self.aws.clock.now
+        return [message for message in queue.messages.values() if message['visible'] <= now]
+
+    # A full batch is delivered at once, otherwise when the batching window closes
+    def _poll_later(self, queue):
+        if queue.mapping is None or queue.flush_scheduled:
+            return
+        delay = 0 if len(self._visible(queue)) >= queue.mapping['batch_size'] else queue.mapping['window']
+        queue.flush_scheduled = True
+        self.aws.events.schedule(delay, lambda: self._poll(queue), 'SQS event source')
+
+    def _poll(self, queue):
+        with self.aws.lock:
+            queue.flush_scheduled = False
+            now = self.aws.clock.now
+            for message in list(queue.messages.values()):
+                if message['sent'] + queue.retention_seconds <= now:
+                    del queue.messages[message['id']]
+                    queue.expired += 1
+            batch = self._visible(queue)[:queue.mapping['batch_size']]
+            for message in batch:
+                message['receive_count'] += 1
+                message['visible'] = now + queue.visibility_timeout
+        if not batch:
+            return
+        event = {'Records': [{
+            'messageId': message['id'],
+            'receiptHandle': uuid.uuid4().hex,
+            'body': message['body'],
+            'attributes': {
+                'ApproximateReceiveCount': str(message['receive_count']),
+                'SentTimestamp': str(int(message['sent'] * 1000)),
+                'SenderId': simulator_actor,
+                'ApproximateFirstReceiveTimestamp': str(int(now * 1000)),
+            },
+            'messageAttributes': {},
+            'md5OfBody': hashlib.md5(message['body'].encode('utf-8')).hexdigest(),
+            'eventSource': 'aws:sqs',
+            'eventSourceARN': queue.arn,
+            'awsRegion': self.aws.region,
+        } for message in batch]}
+        self.aws.recorder.enter(event_source_mapping_actor)
+        try:
+            self.aws.recorder.record('sqs', 'ReceiveMessage')
+        finally:
+            self.aws.recorder.leave()
+        response, function_error = self.aws.services['lambda'].run(queue.mapping['function_name'], event)
+        failed_ids = {message['id'] for message in batch}
+        if not function_error:
+            failed_ids = {failure.get('itemIdentifier') for failure in (response or {}).get('batchItemFailures', [])}
+        with self.aws.lock:
+            for message in batch:
+                if message['id'] not in failed_ids:
+                    queue.messages.pop(message['id'], None)
+            if self._visible(queue):
+                self._poll_later(queue)
+            for message in batch:
+                if message['id'] in failed_ids:
+                    self.aws.events.schedule(queue.visibility_timeout, lambda: self._poll_later(queue),
+                                             'SQS visibility timeout')
+
+    def pending_messages(self):
+        return sum(len(queue.messages) for queue in self.queues.values())
+
+
+############# EventBridge #############
+
+class LocalEventBridge:
+    def __init__(self, aws):
+        self.aws = aws
+        self.rules = []
+
+    def add_rule(self, name, event_pattern, target_arns):
+        self.rules.append({'name': name, 'pattern': event_pattern, 'targets': target_arns})
+
+    # Scheduled rules invoke their targets in the background, they never keep the simulation going by themselves
+    def add_schedule(self, name, schedule_expression, target_arns):
+        interval = rate_seconds(schedule_expression)
+
+        def tick():
+            for target_arn in target_arns:
+                self.aws.services['lambda'].invoke_async(target_arn, {
+                    'version': '0',
+                    'id': str(uuid.uuid4()),
+                    'detail-type': 'Scheduled Event',
+                    'source': 'aws.events',
+                    'account': self.aws.account_id,
+                    'time': self.aws.clock.datetime().isoformat().replace('+00:00', 'Z'),
+                    'region': self.aws.region,
+                    'resources': [f'arn:aws:events:{self.aws.region}:{self.aws.account_id}:rule/{name}'],
+                    'detail': {},
+                }, source=name)
+            self.aws.events.schedule(interval, tick, name, background=True)
+        self.aws.events.schedule(interval, tick, name, background=True)
+
+    def put_event(self, event):
+        for rule in self.rules:
+            if not pattern_matches(rule['pattern'], event):
+                continue
+            for target_arn in rule['targets']:
+                if target_arn.startswith('arn:aws:sqs:'):
+                    self.aws.services['sqs'].send(target_arn, json.dumps(event))
+                else:
+                    self.aws.services['lambda'].invoke_async(target_arn, event, source=rule['name'])
@@ -0,0 +1,223 @@
+import builtins
+import contextlib
+import io
+import json
+import linecache
+import logging
+import os
+import threading
+import time
+import traceback
+import types
+import uuid
+
+from botocore.response import StreamingBody
+
+from local_aws import client_error, unlocked, virtual_datetime_module, virtual_time_module
+
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+
+# Other Variables
+# Asynchronous invocations that fail are retried twice, after about one and two minutes
+async_retry_delays = [60, 120]
+environment_lock = threading.Lock()
+
+
+# Name a function by its logical id without the solution prefix and the Lambda suffixes
+def display_name(logical_id):
+    name = logical_id.replace('S3AutoRestoreMigrate', '', 1)
+    for suffix in ['LambdaFunction', 'Lambdafunction', 'Function']:
+        if name.endswith(suffix) and name != suffix:
+            return name[:-len(suffix)]
+    return name
+
+
+@contextlib.contextmanager
+def environment(variables):
+    with environment_lock:
+        saved = dict(os.environ)
+        os.environ.update(variables)
+        try:
+            yield
+        finally:
+            os.environ.clear()
+            os.environ.update(saved)
+
+
+class LambdaContext:
+    def __init__(self, function, deadline):
+        self.function_name = function.spec['name']
+        self.function_version = '$LATEST'
+        self.invoked_function_arn = function.spec['arn']
+        self.memory_limit_in_mb = str(function.spec['memory_mb'])
+        self.aws_request_id = str(uuid.uuid4())
+        self.log_group_name = f'/aws/lambda/{function.spec["name"]}'
+        self.log_stream_name = uuid.uuid4().hex
+        self._deadline = deadline
+
+    # Handlers never advance the virtual clock, so every invocation has its whole timeout left
+    def get_remaining_time_in_millis(self):
+        return int(self._deadline * 1000)
+
+
+class LocalFunction:
+    def __init__(self, spec):
+        self.spec = spec
+        self.name = display_name(spec['logical_id'])
+        self.module = None
+        self.init_seconds = 0.0
+        self.invocations = 0
+        self.errors = 0
+        self.wall_seconds = 0.0
+        self.running = 0
+        self.max_running = 0
+
+
+############# Lambda #############
+
+# Runs the function code of the template in this process: each function is imported once, on its first
+# invocation, with its own environment, and reads the virtual clock instead of the system clock
+class LocalLambda:
+    def __init__(self, aws, stack, module_overrides=None):
+        self.aws = aws
+        self.functions = {}
+        self._by_name = {}
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # Modules the function code imports, replaced by the simulator's versions
+        self.module_overrides = {
+            'time': virtual_time_module(aws.clock),
+            'datetime': virtual_datetime_module(aws.clock),
+        }
+        self.module_overrides.update(module_overrides or {})
+        for logical_id in stack.function_ids():
+            properties = stack.resources[logical_id]['Properties']
+            if 'ZipFile' not in properties.get('Code', {}):
+                continue
+            function = LocalFunction(stack.function(logical_id))
+            self.functions[logical_id] = function
+            for name in [function.spec['name'], function.spec['arn'], logical_id]:
+                self._by_name[name] = function
+
+    def function(self, function_name):
+        # Qualified ARNs and names carry a version or alias after the name
+        function = self._by_name.get(function_name) or self._by_name.get(function_name.rsplit(':', 1)[0])
+        if function is None:
+            raise client_error('Invoke', 'ResourceNotFoundException', f'Function not found: {function_name}', 404)
+        return function
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if name in self.module_overrides:
+            return self.module_overrides[name]
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    # Import hook of the function code, the same module overrides for every function
+    def importer(self, function):
+        return self._import
+
+    def _load(self, function):
+        with self._load_lock:
+            if function.module is not None:
+                return function.module
+            spec = function.spec
+            filename = f'<{spec["logical_id"]}>'
+            linecache.cache[filename] = (len(spec['code']), None, spec['code'].splitlines(True), filename)
+            module = types.ModuleType(function.name)
+            module.__dict__['__builtins__'] = dict(builtins.__dict__, __import__=self.importer(function))
+            variables = dict(spec['environment'], AWS_REGION=self.aws.region, AWS_DEFAULT_REGION=self.aws.region,
+                             AWS_LAMBDA_FUNCTION_NAME=spec['name'],
+                             AWS_LAMBDA_FUNCTION_MEMORY_SIZE=str(spec['memory_mb']))
+            started = time.perf_counter()
+            self.aws.recorder.enter(function.name)
+            try:
+                with environment(variables):
+                    exec(compile(spec['code'], filename, 'exec'), module.__dict__)
+            finally:
+                self.aws.recorder.leave()
+            function.init_seconds = time.perf_counter() - started
+            function.module = module
+            return module
+
+    # The imported function code, for tools that call its helpers without invoking the handler
+    def module(self, function_name):
+        return self._load(self.function(function_name))
+
+    # Run the handler, returns its result and the error it raised, if any
+    def run(self, function_name, event):
+        function = self.function(function_name)
+        with self._stats_lock:
+            function.running += 1
+            function.max_running = max(function.max_running, function.running)
+            function.invocations += 1
+        started = time.perf_counter()
+        try:
+            module = self._load(function)
+            self.aws.recorder.enter(function.name)
+            try:
+                return module.lambda_handler(json.loads(json.dumps(event)),
+                                             LambdaContext(function, function.spec['timeout_seconds'])), None
+            finally:
+                self.aws.recorder.leave()
+        except Exception as e:
+            with self._stats_lock:
+                function.errors += 1
+            logger.error(f'{function.name} failed: {e}\n{traceback.format_exc()}')
+            return None, f'{type(e).__name__}: {e}'
+        finally:
+            with self._stats_lock:
+                function.running -= 1
+                function.wall_seconds += time.perf_counter() - started
+
+    # The Invoke API, a RequestResponse invocation runs the handler at once, an Event invocation is queued
+    @unlocked
+    def invoke(self, FunctionName, InvocationType='RequestResponse', Payload=b'{}', **kwargs):
+        if isinstance(Payload, (bytes, bytearray)):
+            Payload = Payload.decode('utf-8')
+        if hasattr(Payload, 'read'):
+            Payload = Payload.read().decode('utf-8')
+        event = json.loads(Payload or '{}')
+        self.function(FunctionName)
+        if InvocationType == 'Event':
+            self.invoke_async(FunctionName, event, source='Invoke')
+            return {'StatusCode': 202, 'Payload': StreamingBody(io.BytesIO(b''), 0)}
+        if InvocationType == 'DryRun':
+            return {'StatusCode': 204, 'Payload': StreamingBody(io.BytesIO(b''), 0)}
+        result, function_error = self.run(FunctionName, event)
+        response = {'StatusCode': 200, 'ExecutedVersion': '$LATEST'}
+        if function_error:
+            error_type, _, error_message = function_error.partition(': ')
+            body = json.dumps({'errorMessage': error_message, 'errorType': error_type}).encode('utf-8')
+            response['FunctionError'] = 'Unhandled'
+        else:
+            body = json.dumps(result).encode('utf-8')
+        response['Payload'] = StreamingBody(io.BytesIO(body), len(body))
+        return response
+
+    def invoke_async(self, function_name, event, source, attempt=0):
+        function = self.function(function_name)
+
+        def run_async():
+            result, function_error = self.run(function_name, event)
+            if function_error and attempt < len(async_retry_delays):
+                self.aws.events.schedule(async_retry_delays[attempt],
+                                         lambda: self.invoke_async(function_name, event, source, attempt + 1),
+                                         f'{function.name} retry')
+        self.aws.events.schedule(0, run_async, f'{function.name} invocation from {source}')
+
+
+############# SNS #############
+
+class LocalSNS:
+    def __init__(self, aws):
+        self.aws = aws
+        self.messages = []
+
+    def publish(self, Message, TopicArn=None, Subject=None, **kwargs):
+        message_id = str(uuid.uuid4())
+        self.messages.append({'time': self.aws.clock.now, 'topic': TopicArn, 'subject': Subject,
+                              'message': Message, 'actor': self.aws.recorder.current_actor()})
+        return {'MessageId': message_id}
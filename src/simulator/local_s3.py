@@ -0,0 +1,747 @@
+import base64
+import bisect
+import datetime
+import hashlib
+import io
+import logging
+import math
+import uuid
+from urllib import parse
+
+from botocore.response import StreamingBody
+
+from local_aws import client_error, response_metadata
+
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+
+# Other Variables
+archive_storage_classes = ['GLACIER', 'DEEP_ARCHIVE']
+single_copy_max_bytes = 5 * 1024 ** 3
+min_part_bytes = 5 * 1024 ** 2
+max_part_bytes = 5 * 1024 ** 3
+max_upload_parts = 10000
+list_page_keys = 1000
+system_metadata = ['CacheControl', 'ContentDisposition', 'ContentEncoding', 'ContentLanguage', 'ContentType',
+                   'Expires', 'WebsiteRedirectLocation']
+# Copy arguments s3transfer sends with UploadPartCopy instead of CreateMultipartUpload
+part_copy_args = ['CopySourceIfMatch', 'CopySourceIfModifiedSince', 'CopySourceIfNoneMatch',
+                  'CopySourceIfUnmodifiedSince', 'CopySourceSSECustomerAlgorithm', 'CopySourceSSECustomerKey',
+                  'CopySourceSSECustomerKeyMD5', 'SSECustomerAlgorithm', 'SSECustomerKey', 'SSECustomerKeyMD5',
+                  'RequestPayer', 'ExpectedBucketOwner']
+create_multipart_excluded_args = part_copy_args[:7] + ['MetadataDirective', 'TaggingDirective']
+
+
+############# Object Content #############
+
+# Object data, either real bytes (manifests, reports) or a seed standing for size bytes of archive data,
+# so objects of any size cost nothing to hold. Digests of a byte range are the same for every copy of it
+class Content:
+    def __init__(self, size, body=None, seed=None):
+        self.size = size
+        self.body = body
+        self.seed = seed or uuid.uuid4().hex
+
+    def digest(self, start, end):
+        if self.body is not None:
+            return hashlib.md5(self.body[start:end + 1]).digest()
+        return hashlib.md5(f'{self.seed}:{start}:{end}'.encode('utf-8')).digest()
+
+    def read(self, start, end):
+        if self.body is not None:
+            return self.body[start:end + 1]
+        return bytes(max(0, end - start + 1))
+
+    def checksum(self, algorithm):
+        return checksum_value(algorithm, self.digest(0, self.size - 1))
+
+
+def checksum_value(algorithm, digest):
+    checksum_bytes = {'CRC32': 4, 'CRC32C': 4, 'CRC64NVME': 8, 'SHA1': 20, 'SHA256': 32}[algorithm]
+    return base64.b64encode(hashlib.sha256(algorithm.encode('utf-8') + digest).digest()[:checksum_bytes]).decode('utf-8')
+
+
+def single_part_etag(content):
+    return f'"{content.digest(0, content.size - 1).hex()}"'
+
+
+def multipart_etag(part_digests):
+    return f'"{hashlib.md5(b"".join(part_digests)).hexdigest()}-{len(part_digests)}"'
+
+
+# ETag of content uploaded in parts of part_bytes, the way S3 computes it
+def content_etag(content, part_bytes=None):
+    if not part_bytes:
+        return single_part_etag(content)
+    return multipart_etag([content.digest(start, min(start + part_bytes, content.size) - 1)
+                           for start in range(0, max(content.size, 1), part_bytes)])
+
+
+class S3Object:
+    def __init__(self, key, content, version_id='null', etag=None, part_sizes=None, storage_class='STANDARD',
+                 metadata=None, headers=None, tags=None, checksums=None, last_modified=None, delete_marker=False):
+        self.key = key
+        self.content = content
+        self.version_id = version_id
+        self.part_sizes = part_sizes
+        self.etag = etag or (content_etag(content) if not part_sizes else None)
+        self.storage_class = storage_class
+        self.metadata = metadata or {}
+        self.headers = headers or {}
+        self.tags = tags or []
+        self.checksums = checksums or {}
+        self.last_modified = last_modified
+        self.delete_marker = delete_marker
+        # Set by a restore request: when it was made and when the restored copy is readable
+        self.restore_requested_at = None
+        self.restore_completes_at = None
+        self.restore_expiry = None
+
+    @property
+    def size(self):
+        return self.content.size
+
+    def is_restored(self, now):
+        return self.restore_completes_at is not None and now >= self.restore_completes_at
+
+    def is_readable(self, now):
+        return self.storage_class not in archive_storage_classes or self.is_restored(now)
+
+
+class Bucket:
+    def __init__(self, name, versioned=False):
+        self.name = name
+        self.versioned = versioned
+        self.versions = {}
+        self.sorted_keys = []
+        self.uploads = {}
+        self.notifications = []
+        self.inventory_configurations = {}
+        self.eventbridge = False
+
+    def latest(self, key):
+        versions = self.versions.get(key)
+        if not versions or versions[-1].delete_marker:
+            return None
+        return versions[-1]
+
+    def version(self, key, version_id):
+        for s3_object in self.versions.get(key, []):
+            if s3_object.version_id == version_id:
+                return s3_object
+        return None
+
+    def add(self, s3_object):
+        if s3_object.key not in self.versions:
+            self.versions[s3_object.key] = []
+            bisect.insort(self.sorted_keys, s3_object.key)
+        if self.versioned:
+            self.versions[s3_object.key].append(s3_object)
+        else:
+            self.versions[s3_object.key] = [s3_object]
+
+
+def parse_range(byte_range, size):
+    start, end = byte_range.replace('bytes=', '').split('-')
+    if not start:
+        return max(0, size - int(end)), size - 1
+    return int(start), min(int(end) if end else size - 1, size - 1)
+
+
+def parse_copy_source(copy_source):
+    if isinstance(copy_source, dict):
+        return copy_source['Bucket'], copy_source['Key'], copy_source.get('VersionId')
+    path, _, query = copy_source.lstrip('/').partition('?')
+    bucket, key = path.split('/', 1)
+    version_id = parse.parse_qs(query).get('versionId', [None])[0]
+    return bucket, parse.unquote(key), version_id
+
+
+def parse_tagging(tagging):
+    return [{'Key': key, 'Value': value} for key, value in parse.parse_qsl(tagging or '', keep_blank_values=True)]
+
+
+def read_body(body):
+    if body is None:
+        return b''
+    if isinstance(body, str):
+        return body.encode('utf-8')
+    if hasattr(body, 'read'):
+        return body.read()
+    return bytes(body)
+
+
+############# S3 #############
+
+class LocalS3:
+    def __init__(self, aws, restore_seconds):
+        self.aws = aws
+        self.buckets = {}
+        # Seconds from a restore request until the object is readable, given the object and the retrieval tier
+        self.restore_seconds = restore_seconds
+
+    def add_bucket(self, name, versioned=False):
+        self.buckets[name] = Bucket(name, versioned)
+        return self.buckets[name]
+
+    def _now(self):
+        return self.aws.clock.datetime()
+
+    def _bucket(self, name, operation):
+        if name not in self.buckets:
+            raise client_error(operation, 'NoSuchBucket', 'The specified bucket does not exist', 404)
+        return self.buckets[name]
+
+    def _object(self, bucket_name, key, version_id, operation, head=False):
+        bucket = self._bucket(bucket_name, operation)
+        s3_object = bucket.version(key, version_id) if version_id else bucket.latest(key)
+        if s3_object is None or s3_object.delete_marker:
+            if head:
+                raise client_error(operation, '404', 'Not Found', 404)
+            raise client_error(operation, 'NoSuchKey', 'The specified key does not exist.', 404)
+        return s3_object
+
+    def _new_version_id(self, bucket):
+        return uuid.uuid4().hex if bucket.versioned else 'null'
+
+    def _version_response(self, bucket, s3_object):
+        return {'VersionId': s3_object.version_id} if bucket.versioned else {}
+
+    def _store(self, bucket, s3_object, event_name):
+        s3_object.last_modified = s3_object.last_modified or self._now()
+        bucket.add(s3_object)
+        for notification in bucket.notifications:
+            if (s3_object.key.startswith(notification['prefix']) and s3_object.key.endswith(notification['suffix'])
+                    and event_name.startswith(notification['event_prefix'])):
+                self.aws.services['lambda'].invoke_async(notification['function_arn'],
+                                                         self.object_event(bucket, s3_object, event_name,
+                                                                           notification['id']),
+                                                         source='S3EventNotification')
+
+    def object_event(self, bucket, s3_object, event_name, configuration_id):
+        s3_event_object = {
+            'key': parse.quote_plus(s3_object.key, safe='/'),
+            'size': s3_object.size,
+            'eTag': s3_object.etag.strip('"'),
+            'sequencer': f'{int(self.aws.clock.now * 1000):016X}',
+        }
+        if bucket.versioned:
+            s3_event_object['versionId'] = s3_object.version_id
+        return {'Records': [{
+            'eventVersion': '2.1',
+            'eventSource': 'aws:s3',
+            'awsRegion': self.aws.region,
+            'eventTime': self._now().isoformat().replace('+00:00', 'Z'),
+            'eventName': event_name,
+            's3': {
+                's3SchemaVersion': '1.0',
+                'configurationId': configuration_id,
+                'bucket': {'name': bucket.name, 'arn': f'arn:aws:s3:::{bucket.name}'},
+                'object': s3_event_object,
+            },
+        }]}
+
+    def _object_from_args(self, key, content, args, bucket, etag=None, part_sizes=None):
+        return S3Object(
+            key, content, version_id=self._new_version_id(bucket), etag=etag, part_sizes=part_sizes,
+            storage_class=args.get('StorageClass') or 'STANDARD',
+            metadata=dict(args.get('Metadata') or {}),
+            headers={name: args[name] for name in system_metadata if args.get(name)},
+            tags=parse_tagging(args.get('Tagging')),
+            checksums={args['ChecksumAlgorithm']: content.checksum(args['ChecksumAlgorithm'])}
+            if args.get('ChecksumAlgorithm') and not part_sizes else {},
+        )
+
+    ############# Object API #############
+
+    def put_object(self, Bucket, Key, Body=None, **kwargs):
+        bucket = self._bucket(Bucket, 'PutObject')
+        body = read_body(Body)
+        s3_object = self._object_from_args(Key, Content(len(body), body=body), kwargs, bucket)
+        self._store(bucket, s3_object, 'ObjectCreated:Put')
+        response = {'ETag': s3_object.etag, 'ServerSideEncryption': 'AES256'}
+        response.update(self._version_response(bucket, s3_object))
+        if s3_object.checksums:
+            response.update({f'Checksum{algorithm}': value for algorithm, value in s3_object.checksums.items()})
+        return response
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        self.put_object(Bucket=Bucket, Key=Key, Body=Fileobj.read(), **(ExtraArgs or {}))
+
+    def _object_headers(self, bucket, s3_object, checksum_mode=None):
+        headers = {
+            'ContentLength': s3_object.size,
+            'ETag': s3_object.etag,
+            'LastModified': s3_object.last_modified,
+            'Metadata': dict(s3_object.metadata),
+            'ServerSideEncryption': 'AES256',
+            'ContentType': s3_object.headers.get('ContentType', 'binary/octet-stream'),
+        }
+        headers.update({name: value for name, value in s3_object.headers.items()})
+        headers.update(self._version_response(bucket, s3_object))
+        if s3_object.storage_class != 'STANDARD':
+            headers['StorageClass'] = s3_object.storage_class
+        if s3_object.restore_completes_at is not None:
+            if s3_object.is_restored(self.aws.clock.now):
+                expiry = datetime.datetime.fromtimestamp(s3_object.restore_expiry, datetime.timezone.utc)
+                headers['Restore'] = f'ongoing-request="false", expiry-date="{expiry.strftime("%a, %d %b %Y %H:%M:%S GMT")}"'
+            else:
+                headers['Restore'] = 'ongoing-request="true"'
+        if checksum_mode == 'ENABLED':
+            headers.update({f'Checksum{algorithm}': value for algorithm, value in s3_object.checksums.items()})
+        return headers
+
+    def head_object(self, Bucket, Key, VersionId=None, PartNumber=None, ChecksumMode=None, IfMatch=None, **kwargs):
+        bucket = self._bucket(Bucket, 'HeadObject')
+        s3_object = self._object(Bucket, Key, VersionId, 'HeadObject', head=True)
+        if IfMatch and IfMatch != s3_object.etag:
+            raise client_error('HeadObject', '412', 'Precondition Failed', 412)
+        headers = self._object_headers(bucket, s3_object, ChecksumMode)
+        if PartNumber:
+            part_sizes = s3_object.part_sizes or [s3_object.size]
+            if PartNumber > len(part_sizes):
+                raise client_error('HeadObject', '416', 'Requested Range Not Satisfiable', 416)
+            headers['ContentLength'] = part_sizes[PartNumber - 1]
+            headers['PartsCount'] = len(part_sizes)
+            for algorithm in list(s3_object.checksums):
+                headers.pop(f'Checksum{algorithm}', None)
+        return headers
+
+    def get_object(self, Bucket, Key, VersionId=None, Range=None, IfMatch=None, **kwargs):
+        bucket = self._bucket(Bucket, 'GetObject')
+        s3_object = self._object(Bucket, Key, VersionId, 'GetObject')
+        if IfMatch and IfMatch != s3_object.etag:
+            raise client_error('GetObject', 'PreconditionFailed',
+                               'At least one of the pre-conditions you specified did not hold', 412)
+        if not s3_object.is_readable(self.aws.clock.now):
+            raise client_error('GetObject', 'InvalidObjectState',
+                               "The operation is not valid for the object's storage class", 403)
+        start, end = 0, s3_object.size - 1
+        if Range:
+            start, end = parse_range(Range, s3_object.size)
+        body = s3_object.content.read(start, end)
+        response = self._object_headers(bucket, s3_object)
+        response.update({
+            'Body': StreamingBody(io.BytesIO(body), len(body)),
+            'ContentLength': len(body),
+        })
+        if Range:
+            response['ContentRange'] = f'bytes {start}-{end}/{s3_object.size}'
+        return response
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        bucket = self._bucket(Bucket, 'DeleteObjects')
+        deleted = []
+        for delete_object in Delete['Objects']:
+            key = delete_object['Key']
+            if bucket.versioned:
+                bucket.add(S3Object(key, Content(0), version_id=self._new_version_id(bucket),
+                                    last_modified=self._now(), delete_marker=True))
+            elif key in bucket.versions:
+                bucket.versions.pop(key)
+                bucket.sorted_keys.remove(key)
+            deleted.append({'Key': key})
+        return {'Deleted': deleted}
+
+    def get_object_tagging(self, Bucket, Key, VersionId=None, **kwargs):
+        bucket = self._bucket(Bucket, 'GetObjectTagging')
+        s3_object = self._object(Bucket, Key, VersionId, 'GetObjectTagging')
+        response = {'TagSet': [dict(tag) for tag in s3_object.tags]}
+        response.update(self._version_response(bucket, s3_object))
+        return response
+
+    # The source of a copy must exist, match CopySourceIfMatch and be readable, i.e. restored when archived
+    def _copy_source(self, copy_source, copy_source_if_match, operation):
+        source_bucket, source_key, source_version_id = parse_copy_source(copy_source)
+        source = self._object(source_bucket, source_key, source_version_id, operation)
+        if copy_source_if_match and copy_source_if_match != source.etag:
+            raise client_error(operation, 'PreconditionFailed',
+                               'At least one of the pre-conditions you specified did not hold', 412)
+        if not source.is_readable(self.aws.clock.now):
+            raise client_error(operation, 'InvalidObjectState',
+                               f'Object is of storage class {source.storage_class}. Unable to perform copy operations '
+                               f'on {source.storage_class} objects. You must restore the object to be able to perform '
+                               f'the operation.', 403)
+        return source
+
+    def copy_object(self, CopySource, Bucket, Key, CopySourceIfMatch=None, MetadataDirective='COPY',
+                    TaggingDirective='COPY', **kwargs):
+        bucket = self._bucket(Bucket, 'CopyObject')
+        source = self._copy_source(CopySource, CopySourceIfMatch, 'CopyObject')
+        if source.size > single_copy_max_bytes:
+            raise client_error('CopyObject', 'InvalidRequest',
+                               f'The specified copy source is larger than the maximum allowable size for a copy '
+                               f'source: {single_copy_max_bytes}')
+        args = dict(kwargs)
+        if MetadataDirective == 'COPY':
+            args['Metadata'] = source.metadata
+            args.update(source.headers)
+        s3_object = self._object_from_args(Key, source.content, args, bucket)
+        if TaggingDirective == 'COPY':
+            s3_object.tags = [dict(tag) for tag in source.tags]
+        if not kwargs.get('ChecksumAlgorithm'):
+            s3_object.checksums = {algorithm: value for algorithm, value in source.checksums.items()}
+        self._store(bucket, s3_object, 'ObjectCreated:Copy')
+        copy_result = {'ETag': s3_object.etag, 'LastModified': s3_object.last_modified}
+        copy_result.update({f'Checksum{algorithm}': value for algorithm, value in s3_object.checksums.items()})
+        response = {'CopyObjectResult': copy_result, 'ServerSideEncryption': 'AES256'}
+        response.update(self._version_response(bucket, s3_object))
+        return response
+
+    ############# Multipart Upload API #############
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        bucket = self._bucket(Bucket, 'CreateMultipartUpload')
+        upload_id = uuid.uuid4().hex
+        bucket.uploads[upload_id] = {'key': Key, 'args': kwargs, 'parts': {}}
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def _upload(self, bucket_name, key, upload_id, operation):
+        bucket = self._bucket(bucket_name, operation)
+        upload = bucket.uploads.get(upload_id)
+        if upload is None or upload['key'] != key:
+            raise client_error(operation, 'NoSuchUpload', 'The specified upload does not exist.', 404)
+        return bucket, upload
+
+    def upload_part_copy(self, Bucket, Key, UploadId, PartNumber, CopySource, CopySourceRange=None,
+                         CopySourceIfMatch=None, **kwargs):
+        bucket, upload = self._upload(Bucket, Key, UploadId, 'UploadPartCopy')
+        source = self._copy_source(CopySource, CopySourceIfMatch, 'UploadPartCopy')
+        start, end = 0, source.size - 1
+        if CopySourceRange:
+            start, end = parse_range(CopySourceRange, source.size)
+        if end - start + 1 > max_part_bytes:
+            raise client_error('UploadPartCopy', 'InvalidRequest', 'The specified copy range is too large')
+        part_digest = source.content.digest(start, end)
+        upload['parts'][PartNumber] = {'content': source.content, 'start': start, 'end': end, 'digest': part_digest}
+        return {'CopyPartResult': {'ETag': f'"{part_digest.hex()}"', 'LastModified': self._now()}}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body=None, **kwargs):
+        bucket, upload = self._upload(Bucket, Key, UploadId, 'UploadPart')
+        body = read_body(Body)
+        content = Content(len(body), body=body)
+        part_digest = content.digest(0, len(body) - 1)
+        upload['parts'][PartNumber] = {'content': content, 'start': 0, 'end': len(body) - 1, 'digest': part_digest}
+        return {'ETag': f'"{part_digest.hex()}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload=None, **kwargs):
+        bucket, upload = self._upload(Bucket, Key, UploadId, 'CompleteMultipartUpload')
+        part_numbers = [part['PartNumber'] for part in (MultipartUpload or {}).get('Parts', [])]
+        if not part_numbers or part_numbers != sorted(part_numbers) or len(part_numbers) > max_upload_parts:
+            raise client_error('CompleteMultipartUpload', 'InvalidPartOrder',
+                               'The list of parts was not in ascending order.')
+        parts = []
+        for part_number in part_numbers:
+            if part_number not in upload['parts']:
+                raise client_error('CompleteMultipartUpload', 'InvalidPart',
+                                   'One or more of the specified parts could not be found.')
+            parts.append(upload['parts'][part_number])
+        part_sizes = [part['end'] - part['start'] + 1 for part in parts]
+        if any(part_size < min_part_bytes for part_size in part_sizes[:-1]):
+            raise client_error('CompleteMultipartUpload', 'EntityTooSmall',
+                               'Your proposed upload is smaller than the minimum allowed object size.')
+        # Parts covering one source from start to end carry its content over, so later copies still match
+        contiguous = all(part['content'] is parts[0]['content'] for part in parts) and parts[0]['start'] == 0 and \
+            all(parts[index]['start'] == parts[index - 1]['end'] + 1 for index in range(1, len(parts))) and \
+            parts[-1]['end'] == parts[0]['content'].size - 1
+        if contiguous:
+            content = parts[0]['content']
+        elif all(part['content'].body is not None for part in parts):
+            content = Content(sum(part_sizes), body=b''.join(
+                part['content'].read(part['start'], part['end']) for part in parts))
+        else:
+            content = Content(sum(part_sizes))
+        etag = multipart_etag([part['digest'] for part in parts])
+        s3_object = self._object_from_args(Key, content, upload['args'], bucket, etag=etag, part_sizes=part_sizes)
+        if upload['args'].get('ChecksumAlgorithm'):
+            algorithm = upload['args']['ChecksumAlgorithm']
+            # A checksum of the part checksums, it depends on the part boundaries like the ETag
+            composite = checksum_value(algorithm, b''.join(part['digest'] for part in parts))
+            s3_object.checksums = {algorithm: f'{composite}-{len(parts)}'}
+        del bucket.uploads[UploadId]
+        self._store(bucket, s3_object, 'ObjectCreated:CompleteMultipartUpload')
+        response = {'Bucket': Bucket, 'Key': Key, 'ETag': etag, 'ServerSideEncryption': 'AES256'}
+        response.update(self._version_response(bucket, s3_object))
+        return response
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        bucket, upload = self._upload(Bucket, Key, UploadId, 'AbortMultipartUpload')
+        del bucket.uploads[UploadId]
+        return {}
+
+    ############# Listing #############
+
+    def list_objects_v2(self, Bucket, Prefix='', Delimiter=None, MaxKeys=list_page_keys, ContinuationToken=None,
+                        StartAfter=None, **kwargs):
+        bucket = self._bucket(Bucket, 'ListObjectsV2')
+        start_after = ContinuationToken or StartAfter or ''
+        position = bisect.bisect_right(bucket.sorted_keys, start_after) if start_after else 0
+        position = max(position, bisect.bisect_left(bucket.sorted_keys, Prefix))
+        contents = []
+        common_prefixes = []
+        last_key = None
+        truncated = False
+        while position < len(bucket.sorted_keys):
+            key = bucket.sorted_keys[position]
+            position += 1
+            if not key.startswith(Prefix):
+                break
+            s3_object = bucket.latest(key)
+            if s3_object is None:
+                continue
+            if len(contents) + len(common_prefixes) >= MaxKeys:
+                truncated = True
+                break
+            last_key = key
+            if Delimiter and Delimiter in key[len(Prefix):]:
+                common_prefix = key[:len(Prefix) + key[len(Prefix):].index(Delimiter) + len(Delimiter)]
+                common_prefixes.append({'Prefix': common_prefix})
+                # Skip the rest of the keys rolled up into this common prefix
+                position = bisect.bisect_left(bucket.sorted_keys, common_prefix[:-1] + chr(ord(common_prefix[-1]) + 1))
+                last_key = bucket.sorted_keys[position - 1]
+                continue
+            contents.append({
+                'Key': key,
+                'LastModified': s3_object.last_modified,
+                'ETag': s3_object.etag,
+                'Size': s3_object.size,
+                'StorageClass': s3_object.storage_class,
+            })
+        response = {
+            'IsTruncated': truncated,
+            'Name': Bucket,
+            'Prefix': Prefix,
+            'MaxKeys': MaxKeys,
+            'KeyCount': len(contents) + len(common_prefixes),
+        }
+        if contents:
+            response['Contents'] = contents
+        if common_prefixes:
+            response['CommonPrefixes'] = common_prefixes
+        if Delimiter:
+            response['Delimiter'] = Delimiter
+        if truncated:
+            response['NextContinuationToken'] = last_key
+        return response
+
+    ############# Bucket Configuration #############
+
+    def delete_bucket_inventory_configuration(self, Bucket, Id, **kwargs):
+        bucket = self._bucket(Bucket, 'DeleteBucketInventoryConfiguration')
+        if Id not in bucket.inventory_configurations:
+            raise client_error('DeleteBucketInventoryConfiguration', 'NoSuchConfiguration',
+                               'The specified configuration does not exist.', 404)
+        del bucket.inventory_configurations[Id]
+        return {}
+
+    ############# Restore #############
+
+    def restore_object(self, Bucket, Key, VersionId=None, RestoreRequest=None, **kwargs):
+        restore_request = RestoreRequest or {}
+        tier = restore_request.get('GlacierJobParameters', {}).get('Tier', 'Standard').upper()
+        status_code = self.initiate_restore(Bucket, Key, VersionId, int(restore_request.get('Days', 1)), tier,
+                                            'RestoreObject')
+        return {'ResponseMetadata': response_metadata(status_code)}
+
+    # Start or extend the restore of an archived object, returns the HTTP status code S3 answers with
+    def initiate_restore(self, bucket_name, key, version_id, days, tier, operation='RestoreObject'):
+        bucket = self._bucket(bucket_name, operation)
+        s3_object = self._object(bucket_name, key, version_id, operation)
+        now = self.aws.clock.now
+        if s3_object.storage_class not in archive_storage_classes:
+            raise client_error(operation, 'InvalidObjectState', "The operation is not valid for the object's storage class",
+                               403)
+        if s3_object.restore_completes_at is not None and not s3_object.is_restored(now):
+            raise client_error(operation, 'RestoreAlreadyInProgress', 'Object restore is already in progress', 409)
+        if s3_object.is_restored(now):
+            s3_object.restore_expiry = max(s3_object.restore_expiry, now + days * 86400)
+            return 200
+        s3_object.restore_requested_at = now
+        s3_object.restore_completes_at = now + self.restore_seconds(s3_object, tier)
+        # Restored copies expire at midnight UTC after the requested number of days
+        s3_object.restore_expiry = math.ceil((s3_object.restore_completes_at + days * 86400) / 86400) * 86400
+        self.aws.events.schedule(s3_object.restore_completes_at - now,
+                                 lambda: self._restore_completed(bucket, s3_object), 'S3 restore')
+        return 202
+
+    def _restore_completed(self, bucket, s3_object):
+        if not bucket.eventbridge:
+            return
+        detail_object = {
+            'key': parse.quote_plus(s3_object.key, safe='/'),
+            'size': s3_object.size,
+            'etag': s3_object.etag.strip('"'),
+            'sequencer': f'{int(self.aws.clock.now * 1000):016X}',
+        }
+        if bucket.versioned:
+            detail_object['version-id'] = s3_object.version_id
+        expiry = datetime.datetime.fromtimestamp(s3_object.restore_expiry, datetime.timezone.utc)
+        self.aws.services['events'].put_event({
+            'version': '0',
+            'id': str(uuid.uuid4()),
+            'detail-type': 'Object Restore Completed',
+            'source': 'aws.s3',
+            'account': self.aws.account_id,
+            'time': self._now().isoformat().replace('+00:00', 'Z'),
+            'region': self.aws.region,
+            'resources': [f'arn:aws:s3:::{bucket.name}'],
+            'detail': {
+                'version': '0',
+                'bucket': {'name': bucket.name},
+                'object': detail_object,
+                'request-id': uuid.uuid4().hex[:16].upper(),
+                'requester': 's3.amazonaws.com',
+                'restore-expiry-time': expiry.isoformat().replace('+00:00', 'Z'),
+                'source-storage-class': s3_object.storage_class,
+            },
+        })
+
+
+############# S3 Resource #############
+
+class LocalObjectSummary:
+    def __init__(self, bucket_name, listed):
+        self.bucket_name = bucket_name
+        self.key = listed['Key']
+        self.size = listed['Size']
+        self.e_tag = listed['ETag']
+        self.last_modified = listed['LastModified']
+        self.storage_class = listed['StorageClass']
+
+
+# Bucket(...).objects.filter/all page through ListObjectsV2 like the boto3 collection
+class LocalObjectCollection:
+    def __init__(self, client, bucket_name, filters=None):
+        self._client = client
+        self._bucket_name = bucket_name
+        self._filters = filters or {}
+
+    def filter(self, **filters):
+        return LocalObjectCollection(self._client, self._bucket_name, dict(self._filters, **filters))
+
+    def all(self):
+        return LocalObjectCollection(self._client, self._bucket_name, self._filters)
+
+    def __iter__(self):
+        list_kwargs = dict(self._filters, Bucket=self._bucket_name)
+        while True:
+            list_response = self._client.list_objects_v2(**list_kwargs)
+            for listed in list_response.get('Contents', []):
+                yield LocalObjectSummary(self._bucket_name, listed)
+            if not list_response.get('IsTruncated'):
+                return
+            list_kwargs['ContinuationToken'] = list_response['NextContinuationToken']
+
+
+class LocalBucketResource:
+    def __init__(self, client, name):
+        self.name = name
+        self.objects = LocalObjectCollection(client, name)
+
+
+class LocalS3Resource:
+    def __init__(self, aws):
+        self.meta = type('ResourceMeta', (), {'client': aws.client('s3')})()
+
+    def Bucket(self, name):
+        return LocalBucketResource(self.meta.client, name)
+
+
+############# Transfer Manager #############
+
+class LocalTransferMeta:
+    def __init__(self, call_args):
+        self.call_args = call_args
+        self.size = None
+
+    def provide_transfer_size(self, size):
+        self.size = size
+
+
+class LocalTransferFuture:
+    def __init__(self, meta):
+        self.meta = meta
+        self._exception = None
+
+    def set_exception(self, exception):
+        self._exception = exception
+
+    def done(self):
+        return True
+
+    def result(self):
+        if self._exception:
+            raise self._exception
+
+
+# Stand-in for the s3transfer manager create_transfer_manager returns, copies the way s3transfer does:
+# CopyObject below the multipart threshold, otherwise CreateMultipartUpload, UploadPartCopy per part and
+# CompleteMultipartUpload. Parts are sent one after the other
+class LocalTransferManager:
+    def __init__(self, client, config=None):
+        self._client = client
+        self._config = config
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def shutdown(self, cancel=False, cancel_msg=''):
+        pass
+
+    # s3transfer keeps parts between the S3 limits
+    def _part_bytes(self, size):
+        part_bytes = min(max(self._config.multipart_chunksize, min_part_bytes), max_part_bytes)
+        while math.ceil(size / part_bytes) > max_upload_parts:
+            part_bytes *= 2
+        return part_bytes
+
+    def copy(self, copy_source, bucket, key, extra_args=None, subscribers=None, source_client=None):
+        extra_args = dict(extra_args or {})
+        call_args = type('CallArgs', (), {'copy_source': copy_source, 'bucket': bucket, 'key': key,
+                                          'extra_args': extra_args})()
+        future = LocalTransferFuture(LocalTransferMeta(call_args))
+        for subscriber in subscribers or []:
+            subscriber.on_queued(future=future)
+        try:
+            size = future.meta.size
+            if size is None:
+                head_args = {name: value for name, value in extra_args.items() if name in part_copy_args[7:]}
+                size = (source_client or self._client).head_object(**copy_source, **head_args)['ContentLength']
+            if size < self._config.multipart_threshold:
+                self._client.copy_object(CopySource=copy_source, Bucket=bucket, Key=key, **extra_args)
+            else:
+                self._multipart_copy(copy_source, bucket, key, size, extra_args)
+        except Exception as e:
+            future.set_exception(e)
+        for subscriber in subscribers or []:
+            subscriber.on_done(future=future)
+        return future
+
+    def _multipart_copy(self, copy_source, bucket, key, size, extra_args):
+        create_args = {name: value for name, value in extra_args.items() if name not in create_multipart_excluded_args}
+        upload_id = self._client.create_multipart_upload(Bucket=bucket, Key=key, **create_args)['UploadId']
+        part_args = {name: value for name, value in extra_args.items() if name in part_copy_args}
+        part_bytes = self._part_bytes(size)
+        parts = []
+        try:
+            for part_number, start in enumerate(range(0, size, part_bytes), 1):
+                end = min(start + part_bytes, size) - 1
+                part_response = self._client.upload_part_copy(
+                    Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number, CopySource=copy_source,
+                    CopySourceRange=f'bytes={start}-{end}', **part_args)
+                parts.append({'ETag': part_response['CopyPartResult']['ETag'], 'PartNumber': part_number})
+            self._client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                                   MultipartUpload={'Parts': parts})
+        except Exception:
+            self._client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            raise
+
+
+def create_transfer_manager(client, config, osutil=None):
+    return LocalTransferManager(client, config)
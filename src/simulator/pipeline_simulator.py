@@ -0,0 +1,508 @@
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import math
+import os
+import random
+import sys
+import time
+import types
+from collections import Counter
+
+import boto3
+import boto3.s3.transfer
+
+from local_athena import LocalAthena
+from local_aws import LocalAWS, VirtualClock
+from local_batch_operations import LocalBatchOperations
+from local_dynamodb import LocalDynamoDB, LocalDynamoDBResource
+from local_events import LocalEventBridge, LocalSQS
+from local_lambda import LocalLambda, LocalSNS
+from local_s3 import Content, LocalS3, LocalS3Resource, S3Object, archive_storage_classes, create_transfer_manager
+from stack import Stack, TemplateError
+from state_machine import LocalStepFunctions
+
+
+# Set up logging
+logger = logging.getLogger('pipeline_simulator')
+logger.setLevel('INFO')
+
+
+# Other Variables
+default_template = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                                'automated-archive-restore-and-copy-solution-latest.yaml')
+gib = 1024 ** 3
+mib = 1024 ** 2
+# Hours from a restore request until the object is readable, per storage class and retrieval tier
+restore_hours = {
+    ('GLACIER', 'EXPEDITED'): (1 / 60, 5 / 60),
+    ('GLACIER', 'STANDARD'): (3, 5),
+    ('GLACIER', 'BULK'): (5, 12),
+    ('DEEP_ARCHIVE', 'STANDARD'): (9, 12),
+    ('DEEP_ARCHIVE', 'BULK'): (24, 48),
+}
+
+
+# The stand-ins of the Stack with a generated Archive bucket, returns them with the copies the run should make
+def prepare_pipeline(stack, args, lambda_class=LocalLambda):
+    random_source = random.Random(args.seed)
+    clock = VirtualClock(datetime.datetime.fromisoformat(args.start).timestamp())
+    aws = build_environment(stack, args, clock, random_source, lambda_class)
+    s3 = aws.services['s3']
+    athena = aws.services['athena']
+    solution_bucket = add_solution_bucket(stack, s3)
+    archive_bucket = generate_archive(stack, args, s3, clock, random_source)
+    # With All versions every version of a key is copied to the same destination key, which needs versioning
+    destination_bucket = s3.add_bucket(stack.parameters['DestinationBucket'],
+                                       versioned=stack.parameters['IncludedObjectVersions'] == 'All')
+    config_id = stack.function('InitiateFlowFunction')['environment']['inv_config_id']
+    archive_bucket.inventory_configurations[config_id] = {'Id': config_id}
+
+    # The inventory the solution queries is a snapshot of the Archive bucket, the destination table stays current
+    snapshot = inventory_rows(archive_bucket)
+    for logical_id in stack.resources_of_type('AWS::Glue::Table'):
+        table_name = stack.properties(logical_id)['TableInput']['Name']
+        if table_name.endswith('-destination'):
+            athena.add_table(table_name, lambda: inventory_rows(destination_bucket))
+        else:
+            athena.add_table(table_name, lambda: snapshot)
+    return aws, solution_bucket, archive_bucket, destination_bucket, expected_copies(stack, archive_bucket)
+
+
+# The inventory report of the Archive bucket arriving in the solution bucket starts the workflow
+def deliver_inventory(stack, aws, solution_bucket, archive_bucket):
+    config_id = stack.function('InitiateFlowFunction')['environment']['inv_config_id']
+    inventory_date = aws.clock.datetime().strftime('%Y-%m-%d-%H-%M')
+    inventory_prefix = f'{stack.account_id}/{archive_bucket.name}/{config_id}'
+    aws.services['s3'].put_object(
+        Bucket=solution_bucket.name, Key=f'{inventory_prefix}/hive/dt={inventory_date}/symlink.txt',
+        Body=f's3://{solution_bucket.name}/{inventory_prefix}/data/inventory.parquet\n'.encode('utf-8'))
+
+
+# Handler log records: printed with --verbose, otherwise only the errors are counted per function
+class LogCollector(logging.Handler):
+    def __init__(self, verbose):
+        super().__init__(logging.INFO if verbose else logging.ERROR)
+        self.verbose = verbose
+        self.errors = Counter()
+        self.setFormatter(logging.Formatter('[%(name)s] %(levelname)s %(message)s'))
+
+    def emit(self, record):
+        if record.levelno >= logging.ERROR:
+            self.errors[record.name] += 1
+        if self.verbose:
+            sys.stderr.write(self.format(record) + '\n')
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description='Run the restore and copy pipeline of the template against local stand-ins for S3, DynamoDB, '
+                    'Athena, S3 Batch Operations and Step Functions, on a virtual clock')
+    parser.add_argument('--template', default=default_template, help='CloudFormation template to simulate')
+    parser.add_argument('-p', '--parameter', action='append', default=[], metavar='Name=Value',
+                        help='Stack parameter, can be repeated')
+    parser.add_argument('--objects', type=int, default=1000, help='Keys in the Archive bucket')
+    parser.add_argument('--mean-size-mib', type=float, default=8.0, help='Mean size of the archived objects')
+    parser.add_argument('--large-objects', type=int, default=0, help='Additional objects between 5 and 20 GiB')
+    parser.add_argument('--versions', type=int, default=1, help='Versions of each key')
+    parser.add_argument('--duplicate-fraction', type=float, default=0.0,
+                        help='Fraction of the older versions with the same content as the next version')
+    parser.add_argument('--standard-fraction', type=float, default=0.0,
+                        help='Fraction of the objects in the STANDARD storage class, which are not restored')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the generated archive and restore times')
+    parser.add_argument('--start', default='2025-01-06T08:00:00+00:00', help='Virtual start time, ISO 8601')
+    parser.add_argument('--restore-hours', type=float, default=None,
+                        help='Fixed restore time of every object instead of the typical range of its tier')
+    parser.add_argument('--athena-seconds', type=float, default=20, help='Fixed run time of each Athena query')
+    parser.add_argument('--batch-setup-seconds', type=float, default=120,
+                        help='Time a Batch Operations job takes to read its manifest before running tasks')
+    parser.add_argument('--batch-concurrency', type=int, default=100,
+                        help='Concurrent Lambda invocations of a LambdaInvoke job')
+    parser.add_argument('--copy-mib-per-second', type=float, default=100, help='Copy throughput of each task')
+    parser.add_argument('--max-days', type=float, default=14, help='Virtual days after which the run is stopped')
+    parser.add_argument('--verbose', action='store_true', help='Print the log and output of the functions')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    return parser
+
+
+def parse_args():
+    return argument_parser().parse_args()
+
+
+def stack_parameters(parameter_args):
+    parameters = {}
+    for parameter in parameter_args:
+        name, separator, value = parameter.partition('=')
+        if not separator:
+            raise TemplateError(f'Stack parameters are given as Name=Value, not {parameter}')
+        parameters[name] = value
+    return parameters
+
+
+def restore_model(random_source, fixed_hours):
+    def restore_seconds(s3_object, tier):
+        if fixed_hours is not None:
+            return fixed_hours * 3600
+        low, high = restore_hours.get((s3_object.storage_class, tier), restore_hours[('GLACIER', 'STANDARD')])
+        return random_source.uniform(low, high) * 3600
+    return restore_seconds
+
+
+############# Simulated Environment #############
+
+# The stand-in services, configured from the resources of the stack as CloudFormation would create them
+def build_environment(stack, args, clock, random_source, lambda_class=LocalLambda):
+    aws = LocalAWS(clock, stack.region, stack.account_id)
+    s3 = LocalS3(aws, restore_model(random_source, args.restore_hours))
+    aws.register('s3', s3, resource=LocalS3Resource)
+    dynamodb = LocalDynamoDB(aws)
+    aws.register('dynamodb', dynamodb, resource=LocalDynamoDBResource)
+    athena = LocalAthena(aws, base_seconds=args.athena_seconds)
+    aws.register('athena', athena)
+    lambda_concurrency = args.batch_concurrency
+    batch_copy = stack.function('S3BatchCopyLambdafunction')
+    if batch_copy['reserved_concurrency']:
+        lambda_concurrency = min(lambda_concurrency, batch_copy['reserved_concurrency'])
+    aws.register('s3control', LocalBatchOperations(aws, setup_seconds=args.batch_setup_seconds,
+                                                   lambda_concurrency=lambda_concurrency,
+                                                   copy_bytes_per_second=args.copy_mib_per_second * mib))
+    transfer_module = types.ModuleType('boto3.s3.transfer')
+    transfer_module.__dict__.update(boto3.s3.transfer.__dict__)
+    transfer_module.create_transfer_manager = create_transfer_manager
+    aws.register('lambda', lambda_class(aws, stack, module_overrides={'boto3.s3.transfer': transfer_module}))
+    aws.register('sns', LocalSNS(aws))
+    step_functions = LocalStepFunctions(aws)
+    aws.register('stepfunctions', step_functions)
+    sqs = LocalSQS(aws)
+    aws.register('sqs', sqs)
+    events = LocalEventBridge(aws)
+    aws.register('events', events)
+
+    for logical_id in stack.resources_of_type('AWS::StepFunctions::StateMachine'):
+        step_functions.add_state_machine(stack.resource_arn(logical_id), stack.state_machine_definition(logical_id))
+    for logical_id in stack.resources_of_type('AWS::DynamoDB::Table'):
+        dynamodb.add_table(stack.physical_name(logical_id), stack.properties(logical_id))
+    for logical_id in stack.resources_of_type('AWS::Athena::WorkGroup'):
+        properties = stack.properties(logical_id)
+        athena.add_workgroup(properties['Name'], properties['WorkGroupConfiguration']['ResultConfiguration']
+                             ['OutputLocation'])
+    for logical_id in stack.resources_of_type('AWS::SQS::Queue'):
+        properties = stack.properties(logical_id)
+        sqs.add_queue(stack.resource_arn(logical_id), properties.get('VisibilityTimeout', 30),
+                      properties.get('MessageRetentionPeriod', 345600))
+    for logical_id in stack.resources_of_type('AWS::Lambda::EventSourceMapping'):
+        properties = stack.properties(logical_id)
+        sqs.add_event_source_mapping(properties['EventSourceArn'], properties['FunctionName'],
+                                     properties.get('BatchSize', 10), properties.get('MaximumBatchingWindowInSeconds', 0))
+    for logical_id in stack.resources_of_type('AWS::Events::Rule'):
+        properties = stack.properties(logical_id)
+        target_arns = [target['Arn'] for target in properties['Targets']]
+        if 'ScheduleExpression' in properties:
+            events.add_schedule(stack.physical_name(logical_id), properties['ScheduleExpression'], target_arns)
+        else:
+            events.add_rule(stack.physical_name(logical_id), properties['EventPattern'], target_arns)
+    return aws
+
+
+# The solution bucket notifications the CreateBucketEventNotification custom resource puts
+def add_solution_bucket(stack, s3):
+    solution_bucket = s3.add_bucket(stack.physical_name('S3AutoRestoreMigrateS3Bucket'))
+    environment = stack.function('CreateBucketEventNotification')['environment']
+    destinations = stack.properties('InvokeCustomBackedLambda')
+    for event_name, destination in [('one', 'bucket_event_destination_lambda'),
+                                    ('two', 'bucket_event_destination_lambda_1'),
+                                    ('three', 'bucket_event_destination_lambda'),
+                                    ('four', 'bucket_event_destination_lambda_state_function')]:
+        solution_bucket.notifications.append({
+            'id': environment[f'event_{event_name}_id'],
+            'prefix': environment[f'event_{event_name}_prefix_value'],
+            'suffix': environment[f'event_{event_name}_suffix_value'],
+            'event_prefix': 'ObjectCreated:',
+            'function_arn': destinations[destination],
+        })
+    return solution_bucket
+
+
+# Archive objects with random sizes and ages, older versions are either new content or the same as the next one
+def generate_archive(stack, args, s3, clock, random_source):
+    parameters = stack.parameters
+    archive_bucket = s3.add_bucket(parameters['ArchiveBucket'],
+                                   versioned=parameters['IncludedObjectVersions'] == 'All' or args.versions > 1)
+    archive_bucket.eventbridge = 'RestoreCompletedEventRule' in stack.resources_of_type('AWS::Events::Rule')
+    if parameters['ExistingArchiveStorageClass'] == 'GLACIER_AND_DEEP_ARCHIVE':
+        storage_classes = archive_storage_classes
+    else:
+        storage_classes = [parameters['ExistingArchiveStorageClass']]
+    prefix = parameters['ArchiveBucketPrefix']
+    sizes = [max(1, int(random_source.expovariate(1 / (args.mean_size_mib * mib)))) for _ in range(args.objects)]
+    sizes += [random_source.randint(5 * gib + 1, 20 * gib) for _ in range(args.large_objects)]
+    for index, size in enumerate(sizes):
+        key = f'{prefix}data/{index % 100:02d}/object-{index:07d}.bin'
+        storage_class = 'STANDARD' if random_source.random() < args.standard_fraction else \
+            random_source.choice(storage_classes)
+        modified = clock.now - random_source.uniform(30, 3650) * 86400
+        content = Content(size)
+        for version in range(args.versions):
+            if version and random_source.random() >= args.duplicate_fraction:
+                content = Content(max(1, int(size * random_source.uniform(0.5, 1.5))))
+            modified += random_source.uniform(0, 10) * 86400
+            archive_bucket.add(S3Object(
+                key, content, version_id=s3._new_version_id(archive_bucket), storage_class=storage_class,
+                last_modified=datetime.datetime.fromtimestamp(min(modified, clock.now - 86400), datetime.timezone.utc)))
+    return archive_bucket
+
+
+def inventory_rows(bucket):
+    rows = []
+    for key in bucket.sorted_keys:
+        versions = bucket.versions[key]
+        for position, s3_object in enumerate(versions):
+            rows.append({
+                'bucket': bucket.name,
+                'key': key,
+                'version_id': s3_object.version_id if bucket.versioned else None,
+                'is_latest': position == len(versions) - 1,
+                'is_delete_marker': s3_object.delete_marker,
+                'size': s3_object.size,
+                'last_modified_date': s3_object.last_modified.isoformat(),
+                'e_tag': (s3_object.etag or '').strip('"'),
+                'storage_class': s3_object.storage_class,
+            })
+    return rows
+
+
+# Source versions the solution restores and copies, by the destination key each of them is copied to
+def expected_copies(stack, archive_bucket):
+    parameters = stack.parameters
+    destination_prefix = parameters['BucketForCopyDestinationPrefix']
+    all_versions = parameters['IncludedObjectVersions'] == 'All'
+    expected = {}
+    for key in archive_bucket.sorted_keys:
+        if not key.startswith(parameters['ArchiveBucketPrefix']):
+            continue
+        versions = archive_bucket.versions[key] if all_versions else archive_bucket.versions[key][-1:]
+        selected = [s3_object for s3_object in versions
+                    if s3_object.storage_class in archive_storage_classes and not s3_object.delete_marker]
+        if selected:
+            expected[f'{destination_prefix}/{key}' if destination_prefix else key] = selected
+    return expected
+
+
+# Versions copied to the destination key, oldest first. All versions land as versions of one key
+def destination_versions(destination_bucket, destination_key):
+    return [s3_object for s3_object in destination_bucket.versions.get(destination_key, [])
+            if not s3_object.delete_marker]
+
+
+# A key is copied once it holds a version for each source version selected
+def is_copied(destination_bucket, destination_key, selected):
+    return len(destination_versions(destination_bucket, destination_key)) >= len(selected)
+
+
+############# Simulation #############
+
+def run_until_done(aws, deadline, done):
+    while True:
+        next_time = aws.events.next_time()
+        if next_time is None or next_time > deadline:
+            return
+        # Only background events left, e.g. the scheduled JobScheduler runs: keep going while copies are waited for
+        if not aws.events.pending() and done():
+            return
+        aws.events.run_next()
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '-'
+    days, remainder = divmod(int(round(seconds)), 86400)
+    hours, remainder = divmod(remainder, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f'{days}d {hours:02d}:{minutes:02d}:{seconds:02d}' if days else f'{hours:02d}:{minutes:02d}:{seconds:02d}'
+
+
+def stage(name, start, end, origin):
+    if start is None or end is None:
+        return {'stage': name, 'start_seconds': None, 'end_seconds': None, 'duration_seconds': None}
+    return {'stage': name, 'start_seconds': start - origin, 'end_seconds': end - origin,
+            'duration_seconds': end - start}
+
+
+def timestamps(values):
+    return [value.timestamp() for value in values if value is not None]
+
+
+# Timings, API calls and outcome of the run, stages are measured from the inventory arriving in the solution bucket
+def build_report(aws, stack, expected, destination_bucket, origin, wall_seconds, log_collector):
+    step_functions = aws.services['stepfunctions']
+    batch_operations = aws.services['s3control']
+    lambda_service = aws.services['lambda']
+    history = [(entered, state_name) for execution in step_functions.executions.values()
+               for entered, state_name in execution.history]
+    executions_stopped = [execution.stopped.timestamp() for execution in step_functions.executions.values()
+                          if execution.stopped is not None]
+
+    def first_entered(state_names):
+        return min([entered for entered, state_name in history if state_name in state_names] or [None],
+                   key=lambda value: math.inf if value is None else value)
+
+    restore_jobs = [job for job in batch_operations.jobs.values() if job['operation_name'] == 'S3InitiateRestoreObject']
+    copy_jobs = [job for job in batch_operations.jobs.values() if job['operation_name'] != 'S3InitiateRestoreObject']
+    sources = [s3_object for selected in expected.values() for s3_object in selected]
+    requested = [s3_object.restore_requested_at for s3_object in sources if s3_object.restore_requested_at is not None]
+    restored = [s3_object.restore_completes_at for s3_object in sources
+                if s3_object.restore_completes_at is not None and s3_object.restore_completes_at <= aws.clock.now]
+    copied = {}
+    copied_versions = 0
+    copy_lags = []
+    for destination_key, selected in expected.items():
+        versions = destination_versions(destination_bucket, destination_key)
+        copied_versions += min(len(versions), len(selected))
+        if len(versions) < len(selected):
+            continue
+        copied[destination_key] = versions[len(selected) - 1].last_modified.timestamp()
+        restore_times = [s3_object.restore_completes_at for s3_object in selected if s3_object.restore_completes_at]
+        if restore_times:
+            copy_lags.append(copied[destination_key] - max(restore_times))
+
+    def bounds(values):
+        return (min(values), max(values)) if values else (None, None)
+
+    manifest_end = first_entered(['InvokeRestore', 'CheckRestoreSchedule', 'PostWorkflowTasks'])
+    stages = [
+        stage('Manifest generation', origin, manifest_end, origin),
+        stage('Restore submission', *bounds(timestamps(job['created'] for job in restore_jobs)), origin),
+        stage('State machine', origin, max(executions_stopped) if executions_stopped else None, origin),
+        stage('Restore jobs', *bounds(timestamps([job['created'] for job in restore_jobs]
+                                                 + [job['terminated'] for job in restore_jobs])), origin),
+        stage('Object retrieval', *bounds(requested + restored), origin),
+        stage('Copy jobs', *bounds(timestamps([job['created'] for job in copy_jobs]
+                                              + [job['terminated'] for job in copy_jobs])), origin),
+        stage('End to end', origin, max(copied.values()) if copied else None, origin),
+    ]
+
+    api_calls = {}
+    for (actor, service_name, operation), count in sorted(aws.recorder.calls.items()):
+        api_calls.setdefault(actor, {})[f'{service_name}:{operation}'] = count
+    functions = {}
+    for function in sorted(lambda_service.functions.values(), key=lambda function: function.name):
+        if function.invocations:
+            functions[function.name] = {
+                'invocations': function.invocations,
+                'errors': function.errors,
+                'max_concurrent': function.max_running,
+                'init_wall_seconds': round(function.init_seconds, 3),
+                'wall_seconds': round(function.wall_seconds, 3),
+            }
+    job_summary = {}
+    for job in batch_operations.jobs.values():
+        summary = job_summary.setdefault(job['operation_name'], Counter())
+        summary['jobs'] += 1
+        summary[f'status_{job["status"]}'] += 1
+        summary['tasks'] += len(job['tasks'])
+        summary['tasks_failed'] += job['failed']
+    return {
+        'stack_parameters': stack.parameters,
+        'virtual_seconds': aws.clock.now - origin,
+        'wall_seconds': round(wall_seconds, 3),
+        'objects': {
+            'selected_versions': len(sources),
+            'selected_bytes': sum(s3_object.size for s3_object in sources),
+            'destination_keys': len(expected),
+            'copied_keys': len(copied),
+            'missing_keys': len(expected) - len(copied),
+            'copied_versions': copied_versions,
+            'restore_requested': len(requested),
+        },
+        'stages': stages,
+        'copy_lag_seconds': {'p50': percentile(copy_lags, 0.5), 'p95': percentile(copy_lags, 0.95),
+                             'max': percentile(copy_lags, 1.0)},
+        'executions': [{'name': execution.name, 'status': execution.status, 'transitions': execution.transitions,
+                        'error': execution.error} for execution in step_functions.executions.values()],
+        'batch_operations': {operation: dict(summary) for operation, summary in job_summary.items()},
+        'functions': functions,
+        'api_calls': api_calls,
+        'api_calls_total': sum(aws.recorder.calls.values()),
+        'sns_messages': len(aws.services['sns'].messages),
+        'logged_errors': dict(log_collector.errors),
+    }
+
+
+def print_report(report):
+    objects = report['objects']
+    print(f"Virtual time {format_duration(report['virtual_seconds'])}, wall time {report['wall_seconds']:.1f} s")
+    print(f"Copied {objects['copied_keys']} of {objects['destination_keys']} keys and "
+          f"{objects['copied_versions']} of {objects['selected_versions']} versions "
+          f"({objects['selected_bytes'] / gib:.2f} GiB), {objects['missing_keys']} keys missing, "
+          f"{objects['restore_requested']} restores requested")
+    print('\nStages (from the inventory arriving)')
+    for item in report['stages']:
+        print(f"  {item['stage']:<22} start {format_duration(item['start_seconds']):>12}  "
+              f"end {format_duration(item['end_seconds']):>12}  duration {format_duration(item['duration_seconds']):>12}")
+    lag = report['copy_lag_seconds']
+    print(f"\nRestored to copied: p50 {format_duration(lag['p50'])}, p95 {format_duration(lag['p95'])}, "
+          f"max {format_duration(lag['max'])}")
+    print('\nState machine executions')
+    for execution in report['executions']:
+        print(f"  {execution['name']}: {execution['status']}, {execution['transitions']} transitions"
+              + (f", {execution['error']}" if execution['error'] else ''))
+    print('\nBatch Operations jobs')
+    for operation, summary in report['batch_operations'].items():
+        print(f"  {operation}: " + ', '.join(f'{name} {value}' for name, value in sorted(summary.items())))
+    print('\nFunctions')
+    for name, stats in report['functions'].items():
+        print(f"  {name:<24} {stats['invocations']:>7} invocations  {stats['errors']:>4} errors  "
+              f"max concurrent {stats['max_concurrent']:>4}  wall {stats['wall_seconds']:.2f} s")
+    print(f"\nAPI calls ({report['api_calls_total']} in total)")
+    for actor, calls in report['api_calls'].items():
+        print(f"  {actor}")
+        for operation, count in calls.items():
+            print(f"    {operation:<44} {count:>8}")
+    print(f"\nSNS messages: {report['sns_messages']}")
+    if report['logged_errors']:
+        print('Errors logged: ' + ', '.join(f'{name} {count}' for name, count in report['logged_errors'].items()))
+
+
+def main():
+    args = parse_args()
+    try:
+        stack = Stack(args.template, stack_parameters(args.parameter))
+    except TemplateError as e:
+        sys.exit(f'error: {e}')
+    if stack.parameters['InventoryEngine'] == 'Embedded':
+        sys.exit('error: the pipeline simulator runs the Athena inventory engine only, choose InventoryEngine=Athena')
+
+    aws, solution_bucket, archive_bucket, destination_bucket, expected = prepare_pipeline(stack, args)
+
+    log_collector = LogCollector(args.verbose)
+    logging.getLogger().addHandler(log_collector)
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.ERROR)
+    boto3.client = aws.client
+    boto3.resource = aws.resource
+
+    origin = aws.clock.now
+    started = time.perf_counter()
+    output = sys.stdout if args.verbose else open(os.devnull, 'w')
+    with contextlib.redirect_stdout(output):
+        deliver_inventory(stack, aws, solution_bucket, archive_bucket)
+        run_until_done(aws, origin + args.max_days * 86400,
+                       lambda: all(is_copied(destination_bucket, key, selected) for key, selected in expected.items()))
+    report = build_report(aws, stack, expected, destination_bucket, origin, time.perf_counter() - started,
+                          log_collector)
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,563 @@
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import math
+import os
+import re
+import sys
+import tempfile
+import time
+from array import array
+from urllib import parse
+
+from local_aws import LocalAWS, VirtualClock
+from local_batch_operations import LocalBatchOperations
+from local_dynamodb import LocalDynamoDB, LocalDynamoDBResource
+from local_lambda import LocalLambda
+from local_s3 import LocalS3, LocalS3Resource
+from stack import Stack, TemplateError
+
+
+# Set up logging
+logger = logging.getLogger('restore_planner')
+logger.setLevel('INFO')
+
+
+# Other Variables
+default_template = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                                'automated-archive-restore-and-copy-solution-latest.yaml')
+plan_schema_version = 1
+kib = 1024
+mib = 1024 ** 2
+gib = 1024 ** 3
+# Typical hours from a restore request until the object is readable, per storage class and retrieval tier,
+# the plan uses the middle of the range
+restore_hours = {
+    ('GLACIER', 'STANDARD'): (3, 5),
+    ('GLACIER', 'BULK'): (5, 12),
+    ('DEEP_ARCHIVE', 'STANDARD'): (9, 12),
+    ('DEEP_ARCHIVE', 'BULK'): (24, 48),
+}
+# JobTracker environment variables holding the retrieval delay in hours of each storage class and tier
+retrieval_delay_variables = {
+    ('GLACIER', 'STANDARD'): 'gfr_standard_retrieval_delay',
+    ('GLACIER', 'BULK'): 'gfr_bulk_retrieval_delay',
+    ('DEEP_ARCHIVE', 'STANDARD'): 'gda_standard_retrieval_delay',
+    ('DEEP_ARCHIVE', 'BULK'): 'gda_bulk_retrieval_delay',
+}
+# Stack parameters that change the manifest chunks, cases sharing them read the inventory once
+chunk_parameters = ['ArchiveBucketPrefix', 'ExistingArchiveStorageClass', 'IncludedObjectVersions', 'InventoryEngine',
+                    'ManifestGenerationMode', 'MaxInvKeys', 'MaxInvSizeGiB', 'RestoreOrder', 'RestorePriorityPrefixes',
+                    'CopyEngine', 'CopyVerification', 'MultipartChunkSize', 'TransferMaximumConcurrency']
+# Single pass UNLOAD queries write up to this many chunks each, as in AthenaSplit
+max_unload_partitions = 100
+# List prices in USD of us-east-1, override them with --price for another Region or a later price list
+default_prices = {
+    'glacier_standard_per_1000_restores': 0.05,
+    'glacier_standard_per_gib_restored': 0.01,
+    'glacier_bulk_per_1000_restores': 0.0,
+    'glacier_bulk_per_gib_restored': 0.0,
+    'deep_archive_standard_per_1000_restores': 0.10,
+    'deep_archive_standard_per_gib_restored': 0.02,
+    'deep_archive_bulk_per_1000_restores': 0.025,
+    'deep_archive_bulk_per_gib_restored': 0.0025,
+    'batch_operations_per_job': 0.25,
+    'batch_operations_per_million_tasks': 1.0,
+    'restored_copy_per_gib_month': 0.023,
+    'standard_per_1000_copy_requests': 0.005,
+    'standard_ia_per_1000_copy_requests': 0.01,
+    'onezone_ia_per_1000_copy_requests': 0.01,
+    'intelligent_tiering_per_1000_copy_requests': 0.005,
+    'glacier_ir_per_1000_copy_requests': 0.02,
+    'lambda_per_million_requests': 0.20,
+    'lambda_per_gib_second': 0.0000166667,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Project the manifest chunks, requests, schedule, restored copy footprint and cost of a job '
+                    'group from a local S3 Inventory snapshot, with the inventory filter, chunking and restore '
+                    'scheduling code of the template')
+    parser.add_argument('manifest', help='manifest.json of the S3 Inventory report, CSV or Parquet')
+    parser.add_argument('--data-dir', default=None,
+                        help='Folder with the inventory data files. Default: the data folder next to the dated '
+                             'manifest folder, or the manifest folder')
+    parser.add_argument('--template', default=default_template, help='CloudFormation template to plan with')
+    parser.add_argument('-p', '--parameter', action='append', default=[], metavar='Name=Value',
+                        help='Stack parameter of every case, can be repeated')
+    parser.add_argument('-s', '--sweep', action='append', default=None, metavar='Name=Value1,Value2',
+                        help='Stack parameter to sweep, can be repeated, cases are all the combinations. '
+                             'Default: ArchiveRestoreTier STANDARD and BULK')
+    parser.add_argument('--start', default=None,
+                        help='Time the inventory arrives, ISO 8601, for the submission windows. Default: now')
+    parser.add_argument('--restore-hours', type=float, default=None,
+                        help='Fixed restore time instead of the middle of the typical range of the tier')
+    parser.add_argument('--manifest-query-seconds', type=float, default=20,
+                        help='Run time of each Athena manifest query, or of the Embedded inventory engine')
+    parser.add_argument('--batch-setup-seconds', type=float, default=120,
+                        help='Time a Batch Operations job takes to read its manifest before running tasks')
+    parser.add_argument('--restore-tasks-per-second', type=float, default=1000,
+                        help='Restore requests a Batch Operations job sends per second')
+    parser.add_argument('--batch-concurrency', type=int, default=100,
+                        help='Concurrent Lambda invocations of a LambdaInvoke job')
+    parser.add_argument('--native-copy-concurrency', type=int, default=1000,
+                        help='Concurrent tasks of an S3PutObjectCopy job')
+    parser.add_argument('--copy-mib-per-second', type=float, default=100, help='Copy throughput of each task')
+    parser.add_argument('--task-overhead-seconds', type=float, default=0.2, help='Fixed time of each copy task')
+    parser.add_argument('--price', action='append', default=[], metavar='Name=USD',
+                        help=f'Price override, can be repeated: {", ".join(default_prices)}')
+    parser.add_argument('--schedule', action='store_true', help='Print the schedule of each manifest chunk')
+    parser.add_argument('--json', action='store_true', help='Print the plan as JSON')
+    return parser.parse_args()
+
+
+def name_values(argument, separator):
+    name, found, values = argument.partition('=')
+    if not found:
+        raise TemplateError(f'Expected Name=Value, not {argument}')
+    return name, values.split(separator) if separator else values
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+############# Function Code #############
+
+# The function modules of a stack, imported against local stand-ins so creating their clients sends no request
+def load_functions(stack, start):
+    aws = LocalAWS(VirtualClock(start), stack.region, stack.account_id)
+    aws.register('s3', LocalS3(aws, lambda s3_object, tier: 0), resource=LocalS3Resource)
+    aws.register('dynamodb', LocalDynamoDB(aws), resource=LocalDynamoDBResource)
+    aws.register('s3control', LocalBatchOperations(aws))
+    lambda_service = LocalLambda(aws, stack)
+    return {
+        'inventory': lambda_service.module('InventoryEngineFunction'),
+        'scheduler': lambda_service.module('RestoreSchedulerFunction'),
+        'batch_copy': lambda_service.module('S3BatchCopyLambdafunction'),
+    }
+
+
+############# Manifest Chunks #############
+
+class ChunkStats:
+    def __init__(self, rows, size_bytes):
+        self.rows = rows
+        self.bytes = size_bytes
+        self.lambda_rows = 0
+        self.lambda_bytes = 0
+        self.largest_bytes = 0
+        self.copy_requests = 0
+
+    def to_dict(self):
+        return {'rows': self.rows, 'bytes': self.bytes, 'lambda_rows': self.lambda_rows,
+                'lambda_bytes': self.lambda_bytes, 'largest_bytes': self.largest_bytes,
+                'copy_requests': self.copy_requests}
+
+
+def default_data_dir(manifest_path):
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    data_dir = os.path.join(os.path.dirname(manifest_dir), 'data')
+    return data_dir if os.path.isdir(data_dir) else manifest_dir
+
+
+# Requests that copy an object: one CopyObject with the S3 Batch Operations Copy operation, and with BatchCopy
+# up to the single request limit, larger objects also create, copy in parts and complete a multipart upload
+def copy_requests(batch_copy, size, native):
+    if native or size <= batch_copy.max_part_bytes:
+        return 1
+    return 3 + batch_copy.transfer_profile(size)['parts']
+
+
+# Stream the inventory through the InventoryEngine filter, order and chunk writer, and size each chunk's copy work
+def build_chunks(stack, functions, manifest, data_dir):
+    inventory = functions['inventory']
+    batch_copy = functions['batch_copy']
+    copy_worker = stack.function('S3AutoRestoreMigrateCopyWorker')['environment']
+    parameters = stack.parameters
+    # OffsetLimit manifests carry no size column, CopyWorker then copies every object with BatchCopy
+    offset_limit = parameters['InventoryEngine'] == 'Athena' and parameters['ManifestGenerationMode'] == 'OffsetLimit'
+    hybrid = copy_worker['copy_engine'] == 'Hybrid' and not offset_limit
+    native_copy_max_bytes = int(copy_worker['native_copy_max_bytes'])
+    prefix = parameters['ArchiveBucketPrefix']
+    priority_prefixes = [prefix.strip() for prefix in parameters['RestorePriorityPrefixes'].split(',') if prefix.strip()]
+    max_bytes = 0 if offset_limit else inventory.my_csv_max_bytes
+
+    pending_sizes = array('Q')
+    chunks = []
+
+    # The inventory configuration of the solution only lists the prefix, a snapshot of the whole bucket may not
+    def prefix_rows(rows):
+        for row in rows:
+            if parse.unquote_plus(row[1]).startswith(prefix):
+                yield row
+
+    # Sizes in manifest order, the chunk statistics come from the rows after sorting
+    def recorded_sizes(rows):
+        for row in rows:
+            pending_sizes.append(row[3])
+            yield row
+
+    def write_chunk(chunk_num, chunk_rows, chunk_bytes, chunk_path):
+        os.remove(chunk_path)
+        chunk = ChunkStats(chunk_rows, chunk_bytes)
+        for size in pending_sizes[:chunk_rows]:
+            native = hybrid and size <= native_copy_max_bytes
+            if not native:
+                chunk.lambda_rows += 1
+                chunk.lambda_bytes += size
+            chunk.largest_bytes = max(chunk.largest_bytes, size)
+            chunk.copy_requests += copy_requests(batch_copy, size, native)
+        del pending_sizes[:chunk_rows]
+        chunks.append(chunk)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        rows = inventory.iter_inventory_rows(
+            manifest, lambda data_key: open(os.path.join(data_dir, os.path.basename(data_key)), 'rb'),
+            inventory.storage_classes_to_restore(inventory.my_storage_class_to_restore), inventory.my_incl_versions)
+        rows = inventory.sort_inventory_rows(prefix_rows(rows), parameters['RestoreOrder'], priority_prefixes, work_dir)
+        inventory.write_manifest_chunks(recorded_sizes(rows), inventory.my_incl_versions, inventory.my_csv_max_rows, max_bytes,
+                                        work_dir, write_chunk)
+    return chunks
+
+
+############# Schedule #############
+
+# Seconds between the JobScheduler runs, e.g. rate(30 minutes)
+def schedule_seconds(schedule_expression):
+    match = re.match(r'rate\((\d+) (minute|minutes|hour|hours|day|days)\)', schedule_expression.strip())
+    if not match:
+        raise TemplateError(f'Unsupported schedule expression {schedule_expression}')
+    unit_seconds = {'minute': 60, 'hour': 3600, 'day': 86400}[match.group(2).rstrip('s')]
+    return int(match.group(1)) * unit_seconds
+
+
+def next_run(timestamp, origin, period):
+    return origin + math.ceil((timestamp - origin) / period) * period
+
+
+# Start and end of the Athena or Embedded manifest generation
+def manifest_seconds(parameters, num_chunks, args):
+    if parameters['InventoryEngine'] == 'Embedded':
+        return args.manifest_query_seconds
+    if parameters['ManifestGenerationMode'] == 'OffsetLimit':
+        # Checknumrows counts the rows first, then one query per chunk
+        return (num_chunks + 1) * args.manifest_query_seconds
+    return max(1, math.ceil(num_chunks / max_unload_partitions)) * args.manifest_query_seconds
+
+
+# Timeline of one restore job: restore requests, objects readable, copy jobs, in epoch seconds
+# RestoreEventTracker submits a copy batch once it holds CopyBatchMaxKeys objects or its first object has waited
+# CopyBatchMaxWaitMinutes, objects restoring slowly fill fewer keys per batch
+def copy_batches(chunk, first_restored, last_restored, settings):
+    return max(1, min(chunk.rows, max(math.ceil(chunk.rows / settings['batch_max_keys']),
+                                      math.ceil((last_restored - first_restored) / settings['batch_max_wait_seconds']))))
+
+
+def chunk_timeline(chunk, submit_time, settings, args):
+    restore_done = submit_time + args.batch_setup_seconds + chunk.rows / args.restore_tasks_per_second
+    first_restored = submit_time + args.batch_setup_seconds + settings['restore_seconds']
+    last_restored = restore_done + settings['restore_seconds']
+    # JobTracker records the restore job when it ends, copy_ready_time is the retrieval delay fallback
+    fallback = next_run(restore_done + settings['retrieval_delay_seconds'], settings['origin'],
+                        settings['scheduler_seconds'])
+    trigger = settings['copy_start_trigger']
+    if trigger == 'RetrievalDelay':
+        copy_start = fallback
+    elif trigger == 'RestoreCompletedEvents':
+        copy_start = min(fallback, max(restore_done, last_restored + settings['batch_window_seconds']))
+    else:
+        copy_start = max(restore_done, first_restored + settings['batch_window_seconds'])
+
+    bytes_per_second = args.copy_mib_per_second * mib
+    native_rows = chunk.rows - chunk.lambda_rows
+    native_seconds = (native_rows * args.task_overhead_seconds +
+                      (chunk.bytes - chunk.lambda_bytes) / bytes_per_second) / args.native_copy_concurrency
+    lambda_seconds = max((chunk.lambda_rows * args.task_overhead_seconds + chunk.lambda_bytes / bytes_per_second) /
+                         settings['lambda_concurrency'],
+                         chunk.largest_bytes / bytes_per_second if chunk.lambda_rows else 0)
+    copy_seconds = args.batch_setup_seconds + max(native_seconds, lambda_seconds)
+    copy_done = copy_start + copy_seconds
+    if trigger == 'RestoreCompletedBatches':
+        # Batches copy the objects as they are restored, the last one starts after the last object
+        copy_done = max(copy_done, last_restored + settings['batch_window_seconds'] + args.batch_setup_seconds +
+                        max(native_seconds, lambda_seconds) /
+                        copy_batches(chunk, first_restored, last_restored, settings))
+    return {
+        'submit_time': submit_time,
+        'restore_done_time': restore_done,
+        'first_restored_time': first_restored,
+        'last_restored_time': last_restored,
+        'copy_start_time': copy_start,
+        'copy_done_time': copy_done,
+        # RestoreScheduler counts a job as active until its copy starts
+        'active_until': last_restored + settings['batch_window_seconds'] if trigger == 'RestoreCompletedBatches'
+        else copy_start,
+        'restored_expiry_time': first_restored + settings['restore_days'] * 86400,
+    }
+
+
+# Submit the chunks as the state machine does: RestoreScheduler decides, DelayForNextRestore waits, InvokeRestore submits
+def schedule_chunks(chunks, scheduler, settings, manifests_ready):
+    windows = scheduler.parse_restore_windows(scheduler.my_restore_windows)
+    offset_limit = settings['offset_limit']
+    event = {
+        'restore_job_ids': [None] * len(chunks),
+        'csv_file_rows': [None if offset_limit else chunk.rows for chunk in chunks],
+        'csv_file_bytes': [None if offset_limit else chunk.bytes for chunk in chunks],
+    }
+    timelines = [None] * len(chunks)
+    last_submit = {'time': None, 'manifests': None, 'rows': None, 'bytes': None}
+    now = manifests_ready
+    while None in event['restore_job_ids']:
+        window_wait = scheduler.seconds_until_window(windows, datetime.datetime.fromtimestamp(now, datetime.timezone.utc))
+        budget_wait = scheduler.seconds_until_budget(last_submit['time'], last_submit['manifests'], last_submit['rows'],
+                                                     last_submit['bytes'], now)
+        wait_seconds = max(window_wait, budget_wait)
+        submit_limit = scheduler.my_max_manifests_per_submission
+        if wait_seconds == 0 and scheduler.my_max_active_restore_jobs > 0:
+            active_restore_jobs = sum(1 for timeline in timelines if timeline and timeline['active_until'] > now)
+            if active_restore_jobs >= scheduler.my_max_active_restore_jobs:
+                # The next job leaves the active count when its copy starts, the state machine polls until then
+                wait_seconds = scheduler.my_capacity_poll_seconds
+            submit_limit = min(submit_limit, scheduler.my_max_active_restore_jobs - active_restore_jobs)
+        if wait_seconds:
+            now += min(max(wait_seconds, 1), 86400)
+            continue
+        submit_count = scheduler.manifests_within_budget(event, submit_limit)
+        pending_items = [item for item, job_id in enumerate(event['restore_job_ids']) if job_id is None][:submit_count]
+        for item in pending_items:
+            event['restore_job_ids'][item] = f'planned-{item}'
+            timelines[item] = chunk_timeline(chunks[item], now, settings, settings['args'])
+        last_submit = {
+            'time': now,
+            'manifests': len(pending_items),
+            'rows': None if offset_limit else sum(chunks[item].rows for item in pending_items),
+            'bytes': None if offset_limit else sum(chunks[item].bytes for item in pending_items),
+        }
+        now += 1
+    return timelines
+
+
+# Most restored copy bytes held at once, each chunk counted from its first object restored until it expires
+def peak_restored_bytes(chunks, timelines):
+    changes = []
+    for chunk, timeline in zip(chunks, timelines):
+        changes.append((timeline['first_restored_time'], chunk.bytes))
+        changes.append((timeline['last_restored_time'] + (timeline['restored_expiry_time'] -
+                                                          timeline['first_restored_time']), -chunk.bytes))
+    peak = 0
+    held = 0
+    for change_time, change in sorted(changes):
+        held += change
+        peak = max(peak, held)
+    return peak
+
+
+############# Cost #############
+
+def plan_cost(stack, chunks, prices, settings):
+    parameters = stack.parameters
+    tier = parameters['ArchiveRestoreTier'].lower()
+    storage_class = settings['storage_class'].lower()
+    rows = sum(chunk.rows for chunk in chunks)
+    restored_gib = sum(chunk.bytes for chunk in chunks) / gib
+    lambda_rows = sum(chunk.lambda_rows for chunk in chunks)
+    copy_jobs = settings['copy_jobs']
+    copy_requests_total = sum(chunk.copy_requests for chunk in chunks)
+    copy_storage_class = parameters['StorageClass'].lower()
+    bytes_per_second = settings['args'].copy_mib_per_second * mib
+    lambda_seconds = sum(chunk.lambda_rows * settings['args'].task_overhead_seconds + chunk.lambda_bytes /
+                         bytes_per_second for chunk in chunks)
+    cost = {
+        'restore_requests': rows / 1000 * prices[f'{storage_class}_{tier}_per_1000_restores'],
+        'restore_retrieval': restored_gib * prices[f'{storage_class}_{tier}_per_gib_restored'],
+        'batch_operations': (len(chunks) + copy_jobs) * prices['batch_operations_per_job'] +
+        # One restore task and one copy task per object
+        2 * rows / 1000000 * prices['batch_operations_per_million_tasks'],
+        'restored_copies': restored_gib * settings['restore_days'] / 30 * prices['restored_copy_per_gib_month'],
+        'copy_requests': copy_requests_total / 1000 * prices[f'{copy_storage_class}_per_1000_copy_requests'],
+        'copy_function': lambda_rows / 1000000 * prices['lambda_per_million_requests'] +
+        lambda_seconds * settings['memory_mb'] / 1024 * prices['lambda_per_gib_second'],
+    }
+    cost['total'] = sum(cost.values())
+    return cost
+
+
+############# Plan #############
+
+def plan_case(args, parameters, settings_values, manifest, data_dir, start, prices, chunk_cache):
+    stack = Stack(args.template, dict(parameters, **settings_values))
+    functions = load_functions(stack, start)
+    stack_values = stack.parameters
+    cache_key = (tuple(stack_values[name] for name in chunk_parameters), )
+    if cache_key not in chunk_cache:
+        chunk_cache[cache_key] = build_chunks(stack, functions, manifest, data_dir)
+    chunks = chunk_cache[cache_key]
+
+    job_tracker = stack.function('S3AutoRestoreMigrateJobTrackerWorker')['environment']
+    batch_copy = stack.function('S3BatchCopyLambdafunction')
+    tier = stack_values['ArchiveRestoreTier']
+    # A job restoring both classes waits for its DEEP_ARCHIVE objects
+    storage_class = 'GLACIER' if stack_values['ExistingArchiveStorageClass'] == 'GLACIER' else 'DEEP_ARCHIVE'
+    low, high = restore_hours[(storage_class, tier)]
+    lambda_concurrency = args.batch_concurrency
+    if batch_copy['reserved_concurrency']:
+        lambda_concurrency = min(lambda_concurrency, batch_copy['reserved_concurrency'])
+    offset_limit = stack_values['InventoryEngine'] == 'Athena' and stack_values['ManifestGenerationMode'] == 'OffsetLimit'
+    trigger = stack_values['CopyStartTrigger']
+    copy_jobs = sum((chunk.rows > chunk.lambda_rows) + (chunk.lambda_rows > 0) for chunk in chunks)
+    settings = {
+        'args': args,
+        'origin': start,
+        'storage_class': storage_class,
+        'restore_seconds': (args.restore_hours if args.restore_hours is not None else (low + high) / 2) * 3600,
+        'retrieval_delay_seconds': int(job_tracker[retrieval_delay_variables[(storage_class, tier)]]) * 3600,
+        'scheduler_seconds': schedule_seconds(stack_values['JobSchedulerScheduleCronExpressions']),
+        'copy_start_trigger': trigger,
+        'batch_window_seconds': int(stack_values['CopyBatchWindowSeconds']) if trigger != 'RetrievalDelay' else 0,
+        'batch_max_keys': int(stack_values['CopyBatchMaxKeys']),
+        'batch_max_wait_seconds': int(stack_values['CopyBatchMaxWaitMinutes']) * 60,
+        'restore_days': int(stack_values['ArchiveObjectRestoreDays']),
+        'lambda_concurrency': lambda_concurrency,
+        'memory_mb': batch_copy['memory_mb'],
+        'offset_limit': offset_limit,
+        'copy_jobs': copy_jobs,
+    }
+
+    manifests_ready = start + manifest_seconds(stack_values, len(chunks), args)
+    timelines = schedule_chunks(chunks, functions['scheduler'], settings, manifests_ready)
+    if trigger == 'RestoreCompletedBatches':
+        copy_jobs = sum(copy_batches(chunk, timeline['first_restored_time'], timeline['last_restored_time'], settings)
+                        for chunk, timeline in zip(chunks, timelines))
+        settings['copy_jobs'] = copy_jobs
+    chunk_bytes = [chunk.bytes for chunk in chunks]
+
+    def elapsed(key, pick=max):
+        return pick(timeline[key] for timeline in timelines) - start if timelines else None
+
+    return {
+        'settings': settings_values,
+        'chunks': len(chunks),
+        'objects': sum(chunk.rows for chunk in chunks),
+        'bytes': sum(chunk_bytes),
+        'chunk_bytes_min': min(chunk_bytes, default=0),
+        'chunk_bytes_p50': percentile(chunk_bytes, 0.5) or 0,
+        'chunk_bytes_max': max(chunk_bytes, default=0),
+        'restore_jobs': len(chunks),
+        'copy_jobs': copy_jobs,
+        'restore_requests': sum(chunk.rows for chunk in chunks),
+        'copy_requests': sum(chunk.copy_requests for chunk in chunks),
+        'lambda_copied_objects': sum(chunk.lambda_rows for chunk in chunks),
+        'restore_hours': settings['restore_seconds'] / 3600,
+        'manifests_ready_seconds': manifests_ready - start,
+        'last_submit_seconds': elapsed('submit_time'),
+        'all_restored_seconds': elapsed('last_restored_time'),
+        'all_copied_seconds': elapsed('copy_done_time'),
+        'peak_restored_bytes': peak_restored_bytes(chunks, timelines),
+        # Chunks whose first restored objects expire before the copy ends
+        'chunks_copied_after_expiry': sum(1 for timeline in timelines
+                                          if timeline['copy_done_time'] > timeline['restored_expiry_time']),
+        'cost_usd': plan_cost(stack, chunks, prices, settings),
+        'schedule': [dict(chunk.to_dict(), **{name: value - start for name, value in timeline.items()})
+                     for chunk, timeline in zip(chunks, timelines)],
+    }
+
+
+############# Report #############
+
+def format_bytes(value):
+    for unit, size in [('TiB', 1024 * gib), ('GiB', gib), ('MiB', mib), ('KiB', kib)]:
+        if value >= size:
+            return f'{value / size:.1f} {unit}'
+    return f'{value:.0f} B'
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '-'
+    days, remainder = divmod(int(round(seconds)), 86400)
+    hours, remainder = divmod(remainder, 3600)
+    minutes = remainder // 60
+    return f'{days}d {hours:02d}:{minutes:02d}' if days else f'{hours:02d}:{minutes:02d}'
+
+
+def settings_label(settings):
+    return ' '.join(f'{name}={value}' for name, value in settings.items()) or 'defaults'
+
+
+def print_plan(cases, show_schedule):
+    label_width = max(len('settings'), *(len(settings_label(case['settings'])) for case in cases))
+    print(f"{'settings':<{label_width}} {'chunks':>7} {'objects':>10} {'bytes':>11} {'chunk p50':>11} {'copy jobs':>9} "
+          f"{'copy req':>10} {'restored':>10} {'copied':>10} {'peak restored':>13} {'cost USD':>10}")
+    for case in cases:
+        print(f"{settings_label(case['settings']):<{label_width}} {case['chunks']:>7} {case['objects']:>10} "
+              f"{format_bytes(case['bytes']):>11} {format_bytes(case['chunk_bytes_p50']):>11} {case['copy_jobs']:>9} "
+              f"{case['copy_requests']:>10} {format_duration(case['all_restored_seconds']):>10} "
+              f"{format_duration(case['all_copied_seconds']):>10} {format_bytes(case['peak_restored_bytes']):>13} "
+              f"{case['cost_usd']['total']:>10.2f}")
+    for case in cases:
+        if case['chunks_copied_after_expiry']:
+            print(f"Warning: {settings_label(case['settings'])} copies {case['chunks_copied_after_expiry']} chunks "
+                  'after their first restored objects expire, raise ArchiveObjectRestoreDays')
+    if not show_schedule:
+        return
+    for case in cases:
+        print(f"\nSchedule of {settings_label(case['settings'])} (from the inventory arriving)")
+        print(f"{'chunk':>6} {'objects':>10} {'bytes':>11} {'submitted':>10} {'restored':>10} {'copy start':>10} "
+              f"{'copied':>10}")
+        for chunk_num, chunk in enumerate(case['schedule']):
+            print(f"{chunk_num:>6} {chunk['rows']:>10} {format_bytes(chunk['bytes']):>11} "
+                  f"{format_duration(chunk['submit_time']):>10} {format_duration(chunk['last_restored_time']):>10} "
+                  f"{format_duration(chunk['copy_start_time']):>10} {format_duration(chunk['copy_done_time']):>10}")
+
+
+def main():
+    args = parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)
+    start = time.time()
+    if args.start:
+        start = datetime.datetime.fromisoformat(args.start).timestamp()
+    prices = dict(default_prices)
+    for price in args.price:
+        name, value = name_values(price, None)
+        if name not in prices:
+            sys.exit(f'error: unknown price {name}')
+        prices[name] = float(value)
+    with open(args.manifest) as manifest_file:
+        manifest = json.load(manifest_file)
+    data_dir = args.data_dir or default_data_dir(args.manifest)
+
+    try:
+        parameters = dict(name_values(parameter, None) for parameter in args.parameter)
+        sweeps = dict(name_values(sweep, ',') for sweep in args.sweep or ['ArchiveRestoreTier=STANDARD,BULK'])
+        planning_started = time.perf_counter()
+        chunk_cache = {}
+        cases = [plan_case(args, parameters, dict(zip(sweeps, values)), manifest, data_dir, start, prices,
+                           chunk_cache) for values in itertools.product(*sweeps.values())]
+    except (TemplateError, ValueError, RuntimeError) as e:
+        sys.exit(f'error: {e}')
+
+    if args.json:
+        print(json.dumps({
+            'schema_version': plan_schema_version,
+            'start': datetime.datetime.fromtimestamp(start, datetime.timezone.utc).isoformat(),
+            'parameters': parameters,
+            'prices': prices,
+            'planning_seconds': time.perf_counter() - planning_started,
+            'cases': cases,
+        }, indent=2))
+        return
+    print_plan(cases, args.schedule)
+    print(f'\nPlanned {len(cases)} cases in {time.perf_counter() - planning_started:.1f}s. Times are from the '
+          'inventory arriving, costs are estimates at the prices given, without storage at the destination')
+
+
+if __name__ == '__main__':
+    main()
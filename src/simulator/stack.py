@@ -0,0 +1,261 @@
+import functools
+import json
+import logging
+import re
+
+import yaml
+
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+
+# Other Variables
+partition = 'aws'
+# Stack parameters without a template default, the simulator needs a value for each of them
+simulator_parameter_defaults = {
+    'ArchiveBucket': 'archive-bucket',
+    'DestinationBucket': 'destination-bucket',
+    'CopyTagging': 'Enable',
+    'ExistingArchiveStorageClass': 'GLACIER',
+    'IncludedObjectVersions': 'Current',
+    'RecipientEmail': 'restore-admin@example.com',
+    'ArchiveBucketPrefix': '',
+    'BucketForCopyDestinationPrefix': '',
+}
+# Property holding the physical name of a resource, resources without one get a generated name as in CloudFormation
+name_properties = {
+    'AWS::S3::Bucket': 'BucketName',
+    'AWS::DynamoDB::Table': 'TableName',
+    'AWS::Lambda::Function': 'FunctionName',
+    'AWS::StepFunctions::StateMachine': 'StateMachineName',
+    'AWS::SNS::Topic': 'TopicName',
+    'AWS::SQS::Queue': 'QueueName',
+    'AWS::Athena::WorkGroup': 'Name',
+}
+
+
+class TemplateError(Exception):
+    pass
+
+
+############# Template Loading #############
+
+class TemplateLoader(yaml.SafeLoader):
+    pass
+
+
+# Keep CloudFormation short form tags as their long form, e.g. !Ref X becomes {'Ref': 'X'}
+def construct_intrinsic(loader, tag_suffix, node):
+    if isinstance(node, yaml.ScalarNode):
+        value = loader.construct_scalar(node)
+    elif isinstance(node, yaml.SequenceNode):
+        value = loader.construct_sequence(node, deep=True)
+    else:
+        value = loader.construct_mapping(node, deep=True)
+    if tag_suffix == 'GetAtt' and isinstance(value, str):
+        value = value.split('.', 1)
+    function_name = 'Ref' if tag_suffix == 'Ref' else f'Fn::{tag_suffix}'
+    if tag_suffix == 'Condition':
+        function_name = 'Condition'
+    return {function_name: value}
+
+
+TemplateLoader.add_multi_constructor('!', construct_intrinsic)
+
+
+# Stacks with different parameters share the parsed template, which is never modified
+@functools.lru_cache(maxsize=None)
+def load_template(template_path):
+    with open(template_path) as template_file:
+        return yaml.load(template_file, Loader=TemplateLoader)
+
+
+############# Stack #############
+
+# A deployed copy of the template as CloudFormation would resolve it, without any AWS call
+class Stack:
+    def __init__(self, template_path, parameters=None, stack_name='restore-sim', region='us-east-1',
+                 account_id='111122223333'):
+        self.template = load_template(template_path)
+        self.stack_name = stack_name
+        self.region = region
+        self.account_id = account_id
+        self.resources = self.template['Resources']
+        self.parameters = {}
+        for name, definition in self.template['Parameters'].items():
+            if 'Default' in definition:
+                self.parameters[name] = str(definition['Default'])
+            elif name in simulator_parameter_defaults:
+                self.parameters[name] = simulator_parameter_defaults[name]
+        for name, value in (parameters or {}).items():
+            if name not in self.template['Parameters']:
+                raise TemplateError(f'Unknown stack parameter {name}')
+            allowed_values = [str(allowed) for allowed in self.template['Parameters'][name].get('AllowedValues', [])]
+            if allowed_values and str(value) not in allowed_values:
+                raise TemplateError(f'{name} must be one of {", ".join(allowed_values)}')
+            self.parameters[name] = str(value)
+        missing = [name for name in self.template['Parameters'] if name not in self.parameters]
+        if missing:
+            raise TemplateError(f'No value for stack parameters {", ".join(missing)}')
+
+    def pseudo_parameter(self, name):
+        return {
+            'AWS::Region': self.region,
+            'AWS::AccountId': self.account_id,
+            'AWS::Partition': partition,
+            'AWS::StackName': self.stack_name,
+            'AWS::URLSuffix': 'amazonaws.com',
+        }[name]
+
+    def condition(self, name):
+        return bool(self.resolve(self.template['Conditions'][name]))
+
+    def resource_enabled(self, logical_id):
+        condition_name = self.resources[logical_id].get('Condition')
+        return condition_name is None or self.condition(condition_name)
+
+    def physical_name(self, logical_id):
+        resource = self.resources[logical_id]
+        name_property = name_properties.get(resource['Type'])
+        if name_property and name_property in resource.get('Properties', {}):
+            return self.resolve(resource['Properties'][name_property])
+        name = f'{self.stack_name}-{logical_id}'
+        if resource['Type'] == 'AWS::S3::Bucket':
+            name = name.lower()[:63]
+        return name
+
+    def resource_arn(self, logical_id):
+        resource_type = self.resources[logical_id]['Type']
+        name = self.physical_name(logical_id)
+        arns = {
+            'AWS::Lambda::Function': f'arn:{partition}:lambda:{self.region}:{self.account_id}:function:{name}',
+            'AWS::IAM::Role': f'arn:{partition}:iam::{self.account_id}:role/{name}',
+            'AWS::S3::Bucket': f'arn:{partition}:s3:::{name}',
+            'AWS::SNS::Topic': f'arn:{partition}:sns:{self.region}:{self.account_id}:{name}',
+            'AWS::SQS::Queue': f'arn:{partition}:sqs:{self.region}:{self.account_id}:{name}',
+            'AWS::DynamoDB::Table': f'arn:{partition}:dynamodb:{self.region}:{self.account_id}:table/{name}',
+            'AWS::Events::Rule': f'arn:{partition}:events:{self.region}:{self.account_id}:rule/{name}',
+            'AWS::StepFunctions::StateMachine':
+                f'arn:{partition}:states:{self.region}:{self.account_id}:stateMachine:{name}',
+        }
+        if resource_type not in arns:
+            raise TemplateError(f'No ARN for {logical_id} of type {resource_type}')
+        return arns[resource_type]
+
+    def ref(self, name):
+        if name.startswith('AWS::'):
+            return self.pseudo_parameter(name)
+        if name in self.parameters:
+            return self.parameters[name]
+        if name not in self.resources:
+            raise TemplateError(f'Unresolved reference {name}')
+        resource_type = self.resources[name]['Type']
+        # Topics and state machines return their ARN, queues their URL, everything else its name
+        if resource_type in ['AWS::SNS::Topic', 'AWS::StepFunctions::StateMachine']:
+            return self.resource_arn(name)
+        if resource_type == 'AWS::SQS::Queue':
+            return f'https://sqs.{self.region}.amazonaws.com/{self.account_id}/{self.physical_name(name)}'
+        return self.physical_name(name)
+
+    def get_att(self, logical_id, attribute):
+        if logical_id == 'StackNametoLower' and attribute == 'change_to_lower':
+            return self.stack_name.lower()
+        if attribute == 'Arn':
+            return self.resource_arn(logical_id)
+        raise TemplateError(f'Unsupported attribute {logical_id}.{attribute}')
+
+    def sub(self, template_string, variables=None):
+        variables = variables or {}
+
+        def replace(match):
+            name = match.group(1)
+            if name in variables:
+                return str(self.resolve(variables[name]))
+            if '.' in name and not name.startswith('AWS::'):
+                return str(self.get_att(*name.split('.', 1)))
+            return str(self.ref(name))
+        return re.sub(r'\$\{([^}!]+)\}', replace, template_string)
+
+    # Resolve the intrinsic functions the template uses, AWS::NoValue resolves to None and drops the key
+    def resolve(self, value):
+        if isinstance(value, list):
+            return [resolved for resolved in (self.resolve(item) for item in value) if resolved is not None]
+        if not isinstance(value, dict):
+            return value
+        if len(value) == 1:
+            function_name, args = next(iter(value.items()))
+            if function_name == 'Ref':
+                return None if args == 'AWS::NoValue' else self.ref(args)
+            if function_name == 'Fn::GetAtt':
+                return self.get_att(*args)
+            if function_name == 'Fn::Sub':
+                if isinstance(args, list):
+                    return self.sub(args[0], args[1])
+                return self.sub(args)
+            if function_name == 'Fn::FindInMap':
+                map_name, top_key, second_key = self.resolve(args)
+                return self.template['Mappings'][map_name][top_key][second_key]
+            if function_name == 'Fn::If':
+                condition_name, if_true, if_false = args
+                return self.resolve(if_true if self.condition(condition_name) else if_false)
+            if function_name == 'Fn::Equals':
+                left, right = self.resolve(args)
+                return str(left) == str(right)
+            if function_name == 'Fn::And':
+                return all(self.resolve(condition) for condition in args)
+            if function_name == 'Fn::Or':
+                return any(self.resolve(condition) for condition in args)
+            if function_name == 'Fn::Not':
+                return not self.resolve(args[0])
+            if function_name == 'Condition':
+                return self.condition(args)
+            if function_name == 'Fn::Select':
+                index, items = self.resolve(args)
+                return items[int(index)]
+            if function_name == 'Fn::Split':
+                delimiter, source = self.resolve(args)
+                return source.split(delimiter)
+            if function_name == 'Fn::Join':
+                delimiter, items = self.resolve(args)
+                return delimiter.join(str(item) for item in items)
+        return {key: resolved for key, resolved in ((key, self.resolve(item)) for key, item in value.items())
+                if resolved is not None}
+
+    ############# Functions #############
+
+    def function_ids(self):
+        return [logical_id for logical_id, resource in self.resources.items()
+                if resource['Type'] == 'AWS::Lambda::Function' and self.resource_enabled(logical_id)]
+
+    # Everything the simulator needs to run a function: its name, code, environment and limits
+    def function(self, logical_id):
+        properties = self.resources[logical_id]['Properties']
+        if 'ZipFile' not in properties.get('Code', {}):
+            raise TemplateError(f'{logical_id} has no inline code')
+        environment = {name: str(value) for name, value in
+                       self.resolve(properties.get('Environment', {}).get('Variables', {})).items()}
+        reserved_concurrency = self.resolve(properties.get('ReservedConcurrentExecutions'))
+        return {
+            'logical_id': logical_id,
+            'name': self.physical_name(logical_id),
+            'arn': self.resource_arn(logical_id),
+            'code': properties['Code']['ZipFile'],
+            'environment': environment,
+            'memory_mb': int(properties.get('MemorySize', 128)),
+            'timeout_seconds': int(properties.get('Timeout', 3)),
+            'reserved_concurrency': int(reserved_concurrency) if reserved_concurrency is not None else None,
+        }
+
+    ############# Other Resources #############
+
+    def resources_of_type(self, resource_type):
+        return [logical_id for logical_id, resource in self.resources.items()
+                if resource['Type'] == resource_type and self.resource_enabled(logical_id)]
+
+    def properties(self, logical_id):
+        return self.resolve(self.resources[logical_id].get('Properties', {}))
+
+    def state_machine_definition(self, logical_id):
+        return json.loads(self.resolve(self.resources[logical_id]['Properties']['DefinitionString']))
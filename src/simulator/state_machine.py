@@ -0,0 +1,379 @@
+import copy
+import datetime
+import json
+import logging
+import re
+import uuid
+
+from local_aws import client_error
+
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+
+# Other Variables
+step_functions_actor = 'StepFunctions'
+lambda_invoke_resource = 'arn:aws:states:::lambda:invoke'
+path_token_pattern = re.compile(r'\.([^.\[]+)|\[(\d+)\]')
+# Executions are stopped after this many state transitions, a loop that never ends is a failure to report
+max_state_transitions = 100000
+
+
+class StatesError(Exception):
+    def __init__(self, error, cause=''):
+        super().__init__(f'{error}: {cause}')
+        self.error = error
+        self.cause = cause
+
+
+############# Paths #############
+
+def path_tokens(path):
+    if path == '$':
+        return []
+    if not path.startswith('$'):
+        raise StatesError('States.Runtime', f'Invalid path {path}')
+    tokens = []
+    for name, index in path_token_pattern.findall(path[1:]):
+        tokens.append(int(index) if index else name)
+    return tokens
+
+
+def read_path(data, path):
+    value = data
+    for token in path_tokens(path):
+        try:
+            value = value[token]
+        except (KeyError, IndexError, TypeError):
+            raise StatesError('States.Runtime', f'The JSONPath {path} could not be found in the input')
+    return value
+
+
+def path_present(data, path):
+    try:
+        read_path(data, path)
+    except StatesError:
+        return False
+    return True
+
+
+def write_path(data, path, value):
+    if path is None:
+        return data
+    tokens = path_tokens(path)
+    if not tokens:
+        return value
+    data = copy.deepcopy(data) if isinstance(data, dict) else {}
+    target = data
+    for token in tokens[:-1]:
+        if not isinstance(target.get(token), dict):
+            target[token] = {}
+        target = target[token]
+    target[tokens[-1]] = value
+    return data
+
+
+# Payload templates: keys ending in .$ take their value from a path of the input, or of the context object with $$
+def resolve_parameters(template, data, context):
+    if isinstance(template, dict):
+        resolved = {}
+        for key, value in template.items():
+            if key.endswith('.$'):
+                if not isinstance(value, str) or value.startswith('States.'):
+                    raise StatesError('States.Runtime', f'Intrinsic functions are not simulated: {value}')
+                resolved[key[:-2]] = read_path(context, value[1:]) if value.startswith('$$') else read_path(data, value)
+            else:
+                resolved[key] = resolve_parameters(value, data, context)
+        return resolved
+    if isinstance(template, list):
+        return [resolve_parameters(item, data, context) for item in template]
+    return template
+
+
+############# Choice Rules #############
+
+def timestamp(value):
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+comparators = {
+    'Equals': lambda left, right: left == right,
+    'LessThan': lambda left, right: left < right,
+    'GreaterThan': lambda left, right: left > right,
+    'LessThanEquals': lambda left, right: left <= right,
+    'GreaterThanEquals': lambda left, right: left >= right,
+}
+comparison_types = {
+    'String': lambda value: isinstance(value, str),
+    'Numeric': lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    'Boolean': lambda value: isinstance(value, bool),
+    'Timestamp': lambda value: isinstance(value, str),
+}
+
+
+def rule_matches(rule, data):
+    if 'And' in rule:
+        return all(rule_matches(sub_rule, data) for sub_rule in rule['And'])
+    if 'Or' in rule:
+        return any(rule_matches(sub_rule, data) for sub_rule in rule['Or'])
+    if 'Not' in rule:
+        return not rule_matches(rule['Not'], data)
+    variable = rule['Variable']
+    if 'IsPresent' in rule:
+        return path_present(data, variable) == rule['IsPresent']
+    value = read_path(data, variable)
+    for test, expected in rule.items():
+        if test in ['Variable', 'Next']:
+            continue
+        if test == 'IsNull':
+            return (value is None) == expected
+        if test in ['IsString', 'IsNumeric', 'IsBoolean', 'IsTimestamp']:
+            return comparison_types[test[2:]](value) == expected
+        if test == 'StringMatches':
+            return isinstance(value, str) and re.fullmatch(
+                '.*'.join(re.escape(part) for part in expected.split('*')), value) is not None
+        if test.endswith('Path'):
+            expected = read_path(data, expected)
+            test = test[:-len('Path')]
+        for type_name, is_type in comparison_types.items():
+            if test.startswith(type_name):
+                if not is_type(value) or not is_type(expected):
+                    return False
+                if type_name == 'Timestamp':
+                    value, expected = timestamp(value), timestamp(expected)
+                return comparators[test[len(type_name):]](value, expected)
+        raise StatesError('States.Runtime', f'Unsupported choice rule {test}')
+    raise StatesError('States.Runtime', f'Choice rule without a test on {variable}')
+
+
+def error_matches(error_equals, error):
+    return error in error_equals or 'States.ALL' in error_equals or \
+        ('States.TaskFailed' in error_equals and error not in ['States.Timeout', 'States.Runtime'])
+
+
+############# Step Functions #############
+
+class Execution:
+    def __init__(self, arn, name, state_machine_arn, execution_input, started):
+        self.arn = arn
+        self.name = name
+        self.state_machine_arn = state_machine_arn
+        self.input = execution_input
+        self.status = 'RUNNING'
+        self.started = started
+        self.stopped = None
+        self.output = None
+        self.error = None
+        self.cause = None
+        self.transitions = 0
+        # (virtual time, state name) of every state entered
+        self.history = []
+
+
+# Runs the Amazon States Language of the template's state machines: Task (Lambda invoke), Choice, Wait, Pass,
+# Succeed and Fail, with InputPath, Parameters, ResultSelector, ResultPath, OutputPath, Retry and Catch
+class LocalStepFunctions:
+    def __init__(self, aws):
+        self.aws = aws
+        self.state_machines = {}
+        self.executions = {}
+
+    def add_state_machine(self, arn, definition):
+        self.state_machines[arn] = definition
+
+    def start_execution(self, stateMachineArn, name=None, input='{}', **kwargs):
+        if stateMachineArn not in self.state_machines:
+            raise client_error('StartExecution', 'StateMachineDoesNotExist', f'State Machine Does Not Exist: {stateMachineArn}')
+        name = name or str(uuid.uuid4())
+        execution_arn = f"{stateMachineArn.replace(':stateMachine:', ':execution:')}:{name}"
+        if execution_arn in self.executions:
+            if self.executions[execution_arn].input != input:
+                raise client_error('StartExecution', 'ExecutionAlreadyExists', f'Execution Already Exists: {execution_arn}')
+            return {'executionArn': execution_arn, 'startDate': self.executions[execution_arn].started}
+        execution = Execution(execution_arn, name, stateMachineArn, input, self.aws.clock.datetime())
+        self.executions[execution_arn] = execution
+        definition = self.state_machines[stateMachineArn]
+        self.aws.events.schedule(0, lambda: self._run(execution, definition['StartAt'], json.loads(input)),
+                                 'Step Functions execution')
+        return {'executionArn': execution_arn, 'startDate': execution.started}
+
+    def describe_execution(self, executionArn, **kwargs):
+        if executionArn not in self.executions:
+            raise client_error('DescribeExecution', 'ExecutionDoesNotExist', f'Execution Does Not Exist: {executionArn}')
+        execution = self.executions[executionArn]
+        response = {
+            'executionArn': execution.arn,
+            'stateMachineArn': execution.state_machine_arn,
+            'name': execution.name,
+            'status': execution.status,
+            'startDate': execution.started,
+            'input': execution.input,
+        }
+        if execution.stopped:
+            response['stopDate'] = execution.stopped
+        if execution.output is not None:
+            response['output'] = json.dumps(execution.output)
+        if execution.error:
+            response['error'] = execution.error
+            response['cause'] = execution.cause
+        return response
+
+    def _finish(self, execution, status, output=None, error=None, cause=None):
+        execution.status = status
+        execution.stopped = self.aws.clock.datetime()
+        execution.output = output
+        execution.error = error
+        execution.cause = cause
+        if status != 'SUCCEEDED':
+            logger.error(f'Execution {execution.name} {status}: {error} {cause}')
+
+    def _context(self, execution, state_name, retry_count):
+        return {
+            'Execution': {'Id': execution.arn, 'Name': execution.name, 'Input': json.loads(execution.input),
+                          'StartTime': execution.started.isoformat()},
+            'State': {'Name': state_name, 'EnteredTime': self.aws.clock.datetime().isoformat(),
+                      'RetryCount': retry_count},
+            'StateMachine': {'Id': execution.state_machine_arn},
+        }
+
+    # Run states until the execution ends or waits, a wait or retry continues in a later event
+    def _run(self, execution, state_name, data, retry_counts=None):
+        states = self.state_machines[execution.state_machine_arn]['States']
+        while True:
+            if execution.transitions >= max_state_transitions:
+                self._finish(execution, 'FAILED', error='States.Runtime', cause='Too many state transitions')
+                return
+            state = states[state_name]
+            execution.transitions += 1
+            execution.history.append((self.aws.clock.now, state_name))
+            try:
+                outcome = self._state(execution, state_name, state, data, retry_counts or {})
+            except StatesError as e:
+                self._finish(execution, 'FAILED', error=e.error, cause=e.cause)
+                return
+            retry_counts = None
+            kind, next_state, data, delay = outcome
+            if kind == 'end':
+                self._finish(execution, 'SUCCEEDED' if next_state is None else next_state, output=data)
+                return
+            if kind == 'wait':
+                self.aws.events.schedule(delay, lambda next_state=next_state, data=data:
+                                         self._run(execution, next_state, data), 'Step Functions wait')
+                return
+            if kind == 'retry':
+                self.aws.events.schedule(delay, lambda counts=next_state, data=data:
+                                         self._run(execution, state_name, data, counts), 'Step Functions retry')
+                return
+            state_name = next_state
+
+    def _next(self, state, data):
+        if state.get('End'):
+            return 'end', None, data, 0
+        return 'next', state['Next'], data, 0
+
+    def _state(self, execution, state_name, state, data, retry_counts):
+        state_type = state['Type']
+        if state_type == 'Succeed':
+            return 'end', None, self._output(state, self._input(state, data)), 0
+        if state_type == 'Fail':
+            raise StatesError(state.get('Error', 'States.Fail'), state.get('Cause', ''))
+        if state_type == 'Choice':
+            effective_input = self._input(state, data)
+            for rule in state.get('Choices', []):
+                if rule_matches(rule, effective_input):
+                    return 'next', rule['Next'], self._output(state, effective_input), 0
+            if 'Default' not in state:
+                raise StatesError('States.NoChoiceMatched', f'No choice of {state_name} matched')
+            return 'next', state['Default'], self._output(state, effective_input), 0
+        if state_type == 'Wait':
+            effective_input = self._input(state, data)
+            if 'Seconds' in state:
+                delay = state['Seconds']
+            elif 'SecondsPath' in state:
+                delay = read_path(effective_input, state['SecondsPath'])
+            else:
+                until = state.get('Timestamp') or read_path(effective_input, state['TimestampPath'])
+                delay = (timestamp(until) - self.aws.clock.datetime()).total_seconds()
+            output = self._output(state, effective_input)
+            if state.get('End'):
+                return 'wait', None, output, delay
+            return 'wait', state['Next'], output, delay
+        if state_type == 'Pass':
+            effective_input = self._input(state, data)
+            if 'Parameters' in state:
+                effective_input = resolve_parameters(state['Parameters'], effective_input,
+                                                     self._context(execution, state_name, 0))
+            result = state.get('Result', effective_input)
+            return self._next(state, self._output(state, write_path(data, state.get('ResultPath', '$'), result)))
+        if state_type == 'Task':
+            return self._task(execution, state_name, state, data, retry_counts)
+        raise StatesError('States.Runtime', f'{state_type} states are not simulated')
+
+    def _input(self, state, data):
+        if 'InputPath' in state and state['InputPath'] is None:
+            return {}
+        return read_path(data, state.get('InputPath', '$'))
+
+    def _output(self, state, data):
+        if 'OutputPath' in state and state['OutputPath'] is None:
+            return {}
+        return read_path(data, state.get('OutputPath', '$'))
+
+    def _task(self, execution, state_name, state, data, retry_counts):
+        retry_count = sum(retry_counts.values())
+        context = self._context(execution, state_name, retry_count)
+        effective_input = self._input(state, data)
+        if 'Parameters' in state:
+            effective_input = resolve_parameters(state['Parameters'], effective_input, context)
+        try:
+            result = self._invoke(state['Resource'], effective_input)
+        except StatesError as e:
+            for index, retrier in enumerate(state.get('Retry', [])):
+                if not error_matches(retrier['ErrorEquals'], e.error):
+                    continue
+                attempts = retry_counts.get(index, 0)
+                if attempts >= retrier.get('MaxAttempts', 3):
+                    break
+                delay = retrier.get('IntervalSeconds', 1) * retrier.get('BackoffRate', 2.0) ** attempts
+                return 'retry', dict(retry_counts, **{index: attempts + 1}), data, delay
+            for catcher in state.get('Catch', []):
+                if error_matches(catcher['ErrorEquals'], e.error):
+                    error_output = {'Error': e.error, 'Cause': e.cause}
+                    return 'next', catcher['Next'], write_path(data, catcher.get('ResultPath', '$'), error_output), 0
+            raise
+        if 'ResultSelector' in state:
+            result = resolve_parameters(state['ResultSelector'], result, context)
+        if 'ResultPath' in state and state['ResultPath'] is None:
+            output = data
+        else:
+            output = write_path(data, state.get('ResultPath', '$'), result)
+        return self._next(state, self._output(state, output))
+
+    def _invoke(self, resource, parameters):
+        if resource == lambda_invoke_resource:
+            function_name = parameters['FunctionName']
+            payload = parameters.get('Payload', {})
+        elif resource.startswith('arn:aws:lambda:'):
+            function_name = resource
+            payload = parameters
+        else:
+            raise StatesError('States.Runtime', f'Task resource {resource} is not simulated')
+        self.aws.recorder.enter(step_functions_actor)
+        try:
+            self.aws.recorder.record('lambda', 'Invoke')
+        finally:
+            self.aws.recorder.leave()
+        response, function_error = self.aws.services['lambda'].run(function_name, payload)
+        if function_error:
+            error_type, _, error_message = function_error.partition(': ')
+            raise StatesError(error_type, json.dumps({'errorMessage': error_message, 'errorType': error_type}))
+        if resource == lambda_invoke_resource:
+            return {'ExecutedVersion': '$LATEST', 'Payload': json.loads(json.dumps(response)), 'StatusCode': 200}
+        return json.loads(json.dumps(response))
+
+    ############# Statistics #############
+
+    def running_executions(self):
+        return [execution for execution in self.executions.values() if execution.status == 'RUNNING']
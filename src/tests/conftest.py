@@ -0,0 +1,39 @@
+import datetime
+import os
+import sys
+
+import pytest
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', 'simulator'))
+
+from local_aws import LocalAWS, VirtualClock  # noqa: E402
+from local_batch_operations import LocalBatchOperations  # noqa: E402
+from local_dynamodb import LocalDynamoDB, LocalDynamoDBResource  # noqa: E402
+from local_lambda import LocalLambda  # noqa: E402
+from local_s3 import LocalS3, LocalS3Resource  # noqa: E402
+from stack import Stack  # noqa: E402
+
+
+# Other Variables
+default_template = os.path.join(tests_dir, '..', '..', 'automated-archive-restore-and-copy-solution-latest.yaml')
+start_time = datetime.datetime(2025, 1, 6, 8, 0, tzinfo=datetime.timezone.utc).timestamp()
+
+
+# Imports a function of the template, as deployed with the given Stack parameters, against local stand-ins. The
+# stand-ins' clients are put in the Runtime client cache, so the function never creates a real client
+@pytest.fixture
+def load_function():
+    def load(logical_id, **parameters):
+        stack = Stack(default_template, parameters)
+        aws = LocalAWS(VirtualClock(start_time), stack.region, stack.account_id)
+        aws.register('s3', LocalS3(aws, lambda s3_object, tier: 0), resource=LocalS3Resource)
+        aws.register('dynamodb', LocalDynamoDB(aws), resource=LocalDynamoDBResource)
+        aws.register('s3control', LocalBatchOperations(aws))
+        module = LocalLambda(aws, stack).module(logical_id)
+        for service_name in aws.services:
+            module.service_clients[service_name] = aws.client(service_name)
+        for service_name in aws.resources:
+            module.service_clients[('resource', service_name)] = aws.resource(service_name)
+        return module, aws
+    return load
@@ -0,0 +1,109 @@
+import pytest
+
+logical_id = 'S3AutoRestoreMigrateAthenaSplitFunction'
+unique_order = "key ASC, coalesce(version_id, 'null') ASC"
+
+
+@pytest.fixture
+def athena_split(load_function):
+    module, aws = load_function(logical_id)
+    return module
+
+
+def unload_query(athena_split, next_chunk=0, last_chunk=99, csv_counting_complete=False):
+    return athena_split.unload_query('archive-bucket', '2025-01-05-01-00', unique_order, next_chunk, last_chunk, 1000,
+                                     csv_counting_complete, 's3://solution-bucket/chunks-0-99/')
+
+
+############# Restore Order Strategies #############
+
+@pytest.mark.parametrize('restore_order, order_by', [
+    ('OldestFirst', f'last_modified_date ASC, {unique_order}'),
+    ('NewestFirst', "last_modified_date DESC, key DESC, coalesce(version_id, 'null') DESC"),
+    ('SizeAscending', f'size ASC, last_modified_date ASC, {unique_order}'),
+    ('PrefixClustered', unique_order),
+])
+def test_restore_orders(athena_split, restore_order, order_by):
+    assert athena_split.restore_order_strategies[restore_order]([]) == order_by
+
+
+def test_priority_prefixes_are_quoted(athena_split):
+    assert athena_split.priority_prefix_order(['logs/', "o'brien/"]) == \
+        "CASE WHEN substr(key, 1, 5) = 'logs/' THEN 0 WHEN substr(key, 1, 8) = 'o''brien/' THEN 1 ELSE 2 END ASC, " \
+        f"{unique_order}"
+
+
+def test_no_priority_prefixes_order_by_key(athena_split):
+    assert athena_split.priority_prefix_order([]) == unique_order
+
+
+############# Manifest Queries #############
+
+@pytest.mark.parametrize('storage_class, condition', [
+    ('GLACIER', "storage_class = 'GLACIER'"),
+    ('DEEP_ARCHIVE', "storage_class = 'DEEP_ARCHIVE'"),
+    ('GLACIER_AND_DEEP_ARCHIVE', "(storage_class = 'GLACIER' OR storage_class = 'DEEP_ARCHIVE')"),
+])
+def test_storage_class_filter(load_function, storage_class, condition):
+    athena_split, aws = load_function(logical_id, ExistingArchiveStorageClass=storage_class)
+    assert athena_split.storage_class_filter() == condition
+
+
+def test_offset_limit_query_of_current_versions(athena_split):
+    query = athena_split.offset_limit_query('archive-bucket', '2025-01-05-01-00', unique_order, 3, 1000)
+    assert 'is_latest = true' in query
+    assert 'VersionId' not in query
+    assert f'ORDER BY {unique_order}\n    OFFSET 3000\n    LIMIT 1000;' in query
+
+
+def test_offset_limit_query_of_all_versions(load_function):
+    athena_split, aws = load_function(logical_id, IncludedObjectVersions='All')
+    query = athena_split.offset_limit_query('archive-bucket', '2025-01-05-01-00', unique_order, 0, 1000)
+    assert 'is_latest' not in query
+    assert "ELSE version_id END as VersionId" in query
+
+
+def test_no_copied_filter_without_a_destination_inventory(athena_split):
+    assert athena_split.copied_filter() == ''
+    assert 'NOT EXISTS' not in unload_query(athena_split)
+
+
+def test_copied_filter_matches_the_destination_key(load_function):
+    athena_split, aws = load_function(logical_id, DestinationInventoryLocation='s3://inventory-bucket/destination/',
+                                      BucketForCopyDestinationPrefix="it's")
+    copied_filter = athena_split.copied_filter()
+    assert "WHERE copied.key = concat('it''s/', inventory.key)" in copied_filter
+    assert copied_filter in unload_query(athena_split)
+
+
+# Until the rows are counted, the UNLOAD writes the totals as the leading partitions
+def test_counting_unload_writes_the_totals(athena_split):
+    query = unload_query(athena_split)
+    assert "partitioned_by = ARRAY['total_rows', 'chunk_id', 'chunk_rows', 'chunk_bytes']" in query
+    assert 'WHERE chunk_id BETWEEN 0 AND 99' in query
+    assert 'row_num / 1000 as chunk_id' in query
+
+
+def test_counted_unload_writes_the_chunks_only(athena_split):
+    query = unload_query(athena_split, next_chunk=100, last_chunk=120, csv_counting_complete=True)
+    assert "partitioned_by = ARRAY['chunk_id', 'chunk_rows', 'chunk_bytes']" in query
+    assert 'total_rows' not in query
+    assert 'WHERE chunk_id BETWEEN 100 AND 120' in query
+
+
+def test_size_capped_unload_numbers_the_chunks_by_size(load_function):
+    athena_split, aws = load_function(logical_id, MaxInvSizeGiB=100)
+    query = unload_query(athena_split)
+    assert f'/ {100 * 1024 ** 3} as byte_chunk_id' in query
+    assert 'dense_rank() OVER (ORDER BY row_chunk_id, byte_chunk_id) - 1 as chunk_id' in query
+    assert "partitioned_by = ARRAY['total_rows', 'last_chunk_id', 'chunk_id', 'chunk_rows', 'chunk_bytes']" in query
+
+
+@pytest.mark.parametrize('version_deduplication, version_select', [
+    ('Disable', 'SELECT bucket, key, version_id, size, total_rows, chunk_id'),
+    ('Enable', 'SELECT bucket, key, version_id, duplicate_versions, size, total_rows, chunk_id'),
+])
+def test_all_versions_unload_lists_the_version_id(load_function, version_deduplication, version_select):
+    athena_split, aws = load_function(logical_id, IncludedObjectVersions='All',
+                                      VersionDeduplication=version_deduplication)
+    assert version_select in unload_query(athena_split)
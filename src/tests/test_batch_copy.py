@@ -0,0 +1,122 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from local_s3 import Content, S3Object, content_etag
+
+mib = 1024 ** 2
+gib = 1024 ** 3
+
+
+@pytest.fixture
+def batch_copy(load_function):
+    module, aws = load_function('S3BatchCopyLambdafunction')
+    return module
+
+
+# BatchCopy with an archive bucket and a destination bucket in the local S3
+@pytest.fixture
+def copy_buckets(load_function):
+    module, aws = load_function('S3BatchCopyLambdafunction', SkipCopiedObjects='Enable')
+    s3 = aws.services['s3']
+    return module, s3.add_bucket('archive-bucket'), s3.add_bucket('destination-bucket')
+
+
+############# Transfer Profile #############
+
+# With the default MultipartChunkSize of 16 MiB and TransferMaximumConcurrency of 200
+@pytest.mark.parametrize('size, part_bytes, parts, concurrency', [
+    (10 * mib, 16 * mib, 1, 1),
+    (gib, 16 * mib, 64, 64),
+    (100 * gib, 16 * mib, 6400, 200),
+])
+def test_parts_of_the_chunk_size(batch_copy, size, part_bytes, parts, concurrency):
+    assert batch_copy.transfer_profile(size) == \
+        {'bytes': size, 'part_bytes': part_bytes, 'parts': parts, 'concurrency': concurrency}
+
+
+def test_parts_grow_so_the_object_fits_the_part_limit(batch_copy):
+    profile = batch_copy.transfer_profile(5 * 1024 * gib)
+    assert profile['part_bytes'] == 525 * mib
+    assert profile['parts'] <= batch_copy.max_upload_parts
+    assert profile['parts'] * profile['part_bytes'] >= profile['bytes']
+
+
+def test_source_part_size_is_kept(batch_copy):
+    profile = batch_copy.transfer_profile(100 * mib, source_part_bytes=8 * mib)
+    assert (profile['part_bytes'], profile['parts'], profile['concurrency']) == (8 * mib, 13, 13)
+
+
+# Each part in flight is budgeted 2 MB of the 600 MB function, the memory caps a higher TransferMaximumConcurrency
+def test_part_concurrency_is_capped_by_the_function_memory(load_function):
+    batch_copy, aws = load_function('S3BatchCopyLambdafunction', TransferMaximumConcurrency=940)
+    assert batch_copy.max_part_concurrency == 300
+    assert batch_copy.transfer_profile(100 * gib)['concurrency'] == 300
+
+
+############# Existing Copies #############
+
+def find_existing_copy(batch_copy, key):
+    return batch_copy.find_existing_copy({'Bucket': 'archive-bucket', 'Key': key}, 'destination-bucket', key)
+
+
+def test_missing_destination_is_copied(copy_buckets):
+    batch_copy, archive_bucket, destination_bucket = copy_buckets
+    archive_bucket.add(S3Object('object', Content(10 * mib)))
+    assert find_existing_copy(batch_copy, 'object') == (None, None)
+
+
+def test_same_etag_is_already_copied(copy_buckets):
+    batch_copy, archive_bucket, destination_bucket = copy_buckets
+    content = Content(10 * mib)
+    archive_bucket.add(S3Object('object', content))
+    destination_bucket.add(S3Object('object', content))
+    match, source_head = find_existing_copy(batch_copy, 'object')
+    assert match == 'etag'
+    assert source_head['ContentLength'] == 10 * mib
+
+
+def test_other_content_of_the_same_size_is_copied(copy_buckets):
+    batch_copy, archive_bucket, destination_bucket = copy_buckets
+    archive_bucket.add(S3Object('object', Content(10 * mib)))
+    destination_bucket.add(S3Object('object', Content(10 * mib)))
+    match, source_head = find_existing_copy(batch_copy, 'object')
+    assert match is None
+    assert source_head['ContentLength'] == 10 * mib
+
+
+def test_other_size_is_copied(copy_buckets):
+    batch_copy, archive_bucket, destination_bucket = copy_buckets
+    content = Content(10 * mib)
+    archive_bucket.add(S3Object('object', content))
+    destination_bucket.add(S3Object('object', Content(5 * mib)))
+    assert find_existing_copy(batch_copy, 'object')[0] is None
+
+
+def test_same_full_object_checksum_is_already_copied(copy_buckets):
+    batch_copy, archive_bucket, destination_bucket = copy_buckets
+    content = Content(10 * mib)
+    checksums = {'SHA256': content.checksum('SHA256')}
+    archive_bucket.add(S3Object('object', content, etag=content_etag(content, 8 * mib), part_sizes=[8 * mib, 2 * mib],
+                                checksums=checksums))
+    destination_bucket.add(S3Object('object', content, checksums=checksums))
+    assert find_existing_copy(batch_copy, 'object')[0] == 'checksum-SHA256'
+
+
+# A copy of a multipart source made by a single request has another ETag, the source ETag it records proves the copy
+def test_source_etag_marker_of_a_multipart_source(copy_buckets):
+    batch_copy, archive_bucket, destination_bucket = copy_buckets
+    content = Content(10 * mib)
+    source_etag = content_etag(content, 8 * mib)
+    archive_bucket.add(S3Object('object', content, etag=source_etag, part_sizes=[8 * mib, 2 * mib]))
+    destination_bucket.add(S3Object('object', content))
+    assert find_existing_copy(batch_copy, 'object')[0] is None
+    destination_bucket.add(S3Object('object', content,
+                                    metadata={batch_copy.copied_source_etag_metadata: source_etag}))
+    assert find_existing_copy(batch_copy, 'object')[0] == 'marker'
+
+
+def test_other_errors_are_raised(copy_buckets):
+    batch_copy, archive_bucket, destination_bucket = copy_buckets
+    archive_bucket.add(S3Object('object', Content(10 * mib)))
+    with pytest.raises(ClientError):
+        batch_copy.find_existing_copy({'Bucket': 'archive-bucket', 'Key': 'object'}, 'no-such-bucket', 'object')
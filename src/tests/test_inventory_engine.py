@@ -0,0 +1,107 @@
+from urllib import parse
+
+import pytest
+
+
+@pytest.fixture
+def inventory_engine(load_function):
+    module, aws = load_function('InventoryEngineFunction', InventoryEngine='Embedded')
+    return module
+
+
+def inventory_row(key, size, last_modified_date, version_id='null'):
+    return 'archive-bucket', parse.quote_plus(key), version_id, size, last_modified_date
+
+
+# Runs the chunk writer and returns each chunk it stored with the lines of its file
+def write_chunks(inventory_engine, rows, incl_versions, max_rows, max_bytes, work_dir):
+    chunks = []
+
+    def write_chunk(chunk_num, chunk_rows, chunk_bytes, chunk_path):
+        with open(chunk_path) as chunk_file:
+            chunks.append((chunk_num, chunk_rows, chunk_bytes, chunk_file.read().splitlines()))
+    totals = inventory_engine.write_manifest_chunks(iter(rows), incl_versions, max_rows, max_bytes, str(work_dir),
+                                                    write_chunk)
+    return totals, chunks
+
+
+############# Manifest Chunk Writer #############
+
+def test_chunks_end_at_the_key_count(inventory_engine, tmp_path):
+    rows = [inventory_row(f'data/object-{index}.bin', 10, '2024-01-01T00:00:00.000Z') for index in range(5)]
+    totals, chunks = write_chunks(inventory_engine, rows, 'Current', 2, 0, tmp_path)
+    assert totals == (5, 2)
+    assert [(chunk_num, chunk_rows, chunk_bytes) for chunk_num, chunk_rows, chunk_bytes, lines in chunks] == \
+        [(0, 2, 20), (1, 2, 20), (2, 1, 10)]
+    assert chunks[0][3] == ['archive-bucket,data%2Fobject-0.bin,10', 'archive-bucket,data%2Fobject-1.bin,10']
+
+
+def test_chunks_end_before_the_size_cap(inventory_engine, tmp_path):
+    rows = [inventory_row(f'object-{index}', size, '2024-01-01T00:00:00.000Z')
+            for index, size in enumerate([4, 4, 4, 10, 1])]
+    totals, chunks = write_chunks(inventory_engine, rows, 'Current', 100, 8, tmp_path)
+    assert totals == (5, 3)
+    # An object larger than the cap gets a chunk of its own
+    assert [(chunk_rows, chunk_bytes) for chunk_num, chunk_rows, chunk_bytes, lines in chunks] == \
+        [(2, 8), (1, 4), (1, 10), (1, 1)]
+
+
+def test_all_versions_chunks_list_the_version_id(inventory_engine, tmp_path):
+    rows = [inventory_row('photo 1.jpg', 7, '2024-01-01T00:00:00.000Z', version_id='v1')]
+    totals, chunks = write_chunks(inventory_engine, rows, 'All', 10, 0, tmp_path)
+    assert chunks[0][3] == ['archive-bucket,photo+1.jpg,v1,7']
+
+
+def test_no_rows_store_no_chunk(inventory_engine, tmp_path):
+    totals, chunks = write_chunks(inventory_engine, [], 'Current', 10, 0, tmp_path)
+    assert totals == (0, 0)
+    assert chunks == []
+    assert list(tmp_path.iterdir()) == []
+
+
+############# Restore Order Strategies #############
+
+def sorted_keys(inventory_engine, rows, restore_order, work_dir, priority_prefixes=()):
+    return [parse.unquote_plus(row[1]) for row in
+            inventory_engine.sort_inventory_rows(iter(rows), restore_order, list(priority_prefixes), str(work_dir))]
+
+
+@pytest.fixture
+def unsorted_rows():
+    return [
+        inventory_row('logs/b', 30, '2024-03-01T00:00:00.000Z'),
+        inventory_row('finance/a', 20, '2024-01-01T00:00:00.000Z'),
+        inventory_row('logs/a', 10, '2024-02-01T00:00:00.000Z'),
+        inventory_row('media/a', 10, '2024-01-01T00:00:00.000Z'),
+        inventory_row('finance/b', 40, '2024-02-01T00:00:00.000Z'),
+    ]
+
+
+@pytest.mark.parametrize('restore_order, expected', [
+    ('OldestFirst', ['finance/a', 'media/a', 'finance/b', 'logs/a', 'logs/b']),
+    ('NewestFirst', ['logs/b', 'logs/a', 'finance/b', 'media/a', 'finance/a']),
+    ('SizeAscending', ['media/a', 'logs/a', 'finance/a', 'logs/b', 'finance/b']),
+    ('PrefixClustered', ['finance/a', 'finance/b', 'logs/a', 'logs/b', 'media/a']),
+])
+def test_restore_orders(inventory_engine, unsorted_rows, tmp_path, restore_order, expected):
+    assert sorted_keys(inventory_engine, unsorted_rows, restore_order, tmp_path) == expected
+
+
+def test_priority_prefixes_come_first_in_the_listed_order(inventory_engine, unsorted_rows, tmp_path):
+    keys = sorted_keys(inventory_engine, unsorted_rows, 'PriorityPrefixes', tmp_path, ['logs/', 'finance/'])
+    assert keys == ['logs/a', 'logs/b', 'finance/a', 'finance/b', 'media/a']
+
+
+# Rows spill to sorted runs on disk that are merged, the merge keeps the order and removes the run files
+def test_sort_merges_runs_from_disk(inventory_engine, unsorted_rows, tmp_path, monkeypatch):
+    monkeypatch.setattr(inventory_engine, 'sort_run_rows', 2)
+    keys = sorted_keys(inventory_engine, unsorted_rows, 'OldestFirst', tmp_path)
+    assert keys == ['finance/a', 'media/a', 'finance/b', 'logs/a', 'logs/b']
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_versions_of_a_key_never_tie(inventory_engine, tmp_path):
+    rows = [inventory_row('same', 10, '2024-01-01T00:00:00.000Z', version_id=version_id)
+            for version_id in ['v3', 'v1', 'v2']]
+    sorted_rows = inventory_engine.sort_inventory_rows(iter(rows), 'SizeAscending', [], str(tmp_path))
+    assert [row[2] for row in sorted_rows] == ['v1', 'v2', 'v3']
@@ -0,0 +1,112 @@
+import datetime
+
+import pytest
+
+gib = 1024 ** 3
+
+
+@pytest.fixture
+def restore_scheduler(load_function):
+    module, aws = load_function('RestoreSchedulerFunction')
+    return module
+
+
+def utc(hour, minute, second=0):
+    return datetime.datetime(2025, 1, 6, hour, minute, second)
+
+
+############# Submission Windows #############
+
+def test_windows_are_minutes_of_the_day(restore_scheduler):
+    assert restore_scheduler.parse_restore_windows('22:00-06:00, 12:00-13:30') == [(1320, 360), (720, 810)]
+    assert restore_scheduler.parse_restore_windows('') == []
+
+
+def test_window_must_not_be_empty(restore_scheduler):
+    with pytest.raises(ValueError):
+        restore_scheduler.parse_restore_windows('10:00-10:00')
+
+
+@pytest.mark.parametrize('now, wait_seconds', [
+    (utc(23, 30), 0),
+    (utc(5, 59, 59), 0),
+    (utc(12, 0), 0),
+    # Windows end before their end minute, the next one opens at 12:00
+    (utc(6, 0), 6 * 3600),
+    (utc(13, 0, 30), 9 * 3600 - 30),
+])
+def test_seconds_until_window(restore_scheduler, now, wait_seconds):
+    windows = restore_scheduler.parse_restore_windows('22:00-06:00,12:00-13:00')
+    assert restore_scheduler.seconds_until_window(windows, now) == wait_seconds
+
+
+def test_no_windows_submit_at_any_time(restore_scheduler):
+    assert restore_scheduler.seconds_until_window([], utc(3, 0)) == 0
+
+
+############# Restore Budget #############
+
+@pytest.fixture
+def paced_scheduler(load_function):
+    module, aws = load_function('RestoreSchedulerFunction', RestoreObjectsPerHour=1000, RestoreGiBPerHour=1,
+                                MaxInvKeys=1000)
+    return module
+
+
+def test_first_submission_does_not_wait(paced_scheduler):
+    assert paced_scheduler.seconds_until_budget(None, None, None, None, 1000) == 0
+
+
+# The last submission is spread over the budget of whichever of objects and bytes takes longer
+@pytest.mark.parametrize('rows, size_bytes, now_timestamp, wait_seconds', [
+    (500, 0, 600, 1200),
+    (500, 2 * gib, 600, 6600),
+    (500, 0, 4000, 0),
+])
+def test_seconds_until_budget(paced_scheduler, rows, size_bytes, now_timestamp, wait_seconds):
+    assert paced_scheduler.seconds_until_budget(1, 1, rows, size_bytes, now_timestamp + 1) == wait_seconds
+
+
+# OffsetLimit manifests carry no row count or size, each counts as MaxInvKeys objects
+def test_manifests_without_counts_use_the_key_limit(paced_scheduler):
+    assert paced_scheduler.seconds_until_budget(1, 2, None, None, 1) == 7200
+
+
+def manifest_event(rows, size_bytes, submitted=0):
+    return {
+        'restore_job_ids': ['job-id'] * submitted + [None] * len(rows),
+        'csv_file_rows': [1] * submitted + rows,
+        'csv_file_bytes': [1] * submitted + size_bytes,
+    }
+
+
+@pytest.mark.parametrize('rows, size_bytes, submit_count', [
+    ([400, 400, 400], [0, 0, 0], 2),
+    ([400, 400], [gib // 2, gib // 2 + 1], 1),
+    # One manifest over the budget is still submitted on its own
+    ([5000, 10], [0, 0], 1),
+    ([None, 10], [None, 0], 1),
+])
+def test_manifests_within_budget(paced_scheduler, rows, size_bytes, submit_count):
+    assert paced_scheduler.manifests_within_budget(manifest_event(rows, size_bytes, submitted=2), 10) == submit_count
+
+
+def test_manifests_without_budget_up_to_the_submit_limit(restore_scheduler):
+    assert restore_scheduler.manifests_within_budget(manifest_event([10] * 5, [0] * 5), 3) == 3
+
+
+############# Scheduler Decision #############
+
+# The virtual clock starts at 08:00 UTC, the window opens 14 hours later
+def test_outside_the_window_waits_without_counting_active_jobs(load_function):
+    restore_scheduler, aws = load_function('RestoreSchedulerFunction', RestoreSubmissionWindows='22:00-06:00',
+                                           MaxActiveRestoreJobs=5)
+    decision = restore_scheduler.lambda_handler(manifest_event([10], [0]), None)
+    assert decision == {
+        'submit_now': False,
+        'submit_count': 0,
+        'wait_seconds': 14 * 3600,
+        'window_wait_seconds': 14 * 3600,
+        'budget_wait_seconds': 0,
+        'active_restore_jobs': None,
+    }